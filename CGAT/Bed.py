@@ -17,14 +17,19 @@ file. Additional functions can process intervals (:func:`merge`,
 The method :func:`readAndIndex` can build an in-memory index of a bed-file
 for quick cross-referencing.
 
+For large files, :func:`readArrays` loads the coordinates of all
+intervals into numpy arrays (:class:`BedArrays`) without creating a
+:class:`Bed` object per interval. :func:`merge` and :func:`binIntervals`
+operate on this columnar representation internally.
+
 Reference
 ---------
 
 '''
 import re
 import numpy
-import bisect
 import itertools
+from six.moves import intern
 
 from CGAT import NCL as ncl
 from CGAT import IOTools as IOTools
@@ -37,6 +42,22 @@ Headers = [
     "blockSizes", "blockStarts"]
 
 
+def _fieldProperty(key, position):
+    """return a property accessing the optional field ``key``
+    at ``position``. Absent fields are returned as None."""
+
+    def _get(self):
+        try:
+            return self.fields[position]
+        except IndexError:
+            return None
+
+    def _set(self, value):
+        self[key] = value
+
+    return property(_get, _set)
+
+
 class Bed(object):
     """an interval in bed format.
 
@@ -50,7 +71,7 @@ class Bed(object):
 
     Bed-formatted records can have a variable number of columuns
     with a minimum of 3. Accessing an optional attribute that is not present
-    will raise an IndexError.
+    will return None, while dictionary type access will raise an IndexError.
 
     Attributes
     ----------
@@ -89,6 +110,18 @@ class Bed(object):
 
     default_value = "."
 
+    __slots__ = ("contig", "start", "end", "fields", "track")
+
+    name = _fieldProperty("name", 0)
+    score = _fieldProperty("score", 1)
+    strand = _fieldProperty("strand", 2)
+    thickStart = _fieldProperty("thickStart", 3)
+    thickEnd = _fieldProperty("thickEnd", 4)
+    itemRGB = _fieldProperty("itemRGB", 5)
+    blockCount = _fieldProperty("blockCount", 6)
+    blockSizes = _fieldProperty("blockSizes", 7)
+    blockStarts = _fieldProperty("blockStarts", 8)
+
     def __init__(self):
         self.contig = None
         self.start = 0
@@ -104,7 +137,11 @@ class Bed(object):
         '''Returns a new bed object that is a copy of this one'''
 
         new_entry = Bed()
-        new_entry.__dict__ = self.__dict__.copy()
+        new_entry.contig = self.contig
+        new_entry.start = self.start
+        new_entry.end = self.end
+        new_entry.fields = list(self.fields)
+        new_entry.track = self.track
         return new_entry
 
     def fromGTF(self, gff, is_gtf=False, name=None):
@@ -219,12 +256,6 @@ class Bed(object):
 
             self.fields[position] = value
 
-    def __getattr__(self, key):
-        try:
-            return self.fields[self.map_key2field[key]]
-        except IndexError:
-            return None
-
     @property
     def columns(self):
         '''return number of columns in bed-entry.'''
@@ -261,7 +292,8 @@ def iterator(infile):
 
     Comments and empty lines are ignored. The iterator is
     :term:`track` aware and will set the ``track`` attribute for the
-    Bed objects it yields.
+    Bed objects it yields. Contig names are interned so that
+    records on the same contig share a single string.
 
     Arguments
     ---------
@@ -291,7 +323,9 @@ def iterator(infile):
         # the name field)
         data = line[:-1].split("\t")
         try:
-            b.contig, b.start, b.end = data[0], int(data[1]), int(data[2])
+            b.contig, b.start, b.end = (intern(data[0]),
+                                        int(data[1]),
+                                        int(data[2]))
         except IndexError:
             raise ValueError("parsing error in line '%s'" % line[:-1])
         b.fields = data[3:]
@@ -380,6 +414,138 @@ def blocked_iterator(iterator):
     yield _update(bed, blocks)
 
 
+class BedArrays(object):
+    """columnar representation of a collection of bed intervals.
+
+    Contigs are stored as integer codes into a sorted list of contig
+    names, such that sorting by code is equivalent to sorting by
+    contig name.
+
+    Attributes
+    ----------
+    contigs : list
+       Sorted list of contig names.
+    contig_codes : numpy.ndarray
+       Index of the contig of each interval in :attr:`contigs`.
+    starts : numpy.ndarray
+       Interval start positions.
+    ends : numpy.ndarray
+       Interval end positions.
+    names : numpy.ndarray
+       Interval names. Absent names are set to None.
+    scores : numpy.ndarray
+       Interval scores. Absent or non-numeric scores are set to nan.
+    strands : numpy.ndarray
+       Interval strands. Absent strands are set to ``.``.
+    """
+
+    def __init__(self, contigs, contig_codes, starts, ends,
+                 names, scores, strands):
+        self.contigs = contigs
+        self.contig_codes = contig_codes
+        self.starts = starts
+        self.ends = ends
+        self.names = names
+        self.scores = scores
+        self.strands = strands
+
+    @classmethod
+    def fromBeds(cls, beds):
+        """build columnar representation from a list of
+        :class:`Bed` objects."""
+        return _buildArrays(
+            (bed.contig, bed.start, bed.end, bed.fields) for bed in beds)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def getLengths(self):
+        """return array of interval lengths."""
+        return self.ends - self.starts
+
+    def getSortOrder(self):
+        """return indices that sort intervals by contig and start.
+
+        The sort is stable.
+        """
+        return numpy.lexsort((self.starts, self.contig_codes))
+
+
+def _buildArrays(records):
+    """build a :class:`BedArrays` object from an iterator of
+    tuples (contig, start, end, fields)."""
+
+    map_contig2code = {}
+    codes, starts, ends, names, scores, strands = [], [], [], [], [], []
+    for contig, start, end, fields in records:
+        try:
+            code = map_contig2code[contig]
+        except KeyError:
+            code = map_contig2code[contig] = len(map_contig2code)
+        codes.append(code)
+        starts.append(start)
+        ends.append(end)
+        nfields = len(fields)
+        names.append(fields[0] if nfields > 0 else None)
+        score = numpy.nan
+        if nfields > 1:
+            try:
+                score = float(fields[1])
+            except ValueError:
+                pass
+        scores.append(score)
+        strands.append(fields[2] if nfields > 2 else ".")
+
+    # recode contigs such that codes sort like contig names
+    contigs = sorted(map_contig2code.keys())
+    recode = numpy.zeros(len(contigs), dtype=numpy.int32)
+    for x, contig in enumerate(contigs):
+        recode[map_contig2code[contig]] = x
+
+    names_array = numpy.empty(len(names), dtype=object)
+    names_array[:] = names
+
+    return BedArrays(
+        contigs,
+        recode[numpy.array(codes, dtype=numpy.int32)],
+        numpy.array(starts, dtype=numpy.int64),
+        numpy.array(ends, dtype=numpy.int64),
+        names_array,
+        numpy.array(scores, dtype=numpy.float64),
+        numpy.array(strands, dtype=object))
+
+
+def readArrays(infile):
+    """read a :term:`bed` formatted file into numpy arrays.
+
+    This method avoids creating a :class:`Bed` object for each
+    interval and is thus suited to large files. Only the first six
+    columns are parsed, track information is ignored.
+
+    Arguments
+    ---------
+    infile : File
+
+    Returns
+    -------
+    arrays : :class:`BedArrays`
+    """
+
+    def _iterate(infile):
+        for line in infile:
+            if line.startswith("track") or line.startswith("#"):
+                continue
+            if line.strip() == "":
+                continue
+            data = line[:-1].split("\t", 6)
+            try:
+                yield data[0], int(data[1]), int(data[2]), data[3:6]
+            except IndexError:
+                raise ValueError("parsing error in line '%s'" % line[:-1])
+
+    return _buildArrays(_iterate(infile))
+
+
 def readAndIndex(infile, with_values=False, per_track=False):
     """read and index a bed formatted file in ``infile``.
 
@@ -473,21 +639,18 @@ def binIntervals(iterator, num_bins=5, method="equal-bases", bin_edges=None):
 
     """
 
-    data = []
-    beds = list(iterator)
-
-    for bed in beds:
-        bed.fields[1] = float(bed.fields[1])
+    arrays = BedArrays.fromBeds(list(iterator))
+    scores = arrays.scores
+    if numpy.isnan(scores).any():
+        raise ValueError("binIntervals requires a numeric score field")
 
     if bin_edges is None:
         if method == "equal-bases":
-            data = numpy.array(
-                sorted([(x.fields[1], x.end - x.start) for x in beds]))
+            weights = arrays.getLengths()
         elif method == "equal-intervals":
-            data = numpy.array(sorted([(x.fields[1], 1) for x in beds]))
+            weights = numpy.ones(len(arrays), dtype=numpy.int64)
         elif method == "equal-range":
-            vals = [x.fields[1] for x in beds]
-            mi, ma = min(vals), max(vals)
+            mi, ma = scores.min(), scores.max()
             increment = float(ma - mi) / num_bins
             bin_edges = numpy.arange(mi, ma, increment)
         else:
@@ -495,86 +658,81 @@ def binIntervals(iterator, num_bins=5, method="equal-bases", bin_edges=None):
                 "unknown method %s to compute bins, supply bin_edges" % method)
 
     if bin_edges is None:
-        sums = data[:, 1].cumsum(axis=0)
+        order = numpy.lexsort((weights, scores))
+        values = scores[order]
+        sums = weights[order].cumsum()
         total = float(sums[-1])
         increment = float(total / num_bins)
-        bin_edges = [data[0][0]]
-        occupancies = []
+        bin_edges = [float(values[0])]
         threshold = increment
-        occ = 0
-        for v, s in zip(data, sums):
-            occ += v[1]
+        for v, s in zip(values.tolist(), sums.tolist()):
             if s > threshold:
-                bin_edges.append(v[0])
+                bin_edges.append(v)
                 threshold += increment
-                occupancies.append(occ)
-                occ = 0
 
-        bin_edges.append(data[-1][0] + 1)
+        bin_edges.append(float(values[-1]) + 1)
+
+    order = arrays.getSortOrder()
+    contig_codes = arrays.contig_codes[order]
+    bins = numpy.searchsorted(bin_edges, scores[order], side="right") - 1
+    first, last = _getRuns(
+        (bins[1:] != bins[:-1]) | (contig_codes[1:] != contig_codes[:-1]))
 
-    beds.sort(key=lambda x: (x.contig, x.start))
-    last_contig, start, end, last_name = None, None, None, None
     new_beds = []
-    for bed in beds:
-        name = bisect.bisect_right(bin_edges, bed.fields[1]) - 1
-        contig = bed.contig
-        if name != last_name or last_contig != contig:
-            if last_name is not None:
-                b = Bed()
-                b.contig, b.start, b.end, b.fields = last_contig, start, end, [
-                    last_name]
-                new_beds.append(b)
-            start = bed.start
-            last_name = name
-            last_contig = contig
-
-        end = bed.end
-
-    if last_name is not None:
+    for contig, start, end, name in zip(
+            contig_codes[first].tolist(),
+            arrays.starts[order][first].tolist(),
+            arrays.ends[order][last].tolist(),
+            bins[first].tolist()):
         b = Bed()
-        b.contig, b.start, b.end, b.fields = contig, start, end, [last_name]
+        b.contig, b.start, b.end, b.fields = \
+            arrays.contigs[contig], start, end, [name]
         new_beds.append(b)
 
     return new_beds, bin_edges
 
 
+def _getRuns(is_new):
+    """return arrays with the first and last index of runs of
+    consecutive elements. ``is_new[x]`` is True if element ``x + 1``
+    starts a new run."""
+    first = numpy.concatenate(([0], numpy.nonzero(is_new)[0] + 1))
+    last = numpy.append(first[1:] - 1, len(is_new))
+    return first, last
+
+
 def merge(iterator):
     '''merge overlapping intervals and returns a list of merged intervals.
+
+    Book-ended intervals are not merged.
     '''
 
     beds = list(iterator)
     if len(beds) == 0:
         return []
 
-    beds.sort(key=lambda x: (x.contig, x.start))
-
-    def iterate_chunks(beds):
+    arrays = BedArrays.fromBeds(beds)
+    order = arrays.getSortOrder()
+    contig_codes = arrays.contig_codes[order]
+    starts = arrays.starts[order]
+    ends = arrays.ends[order]
 
-        last = beds[0]
-        to_join = [last]
-        end = last.end
-        contig = last.contig
+    # running maximum of end positions within each contig. Contigs
+    # are offset so that the maximum is reset at each contig boundary.
+    offset = contig_codes * (ends.max() + 1)
+    max_ends = numpy.maximum.accumulate(ends + offset) - offset
 
-        for this in beds[1:]:
-            d = this.start - end
-            if this.contig != contig or d >= 0:
-                yield to_join, end
-                contig = this.contig
-                to_join = []
-                end = this.end
-
-            end = max(end, this.end)
-            to_join.append(this)
-
-        yield to_join, end
-        raise StopIteration
+    first, last = _getRuns(
+        (contig_codes[1:] != contig_codes[:-1]) |
+        (starts[1:] >= max_ends[:-1]))
 
     n = []
-    for to_join, end in iterate_chunks(beds):
-
+    for contig, start, end in zip(contig_codes[first].tolist(),
+                                  starts[first].tolist(),
+                                  max_ends[last].tolist()):
         y = Bed()
-        y.contig = to_join[0].contig
-        y.start = to_join[0].start
+        y.contig = arrays.contigs[contig]
+        y.start = start
         y.end = end
         n.append(y)
 
@@ -9,6 +9,11 @@ single entry and a series of iterators to iterate of :term:`PSL`
 formatted files (:func:`iterator`, :func:`iterator_target_overlap`,
 ...).
 
+:func:`iterator_arrays` reads :term:`PSL` formatted files in blocks
+of alignments stored in numpy arrays (:class:`MatchArrays`), which
+permits filtering alignments and computing coverage without
+creating a :class:`Match` object for each alignment.
+
 Reference
 ---------
 
@@ -16,6 +21,7 @@ Reference
 import copy
 import string
 import collections
+import numpy
 
 try:
     import alignlib_lite
@@ -428,13 +434,13 @@ class Match:
         for qstart, tstart, size in b[1:]:
             yield (last_tend, tstart)
             last_tend = tstart + size
-        raise StopIteration
+        return
 
     def iterator_exons(self):
 
         for qstart, tstart, size in self.getBlocks():
             yield tstart, tstart + size
-        raise StopIteration
+        return
 
     def iterator_introns(self):
 
@@ -443,19 +449,19 @@ class Match:
         for qstart, tstart, size in b[1:]:
             yield (last_tend, tstart)
             last_tend = tstart + size
-        raise StopIteration
+        return
 
     def iterator_query_exons(self):
 
         for qstart, tstart, size in self.getBlocks():
             yield qstart, qstart + size
-        raise StopIteration
+        return
 
     def iterator_sbjct_exons(self):
 
         for qstart, tstart, size in self.getBlocks():
             yield tstart, tstart + size
-        raise StopIteration
+        return
 
     def iterator_query_introns(self):
 
@@ -464,7 +470,7 @@ class Match:
         for qstart, tstart, size in b[1:]:
             yield (last_qend, qstart)
             last_qend = qstart + size
-        raise StopIteration
+        return
 
     def getHeader(self):
 
@@ -583,7 +589,7 @@ def _iterate(infile):
     while 1:
         line = infile.readline()
         if not line:
-            raise StopIteration
+            return
 
         if line[0] == "#":
             continue
@@ -627,7 +633,7 @@ def iterator2(infile):
     while 1:
         line = infile.readline()
         if not line:
-            raise StopIteration
+            return
         if line[0] == "#":
             continue
         if line.startswith("match"):
@@ -647,7 +653,7 @@ def iterator(infile):
     while 1:
         line = infile.readline()
         if not line:
-            raise StopIteration
+            return
         if line[0] == "#":
             continue
         if line.startswith("match"):
@@ -667,7 +673,7 @@ def iterator_pslx(infile):
     while 1:
         line = infile.readline()
         if not line:
-            raise StopIteration
+            return
         if line[0] == "#":
             continue
         if line.startswith("match"):
@@ -681,6 +687,328 @@ def iterator_pslx(infile):
         yield match
 
 
+class MatchArrays(object):
+
+    """a block of :term:`psl` formatted alignments stored in columns.
+
+    Each column of a :term:`psl` file is stored in a numpy array with
+    the same name as the corresponding attribute of :class:`Match`.
+    Identifiers and strand are stored as arrays of strings.
+
+    Alignment blocks are stored in compressed sparse row format. The
+    blocks of alignment ``x`` are in the arrays :attr:`mBlockSizes`,
+    :attr:`mQueryBlockStarts` and :attr:`mSbjctBlockStarts` between
+    ``mBlockOffsets[x]`` and ``mBlockOffsets[x+1]``.
+
+    Single :class:`Match` objects are built on demand with
+    :meth:`getMatch` or by iterating over the block.
+    """
+
+    # integer columns and their position in a psl formatted line
+    mIntColumns = (("mNMatches", 0),
+                   ("mNMismatches", 1),
+                   ("mNRepMatches", 2),
+                   ("mNns", 3),
+                   ("mQueryNGapsCounts", 4),
+                   ("mQueryNGapsBases", 5),
+                   ("mSbjctNGapsCounts", 6),
+                   ("mSbjctNGapsBases", 7),
+                   ("mQueryLength", 10),
+                   ("mQueryFrom", 11),
+                   ("mQueryTo", 12),
+                   ("mSbjctLength", 14),
+                   ("mSbjctFrom", 15),
+                   ("mSbjctTo", 16),
+                   ("mNBlocks", 17))
+
+    mStrColumns = (("strand", 8),
+                   ("mQueryId", 9),
+                   ("mSbjctId", 13))
+
+    mBlockColumns = (("mBlockSizes", 18),
+                     ("mQueryBlockStarts", 19),
+                     ("mSbjctBlockStarts", 20))
+
+    def __init__(self, **columns):
+        for column, idx in self.mIntColumns + self.mStrColumns + \
+                self.mBlockColumns + (("mBlockOffsets", None),):
+            setattr(self, column, columns.get(column))
+
+    @classmethod
+    def fromLines(cls, lines):
+        '''build from a list of :term:`psl` formatted lines.'''
+
+        def _parse(values, sep, column, expected):
+            # parse integers with numpy's text parser
+            if values:
+                result = numpy.fromstring(values, dtype=numpy.int64, sep=sep)
+            else:
+                result = numpy.zeros(0, dtype=numpy.int64)
+            if len(result) != expected:
+                raise ParsingError(
+                    "parsing error: expected %i values in %s, got %i" %
+                    (expected, column, len(result)))
+            return result
+
+        nlines = len(lines)
+        values = None
+        if all([x.count("\t") == 20 for x in lines]):
+            # regular psl: split all lines at once and slice
+            # out columns.
+            values = "".join(lines).split()
+            if len(values) != 21 * nlines:
+                values = None
+
+        if values is not None:
+            fields = [values[x::21] for x in range(21)]
+        else:
+            data = [x.split() for x in lines]
+            for values in data:
+                if len(values) < 21:
+                    raise ParsingError("parsing error: %i fields" %
+                                       len(values), "\t".join(values))
+            fields = [[x[idx] for x in data] for idx in range(21)]
+
+        columns = {}
+        for column, idx in cls.mIntColumns:
+            columns[column] = _parse(" ".join(fields[idx]),
+                                     " ", column, nlines)
+
+        for column, idx in cls.mStrColumns:
+            columns[column] = numpy.array(fields[idx], dtype=numpy.str_)
+
+        offsets = numpy.zeros(nlines + 1, dtype=numpy.int64)
+        numpy.cumsum(columns["mNBlocks"], out=offsets[1:])
+        columns["mBlockOffsets"] = offsets
+
+        for column, idx in cls.mBlockColumns:
+            columns[column] = _parse("".join(fields[idx]),
+                                     ",", column, offsets[-1])
+
+        return cls(**columns)
+
+    def __len__(self):
+        return len(self.mNMatches)
+
+    def getMatch(self, idx):
+        '''return alignment *idx* as a :class:`Match` object.'''
+        match = Match()
+        for column, x in self.mIntColumns:
+            setattr(match, column, int(getattr(self, column)[idx]))
+        for column, x in self.mStrColumns:
+            setattr(match, column, str(getattr(self, column)[idx]))
+
+        start, end = self.mBlockOffsets[idx], self.mBlockOffsets[idx + 1]
+        for column, x in self.mBlockColumns:
+            setattr(match, column,
+                    [int(y) for y in getattr(self, column)[start:end]])
+
+        aligned = match.mNMatches + match.mNMismatches
+        if match.mQueryLength != 0:
+            match.mQueryCoverage = 100.0 * aligned / match.mQueryLength
+        else:
+            match.mQueryCoverage = 0
+        if match.mSbjctLength != 0:
+            match.mSbjctCoverage = 100.0 * aligned / match.mSbjctLength
+        else:
+            match.mSbjctCoverage = 0
+        if aligned > 0:
+            match.mPid = 100.0 * float(match.mNMatches) / aligned
+        else:
+            match.mPid = 100.0
+        return match
+
+    def __getitem__(self, idx):
+        return self.getMatch(idx)
+
+    def __iter__(self):
+        for x in range(len(self)):
+            yield self.getMatch(x)
+
+    def __str__(self):
+        return "\n".join([str(x) for x in self])
+
+    def _getPercentage(self, nominator, denominator, default):
+        result = numpy.empty(len(self), dtype=numpy.float64)
+        result.fill(default)
+        take = denominator != 0
+        result[take] = 100.0 * nominator[take] / denominator[take]
+        return result
+
+    def getQueryCoverage(self):
+        '''return percentage of query covered by alignments.'''
+        return self._getPercentage(self.mNMismatches + self.mNMatches,
+                                   self.mQueryLength, 0)
+
+    def getSbjctCoverage(self):
+        '''return percentage of sbjct covered by alignments.'''
+        return self._getPercentage(self.mNMismatches + self.mNMatches,
+                                   self.mSbjctLength, 0)
+
+    def getPid(self):
+        '''return percentage identity of alignments.'''
+        return self._getPercentage(self.mNMatches,
+                                   self.mNMismatches + self.mNMatches,
+                                   100.0)
+
+    def select(self, take):
+        '''return a :class:`MatchArrays` object with the alignments
+        in *take*.
+
+        *take* is either a boolean mask or an array of indices.
+        '''
+        take = numpy.asarray(take)
+        if take.dtype == numpy.bool_:
+            take = numpy.nonzero(take)[0]
+        else:
+            take = take.astype(numpy.int64)
+
+        columns = {}
+        for column, idx in self.mIntColumns + self.mStrColumns:
+            columns[column] = getattr(self, column)[take]
+
+        starts = self.mBlockOffsets[take]
+        nblocks = self.mBlockOffsets[take + 1] - starts
+        offsets = numpy.zeros(len(take) + 1, dtype=numpy.int64)
+        numpy.cumsum(nblocks, out=offsets[1:])
+        columns["mBlockOffsets"] = offsets
+
+        # indices of selected blocks
+        blocks = numpy.repeat(starts - offsets[:-1], nblocks) + \
+            numpy.arange(offsets[-1])
+        for column, idx in self.mBlockColumns:
+            columns[column] = getattr(self, column)[blocks]
+
+        return self.__class__(**columns)
+
+    def filter(self,
+               min_query_coverage=None,
+               min_sbjct_coverage=None,
+               min_pid=None):
+        '''return alignments with query coverage, sbjct coverage and
+        percent identity at least as large as the given thresholds.
+        '''
+        keep = numpy.ones(len(self), dtype=numpy.bool_)
+        if min_query_coverage is not None:
+            keep &= self.getQueryCoverage() >= min_query_coverage
+        if min_sbjct_coverage is not None:
+            keep &= self.getSbjctCoverage() >= min_sbjct_coverage
+        if min_pid is not None:
+            keep &= self.getPid() >= min_pid
+        return self.select(keep)
+
+    def overlaps(self, index, by_query=False):
+        '''return a boolean mask of alignments overlapping intervals
+        in *index*.
+
+        *index* is an :class:`IndexedGenome.Static` object. The full
+        range of an alignment on the sbjct is used or on the
+        query if *by_query* is set.
+        '''
+        if by_query:
+            contigs, starts, ends = \
+                self.mQueryId, self.mQueryFrom, self.mQueryTo
+        else:
+            contigs, starts, ends = \
+                self.mSbjctId, self.mSbjctFrom, self.mSbjctTo
+
+        result = numpy.zeros(len(self), dtype=numpy.bool_)
+        for contig in numpy.unique(contigs):
+            take = numpy.nonzero(contigs == contig)[0]
+            try:
+                offsets, ids = index.getBatch(str(contig),
+                                              starts[take], ends[take])
+            except KeyError:
+                continue
+            result[take] = offsets[1:] > offsets[:-1]
+        return result
+
+    def getBlockCoordinates(self, by_query=False):
+        '''return arrays of contigs, starts and ends of all
+        alignment blocks.
+
+        Query coordinates are on the forward/reverse strand
+        depending on the strand of an alignment.
+        '''
+        nblocks = self.mBlockOffsets[1:] - self.mBlockOffsets[:-1]
+        if by_query:
+            contigs = numpy.repeat(self.mQueryId, nblocks)
+            starts = self.mQueryBlockStarts
+        else:
+            contigs = numpy.repeat(self.mSbjctId, nblocks)
+            starts = self.mSbjctBlockStarts
+        return contigs, starts, starts + self.mBlockSizes
+
+    def addCoverage(self, counts, by_query=False):
+        '''add the coverage of alignment blocks to *counts*.
+
+        *counts* is a dictionary of arrays of per-base differences
+        in coverage. Arrays for contigs not in *counts* are created
+        with the size given in the alignments. Blocks extending
+        beyond the end of an array are truncated. The coverage itself
+        is obtained with :func:`getCoverage`.
+        '''
+        contigs, starts, ends = self.getBlockCoordinates(by_query)
+        if by_query:
+            ids, lengths = self.mQueryId, self.mQueryLength
+        else:
+            ids, lengths = self.mSbjctId, self.mSbjctLength
+
+        for contig in numpy.unique(contigs):
+            key = str(contig)
+            if key not in counts:
+                size = lengths[numpy.nonzero(ids == contig)[0][0]]
+                counts[key] = numpy.zeros(size + 1, dtype=numpy.int64)
+            diff = counts[key]
+            take = contigs == contig
+            size = len(diff) - 1
+            nclipped = numpy.count_nonzero(ends[take] > size)
+            if nclipped:
+                E.warn("%i blocks extend beyond the end of %s (%i bases)"
+                       " and are truncated" % (nclipped, key, size))
+            for positions, increment in ((starts[take], 1),
+                                         (ends[take], -1)):
+                positions, n = numpy.unique(
+                    numpy.minimum(positions, size), return_counts=True)
+                diff[positions] += increment * n
+
+
+def getCoverage(counts, dtype=numpy.int64):
+    '''return coverage from per-base differences in *counts*.
+
+    See :meth:`MatchArrays.addCoverage`.
+    '''
+    return dict([(contig, numpy.cumsum(diff[:-1]).astype(dtype))
+                 for contig, diff in counts.items()])
+
+
+def iterator_arrays(infile, block_size=100000):
+    """iterate over the contents of a psl file in blocks of
+    *block_size* alignments.
+
+    Yields :class:`MatchArrays` objects.
+    """
+    lines = []
+    for line in infile:
+        if line[0] == "#":
+            continue
+        if line.startswith("match"):
+            continue
+        if line.startswith("psLayout version 3"):
+            for x in range(4):
+                next(infile)
+            continue
+        if not line.strip():
+            continue
+        lines.append(line)
+        if len(lines) >= block_size:
+            yield MatchArrays.fromLines(lines)
+            lines = []
+
+    if lines:
+        yield MatchArrays.fromLines(lines)
+
+
 def iterator_target_overlap(infile, merge_distance):
     '''iterate over psl formatted infile and return
     blocks of target overlapping alignments.'''
@@ -807,7 +1135,7 @@ def iterator_per_query(iterator_psl):
     for x in list(data.values()):
         yield x
 
-    raise StopIteration
+    return
 
 FIELDS = ("matches",
           "misMatches",
@@ -12,10 +12,19 @@ create a table from a csv separated file and load data into it.
 This module supports backends for postgres and sqlite3. Column types are
 auto-detected.
 
-.. todo::
+Rows are inserted in batches of ``--batch-size`` rows, each batch in its
+own transaction, so that memory usage does not grow with the size of the
+table. Indices are built after all data have been loaded.
 
-   Use file import where appropriate to speed up loading. Currently, this is
-   not always the case.
+For sqlite, the option ``--bulk-load`` sets pragmas that speed up
+loading (see :data:`BULK_LOAD_PRAGMAS`) for the duration of the load.
+The option ``--quick`` implies ``--bulk-load``.
+
+Many jobs loading tables into the same sqlite database at the same time
+will compete for the database lock. With the option ``--load-queue``,
+jobs instead queue up (see :class:`LoadQueue`) and load their tables one
+after the other. The database is switched to WAL mode so that readers
+are not blocked by the loading job.
 
 Usage
 -----
@@ -29,16 +38,22 @@ Code
 '''
 import os
 import csv
+import fcntl
 import string
 import re
 import time
-import tempfile
 
 from CGAT import Experiment as E
 from CGAT import CSV as CSV
 from CGAT import IOTools as IOTools
 import sqlite3
 
+# pragmas set for bulk loading into sqlite. The journal mode is not
+# changed for databases in WAL mode.
+BULK_LOAD_PRAGMAS = (("synchronous", "OFF"),
+                     ("journal_mode", "MEMORY"),
+                     ("cache_size", "-%(cache_size)i"))
+
 
 def executewait(dbhandle, statement, error,
                 retry=False,
@@ -46,31 +61,244 @@ def executewait(dbhandle, statement, error,
                 args=()):
     '''execute sql statement.
 
-    Retry on error, if retry is True.
+    Retry on error, if retry is True. Retries back off exponentially
+    up to *wait* seconds and give up after waiting a total of 20 times
+    *wait* seconds.
     Returns a cursor object.
     '''
 
     cc = dbhandle.cursor()
-    i = 20
-    while i > 0:
+    remaining = 20 * wait
+    delay = min(0.1, wait)
+    while remaining > 0:
         try:
             cc.execute(statement, args)
             return cc
         except sqlite3.OperationalError as e:
             E.warn("import failed: msg=%s, statement=\n  %s" %
                    (str(e), statement))
-        # TODO: check for database locked msg
             if not retry:
                 raise e
             if not re.search("locked", str(e)):
                 raise e
-            time.sleep(wait)
-            i -= 1
+            delay = min(delay, remaining)
+            time.sleep(delay)
+            remaining -= delay
+            delay = min(2 * delay, wait)
             continue
         break
     raise sqlite3.OperationalError("Database locked and too many retries")
 
 
+class LoadQueue(object):
+    '''first-in-first-out queue of jobs writing to the same database.
+
+    The queue is implemented through lock files in *queue_dir*, which
+    defaults to the database name with the suffix ``.queue``.  Each
+    job draws a ticket and holds an exclusive lock on its ticket file
+    until it has finished. A job then blocks on the lock of the ticket
+    drawn before its own, so that it is woken as soon as its
+    predecessor finishes or dies, without polling.
+
+    A job removes its ticket file when it has finished. The last job
+    in the queue also removes the ticket counter, so that only
+    ``queue.log`` remains. Queue wait and load times are appended to
+    the file ``queue.log`` in *queue_dir*.
+
+    Usage::
+
+        with LoadQueue("csvdb", name="mytable"):
+            load_table()
+    '''
+
+    def __init__(self, database, name=None, queue_dir=None):
+        if queue_dir is None:
+            queue_dir = database + ".queue"
+        self.queue_dir = queue_dir
+        self.name = name
+        self.ticket = None
+        self.ticket_file = None
+        self.wait_time = 0
+        self.start_time = None
+
+    def _getTicketFilename(self, ticket):
+        return os.path.join(self.queue_dir, "%012i.ticket" % ticket)
+
+    def _lockCounter(self):
+        '''open and lock the ticket counter.
+
+        The counter is removed when the queue is empty. A lock obtained
+        on a counter that has been removed in the meantime is discarded
+        and the new counter is locked instead.
+        '''
+        filename = os.path.join(self.queue_dir, "counter")
+        while 1:
+            outf = open(filename, "a+")
+            fcntl.flock(outf, fcntl.LOCK_EX)
+            try:
+                if os.fstat(outf.fileno()).st_ino == \
+                   os.stat(filename).st_ino:
+                    return outf
+            except OSError:
+                pass
+            outf.close()
+
+    def __enter__(self):
+        if not os.path.exists(self.queue_dir):
+            try:
+                os.makedirs(self.queue_dir)
+            except OSError:
+                # created by another job
+                if not os.path.isdir(self.queue_dir):
+                    raise
+
+        queued_at = time.time()
+
+        # draw a ticket and lock it while holding the counter lock
+        with self._lockCounter() as outf:
+            outf.seek(0)
+            self.ticket = int(outf.read().strip() or 0) + 1
+            outf.seek(0)
+            outf.truncate()
+            outf.write("%i\n" % self.ticket)
+            outf.flush()
+            self.ticket_file = open(
+                self._getTicketFilename(self.ticket), "w")
+            fcntl.flock(self.ticket_file, fcntl.LOCK_EX)
+
+        predecessor = self._getTicketFilename(self.ticket - 1)
+        try:
+            inf = open(predecessor)
+        except IOError:
+            inf = None
+
+        if inf is not None:
+            E.info("waiting in load queue %s with ticket %i" %
+                   (self.queue_dir, self.ticket))
+            fcntl.flock(inf, fcntl.LOCK_EX)
+            inf.close()
+            # left behind if the predecessor died
+            try:
+                os.unlink(predecessor)
+            except OSError:
+                pass
+
+        self.start_time = time.time()
+        self.wait_time = self.start_time - queued_at
+        E.info("load queue ticket %i: waited %.1f seconds" %
+               (self.ticket, self.wait_time))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        load_time = time.time() - self.start_time
+        filename = os.path.join(self.queue_dir, "queue.log")
+        write_header = not os.path.exists(filename)
+        with open(filename, "a") as outf:
+            if write_header:
+                outf.write("ticket\tpid\tname\tqueued\t"
+                           "wait_time\tload_time\tstatus\n")
+            outf.write("%i\t%i\t%s\t%s\t%.2f\t%.2f\t%s\n" % (
+                self.ticket,
+                os.getpid(),
+                self.name,
+                time.strftime(
+                    "%Y-%m-%d %H:%M:%S",
+                    time.localtime(self.start_time - self.wait_time)),
+                self.wait_time,
+                load_time,
+                "failed" if exc_type else "success"))
+        with self._lockCounter() as outf:
+            outf.seek(0)
+            last_ticket = int(outf.read().strip() or 0)
+            os.unlink(self._getTicketFilename(self.ticket))
+            if last_ticket == self.ticket:
+                # no other job is queued
+                os.unlink(outf.name)
+        # releases the lock and wakes up the next job
+        self.ticket_file.close()
+        self.ticket_file = None
+        return False
+
+
+def setPragmas(dbhandle, pragmas, error, retry=False):
+    '''set sqlite pragmas.
+
+    Returns a list of tuples with the previous values such that the
+    settings can be restored by calling this function again.
+    '''
+    previous = []
+    for pragma, value in pragmas:
+        cc = executewait(dbhandle, "PRAGMA %s" % pragma, error, retry)
+        old_value = cc.fetchone()[0]
+        cc.close()
+        if pragma == "journal_mode" and str(old_value).lower() == "wal":
+            continue
+        cc = executewait(dbhandle, "PRAGMA %s = %s" % (pragma, value),
+                         error, retry)
+        cc.close()
+        previous.append((pragma, old_value))
+        E.debug("set pragma %s = %s (was %s)" % (pragma, value, old_value))
+    return previous
+
+
+def insertBatches(dbhandle, statement, rows, error,
+                  batch_size=100000,
+                  retry=False,
+                  report_step=10000,
+                  wait=5):
+    '''insert *rows* using *statement* in batches of *batch_size*.
+
+    Each batch is inserted within a transaction. If *retry* is set,
+    a batch that fails because the database is locked is rolled back
+    and tried again.
+
+    Returns the number of rows inserted.
+    '''
+
+    ninput = 0
+    start = time.time()
+    last_report = 0
+
+    def _insert(batch):
+        while 1:
+            try:
+                dbhandle.executemany(statement, batch)
+                dbhandle.commit()
+            except error as msg:
+                E.warn("import failed: msg=%s, statement=\n  %s" %
+                       (msg, statement))
+                dbhandle.rollback()
+                if not retry:
+                    raise
+                if not re.search("locked", str(msg)):
+                    raise
+                time.sleep(wait)
+                continue
+            break
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _insert(batch)
+            ninput += len(batch)
+            batch = []
+            if ninput - last_report >= report_step:
+                last_report = ninput
+                E.info("inserted %i rows, %.0f rows/s" %
+                       (ninput, ninput / max(time.time() - start, 1e-6)))
+
+    if batch:
+        _insert(batch)
+        ninput += len(batch)
+
+    E.info("inserted %i rows in %.1f seconds, %.0f rows/s" %
+           (ninput, time.time() - start,
+            ninput / max(time.time() - start, 1e-6)))
+
+    return ninput
+
+
 def quoteRow(row, take,
              map_column2type,
              missing_values,
@@ -258,6 +486,16 @@ def run(infile, options, report_step=10000):
     options.tablename = quoteTableName(
         options.tablename, backend=options.backend)
 
+    if options.load_queue and options.backend == "sqlite":
+        with LoadQueue(options.database_name, name=options.tablename):
+            loadTable(infile, options, report_step=report_step)
+    else:
+        loadTable(infile, options, report_step=report_step)
+
+
+def loadTable(infile, options, report_step=10000):
+    '''load data from *infile* into a table in the database.'''
+
     if options.map:
         m = {}
         for x in options.map:
@@ -268,8 +506,7 @@ def run(infile, options, report_step=10000):
         options.map = {}
 
     existing_tables = set()
-
-    quick_import_separator = "\t"
+    restore_pragmas = []
 
     if options.database_backend == "postgres":
         import psycopg2
@@ -316,6 +553,12 @@ def run(infile, options, report_step=10000):
         dbhandle.text_factory = str
 
         error = sqlite3.OperationalError
+
+        if options.load_queue:
+            cc = executewait(dbhandle, "PRAGMA journal_mode = WAL",
+                             error, options.retry)
+            cc.close()
+
         options.insert_many = True  # False
         options.null = None  # "NULL"
         options.text = "TEXT"
@@ -327,12 +570,8 @@ def run(infile, options, report_step=10000):
         existing_tables = set([x[0] for x in cc])
         cc.close()
 
-        # use , as separator
-        quick_import_statement = \
-            "sqlite3 %s '.import %%s %s'" % \
-            (options.database_name, options.tablename)
-
-        quick_import_separator = "|"
+        if options.insert_quick:
+            options.bulk_load = True
 
     if options.header is not None:
         options.header = [x.strip() for x in options.header.split(",")]
@@ -438,87 +677,27 @@ def run(infile, options, report_step=10000):
 
     ninput = 0
 
-    E.info("inserting data")
+    if options.backend == "sqlite" and options.bulk_load:
+        pragmas = [(x, y % {"cache_size": options.cache_size * 1024})
+                   for x, y in BULK_LOAD_PRAGMAS]
+        restore_pragmas = setPragmas(
+            dbhandle, pragmas, error, options.retry)
 
-    if options.insert_quick:
-        E.info("using quick insert")
-
-        outfile, filename = tempfile.mkstemp()
-
-        E.debug("dumping data into %s" % filename)
-
-        for d in row_iter(rows, reader):
-
-            ninput += 1
-            os.write(outfile, quick_import_separator.join(
-                [str(d[x]) for x in take]) + "\n")
-
-            if ninput % report_step == 0:
-                E.info("iteration %i\n" % ninput)
-
-        os.close(outfile)
-
-        statement = quick_import_statement % filename
-        E.debug(statement)
-
-        # infinite loop possible
-        while 1:
-
-            retcode = E.run(statement, cwd=os.getcwd(), close_fds=True)
-
-            if retcode != 0:
-                E.warn("import error using statement: %s" % statement)
-
-                if not options.retry:
-                    raise ValueError(
-                        "import error using statement: %s" % statement)
-
-                time.sleep(5)
-                continue
-
-            break
-
-        os.remove(filename)
-
-        # there is no way to insert NULL values into sqlite. The only
-        # solution is to update all colums.
-        for column in take:
-            executewait(dbhandle,
-                        "UPDATE %s SET %s = NULL WHERE %s = 'None'" % (
-                            options.tablename, column, column),
-                        error,
-                        options.retry)
-
-    elif options.insert_many:
-        data = []
-        for d in row_iter(rows, reader):
-            ninput += 1
-
-            data.append([d[x] for x in take])
-
-            if ninput % report_step == 0:
-                E.info("iteration %i" % ninput)
+    E.info("inserting data")
 
+    if options.insert_many:
         statement = "INSERT INTO %s VALUES (%s)" % (
             options.tablename, ",".join("?" * len(take)))
 
-        E.info("inserting %i rows" % len(data))
         E.debug("multiple insert:\n# %s" % statement)
 
-        while 1:
-            try:
-                dbhandle.executemany(statement, data)
-            except error as msg:
-                E.warn("import failed: msg=%s, statement=\n  %s" %
-                       (msg, statement))
-                # TODO: check for database locked msg
-                if not options.retry:
-                    raise error(msg)
-                if not re.search("locked", str(msg)):
-                    raise error(msg)
-                time.sleep(5)
-                continue
-            break
+        ninput = insertBatches(
+            dbhandle, statement,
+            ([d[x] for x in take] for d in row_iter(rows, reader)),
+            error,
+            batch_size=options.batch_size,
+            retry=options.retry,
+            report_step=report_step)
 
     else:
         # insert line by line (could not figure out how to do bulk loading with
@@ -564,6 +743,9 @@ def run(infile, options, report_step=10000):
 
     dbhandle.commit()
 
+    if restore_pragmas:
+        setPragmas(dbhandle, restore_pragmas, error, options.retry)
+
 
 def buildParser():
 
@@ -630,8 +812,28 @@ def buildParser():
 
     parser.add_option("-q", "--quick", dest="insert_quick",
                       action="store_true",
-                      help="try quick file based import - needs to "
-                      "be supported by the backend [default=%default].")
+                      help="try quick import - needs to "
+                      "be supported by the backend. For sqlite, this "
+                      "implies --bulk-load [default=%default].")
+
+    parser.add_option("--bulk-load", dest="bulk_load",
+                      action="store_true",
+                      help="set sqlite pragmas for fast loading while "
+                      "the table is loaded [default=%default].")
+
+    parser.add_option("--load-queue", dest="load_queue",
+                      action="store_true",
+                      help="wait in a queue for other jobs loading into "
+                      "the same sqlite database to finish. Switches the "
+                      "database to WAL mode [default=%default].")
+
+    parser.add_option("--batch-size", dest="batch_size", type="int",
+                      help="number of rows to insert per transaction "
+                      "[default=%default].")
+
+    parser.add_option("--cache-size", dest="cache_size", type="int",
+                      help="sqlite page cache size in Mb when "
+                      "bulk loading [default=%default].")
 
     parser.add_option("-i", "--add-index", dest="indices", type="string",
                       action="append",
@@ -680,6 +882,10 @@ def buildParser():
         indices=[],
         missing_values=("na", "NA", ),
         insert_quick=False,
+        bulk_load=False,
+        load_queue=False,
+        batch_size=100000,
+        cache_size=512,
         allow_empty=False,
         retry=False,
         utf=False,
@@ -628,7 +628,8 @@ class Counts(object):
                     min_cbin, max_cbin, width_cbin,
                     min_ibin, max_ibin, width_ibin,
                     tracks_map,  groups,
-                    difference, s_max=100, i=1):
+                    difference, s_max=100, i=1,
+                    seed=None):
         '''take a dataframe and shuffle the rows to obtain spike in rows.
         return the indices to obtain the rows from the counts table
         and the counts per bin
@@ -644,6 +645,12 @@ class Counts(object):
         * difference = "relative", "logfold" or "abs_logfold"
         * s_max = maximum number of spikes per bin
         * i = number of iterations. More iterations = more filled bins
+        * seed = seed for the random number generator. If not given,
+          a seed is drawn from the python random module.
+
+        The permutations for all iterations are drawn at once. As the
+        group means of a row do not depend on the permutation, they
+        are computed once and then indexed by the permutations.
         '''
 
         # make bins with an extra bin at the end to capture spike-ins with
@@ -653,51 +660,70 @@ class Counts(object):
         i_bins = np.arange(min_ibin, max_ibin + width_ibin, width_ibin)
 
         bin_counts = np.zeros((len(i_bins) + 1, len(c_bins) + 1))
+        flat_counts = bin_counts.reshape(-1)
+        ncolumns = bin_counts.shape[1]
 
         indices = {(key1, key2): []
                    for key1 in np.digitize(i_bins, i_bins)
                    for key2 in np.digitize(c_bins, c_bins)}
 
-        min_occup = min(bin_counts.flatten())
-        for iteration in range(0,  i):
+        if seed is None:
+            seed = random.randint(0, 2 ** 32 - 1)
+        rng = np.random.RandomState(seed)
+
+        nrows = self.table.shape[0]
+        row_names = self.table.index.values
+        group1_means = self.table[tracks_map[groups[0]]].values.astype(
+            np.float64).mean(axis=1)
+        group2_means = self.table[tracks_map[groups[1]]].values.astype(
+            np.float64).mean(axis=1)
+
+        # one row per iteration
+        group1_rand = np.argsort(rng.random_sample((i, nrows)), axis=1)
+        group2_rand = np.argsort(rng.random_sample((i, nrows)), axis=1)
+
+        for iteration in range(0, i):
+            # spike-ins falling into the first or final bins are ignored
+            valid_counts = bin_counts[1:len(i_bins), 1:len(c_bins)]
+            if valid_counts.size and valid_counts.min() >= s_max:
+                E.info("all bins filled after %i iterations" % iteration)
+                break
+
             E.info("performing shuffling iteration number %i.." % (
                 iteration + 1))
-            if min_occup < s_max:
-                group1_rand = copy.copy(self.table.index.tolist())
-                group2_rand = copy.copy(self.table.index.tolist())
-                random.shuffle(group1_rand)
-                random.shuffle(group2_rand)
-
-                # subset the dataframe rows in the first random order
-                # and by the column_ids in the first group
-                # and return means across columns. Repeat for group2
-                group1_mean = self.table.ix[group1_rand,
-                                            tracks_map[groups[0]]].apply(
-                                                np.mean, axis=1).tolist()
-                group2_mean = self.table.ix[group2_rand,
-                                            tracks_map[groups[1]]].apply(
-                                                np.mean, axis=1).tolist()
-                # retrieve the index for the bin in
-                # which each index value falls
-                change_idx, initial_idx = means2idxarrays(
-                    group1_mean, group2_mean, i_bins, c_bins, difference)
-
-                # for each initial and change value coordinate
-                for idx, coord in enumerate(zip(initial_idx, change_idx)):
-                    # ignore spike-in if change or initial fall into the final
-                    # bin
-                    if coord[0] < len(i_bins) and coord[1] < len(c_bins):
-                        if coord in list(indices.keys()):
-                            # if max fill of bin not reached
-                            if bin_counts[coord] < s_max:
-                                # ...append tuple of df indeces for groups
-                                bin_counts[coord] += 1
-                                indices[coord].append((group1_rand[idx],
-                                                       group2_rand[idx]))
-
-                    # find the minimum value in the counts array this should
-                    # save time if all bins are filled before final iteration
-                    min_occup = min(bin_counts.flatten())
+
+            group1_idx = group1_rand[iteration]
+            group2_idx = group2_rand[iteration]
+
+            # retrieve the index for the bin in
+            # which each index value falls
+            change_idx, initial_idx = means2idxarrays(
+                group1_means[group1_idx], group2_means[group2_idx],
+                i_bins, c_bins, difference)
+
+            valid = np.nonzero((initial_idx > 0) &
+                               (initial_idx < len(i_bins)) &
+                               (change_idx > 0) &
+                               (change_idx < len(c_bins)))[0]
+            codes = initial_idx[valid] * ncolumns + change_idx[valid]
+
+            # rank spike-ins within each bin in the order they were drawn
+            # and keep those that do not exceed the maximum fill of a bin
+            order = np.argsort(codes, kind="mergesort")
+            sorted_codes = codes[order]
+            rank = (np.arange(len(sorted_codes)) -
+                    np.searchsorted(sorted_codes, sorted_codes, side="left") +
+                    flat_counts[sorted_codes])
+            keep = np.sort(order[rank < s_max])
+
+            flat_counts += np.bincount(codes[keep], minlength=len(flat_counts))
+
+            # ...append tuple of df indeces for groups
+            for coord, row1, row2 in zip(
+                    zip(initial_idx[valid[keep]], change_idx[valid[keep]]),
+                    row_names[group1_idx[valid[keep]]],
+                    row_names[group2_idx[valid[keep]]]):
+                indices[coord].append((row1, row2))
 
         E.info("The largest bin has %i entries" % max(bin_counts.flatten()))
 
@@ -824,22 +850,22 @@ def means2idxarrays(g1, g2, i_bins, c_bins, difference):
     '''take two arrays of values and return the initial values
     and differences as numpy digitised arrays'''
 
+    g1 = np.asarray(g1, dtype=np.float64)
+    g2 = np.asarray(g2, dtype=np.float64)
+
     if difference == "relative":
         # calculate difference between mean values for group1 and group2
         # g1 and g2 always the same length
-        change = [g2[x] - g1[x] for x in range(0, len(g1))]
+        change = g2 - g1
         initial = g1
 
     elif difference == "logfold":
-        change = [np.log2((g2[x] + 1.0) / (g1[x] + 1.0))
-                  for x in range(0, len(g1))]
-        initial = [np.log2(g1[x] + 1.0) for x in range(0, len(g1))]
+        change = np.log2((g2 + 1.0) / (g1 + 1.0))
+        initial = np.log2(g1 + 1.0)
 
     elif difference == "abs_logfold":
-        change = [abs(np.log2((g2[x] + 1.0) / (g1[x] + 1.0)))
-                  for x in range(0, len(g1))]
-        initial = [max(np.log2(g1[x] + 1.0), np.log2(g2[x] + 1.0))
-                   for x in range(0, len(g1))]
+        change = np.abs(np.log2((g2 + 1.0) / (g1 + 1.0)))
+        initial = np.maximum(np.log2(g1 + 1.0), np.log2(g2 + 1.0))
 
     # return arrays of len(change) with the index position in c_bins
     # corresponding to the bin in which the value of change falls
@@ -34,7 +34,7 @@ def executewait(dbhandle, statement, error=Exception, regex_error="locked",
         Number of retries. If set to negative number, retry indefinitely.
         If set to 0, there will be only one attempt.
     wait : int
-        Number of seconds to way between retries.
+        Number of seconds to wait between retries.
 
     Returns
     -------
@@ -49,7 +49,7 @@ def executewait(dbhandle, statement, error=Exception, regex_error="locked",
         except error as msg:
             if retries == 0:
                 raise
-            if not re.search("locked", str(msg)):
+            if not re.search(regex_error, str(msg)):
                 raise
             time.sleep(wait)
             retries -= 1
@@ -15,6 +15,7 @@ Methods implemented are:
    DESeq
    EdgeR
    ttest
+   sam (permutation test without R)
 
 The aim of this module is to run these individual tools and
 output a table in a common format.
@@ -57,6 +58,7 @@ import pandas
 import ggplot
 import copy
 import numpy as np
+import scipy.stats
 from scipy.stats import ttest_ind
 import matplotlib
 import matplotlib.pyplot as plt
@@ -69,6 +71,7 @@ from rpy2.robjects.packages import importr
 from rpy2.robjects.vectors import FloatVector
 from rpy2.rinterface import RRuntimeError
 import os
+import multiprocessing
 
 try:
     import CGAT.Experiment as E
@@ -652,6 +655,84 @@ class DEResult_TTest(DEResult):
                                               self.table['treatment_name']))
 
 
+class DEExperiment_SAM(DEExperiment):
+    '''DECaller object to run a SAM permutation test on counts data.
+
+    Counts are log2 transformed with a pseudocount of 1 before
+    testing. Means and standard deviations are reported on the
+    normalised counts.
+    '''
+
+    def run(self, counts, design, normalise=True,
+            normalise_method="deseq-size-factors",
+            npermutations=1000,
+            threads=1,
+            seed=None):
+
+        if normalise is True:
+            counts.normalise(method=normalise_method)
+
+        df_dict = collections.defaultdict(list)
+        probesets = counts.table.index.tolist()
+        log_counts = numpy.log2(counts.table.values.astype(numpy.float64) + 1)
+
+        for combination in itertools.combinations(design.groups, 2):
+
+            control, treatment = combination
+            n_rows = counts.table.shape[0]
+            df_dict["control_name"].extend((control,) * n_rows)
+            df_dict["treatment_name"].extend((treatment,) * n_rows)
+            df_dict["test_id"].extend(probesets)
+            df_dict["status"].extend(("OK",) * n_rows)
+
+            c_keep = numpy.array([x == control for x in design.conditions])
+            t_keep = numpy.array([x == treatment for x in design.conditions])
+            control_counts = counts.table.iloc[:, c_keep]
+            treatment_counts = counts.table.iloc[:, t_keep]
+
+            df_dict["control_mean"].extend(control_counts.mean(axis=1))
+            df_dict["control_std"].extend(control_counts.std(axis=1))
+            df_dict["treatment_mean"].extend(treatment_counts.mean(axis=1))
+            df_dict["treatment_std"].extend(treatment_counts.std(axis=1))
+
+            genes, cutoff, fdr_values = SAMPermutation()(
+                probesets,
+                treatments=list(log_counts[:, t_keep].T),
+                controls=list(log_counts[:, c_keep].T),
+                npermutations=npermutations,
+                threads=threads,
+                seed=seed)
+
+            df_dict["p_value"].extend([x.pvalue for x in genes])
+            df_dict["p_value_adj"].extend([x.qvalue for x in genes])
+
+        result = DEResult_SAM(testTable=pandas.DataFrame(df_dict))
+        result.table.set_index("test_id", inplace=True)
+
+        return result
+
+
+class DEResult_SAM(DEResult):
+
+    def getResults(self, fdr):
+        ''' post-process test results table into generic results output
+
+        The adjusted p-values are the SAM q-values.
+        '''
+
+        self.table["fold"] = (
+            self.table["treatment_mean"] / self.table["control_mean"])
+
+        self.table["significant"] = pvaluesToSignficant(
+            self.table["p_value_adj"], fdr)
+
+        self.table["l2fold"] = list(numpy.log2(self.table["fold"]))
+
+        self.table["transformed_l2fold"] = self.table["l2fold"]
+        self.table["contrast"] = (self.table['control_name'] + "_vs_"
+                                  + self.table['treatment_name'])
+
+
 class DEExperiment_edgeR(DEExperiment):
     '''DEExperiment object to run edgeR on counts data
 
@@ -1499,41 +1580,75 @@ def writeExpressionResults(outfile, result):
 class WelchsTTest(object):
 
     '''base class for computing expression differences.
+
+    The test statistics for all probesets are computed at once
+    from the per-probeset means and standard deviations.
     '''
 
     def __call__(self,
                  probesets,
                  treatments,
-                 controls):
+                 controls,
+                 alpha=0.05):
 
         assert len(probesets) == len(treatments[0])
         assert len(probesets) == len(controls[0])
 
-        nskipped = 0
-        results = []
-
-        for probeset, treatment, control in zip(
-                probesets, zip(*treatments), zip(*controls)):
+        # probesets x samples
+        treatments = numpy.array(treatments, dtype=numpy.float64).T
+        controls = numpy.array(controls, dtype=numpy.float64).T
 
-            nval1, nval2 = len(treatment), len(control)
-            mean1, mean2 = numpy.mean(treatment), numpy.mean(control)
-            stddev1, stddev2 = numpy.std(treatment), numpy.std(control)
+        nval1, nval2 = treatments.shape[1], controls.shape[1]
+        mean1, mean2 = treatments.mean(axis=1), controls.mean(axis=1)
+        stddev1, stddev2 = treatments.std(axis=1), controls.std(axis=1)
 
-            try:
-                s = Stats.doWelchsTTest(nval1, mean1, stddev1,
-                                        nval2, mean2, stddev2,
-                                        alpha=0.05)
-            except ValueError:
-                E.warn(
-                    "expressionDifferences: standard deviations are 0 for "
-                    "probeset %s - skipped" % probeset)
-                nskipped += 1
-                continue
+        skip = (stddev1 == 0) & (stddev2 == 0)
+        for probeset in numpy.array(probesets, dtype=object)[skip]:
+            E.warn(
+                "expressionDifferences: standard deviations are 0 for "
+                "probeset %s - skipped" % probeset)
+        nskipped = int(skip.sum())
+        keep = numpy.nonzero(~skip)[0]
+
+        mean1, mean2 = mean1[keep], mean2[keep]
+        stddev1, stddev2 = stddev1[keep], stddev2[keep]
+
+        # convert standard deviation to sample variance
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            svar1 = stddev1 ** 2 * nval1 / float(nval1 - 1)
+            svar2 = stddev2 ** 2 * nval2 / float(nval2 - 1)
+
+            # compute df and test statistic
+            df = ((svar1 / nval1 + svar2 / nval2) ** 2) / \
+                (((svar1 / nval1) ** 2) / (nval1 - 1)
+                 + ((svar2 / nval2) ** 2) / (nval2 - 1))
+            denom = numpy.sqrt(svar1 / nval1 + svar2 / nval2)
+            z = numpy.abs(mean1 - mean2) / denom
+
+        pvalues = 2 * scipy.stats.t.sf(z, df)
+        zlower = scipy.stats.t.ppf(alpha, df)
+        zupper = scipy.stats.t.ppf(1.0 - alpha, df)
 
-            s.mProbeset = probeset
+        results = []
+        for x, idx in enumerate(keep):
+            s = Stats.WelchTTest()
+            s.mPValue = pvalues[x]
+            s.mDegreesFreedom = df[x]
+            s.mZ = z[x]
+            s.mMean1 = mean1[x]
+            s.mMean2 = mean2[x]
+            s.mSampleVariance1 = svar1[x]
+            s.mSampleVariance2 = svar2[x]
+            s.mDifference = mean1[x] - mean2[x]
+            s.mZLower = zlower[x]
+            s.mZUpper = zupper[x]
+            s.mDifferenceLower = zlower[x] * denom[x]
+            s.mDifferenceUpper = zupper[x] * denom[x]
+            s.mProbeset = probesets[idx]
             results.append(s)
 
-        qvalues = Stats.doFDR([x.mPValue for x in results]).mQValues
+        qvalues = Stats.doFDR([x.mPValue for x in results],
+                              use_r=False).mQValues
 
         for s, qvalue in zip(results, qvalues):
             s.mQValue = qvalue
@@ -1832,6 +1947,310 @@ class SAM(object):
         return genes, cutoff, fdr_values
 
 
+def computeSAMStatistics(matrix, labels, s0=0.0):
+    '''compute SAM d-statistics for two-group comparisons.
+
+    *matrix* is an array of expression values with genes in rows
+    and samples in columns. *labels* is a boolean array marking the
+    samples in the treatment group. *labels* can be a vector or a
+    matrix with one label assignment per row, in which case the
+    statistics for all assignments are computed at once.
+
+    The d-statistic is the difference in means divided by the pooled
+    standard error plus the fudge factor *s0*.
+
+    returns a tuple of arrays (d, r, s) with the d-statistic, the
+    difference in means and the standard error. Each array has
+    shape genes x assignments.
+    '''
+    labels = numpy.atleast_2d(labels).astype(numpy.float64)
+    nsamples = matrix.shape[1]
+    n1 = labels.sum(axis=1)
+    n2 = nsamples - n1
+
+    # centre each gene to avoid loss of precision in the
+    # sums of squares
+    matrix = matrix - matrix.mean(axis=1)[:, numpy.newaxis]
+    squares = matrix ** 2
+
+    sum1 = matrix.dot(labels.T)
+    sum2 = matrix.sum(axis=1)[:, numpy.newaxis] - sum1
+    sq1 = squares.dot(labels.T)
+    sq2 = squares.sum(axis=1)[:, numpy.newaxis] - sq1
+
+    mean1 = sum1 / n1
+    mean2 = sum2 / n2
+    ss = numpy.maximum(
+        (sq1 - n1 * mean1 ** 2) + (sq2 - n2 * mean2 ** 2), 0)
+
+    r = mean1 - mean2
+    s = numpy.sqrt((1.0 / n1 + 1.0 / n2) / (n1 + n2 - 2) * ss)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        d = r / (s + s0)
+    return d, r, s
+
+
+# data shared with worker processes computing permutations
+_SAM_WORKER = {}
+
+
+def _initializeSAMWorker(matrix, observed, ntreatments, s0):
+    '''store data for SAM permutations in the worker process.'''
+    _SAM_WORKER["matrix"] = matrix
+    _SAM_WORKER["observed"] = observed
+    _SAM_WORKER["abs_observed"] = numpy.abs(observed)
+    _SAM_WORKER["ntreatments"] = ntreatments
+    _SAM_WORKER["s0"] = s0
+
+
+def _runSAMPermutations(args):
+    '''compute a batch of SAM permutations.
+
+    returns a tuple with the sums of the ordered d-statistics and,
+    for each gene, the number of permuted d-statistics that are
+    larger/smaller than the observed d-statistic and larger than
+    the observed d-statistic in absolute value.
+    '''
+    seed, npermutations = args
+    matrix = _SAM_WORKER["matrix"]
+    observed = _SAM_WORKER["observed"]
+    ntreatments = _SAM_WORKER["ntreatments"]
+
+    # build label matrix, one permutation per row
+    rng = numpy.random.RandomState(seed)
+    nsamples = matrix.shape[1]
+    selected = numpy.argsort(
+        rng.random_sample((npermutations, nsamples)),
+        axis=1)[:, :ntreatments]
+    labels = numpy.zeros((npermutations, nsamples), dtype=numpy.bool_)
+    labels[numpy.arange(npermutations)[:, numpy.newaxis], selected] = True
+
+    d = computeSAMStatistics(matrix, labels, _SAM_WORKER["s0"])[0]
+    d[numpy.isnan(d)] = 0
+
+    # sort each permutation, rows are contiguous in the transpose
+    d = numpy.sort(d.T, axis=1)
+    sum_ordered = d.sum(axis=0)
+
+    pooled = numpy.sort(d.ravel())
+    ntotal = len(pooled)
+    nlarger = ntotal - numpy.searchsorted(pooled, observed, side="left")
+    nsmaller = numpy.searchsorted(pooled, observed, side="right")
+
+    abs_observed = _SAM_WORKER["abs_observed"]
+    nabs = ntotal - numpy.searchsorted(pooled, abs_observed, side="left")
+    nabs += numpy.searchsorted(pooled, -abs_observed, side="right")
+    # do not count zeros twice
+    nabs -= (abs_observed == 0) * (
+        numpy.searchsorted(pooled, 0, side="right")
+        - numpy.searchsorted(pooled, 0, side="left"))
+
+    return sum_ordered, nlarger, nsmaller, nabs
+
+
+class SAMPermutation(object):
+
+    '''SAM analysis of microarray data without R.
+
+    Use the Two-Class Unpaired Case with a pooled variance estimate.
+
+    The d-statistics of all genes are computed as matrix operations.
+    Permutations are processed in batches of *batch_size* label
+    assignments. Batches are distributed over *threads* processes.
+
+    Significant genes are either called at *fdr* or the
+    top *ngenes* are returned.
+
+    *treatments* and *control* are arrays of
+    arrays of expression values.
+
+    The fudge factor s0 is set to the *s0_percentile* percentile of
+    the gene-wise standard errors unless *s0* is given.
+    P-values are computed from the pooled permutation distribution
+    of the absolute d-statistics. The proportion of true null
+    hypotheses is estimated at lambda = 0.5 as in siggenes.
+
+    Permutations are reproducible if *seed* is given.
+
+    .. note::
+        SAM requires log2 scaled expression levels.
+
+    fold change is treatment / control.
+
+    '''
+
+    def __call__(self, probesets,
+                 treatments,
+                 controls,
+                 pattern=None,
+                 fdr=0.10,
+                 ngenes=None,
+                 npermutations=1000,
+                 ndelta=10,
+                 s0=None,
+                 s0_percentile=50,
+                 batch_size=100,
+                 threads=1,
+                 seed=None,
+                 treatment_label="treatment",
+                 control_label="control"):
+
+        if ngenes and fdr:
+            raise ValueError("either supply ngenes or fdr, but not both.")
+
+        matrix = numpy.array(treatments + controls, dtype=numpy.float64).T
+        ngenes_total, nsamples = matrix.shape
+        ntreatments = len(treatments)
+
+        E.debug("build expression matrix: %i x %i" % matrix.shape)
+
+        labels = numpy.zeros(nsamples, dtype=numpy.bool_)
+        labels[:ntreatments] = True
+
+        d, r, s = [x[:, 0] for x in computeSAMStatistics(matrix, labels)]
+        if s0 is None:
+            s0 = numpy.percentile(s, s0_percentile)
+        d = r / (s + s0)
+        d[numpy.isnan(d)] = 0
+
+        E.info("computing %i permutations with s0=%f" % (npermutations, s0))
+
+        if seed is None:
+            seed = numpy.random.randint(0, 2 ** 31 - 1 - npermutations)
+
+        batches = [(seed + x, min(batch_size, npermutations - x))
+                   for x in range(0, npermutations, batch_size)]
+
+        initargs = (matrix, d, ntreatments, s0)
+        if threads > 1:
+            pool = multiprocessing.Pool(threads,
+                                        initializer=_initializeSAMWorker,
+                                        initargs=initargs)
+            results = pool.map(_runSAMPermutations, batches)
+            pool.close()
+            pool.join()
+        else:
+            _initializeSAMWorker(*initargs)
+            results = list(map(_runSAMPermutations, batches))
+            _SAM_WORKER.clear()
+
+        sum_ordered, nlarger, nsmaller, nabs = [
+            numpy.sum(x, axis=0) for x in zip(*results)]
+
+        # expected d-statistics from the permutations
+        expected_d = sum_ordered / float(npermutations)
+
+        pvalues = nabs / float(npermutations * ngenes_total)
+        pi0 = min(1.0, Stats.computePi0Lambda(pvalues, [0.5])[0])
+        qvalues = Stats.computeQValues(pvalues, pi0=pi0)
+
+        fdr_data = collections.namedtuple("sam_fdr", (
+            "delta", "p0", "false", "significant", "fdr", "cutlow",
+            "cutup", "j2", "j1"))
+        cutoff_data = collections.namedtuple(
+            "sam_cutoff", ("delta", "significant", "fdr"))
+
+        # compute fdr at a range of thresholds delta
+        order = numpy.argsort(d, kind="mergesort")
+        d_ordered = d[order]
+        differences = d_ordered - expected_d
+        nlarger, nsmaller = nlarger[order], nsmaller[order]
+
+        max_delta = numpy.abs(differences).max()
+        deltas = numpy.linspace(0, max_delta, ndelta + 1)[1:]
+
+        fdr_values = []
+        for delta in deltas:
+            up = numpy.nonzero((differences >= delta) & (d_ordered > 0))[0]
+            low = numpy.nonzero((differences <= -delta) & (d_ordered < 0))[0]
+
+            if len(up):
+                j1 = up[0]
+                cutup = d_ordered[j1]
+                false = nlarger[j1]
+                called = ngenes_total - numpy.searchsorted(
+                    d_ordered, cutup, side="left")
+            else:
+                j1, cutup, false, called = ngenes_total, numpy.inf, 0, 0
+
+            if len(low):
+                j2 = low[-1]
+                cutlow = d_ordered[j2]
+                false += nsmaller[j2]
+                called += numpy.searchsorted(d_ordered, cutlow, side="right")
+            else:
+                j2, cutlow = -1, -numpy.inf
+
+            false = false / float(npermutations)
+            if called > 0:
+                fdr_value = min(1.0, pi0 * false / called)
+            else:
+                fdr_value = 0.0
+
+            # j1 and j2 are reported 1-based as in siggenes
+            fdr_values.append(fdr_data(delta, pi0, false, called, fdr_value,
+                                       cutlow, cutup, j2 + 1, j1 + 1))
+
+        # find d cutoff. The number of called genes decreases with
+        # increasing delta.
+        if fdr is not None and fdr > 0:
+            selected = [x for x in fdr_values
+                        if x.significant > 0 and x.fdr <= fdr][:1]
+        elif ngenes:
+            selected = [x for x in fdr_values
+                        if x.significant >= ngenes][-1:]
+        else:
+            raise ValueError("either supply ngenes or fdr")
+
+        if selected:
+            values = selected[0]
+            cutoff = cutoff_data(values.delta, values.significant, values.fdr)
+            E.debug("using cutoff %s" % str(cutoff))
+            significant = (d >= values.cutup) | (d <= values.cutlow)
+        else:
+            E.debug("no cutoff found - no significant genes.")
+            cutoff = None
+            significant = numpy.zeros(ngenes_total, dtype=numpy.bool_)
+
+        if pattern:
+            outfile = pattern % "sam.pdf"
+            plt.figure()
+            plt.plot(expected_d, d_ordered, ".", color="black")
+            plt.plot(expected_d, expected_d, "-", color="grey")
+            if cutoff:
+                sig = significant[order]
+                plt.plot(expected_d[sig], d_ordered[sig], ".", color="red")
+            plt.xlabel("expected d(i)")
+            plt.ylabel("observed d(i)")
+            plt.savefig(os.path.expanduser(outfile))
+            plt.close()
+
+        mean1 = matrix[:, :ntreatments].mean(axis=1)
+        mean2 = matrix[:, ntreatments:].mean(axis=1)
+        std1 = matrix[:, :ntreatments].std(axis=1)
+        std2 = matrix[:, ntreatments:].std(axis=1)
+
+        genes = []
+        for x, probeset in enumerate(probesets):
+            l2fold = mean1[x] - mean2[x]
+            genes.append(GeneExpressionResult._make((probeset,
+                                                     treatment_label,
+                                                     mean1[x],
+                                                     std1[x],
+                                                     control_label,
+                                                     mean2[x],
+                                                     std2[x],
+                                                     pvalues[x],
+                                                     qvalues[x],
+                                                     l2fold,
+                                                     math.pow(2, l2fold),
+                                                     math.pow(2, l2fold),
+                                                     int(significant[x]),
+                                                     "OK")))
+
+        return genes, cutoff, fdr_values
+
+
 #########################################################################
 #########################################################################
 #########################################################################
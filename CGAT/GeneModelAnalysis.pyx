@@ -126,9 +126,11 @@ def readIntervalsFromGFF(filename_gff, source, feature,
         elif with_records:
             for bed in iterator:
                 ninput += 1
-                bed.gene_id = bed.fields[0]
-                bed.transcript_id = bed.gene_id
-                e[bed.contig].append((bed.start, bed.end, bed))
+                # records are used like gtf records
+                gtf = GTF.Entry().fromBed(bed,
+                                          gene_id=bed.fields[0],
+                                          transcript_id=bed.fields[0])
+                e[bed.contig].append((bed.start, bed.end, gtf))
         else:
             for bed in iterator:
                 ninput += 1
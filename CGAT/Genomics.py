@@ -17,6 +17,7 @@ import hashlib
 import base64
 import tempfile
 import sys
+import itertools
 from functools import reduce
 
 try:
@@ -982,15 +983,19 @@ def MapCodon2AA(codon, is_seleno=False, ignore_n=True):
 
     codon = codon.upper()
 
-    codon = re.sub("[.-]", "", codon)
-    if len(codon) == 0:
-        return GAP_CHAR
-
     if is_seleno:
         code = GeneticCodeSeleno
     else:
         code = GeneticCode
 
+    # complete codons without gaps
+    if codon in code:
+        return code[codon]
+
+    codon = re.sub("[.-]", "", codon)
+    if len(codon) == 0:
+        return GAP_CHAR
+
     if codon in code:
         return code[codon]
     elif codon == "---":
@@ -1082,6 +1087,94 @@ def Alignment2PeptideAlignment(alignment,
     return map_query2sbjct, "".join(sbjct_residues)
 
 
+# Translation of nucleotide sequences is done with lookup tables.
+# Each character is assigned to a class: A, C, G, T, N, gap or other.
+# The codon formed by the classes of its three characters indexes
+# a table of amino acids that is built with MapCodon2AA.
+_CODON_CLASS_CHARS = "ACGTN-X"
+_CODON_CLASSES = numpy.empty(256, dtype=numpy.int32)
+_CODON_CLASSES.fill(6)
+for _x, _c in enumerate("ACGTN"):
+    _CODON_CLASSES[ord(_c)] = _x
+    _CODON_CLASSES[ord(_c.lower())] = _x
+for _c in ".-":
+    _CODON_CLASSES[ord(_c)] = 5
+
+# characters that mark a codon as lower case
+_LOWER_CASE_CHARS = numpy.zeros(256, dtype=numpy.bool_)
+for _c in "acgtnx":
+    _LOWER_CASE_CHARS[ord(_c)] = True
+
+# sequences shorter than this are translated codon by codon
+_MIN_VECTORIZED_LENGTH = 90
+
+_TRANSLATION_TABLES = {}
+_TRANSLATION_CACHE = {}
+
+
+def _getTranslationTable(is_seleno, ignore_n):
+    '''return a table mapping codon classes to amino acids.'''
+    key = (is_seleno, ignore_n)
+    if key not in _TRANSLATION_TABLES:
+        _TRANSLATION_TABLES[key] = numpy.array(
+            [ord(MapCodon2AA("".join(codon),
+                             is_seleno=is_seleno,
+                             ignore_n=ignore_n))
+             for codon in itertools.product(_CODON_CLASS_CHARS, repeat=3)],
+            dtype=numpy.uint8)
+    return _TRANSLATION_TABLES[key]
+
+
+def _translateCodon(codon, is_seleno, prefer_lowercase, ignore_n):
+    '''translate a single (possibly incomplete) codon.'''
+    key = (codon, is_seleno, prefer_lowercase, ignore_n)
+    try:
+        return _TRANSLATION_CACHE[key]
+    except KeyError:
+        pass
+
+    if prefer_lowercase:
+        is_lower = any(c in "acgtnx" for c in codon)
+    else:
+        is_lower = all(c in "acgtnx" for c in codon)
+
+    aa = MapCodon2AA(codon.upper(),
+                     is_seleno=is_seleno,
+                     ignore_n=ignore_n)
+    if is_lower:
+        aa = aa.lower()
+    else:
+        aa = aa.upper()
+
+    # do not let the cache grow without bounds for unusual input
+    if len(_TRANSLATION_CACHE) > 100000:
+        _TRANSLATION_CACHE.clear()
+    _TRANSLATION_CACHE[key] = aa
+    return aa
+
+
+def _translateCodons(sequence, is_seleno, prefer_lowercase, ignore_n):
+    '''translate complete codons in *sequence* with a lookup table.
+
+    returns the translation as a string.
+    '''
+    codons = numpy.frombuffer(sequence.encode("latin-1"),
+                              dtype=numpy.uint8).reshape(-1, 3)
+    classes = _CODON_CLASSES[codons]
+    residues = _getTranslationTable(is_seleno, ignore_n)[
+        classes[:, 0] * 49 + classes[:, 1] * 7 + classes[:, 2]]
+
+    lower_case = _LOWER_CASE_CHARS[codons]
+    if prefer_lowercase:
+        is_lower = lower_case.any(axis=1)
+    else:
+        is_lower = lower_case.all(axis=1)
+    is_lower &= (residues >= ord("A")) & (residues <= ord("Z"))
+    residues[is_lower] += ord("a") - ord("A")
+
+    return residues.tobytes().decode("ascii")
+
+
 def translate(sequence,
               is_seleno=False,
               prefer_lowercase=True,
@@ -1095,29 +1188,57 @@ def translate(sequence,
     If ``ignore_n`` is set, codons with ``n`` are returned
     as ``?`` in order to distinguish them from stop codons.
 
+    Codons are translated with the same rules as in
+    :func:`MapCodon2AA`. A codon is translated into a lower-case
+    amino acid if any (``prefer_lowercase``) or all of its
+    characters are lower case.
+
     '''
-    residues = []
+    ncomplete = len(sequence) - len(sequence) % 3
+
+    if ncomplete < _MIN_VECTORIZED_LENGTH:
+        return "".join(
+            [_translateCodon(sequence[x:x + 3],
+                             is_seleno, prefer_lowercase, ignore_n)
+             for x in range(0, len(sequence), 3)])
+
+    peptide = _translateCodons(sequence[:ncomplete],
+                               is_seleno, prefer_lowercase, ignore_n)
+    if ncomplete < len(sequence):
+        peptide += _translateCodon(sequence[ncomplete:],
+                                   is_seleno, prefer_lowercase, ignore_n)
+    return peptide
 
-    for x in range(0, len(sequence), 3):
-        if prefer_lowercase:
-            is_lower = False
-            for c in sequence[x:x + 3]:
-                is_lower = is_lower or c in "acgtnx"
-        else:
-            is_lower = True
-            for c in sequence[x:x + 3]:
-                is_lower = is_lower and c in "acgtnx"
-
-        if is_lower:
-            residues.append(MapCodon2AA(sequence[x:x + 3].upper(),
-                                        is_seleno=is_seleno,
-                                        ignore_n=ignore_n).lower())
-        else:
-            residues.append(MapCodon2AA(sequence[x:x + 3].upper(),
-                                        is_seleno=is_seleno,
-                                        ignore_n=ignore_n).upper())
 
-    return "".join(residues)
+def translateBatch(sequences,
+                   is_seleno=False,
+                   prefer_lowercase=True,
+                   ignore_n=False):
+    '''translate a collection of DNA sequences into peptide sequences.
+
+    The complete codons of all sequences are translated in a single
+    call. See :func:`translate` for the meaning of the options.
+
+    returns a list of peptide sequences.
+    '''
+    sequences = list(sequences)
+    ncomplete = [len(x) - len(x) % 3 for x in sequences]
+
+    peptides = _translateCodons(
+        "".join([x[:y] for x, y in zip(sequences, ncomplete)]),
+        is_seleno, prefer_lowercase, ignore_n)
+
+    result = []
+    start = 0
+    for sequence, n in zip(sequences, ncomplete):
+        end = start + n // 3
+        peptide = peptides[start:end]
+        if n < len(sequence):
+            peptide += _translateCodon(sequence[n:],
+                                       is_seleno, prefer_lowercase, ignore_n)
+        result.append(peptide)
+        start = end
+    return result
 
 
 def TranslateDNA2Protein(*args, **kwargs):
@@ -21,7 +21,10 @@ These include methods for
   :func:`iterator_split`,
 
 * creating lists/dictionaries from files, such as :func:`readMap` and
-  :func:`readList`, and
+  :func:`readList`,
+
+* reading tables column-wise into numpy arrays, such as
+  :func:`readColumns`, :func:`readMatrix` and :func:`readTable`, and
 
 * working with file collections (see :class:`FilePool`).
 
@@ -34,16 +37,18 @@ import collections
 import glob
 import gzip
 import itertools
+import multiprocessing.pool
 import numpy
 import numpy.ma
+import operator
 import os
 import re
 import shutil
 import stat
-import string
 import subprocess
 import sys
 import time
+import zlib
 
 
 def getFirstLine(filename, nlines=1):
@@ -754,11 +759,33 @@ def invert_dictionary(dict, make_unique=False):
     return inv
 
 
+def _compressGzipMember(data):
+    '''compress *data* into a complete gzip member.
+
+    Concatenated gzip members form a valid gzip file.
+    '''
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                  zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
 class FilePool:
     """manage a pool of output files.
 
-    This class will keep a large number of files open. To
-    see if you can handle this, check the limit within the shell::
+    Data written to the pool is buffered per file and appended to the
+    files in large blocks. Buffers are written when the buffer for a
+    file exceeds :attr:`buffer_size` characters or when all buffers
+    together exceed :attr:`max_buffer_size` characters. In the latter
+    case, the largest buffers are written first. Buffer sizes count
+    characters, not encoded bytes. For ASCII data the two are the same.
+
+    At most :attr:`maxopen` files are kept open at the same time. If
+    more files are required, the least recently used file is closed.
+    To see how many files you can open, check the limit within the
+    shell::
 
        ulimit -n
 
@@ -766,11 +793,9 @@ class FilePool:
 
       cat /proc/sys/fs/file-nr
 
-    Changing these limits might not be easy without root privileges.
-
-    The maximum number of files opened is given by :attr:`maxopen`.
-    This class is inefficient if the number of files is larger than
-    :attr:`maxopen` and calls to `write` do not group keys together.
+    If the output pattern ends in ``.gz``, each block is compressed
+    into a separate gzip member. Compression can be done in parallel
+    by setting `threads`.
 
     To use this class, create a FilePool and write to it as if it was
     a single file, specifying a section for each write::
@@ -779,9 +804,11 @@ class FilePool:
         for value in range(100):
             for section in ("file1", "file2", "file3"):
                  pool.write(section, str(value) + ",")
+        pool.close()
 
     This will create three files called ``file1.tsv``, ``file2.tsv``,
-    ``file3.tsv``, each containing the numbers from 0 to 99.
+    ``file3.tsv``, each containing the numbers from 0 to 99. Files
+    are complete only after :meth:`close` has been called.
 
     The FilePool acts otherwise as a dictionary providing access to
     the number of times an item has been written to each file::
@@ -796,48 +823,84 @@ class FilePool:
        output pattern to use. Should contain a "%s". If set to None, the
        pattern "%s" will be used.
     header : string
-       optional header to write when writing to a file the first time.
+       optional header to write when creating a file.
     force : bool
        overwrite existing files. All files matching the pattern will be
        deleted.
+    buffer_size : int
+       number of characters to buffer per file.
+    max_buffer_size : int
+       number of characters to buffer in total. If None, buffer
+       everything until :meth:`close` is called.
+    threads : int
+       number of threads to use for compressing output.
 
     """
 
-    maxopen = 5000
+    maxopen = 1000
 
     def __init__(self,
                  output_pattern=None,
                  header=None,
-                 force=True):
+                 force=True,
+                 buffer_size=1048576,
+                 max_buffer_size=104857600,
+                 threads=0):
 
-        self.mFiles = {}
+        self.mFiles = collections.OrderedDict()
         self.mOutputPattern = output_pattern
 
-        self.open = open
-
+        self.mCompress = False
         if output_pattern:
             _, ext = os.path.splitext(output_pattern)
             if ext.lower() in (".gz", ".z"):
-                self.open = gzip.open
+                self.mCompress = True
 
         self.mCounts = collections.defaultdict(int)
         self.mHeader = header
+        self.mCreated = set()
+
+        self.mBuffers = collections.defaultdict(list)
+        self.mBufferSizes = collections.defaultdict(int)
+        self.mBufferedChars = 0
+        self.buffer_size = buffer_size
+        self.max_buffer_size = max_buffer_size
+
+        self.mThreadPool = None
+        if threads and self.mCompress:
+            self.mThreadPool = multiprocessing.pool.ThreadPool(threads)
+
+        self.isClosed = False
+
         if force and output_pattern:
             for f in glob.glob(re.sub("%s", "*", output_pattern)):
                 os.remove(f)
 
     def __del__(self):
         """close all open files."""
-        for file in list(self.mFiles.values()):
-            file.close()
+        if not self.isClosed:
+            self.close()
 
     def __len__(self):
         return len(self.mCounts)
 
     def close(self):
+        """write all buffered data and close all open files."""
+        if self.isClosed:
+            return
+        self.flush()
+        self.closeFiles()
+        if self.mThreadPool is not None:
+            self.mThreadPool.close()
+            self.mThreadPool.join()
+            self.mThreadPool = None
+        self.isClosed = True
+
+    def closeFiles(self):
         """close all open files."""
         for file in list(self.mFiles.values()):
             file.close()
+        self.mFiles.clear()
 
     def values(self):
         return list(self.mCounts.values())
@@ -866,8 +929,7 @@ class FilePool:
             return identifier
 
     def setHeader(self, header):
-        """set the header to be written to each file when opening
-        for the first time."""
+        """set the header to be written to each file when creating it."""
 
         self.mHeader = header
 
@@ -876,38 +938,100 @@ class FilePool:
 
         If file is in a new directory, create directories.
         """
-        if mode in ("w", "a"):
+        if mode[0] in ("w", "a"):
             dirname = os.path.dirname(filename)
             if dirname and not os.path.exists(dirname):
                 os.makedirs(dirname)
 
-        return self.open(filename, mode)
+        return open(filename, mode)
 
-    def write(self, identifier, line):
-        """write `line` to file specified by `identifier`"""
-        filename = self.getFilename(identifier)
+    def getHandle(self, filename):
+        """return an open file handle for appending to `filename`.
 
-        if filename not in self.mFiles:
+        If :attr:`maxopen` files are open, the least recently used
+        file is closed.
+        """
+        try:
+            handle = self.mFiles.pop(filename)
+        except KeyError:
+            if self.maxopen and len(self.mFiles) >= self.maxopen:
+                _, lru = self.mFiles.popitem(last=False)
+                lru.close()
+            if self.mCompress:
+                handle = self.openFile(filename, "ab")
+            else:
+                handle = self.openFile(filename, "a")
 
-            if self.maxopen and len(self.mFiles) > self.maxopen:
-                for f in list(self.mFiles.values()):
-                    f.close()
-                self.mFiles = {}
+        # move to end of LRU order
+        self.mFiles[filename] = handle
+        return handle
 
-            self.mFiles[filename] = self.openFile(filename, "a")
-            if self.mHeader:
-                self.mFiles[filename].write(self.mHeader)
+    def write(self, identifier, line):
+        """write `line` to file specified by `identifier`"""
+        if self.isClosed:
+            raise IOError("write on closed FilePool")
 
-        try:
-            self.mFiles[filename].write(line)
-        except ValueError as msg:
-            raise ValueError(
-                "error while writing to %s: msg=%s" % (filename, msg))
+        filename = self.getFilename(identifier)
+        self.mBuffers[filename].append(line)
         self.mCounts[filename] += 1
 
+        size = len(line)
+        self.mBufferSizes[filename] += size
+        self.mBufferedChars += size
+
+        if self.buffer_size and \
+           self.mBufferSizes[filename] >= self.buffer_size:
+            self.flush([filename])
+        elif self.max_buffer_size and \
+                self.mBufferedChars >= self.max_buffer_size:
+            # write largest buffers until half the space is free
+            filenames = sorted(self.mBufferSizes,
+                               key=self.mBufferSizes.get,
+                               reverse=True)
+            target = self.mBufferedChars - self.max_buffer_size // 2
+            flushed = 0
+            for n, filename in enumerate(filenames):
+                flushed += self.mBufferSizes[filename]
+                if flushed >= target:
+                    break
+            self.flush(filenames[:n + 1])
+
+    def flush(self, filenames=None):
+        """write buffered data to disk.
+
+        If `filenames` is given, only write the buffers of these files.
+        """
+        if filenames is None:
+            filenames = list(self.mBuffers.keys())
+
+        blocks = []
+        for filename in filenames:
+            data = "".join(self.mBuffers.pop(filename))
+            self.mBufferedChars -= self.mBufferSizes.pop(filename)
+            if filename not in self.mCreated:
+                self.mCreated.add(filename)
+                if self.mHeader and not os.path.exists(filename):
+                    data = self.mHeader + data
+            blocks.append(data)
+
+        if self.mCompress:
+            if self.mThreadPool is not None:
+                blocks = self.mThreadPool.map(_compressGzipMember, blocks)
+            else:
+                blocks = list(map(_compressGzipMember, blocks))
+
+        for filename, data in zip(filenames, blocks):
+            try:
+                self.getHandle(filename).write(data)
+            except ValueError as msg:
+                raise ValueError(
+                    "error while writing to %s: msg=%s" % (filename, msg))
+
     def deleteFiles(self, min_size=0):
         """delete all files below a minimum size `min_size` bytes."""
 
+        self.flush()
+        self.closeFiles()
         ndeleted = 0
         for filename, counts in list(self.mCounts.items()):
             if counts < min_size:
@@ -920,46 +1044,379 @@ class FilePool:
 class FilePoolMemory(FilePool):
     """manage a pool of output files in memory.
 
-    The usage is the same as :class:`FilePool` but the data is cached
-    in memory before writing to disk.
+    The usage is the same as :class:`FilePool` but all data is cached
+    in memory before writing to disk on :meth:`close`.
 
     """
 
-    maxopen = 5000
-
     def __init__(self, *args, **kwargs):
+        kwargs.update({"buffer_size": None,
+                       "max_buffer_size": None})
         FilePool.__init__(self, *args, **kwargs)
 
-        self.data = collections.defaultdict(list)
-        self.isClosed = False
-
-    def __del__(self):
-        """close all open files.
-        """
-        if not self.isClosed:
-            self.close()
-
     def close(self):
         """close all open files.
         writes the data to disk.
         """
         if self.isClosed:
             raise IOError("write on closed FilePool in close()")
+        FilePool.close(self)
 
-        for filename, data in self.data.items():
-            f = self.openFile(filename, "a")
-            if self.mHeader:
-                f.write(self.mHeader)
-            f.write("".join(data))
-            f.close()
 
-        self.isClosed = True
+def iterateChunks(infile,
+                  chunk_size=100000,
+                  separator="\t",
+                  comment="#"):
+    """iterate over the rows in infile in chunks.
 
-    def write(self, identifier, line):
+    Comment lines and empty lines are skipped.
 
-        filename = self.getFilename(identifier)
-        self.data[filename].append(line)
-        self.mCounts[filename] += 1
+    Arguments
+    ---------
+    infile : File
+       File object to read from
+    chunk_size : int
+       Number of rows per chunk.
+    separator : string
+       Field separator.
+    comment : string
+       Lines starting with this prefix are ignored. Set to None
+       to keep all lines.
+
+    Returns
+    -------
+    iterator : iterator
+       Each chunk is a list of rows. Each row is a list of fields.
+    """
+    chunk = []
+    for line in infile:
+        if comment and line.startswith(comment):
+            continue
+        line = line.rstrip("\r\n")
+        if not line:
+            continue
+        chunk.append(line.split(separator))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _isVectorType(dtype):
+    '''return True if *dtype* can be converted with numpy.'''
+    if dtype is str:
+        return True
+    try:
+        numpy.dtype(dtype)
+    except TypeError:
+        return False
+    return True
+
+
+def _convertColumn(values, dtype, missing_values=None):
+    '''convert a column of strings to *dtype*.
+
+    *dtype* is either str, a numpy compatible type or a function
+    that is applied to each value.
+
+    If *missing_values* is None, values that can not be converted are
+    masked. Otherwise, only values in *missing_values* are masked and
+    any other value that can not be converted raises a ValueError.
+
+    returns a tuple of (values, mask). The mask is None if no
+    value is missing.
+    '''
+    if dtype is str:
+        return numpy.array(values, dtype=object), None
+
+    if not _isVectorType(dtype):
+        return numpy.array(list(map(dtype, values)), dtype=object), None
+
+    dtype = numpy.dtype(dtype)
+    if not missing_values:
+        # fast path: numpy converts the strings directly
+        try:
+            return numpy.array(values, dtype=dtype), None
+        except ValueError as msg:
+            if missing_values is not None:
+                raise ValueError("parsing error: %s" % msg)
+
+    values = numpy.array(values, dtype=str)
+    mask = None
+    if missing_values:
+        mask = numpy.in1d(values, missing_values)
+        if mask.any():
+            values = numpy.where(mask, "0", values)
+        else:
+            mask = None
+
+        try:
+            return values.astype(dtype), mask
+        except ValueError as msg:
+            raise ValueError("parsing error: %s" % msg)
+
+    # mask unparseable values, converting each distinct value once
+    uniques, inverse = numpy.unique(values, return_inverse=True)
+    converted = numpy.zeros(len(uniques), dtype=dtype)
+    unparseable = numpy.zeros(len(uniques), dtype=numpy.bool_)
+    for x, value in enumerate(uniques):
+        try:
+            converted[x] = dtype.type(value)
+        except ValueError:
+            unparseable[x] = True
+
+    unparseable = unparseable[inverse]
+    if mask is None:
+        mask = unparseable
+    else:
+        mask |= unparseable
+    return converted[inverse], mask
+
+
+def _getCacheKey(take, dtype, column_types, headers, separator,
+                 comment, missing_values, skip_short):
+    '''return a key describing how a cached table has been parsed.'''
+    def _name(x):
+        if x is str:
+            return "str"
+        return numpy.dtype(x).str
+
+    if take != "all":
+        take = list(take)
+    return repr((take,
+                 _name(dtype),
+                 sorted([(x, _name(y)) for x, y in column_types.items()]),
+                 bool(headers),
+                 separator,
+                 comment,
+                 missing_values,
+                 bool(skip_short)))
+
+
+def _loadCache(cache, filename, key):
+    '''load columns from npz file *cache*.
+
+    returns None if the cache does not exist, is older than
+    *filename* or has been created with different parameters.
+    '''
+    if not os.path.exists(cache):
+        return None
+    if os.path.getmtime(cache) < os.path.getmtime(filename):
+        return None
+
+    with numpy.load(cache, allow_pickle=False) as data:
+        if str(data["key"]) != key:
+            return None
+        if data["has_headers"]:
+            headers = data["headers"].tolist()
+        else:
+            headers = None
+        columns = []
+        for x in range(int(data["ncolumns"])):
+            values = data["values%i" % x]
+            if values.dtype.kind == "U":
+                values = values.astype(object)
+            else:
+                values = numpy.ma.masked_array(values,
+                                               mask=data["mask%i" % x])
+            columns.append(values)
+
+    return columns, headers
+
+
+def _saveCache(cache, key, columns, headers):
+    '''save columns to npz file *cache*.'''
+    data = {"key": numpy.array(key),
+            "has_headers": numpy.array(headers is not None),
+            "headers": numpy.array(headers or [], dtype=str),
+            "ncolumns": numpy.array(len(columns))}
+
+    for x, values in enumerate(columns):
+        if isinstance(values, numpy.ma.MaskedArray):
+            data["values%i" % x] = values.data
+            data["mask%i" % x] = numpy.ma.getmaskarray(values)
+        else:
+            data["values%i" % x] = numpy.array(values, dtype=str)
+
+    # write to temporary file first so that an interrupted
+    # write does not leave a truncated cache behind.
+    tmpfile = cache + ".tmp"
+    with open(tmpfile, "wb") as outf:
+        numpy.savez(outf, **data)
+    os.rename(tmpfile, cache)
+
+
+def readColumns(infile,
+                take="all",
+                dtype=numpy.float64,
+                column_types=None,
+                headers=True,
+                separator="\t",
+                comment="#",
+                missing_values=None,
+                skip_short=False,
+                chunk_size=100000,
+                cache=None):
+    """read a table column-wise.
+
+    The file is read in chunks of *chunk_size* rows and each column
+    is converted with a single numpy call per chunk.
+
+    Arguments
+    ---------
+    infile : File
+       File object to read from
+    take : list
+       Columns to take. If "all", take all columns.
+    dtype : type
+       Default type of columns.
+    column_types : dict
+       Types of individual columns, overriding `dtype`. Keys are
+       column indices in the file. A type can be str, a numpy type or
+       a function that is applied to every value in the column.
+    headers : bool
+       If true, the first line contains column headers.
+    separator : string
+       Field separator.
+    comment : string
+       Lines starting with this prefix are ignored.
+    missing_values : tuple
+       Values to mask in numeric columns. If None, all values that
+       can not be converted are masked. Otherwise, values not in
+       `missing_values` that can not be converted raise a ValueError.
+    skip_short : bool
+       If true, skip rows that do not contain all columns in `take`.
+       Otherwise, raise a ValueError.
+    chunk_size : int
+       Number of rows to convert at a time.
+    cache : string
+       Filename of a cached binary copy of the table (npz format). If
+       the cache exists, is newer than `infile` and has been created
+       with the same parameters, the table is read from the cache.
+       Otherwise the cache is created. Only columns of type str and
+       numpy types can be cached. The cache is ignored if `infile`
+       is not a file on disk (for example stdin or a pipe), as its
+       age can not be checked.
+
+    Returns
+    -------
+    columns : list
+       A list of arrays, one for each column in `take`. Numeric
+       columns are :class:`numpy.ma.MaskedArray` objects, other
+       columns are arrays of python objects.
+    headers : list
+       Column headers. None, if `headers` is False.
+    """
+
+    if column_types is None:
+        column_types = {}
+
+    filename = getattr(infile, "name", None)
+    if not (filename and os.path.isfile(filename)):
+        cache = None
+
+    key = None
+    if cache is not None:
+        if not all([_isVectorType(x) for x in
+                    [dtype] + list(column_types.values())]):
+            raise ValueError("caching requires str or numpy column types")
+        key = _getCacheKey(take, dtype, column_types, headers,
+                           separator, comment, missing_values,
+                           skip_short)
+        result = _loadCache(cache, filename, key)
+        if result is not None:
+            return result
+
+    chunks = iterateChunks(infile,
+                           chunk_size=chunk_size,
+                           separator=separator,
+                           comment=comment)
+
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        first_chunk = []
+        if take == "all":
+            take = []
+        if headers:
+            headers = []
+    else:
+        if take == "all":
+            take = list(range(len(first_chunk[0])))
+        if headers:
+            header_fields = first_chunk.pop(0)
+            headers = [header_fields[x] for x in take]
+
+    if not headers:
+        headers = None
+
+    dtypes = [column_types.get(x, dtype) for x in take]
+    min_fields = max(take) + 1 if take else 0
+
+    # numeric columns of the same type are converted together
+    blocks = collections.defaultdict(list)
+    if not missing_values:
+        for x, column_type in enumerate(dtypes):
+            if column_type is not str and _isVectorType(column_type):
+                blocks[numpy.dtype(column_type)].append(x)
+
+    values = [[_convertColumn([], x)[0]] for x in dtypes]
+    masks = [[numpy.zeros(0, dtype=numpy.bool_)] for x in take]
+    for chunk in itertools.chain([first_chunk], chunks):
+        if skip_short:
+            chunk = [x for x in chunk if len(x) >= min_fields]
+        elif chunk and min(map(len, chunk)) < min_fields:
+            raise ValueError(
+                "row with less than %i fields in chunk starting with %s" %
+                (min_fields, separator.join(chunk[0])))
+
+        converted = set()
+        for block_type, indices in blocks.items():
+            if len(indices) < 2:
+                continue
+            fields = [take[x] for x in indices]
+            if fields == list(range(fields[0], fields[-1] + 1)):
+                getter = operator.itemgetter(
+                    slice(fields[0], fields[-1] + 1))
+            else:
+                getter = operator.itemgetter(*fields)
+            try:
+                block = numpy.array([getter(row) for row in chunk],
+                                    dtype=block_type)
+            except ValueError:
+                # convert column by column below
+                continue
+            block.shape = (len(chunk), len(indices))
+            for y, x in enumerate(indices):
+                values[x].append(block[:, y])
+                masks[x].append(numpy.zeros(len(chunk), dtype=numpy.bool_))
+            converted.update(indices)
+
+        for x, column in enumerate(take):
+            if x in converted:
+                continue
+            data, mask = _convertColumn([row[column] for row in chunk],
+                                        dtypes[x],
+                                        missing_values)
+            values[x].append(data)
+            if mask is None:
+                mask = numpy.zeros(len(data), dtype=numpy.bool_)
+            masks[x].append(mask)
+
+    columns = []
+    for x, column_type in enumerate(dtypes):
+        data = numpy.concatenate(values[x])
+        if column_type is str or not _isVectorType(column_type):
+            columns.append(data)
+        else:
+            columns.append(numpy.ma.masked_array(
+                data, mask=numpy.concatenate(masks[x])))
+
+    if cache is not None:
+        _saveCache(cache, key, columns, headers)
+
+    return columns, headers
 
 
 def readMap(infile,
@@ -999,41 +1456,36 @@ def readMap(infile,
     """
     m = dtype()
     r = dtype()
-    n = 0
 
     if columns == "all":
-        key_column = 0
-        value_column = None
-    else:
-        key_column, value_column = columns
-
-    key_function, value_function = map_functions
-    # default is to return a tuple for multiple values
-    datatype = None
-
-    for l in infile:
-        if l[0] == "#":
-            continue
-        n += 1
-
-        if has_header and n == 1:
-            if columns == "all":
-                header = l[:-1].split("\t")
+        key_function, value_function = map_functions
+        # default is to return a tuple for multiple values
+        datatype = None
+        keys, values = [], []
+        for chunk in iterateChunks(infile):
+            if has_header and datatype is None:
+                header = chunk.pop(0)
                 # remove the first column
                 datatype = collections.namedtuple("DATA", header[1:])
-            continue
-
-        d = l[:-1].split("\t")
-        if len(d) < 2:
-            continue
-        key = key_function(d[key_column])
-        if value_column:
-            val = value_function(d[value_column])
-        elif datatype:
-            val = datatype._make([d[x] for x in range(1, len(d))])
-        else:
-            val = tuple(map(value_function, [d[x] for x in range(1, len(d))]))
-
+            for d in chunk:
+                if len(d) < 2:
+                    continue
+                keys.append(key_function(d[0]))
+                if datatype:
+                    values.append(datatype._make(d[1:]))
+                else:
+                    values.append(tuple(map(value_function, d[1:])))
+    else:
+        (keys, values), header = readColumns(
+            infile,
+            take=columns,
+            column_types=dict(zip(columns, map_functions)),
+            headers=has_header,
+            missing_values=(),
+            skip_short=True)
+        keys, values = keys.tolist(), values.tolist()
+
+    for key, val in zip(keys, values):
         m[key] = val
         if val not in r:
             r[val] = []
@@ -1132,22 +1584,15 @@ def readMultiMap(infile,
     """
     m = dtype()
     r = dtype()
-    n = 0
-    for l in infile:
-        if l[0] == "#":
-            continue
-        n += 1
 
-        if has_header and n == 1:
-            continue
-
-        d = l[:-1].split("\t")
-        try:
-            key = map_functions[0](d[columns[0]])
-            val = map_functions[1](d[columns[1]])
-        except (ValueError, IndexError) as msg:
-            raise ValueError("parsing error in line %s: %s" % (l[:-1], msg))
+    (keys, values), header = readColumns(
+        infile,
+        take=columns,
+        column_types=dict(zip(columns, map_functions)),
+        headers=has_header,
+        missing_values=())
 
+    for key, val in zip(keys.tolist(), values.tolist()):
         if key not in m:
             m[key] = []
         m[key].append(val)
@@ -1161,23 +1606,28 @@ def readMultiMap(infile,
         return m
 
 
-def readMatrix(infile, dtype=numpy.float):
+def readMatrix(infile, dtype=numpy.float, cache=None):
     '''read a numpy matrix from infile.
 
+    The first line contains the column headers and the first column
+    the row headers. If *cache* is given, the matrix is stored in and
+    read from a binary sidecar file, see :func:`readColumns`.
+
     return tuple of matrix, row_headers, col_headers
     '''
 
-    lines = [l for l in infile.readlines() if not l.startswith("#")]
-    nrows = len(lines) - 1
-    col_headers = lines[0][:-1].split("\t")[1:]
-    ncols = len(col_headers)
-    matrix = numpy.zeros((nrows, ncols), dtype=dtype)
-    row_headers = []
+    columns, headers = readColumns(infile,
+                                   dtype=dtype,
+                                   column_types={0: str},
+                                   missing_values=(),
+                                   cache=cache)
 
-    for row, l in enumerate(lines[1:]):
-        data = l[:-1].split("\t")
-        row_headers.append(data[0])
-        matrix[row] = numpy.array(data[1:], dtype=dtype)
+    row_headers = columns[0].tolist()
+    col_headers = headers[1:]
+    if len(columns) > 1:
+        matrix = numpy.column_stack([x.data for x in columns[1:]])
+    else:
+        matrix = numpy.zeros((len(row_headers), 0), dtype=dtype)
 
     return matrix, row_headers, col_headers
 
@@ -1204,7 +1654,11 @@ def readTable(file,
               ):
     """read a table of values.
 
-    If cumulate_out_of_range is set to true, the terminal bins will
+    Values that can not be converted to *numeric_type* are masked.
+
+    If *truncate* is given as a tuple (min, max), rows with a value in
+    the first column outside this range are removed.  If
+    cumulate_out_of_range is set to true, the terminal bins will
     contain the cumulative values of bins out of range.
 
     .. note:: Deprecated
@@ -1212,88 +1666,37 @@ def readTable(file,
 
     """
 
-    lines = [x for x in file.readlines() if x[0] != "#"]
+    columns, fields = readColumns(file,
+                                  take=take,
+                                  dtype=numeric_type,
+                                  headers=headers,
+                                  separator=separator)
 
-    if len(lines) == 0:
+    if len(columns) == 0 or (len(columns[0]) == 0 and not fields):
         return None, []
 
-    if take == "all":
-        num_cols = len(string.split(lines[0][:-1], "\t"))
-        take = list(range(0, num_cols))
-    else:
-        num_cols = len(take)
-
     if headers:
-        headers = lines[0][:-1].split("\t")
-        headers = [headers[x] for x in take]
-        del lines[0]
+        headers = fields
 
-    num_rows = len(lines)
-    matrix = numpy.ma.masked_array(
-        numpy.zeros((num_rows, num_cols), numeric_type))
+    matrix = numpy.ma.column_stack(columns)
 
-    if truncate:
+    if truncate is not None:
         min_row, max_row = truncate
+        bins = matrix[:, 0].filled(numpy.nan)
+        below = bins < min_row
+        above = bins >= max_row
+        inside = numpy.nonzero(~(below | above))[0]
 
-    nrow = 0
-    min_data = [0] * num_cols
-    max_data = None
-    for l in lines:
-        data = l[:-1].split("\t")
-        data = [data[x] for x in take]
-
-        # try conversion. Unparseable fields set to missing_value
-        for x in range(len(data)):
-            try:
-                data[x] = float(data[x])
-            except ValueError:
-                data[x] = numpy.ma.masked
-
-        if truncate is not None:
-            if data[0] < min_row:
-                if cumulate_out_of_range:
-                    for x in range(1, num_cols):
-                        min_data[x] += data[x]
-                continue
-            elif data[0] >= max_row:
-                if max_data is None:
-                    max_data = [0] * num_cols
-                    max_data[0] = max_row
-                for x in range(1, num_cols):
-                    try:
-                        max_data[x] += data[x]
-                    except TypeError:
-                        # missing values cause type errors
-                        continue
-                continue
-            elif min_row is not None:
-                if cumulate_out_of_range:
-                    for x in range(0, num_cols):
-                        try:
-                            min_data[x] += data[x]
-                        except TypeError:
-                            # missing values cause type errors
-                            continue
-                    else:
-                        min_data = data
-                data = min_data
-                min_row = None
-
-        # copy values into matrix
-        # this is a bit clumsy, but missing values
-        # cause an error otherwise
-        for x in range(len(data)):
-            matrix[nrow, x] = data[x]
-
-        nrow += 1
-
-    if truncate is not None:
+        result = matrix[inside]
         if cumulate_out_of_range:
-            if max_data is not None:
-                matrix[nrow] = max_data
-
-        # truncate matrix
-        matrix = matrix[0:nrow + 1, 0:num_cols]
+            if below.any() and len(inside) > 0:
+                result[0, 1:] = result[0, 1:].filled(0) + \
+                    matrix[below, 1:].sum(axis=0).filled(0)
+            if above.any():
+                max_data = matrix[above].sum(axis=0).filled(0)
+                max_data[0] = max_row
+                result = numpy.ma.vstack((result, max_data))
+        matrix = result
 
     return matrix, headers
 
@@ -20,6 +20,14 @@ To index a file, use the :mod:`scripts/index_fasta` command line utility or the
 
    > python index_fasta.py hg19 chr*.fa
 
+Databases can be compressed in blocks (see :func:`createDatabase`).
+Decompressed blocks are kept in a least-recently-used cache (see
+:class:`BlockReader`) and, for sequential access, subsequent blocks
+are decompressed in advance. The cache size and read-ahead can be
+set when opening a database::
+
+   fasta = IndexedFasta("hg19", cache_size=64, read_ahead=4)
+
 This module has some useful utility functions:
 
 :func:`splitFasta`
@@ -38,6 +46,8 @@ Reference
 import os
 import sys
 import array
+import bisect
+import collections
 import string
 import re
 import struct
@@ -59,39 +69,205 @@ from six import StringIO
 IS_PY3 = sys.version_info.major >= 3
 
 
-class Uncompressor:
+# number of decompressed blocks kept in memory per database
+DEFAULT_CACHE_SIZE = 32
+# number of blocks to decompress ahead for sequential access
+DEFAULT_READ_AHEAD = 2
+
+
+class BlockCache:
+    """least-recently-used cache of decompressed blocks.
+
+    Blocks are identified by their position in the compressed file.
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        self.mSize = size
+        self.mBlocks = collections.OrderedDict()
+        self.mHits = 0
+        self.mMisses = 0
+
+    def __len__(self):
+        return len(self.mBlocks)
+
+    def get(self, key):
+        """return block at *key* or None if not in cache."""
+        try:
+            block = self.mBlocks.pop(key)
+        except KeyError:
+            self.mMisses += 1
+            return None
+        # re-insert to mark as most recently used
+        self.mBlocks[key] = block
+        self.mHits += 1
+        return block
 
-    def __init__(self, filename, unmangler):
+    def add(self, key, block):
+        self.mBlocks[key] = block
+        if len(self.mBlocks) > self.mSize:
+            self.mBlocks.popitem(last=False)
+
+
+class BlockReader:
+    """random access to a file of independently compressed blocks.
+
+    Decompressed blocks are kept in a :class:`BlockCache` of
+    *cache_size* blocks. If consecutive requests access consecutive
+    blocks, *read_ahead* additional blocks are decompressed in
+    advance.
+
+    Subclasses need to implement :meth:`_decompress`.
+    """
+
+    def __init__(self, filename,
+                 cache_size=DEFAULT_CACHE_SIZE,
+                 read_ahead=DEFAULT_READ_AHEAD):
         self.mFile = open(filename, "rb")
+        self.mCache = BlockCache(cache_size)
+        self.mReadAhead = read_ahead
+        self.mLastBlock = None
+
+    def _decompress(self, data):
+        raise NotImplementedError
+
+    def _readBlocks(self, offsets, first, last, skip, size, buf, pos):
+        """copy *size* bytes starting *skip* bytes into block *first*
+        into the preallocated buffer *buf* at *pos*.
+
+        Block x is stored at offsets[x]:offsets[x+1] in the
+        compressed file.
+
+        Returns the position in *buf* after the copied data.
+        """
+        blocks = {}
+        missing = []
+        for x in range(first, last + 1):
+            block = self.mCache.get(offsets[x])
+            if block is None:
+                missing.append(x)
+            else:
+                blocks[x] = block
+
+        if missing:
+            a, b = missing[0], missing[-1]
+            if self.mLastBlock is not None and \
+               self.mLastBlock[0] == offsets[0] and \
+               a - 1 <= self.mLastBlock[1] <= a:
+                b = min(b + self.mReadAhead, len(offsets) - 2)
+
+            # read all compressed blocks with a single read
+            self.mFile.seek(offsets[a])
+            data = self.mFile.read(offsets[b + 1] - offsets[a])
+            for x in range(a, b + 1):
+                if x in blocks:
+                    continue
+                block = self._decompress(
+                    data[offsets[x] - offsets[a]:offsets[x + 1] - offsets[a]])
+                self.mCache.add(offsets[x], block)
+                if x <= last:
+                    blocks[x] = block
+
+        self.mLastBlock = (offsets[0], last)
+
+        view = memoryview(buf)
+        for x in range(first, last + 1):
+            block = blocks[x]
+            n = min(len(block) - skip, size)
+            view[pos:pos + n] = memoryview(block)[skip:skip + n]
+            pos += n
+            size -= n
+            skip = 0
+        return pos
+
+
+class Uncompressor(BlockReader):
+    """random access to databases compressed in blocks of
+    equal uncompressed size (lzo, zlib, gzip, bzip2)."""
+
+    def __init__(self, filename, unmangler, *args, **kwargs):
+        BlockReader.__init__(self, filename, *args, **kwargs)
         self.mUnMangler = unmangler
 
+    def _decompress(self, data):
+        block = self.mUnMangler(data)
+        if not isinstance(block, bytes):
+            block = block.encode("ascii")
+        return block
+
     def read(self, block_size, indices, start, end):
         """read an uncompressed block from start:end.
 
-        The compressed chunk starts at first_pos.
-        NOTE: This is poorly implemented - do better.
+        *indices* contains the positions of the compressed blocks,
+        each containing *block_size* uncompressed bytes.
         """
+        first = start // block_size
+        last = (end - 1) // block_size
+        assert last < len(indices) - 1
 
-        # skip over uncompressed blocks
-        d = int(math.floor(float(start) / block_size))
-        r = start % block_size
-        assert(d < len(indices))
-        self.mFile.seek(indices[d])
+        buf = bytearray(end - start)
+        size = self._readBlocks(indices, first, last,
+                                start - first * block_size,
+                                end - start, buf, 0)
 
-        # read x bytes of compressed data, at least one full chunk.
-        nchunks = int(math.ceil(float((r + end - start)) / block_size))
+        assert size == end - start, \
+            "fragment smaller than requested size: %i > %i-%i=%i" %\
+            (size, end, start, end - start)
 
-        fragments = []
-        for x in range(d, d + nchunks):
-            s = self.mFile.read(indices[x + 1] - indices[x])
-            fragments.append(self.mUnMangler(s))
-        u = "".join(fragments)
+        return bytes(buf)
 
-        assert len(u) >= end - start, \
-            "fragment smaller than requested size: %i > %i-%i=%i" %\
-            (len(u), end, start, end - start)
 
-        return u[r:r + end - start]
+class DictzipUncompressor(BlockReader):
+    """random access to a dictzip compressed database.
+
+    Provides the :meth:`seek` and :meth:`read` methods of a file
+    object. Dictzip chunks are decompressed through the block
+    cache.
+    """
+
+    def __init__(self, filename, *args, **kwargs):
+        from . import dictzip
+        BlockReader.__init__(self, filename, *args, **kwargs)
+        # parse the headers of all dictzip members
+        gzipfile = dictzip.GzipFile(filename)
+        if not gzipfile.dictzip:
+            raise ValueError("%s is not a dictzip file" % filename)
+        self.mMemberOffsets = gzipfile.memberoffset
+        self.mMemberChunkLengths = gzipfile.memberchlen
+        self.mMemberFlushPoints = gzipfile.memberflushpoints
+        self.mLength = gzipfile.uncompressed_length
+        gzipfile.close()
+        self.mOffset = 0
+
+    def _decompress(self, data):
+        # chunks are separated by full flushes and can be
+        # decompressed independently
+        return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data)
+
+    def seek(self, offset):
+        self.mOffset = offset
+
+    def read(self, size):
+        end = min(self.mOffset + size, self.mLength)
+        buf = bytearray(max(0, end - self.mOffset))
+        offset, pos = self.mOffset, 0
+        while offset < end:
+            member = bisect.bisect_right(self.mMemberOffsets, offset) - 1
+            member_start = self.mMemberOffsets[member]
+            if member + 1 < len(self.mMemberOffsets):
+                member_end = self.mMemberOffsets[member + 1]
+            else:
+                member_end = self.mLength
+            chunk_length = self.mMemberChunkLengths[member]
+            stop = min(end, member_end)
+            first = (offset - member_start) // chunk_length
+            last = (stop - 1 - member_start) // chunk_length
+            pos = self._readBlocks(self.mMemberFlushPoints[member],
+                                   first, last,
+                                   offset - member_start - first * chunk_length,
+                                   stop - offset, buf, pos)
+            offset = stop
+        self.mOffset = end
+        return bytes(buf)
 
 
 def writeFragments(outfile_fasta,
@@ -357,8 +533,6 @@ class MultipleFastaIterator:
             if filename != "-":
                 infile.close()
 
-        raise StopIteration
-
 
 def createDatabase(db, iterator,
                    force=False,
@@ -600,11 +774,16 @@ class CGATIndexedFasta:
 
     """an indexed fasta file."""
 
-    def __init__(self, dbname):
+    def __init__(self, dbname,
+                 cache_size=DEFAULT_CACHE_SIZE,
+                 read_ahead=DEFAULT_READ_AHEAD):
 
         if dbname.endswith(".fasta"):
             dbname = dbname[:-len(".fasta")]
 
+        self.mCacheOptions = {"cache_size": cache_size,
+                              "read_ahead": read_ahead}
+
         for x in PREFERENCES:
             d = "%s.%s" % (dbname, NAME_MAP[x][0])
             i = "%s.%s" % (dbname, NAME_MAP[x][1])
@@ -647,21 +826,25 @@ class CGATIndexedFasta:
         if self.mMethod == "uncompressed":
             self.mDatabaseFile = open(self.mDbname, "r")
         elif self.mMethod == "dictzip":
-            from . import dictzip
-            self.mDatabaseFile = dictzip.GzipFile(self.mDbname)
+            self.mDatabaseFile = DictzipUncompressor(
+                self.mDbname, **self.mCacheOptions)
         elif self.mMethod == "lzo":
             import lzo
-            self.mDatabaseFile = Uncompressor(self.mDbname, lzo.decompress)
+            self.mDatabaseFile = Uncompressor(
+                self.mDbname, lzo.decompress, **self.mCacheOptions)
         elif self.mMethod == "gzip":
-            self.mDatabaseFile = Uncompressor(self.mDbname, gzip_demangler)
+            self.mDatabaseFile = Uncompressor(
+                self.mDbname, gzip_demangler, **self.mCacheOptions)
         elif self.mMethod == "zlib":
-            self.mDatabaseFile = Uncompressor(self.mDbname, zlib.decompress)
+            self.mDatabaseFile = Uncompressor(
+                self.mDbname, zlib.decompress, **self.mCacheOptions)
         elif self.mMethod == "bzip2":
             import bz2
-            self.mDatabaseFile = Uncompressor(self.mDbname, bz2.decompress)
+            self.mDatabaseFile = Uncompressor(
+                self.mDbname, bz2.decompress, **self.mCacheOptions)
         elif self.mMethod == "debug":
             self.mDatabaseFile = Uncompressor(
-                self.mDbname + ".debug", lambda x: x)
+                self.mDbname + ".debug", lambda x: x, **self.mCacheOptions)
 
         filename_index = self.mNameIndex + ".dbm"
 
@@ -778,7 +961,7 @@ class CGATIndexedFasta:
         data = self.mIndex[self.getToken(contig)]
         try:
             pos_id, pos_seq, lcontig = struct.unpack("QQi", data)
-        except struct.error:
+        except (struct.error, TypeError):
             pos_id, pos_seq, lcontig, points = data
         return lcontig
 
@@ -791,7 +974,7 @@ class CGATIndexedFasta:
             data = self.mIndex[self.getToken(contig)]
             try:
                 pos_id, pos_seq, lcontig = struct.unpack("QQi", data)
-            except struct.error:
+            except (struct.error, TypeError):
                 pos_id, pos_seq, lcontig, points = data
             results.append(lcontig)
         return results
@@ -966,9 +1149,13 @@ class CGATIndexedFasta:
 class PysamIndexedFasta(CGATIndexedFasta):
 
     '''interface a  pysam/samtools indexed fasta file with the
-    CGATIndexedFasta API.'''
+    CGATIndexedFasta API.
 
-    def __init__(self, dbname):
+    The cache options of :class:`CGATIndexedFasta` are accepted
+    but ignored.
+    '''
+
+    def __init__(self, dbname, *args, **kwargs):
 
         # open database file and truncate
         if os.path.exists(dbname) and dbname.endswith(".fa"):
@@ -1027,7 +1214,7 @@ class PysamIndexedFasta(CGATIndexedFasta):
         data = self.mIndex[contig]
         try:
             pos_id, pos_seq, lsequence = struct.unpack("QQi", data)
-        except struct.error:
+        except (struct.error, TypeError):
             pos_id, pos_seq, lsequence, points = data
 
         # convert to 0-based positive strand coordinates
@@ -1200,6 +1387,22 @@ def benchmarkRandomFragment(fasta, size):
     return s
 
 
+def iterateSequentialFragments(fasta, size):
+    """iterate over consecutive fragments of *size* across all
+    contigs in *fasta*. The iteration restarts at the first contig
+    once all contigs have been visited.
+    """
+    contigs = [x for x, y in sorted(fasta.getContigSizes(
+        with_synonyms=False).items()) if y >= size]
+    if not contigs:
+        raise ValueError("no contig is longer than %i" % size)
+    while True:
+        for contig in contigs:
+            lcontig = fasta.getLength(contig)
+            for start in range(0, lcontig - size + 1, size):
+                yield fasta.getSequence(contig, "+", start, start + size)
+
+
 def verify(fasta1, fasta2, num_iterations, fragment_size,
            stdout=sys.stdout, quiet=False):
     """verify two databases.
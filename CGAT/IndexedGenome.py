@@ -17,11 +17,20 @@ quicksect
    to be installed. The benefit of quicksect is that it allows also
    quick retrieval of intervals that are closest before or after an query.
 
+sorted arrays
+   A read-only index of intervals stored in numpy arrays sorted by
+   start coordinate and augmented with the running maximum of the end
+   coordinate. The index is built in bulk and permits batch queries
+   of many intervals at once. As it consists of plain arrays, it can be
+   pickled and saved to disk and memory-mapped, so that it can be
+   shared between processes.
+
 The principal clas is :class:`IndexedGenome` which uses NCL and stores
 a value associated with each interval. :class:`Quicksect` is equivalent
 to :class:`IndexedGenome` but uses quicksect. The :class:`Simple` is a
 light-weight version of :class:`IndexedGenome` that does not store a
-value and thus preserves space.
+value and thus preserves space. :class:`Static` is equivalent to
+:class:`IndexedGenome` but uses sorted arrays (:class:`IntervalArray`).
 
 The basic usage is::
 
@@ -30,18 +39,34 @@ The basic usage is::
    for contig, start, end, value in intervals:
       index.add(contig, start, end, value)
 
-   print index.contains("chr1", 1000, 2000)
-   print index.get("chr1", 10000, 20000)
+   print(index.contains("chr1", 1000, 2000))
+   print(index.get("chr1", 10000, 20000))
 
 The index is built in memory.
 
+A :class:`Static` index can be built from arrays of coordinates
+and queried with arrays of intervals::
+
+   index = Static.fromArrays(contigs, starts, ends, values)
+   offsets, hits = index.getBatch("chr1", query_starts, query_ends)
+   for x in range(len(query_starts)):
+       print(index.getValues("chr1", hits[offsets[x]:offsets[x + 1]]))
+
+
 Reference
 ---------
 
 '''
+import sys
+import numpy
 from CGAT import NCL as ncl
 from bx.intervals.intersection import Intersecter, Interval
 
+if sys.version_info.major >= 3:
+    import pickle as pickle
+else:
+    import cPickle as pickle
+
 
 class IndexedGenome:
 
@@ -143,3 +168,258 @@ class Quicksect(IndexedGenome):
                     Interval(start, end),
                     num_intervals=1,
                     max_dist=max_dist)]
+
+
+class IntervalArray(object):
+
+    '''a read-only container of intervals stored in sorted arrays.
+
+    Intervals are sorted by start coordinate. The running maximum of
+    the end coordinates permits a binary search for the first
+    interval that might overlap a query.
+
+    Intervals can be added with :meth:`add` like to a
+    :class:`NCL.NCL`, but the arrays are only built once the index
+    is queried. Alternatively, the index can be built in bulk with
+    :meth:`fromArrays`.
+
+    The value ids returned by :meth:`findBatch` are the positions of
+    the intervals in the order they have been added.
+    '''
+
+    def __init__(self):
+        self.mTuples = []
+        self.mValues = []
+        self.mIsDirty = False
+        self.mIsReadOnly = False
+        self.mStarts = numpy.zeros(0, dtype=numpy.int64)
+        self.mEnds = numpy.zeros(0, dtype=numpy.int64)
+        self.mMaxEnds = numpy.zeros(0, dtype=numpy.int64)
+        self.mIds = numpy.zeros(0, dtype=numpy.int64)
+
+    @classmethod
+    def fromArrays(cls, starts, ends, values=None):
+        '''build index from arrays of *starts* and *ends*.
+
+        If *values* is not given, the value of an interval is
+        its position in the arrays.
+        '''
+        index = cls()
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        ends = numpy.asarray(ends, dtype=numpy.int64)
+        if len(starts) != len(ends):
+            raise ValueError(
+                "starts and ends of different length (%i != %i)" %
+                (len(starts), len(ends)))
+        if numpy.any(starts < 0):
+            raise ValueError("only positive coordinates are accepted")
+        if numpy.any(starts >= ends):
+            raise ValueError("empty/invalid intervals in arrays")
+
+        if values is None:
+            index.mValues = None
+        else:
+            index.mValues = list(values)
+            if len(index.mValues) != len(starts):
+                raise ValueError(
+                    "values and intervals of different length (%i != %i)" %
+                    (len(index.mValues), len(starts)))
+
+        index._build(starts, ends)
+        index.mIsReadOnly = True
+        return index
+
+    def _build(self, starts, ends):
+        '''build sorted arrays from unsorted *starts* and *ends*.'''
+        order = numpy.lexsort((ends, starts))
+        self.mStarts = starts[order]
+        self.mEnds = ends[order]
+        self.mIds = order.astype(numpy.int64)
+        self.mMaxEnds = numpy.maximum.accumulate(self.mEnds)
+
+    def _commit(self):
+        '''build arrays if intervals have been added.'''
+        if self.mIsDirty:
+            data = numpy.array(self.mTuples, dtype=numpy.int64)
+            data.shape = (len(self.mTuples), 2)
+            self._build(data[:, 0], data[:, 1])
+            self.mIsDirty = False
+
+    def add(self, start, end, value=None):
+        '''add segment *start*, *end* with *value* to index.
+
+        returns the id of the added segment.
+        '''
+        if self.mIsReadOnly:
+            raise ValueError("can not add to index built from arrays")
+        if start < 0:
+            raise ValueError(
+                "only positive coordinates are accepted (%i<0)" % start)
+        if start >= end:
+            raise ValueError(
+                "adding empty/invalid interval (%i,%i)" % (start, end))
+        v = len(self.mTuples)
+        self.mTuples.append((start, end))
+        self.mValues.append(value)
+        self.mIsDirty = True
+        return v
+
+    def getValue(self, idx):
+        '''return value for interval with id *idx*.'''
+        if self.mValues is None:
+            return idx
+        return self.mValues[idx]
+
+    def _range(self, start, end):
+        '''return range in sorted arrays that might overlap.'''
+        first = numpy.searchsorted(self.mMaxEnds, start, side="right")
+        last = numpy.searchsorted(self.mStarts, end, side="left")
+        return first, last
+
+    def find(self, start, end):
+        '''find intervals overlapping *start* and *end*.
+
+        returns a list of tuples (start, end, value).
+        '''
+        if start < 0:
+            raise ValueError(
+                "only positive coordinates are accepted (%i<0)" % start)
+        self._commit()
+        first, last = self._range(start, end)
+        return [(int(self.mStarts[x]),
+                 int(self.mEnds[x]),
+                 self.getValue(int(self.mIds[x])))
+                for x in range(first, last) if self.mEnds[x] > start]
+
+    def findBatch(self, starts, ends):
+        '''find intervals overlapping a set of query intervals.
+
+        Returns a tuple (offsets, ids) in compressed sparse row format.
+        The ids of intervals overlapping query ``x`` are
+        ``ids[offsets[x]:offsets[x + 1]]``. Within a query, ids are
+        sorted by interval start.
+        '''
+        self._commit()
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        ends = numpy.asarray(ends, dtype=numpy.int64)
+
+        first, last = self._range(starts, ends)
+        ncandidates = numpy.maximum(last - first, 0)
+        total = ncandidates.sum()
+
+        # expand candidate ranges into a flat array of positions
+        query = numpy.repeat(numpy.arange(len(starts)), ncandidates)
+        candidate_offsets = numpy.cumsum(ncandidates) - ncandidates
+        positions = numpy.arange(total, dtype=numpy.int64) - \
+            numpy.repeat(candidate_offsets, ncandidates) + \
+            numpy.repeat(first, ncandidates)
+
+        take = self.mEnds[positions] > starts[query]
+        query = query[take]
+        positions = positions[take]
+
+        offsets = numpy.zeros(len(starts) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(query, minlength=len(starts)),
+                     out=offsets[1:])
+        return offsets, self.mIds[positions]
+
+    def __len__(self):
+        self._commit()
+        return len(self.mStarts)
+
+
+class Static(IndexedGenome):
+
+    '''index intervals using sorted arrays.
+
+    The index can be saved to disk with :meth:`save` and
+    memory-mapped with :meth:`load`.
+    '''
+    index_factory = IntervalArray
+
+    def __init__(self, *args, **kwargs):
+        IndexedGenome.__init__(self, *args, **kwargs)
+
+    @classmethod
+    def fromArrays(cls, contigs, starts, ends, values=None):
+        '''build index from arrays of *contigs*, *starts* and *ends*.
+
+        If *values* is not given, the value of an interval is
+        its position within its contig in the arrays.
+        '''
+        index = cls()
+        contigs = numpy.asarray(contigs)
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        ends = numpy.asarray(ends, dtype=numpy.int64)
+
+        for contig in numpy.unique(contigs):
+            take = numpy.nonzero(contigs == contig)[0]
+            if values is None:
+                v = None
+            else:
+                v = [values[x] for x in take]
+            index.mIndex[str(contig)] = IntervalArray.fromArrays(
+                starts[take], ends[take], v)
+        return index
+
+    def getBatch(self, contig, starts, ends):
+        '''return intervals overlapping a set of query intervals.
+
+        See :meth:`IntervalArray.findBatch`.
+        '''
+        if contig not in self.mIndex:
+            raise KeyError("contig %s not in index" % contig)
+        return self.mIndex[contig].findBatch(starts, ends)
+
+    def getValues(self, contig, ids):
+        '''return values for intervals with *ids* on *contig*.'''
+        index = self.mIndex[contig]
+        return [index.getValue(x) for x in ids]
+
+    def save(self, filename):
+        '''save index to *filename*.
+
+        The coordinates are saved in :file:`filename.npy` and the
+        values in :file:`filename.vals`.
+        '''
+        contigs, arrays, values = [], [], []
+        for contig, index in sorted(self.mIndex.items()):
+            index._commit()
+            contigs.append((contig, len(index)))
+            arrays.append(numpy.vstack((index.mStarts,
+                                        index.mEnds,
+                                        index.mMaxEnds,
+                                        index.mIds)))
+            values.append(index.mValues)
+
+        if arrays:
+            data = numpy.hstack(arrays)
+        else:
+            data = numpy.zeros((4, 0), dtype=numpy.int64)
+        numpy.save(filename + ".npy", data)
+        with open(filename + ".vals", "wb") as outf:
+            pickle.dump((contigs, values), outf)
+
+    @classmethod
+    def load(cls, filename, mmap_mode="r"):
+        '''load index from *filename*.
+
+        The coordinates are memory-mapped with *mmap_mode*
+        (see :func:`numpy.load`).
+        '''
+        data = numpy.load(filename + ".npy", mmap_mode=mmap_mode)
+        with open(filename + ".vals", "rb") as inf:
+            contigs, values = pickle.load(inf)
+
+        index = cls()
+        offset = 0
+        for (contig, length), v in zip(contigs, values):
+            interval_array = IntervalArray()
+            interval_array.mStarts, interval_array.mEnds, \
+                interval_array.mMaxEnds, interval_array.mIds = \
+                data[:, offset:offset + length]
+            interval_array.mValues = v
+            interval_array.mIsReadOnly = True
+            index.mIndex[contig] = interval_array
+            offset += length
+        return index
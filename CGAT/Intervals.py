@@ -14,11 +14,23 @@ An interval list is simply a list of such intervals.
 The majority of the functions in this module take one or more lists of
 intervals and return one or more new lists of intervals.
 
+The functions :func:`iterator_overlapping` and
+:func:`iterator_overlap_pairs` compare streams of genomic intervals
+such as :class:`GTF.Entry` or :class:`Bed.Bed` objects, which have
+``contig``, ``start`` and ``end`` attributes. The streams need to be
+sorted by contig and start (see :func:`isSorted`), for example with
+``sort -k1,1 -k2,2n`` or ``gtf2gtf.py --method=sort
+--sort-order=position``. The streams are compared in a single sweep
+and only the intervals overlapping the current position are kept in
+memory.
+
 Reference
 ---------
 
 '''
 
+import heapq
+
 
 def getLength(intervals):
     """return sum of intervals lengths.
@@ -479,3 +491,129 @@ def ShortenIntervalsOverlap(intervals, to_remove):
             new_intervals.append((this_from, this_to))
 
     return new_intervals
+
+
+def iterator_check_sorted(iterator):
+    """iterate over genomic intervals in *iterator* and check that
+    they are sorted by contig and start.
+
+    Contigs are sorted alphabetically.
+
+    Raises ValueError if the input is not sorted.
+    """
+    last_contig, last_start = None, None
+    for interval in iterator:
+        if interval.contig == last_contig:
+            if interval.start < last_start:
+                raise ValueError(
+                    "input not sorted by position: %s:%i after %s:%i" %
+                    (interval.contig, interval.start,
+                     last_contig, last_start))
+        elif last_contig is not None and interval.contig < last_contig:
+            raise ValueError(
+                "input not sorted by contig: %s after %s" %
+                (interval.contig, last_contig))
+        last_contig, last_start = interval.contig, interval.start
+        yield interval
+
+
+def isSorted(iterator):
+    """return True if genomic intervals in *iterator* are sorted by
+    contig and start.
+
+    The iterator is consumed.
+    """
+    try:
+        for interval in iterator_check_sorted(iterator):
+            pass
+    except ValueError:
+        return False
+    return True
+
+
+def iterator_overlapping(query_iterator, target_iterator):
+    """iterate over genomic intervals in *query_iterator* and
+    return overlapping intervals in *target_iterator*.
+
+    Both iterators need to be sorted by contig and start (see
+    :func:`isSorted`) and are compared in a single pass. Empty
+    intervals do not overlap any other interval.
+
+    Yields tuples of (query, targets) for each query, where targets
+    is a list of overlapping intervals sorted by start.
+
+    Raises ValueError if an input is not sorted.
+    """
+    targets = iterator_check_sorted(target_iterator)
+    next_target = next(targets, None)
+    active = []
+
+    for query in iterator_check_sorted(query_iterator):
+        contig, start, end = query.contig, query.start, query.end
+
+        # targets ending before start will not overlap subsequent queries
+        active = [x for x in active
+                  if x.contig == contig and x.end > start]
+
+        while next_target is not None and next_target.contig < contig:
+            next_target = next(targets, None)
+
+        while next_target is not None and \
+                next_target.contig == contig and \
+                next_target.start < end:
+            if next_target.end > start and \
+                    next_target.end > next_target.start:
+                active.append(next_target)
+            next_target = next(targets, None)
+
+        if start < end:
+            yield query, [x for x in active if x.start < end]
+        else:
+            yield query, []
+
+
+def iterator_overlap_pairs(*iterators):
+    """iterate over pairs of overlapping genomic intervals from
+    different streams.
+
+    All iterators need to be sorted by contig and start (see
+    :func:`isSorted`) and are merged in a single pass. Empty
+    intervals do not overlap any other interval.
+
+    Yields tuples of (index1, interval1, index2, interval2) with
+    index1 < index2 being the positions of the streams in
+    *iterators*. Each pair of overlapping intervals is reported
+    once, when the one starting later is encountered.
+
+    Raises ValueError if an input is not sorted.
+    """
+
+    def _tag(iterator, idx):
+        for counter, interval in enumerate(iterator_check_sorted(iterator)):
+            yield (interval.contig, interval.start, idx, counter), interval
+
+    merged = heapq.merge(*[_tag(iterator, idx)
+                           for idx, iterator in enumerate(iterators)])
+
+    active = [[] for x in iterators]
+    last_contig = None
+    for key, interval in merged:
+        contig, start, idx, counter = key
+        if contig != last_contig:
+            active = [[] for x in iterators]
+            last_contig = contig
+
+        if interval.end <= start:
+            continue
+
+        for other_idx, others in enumerate(active):
+            others[:] = [x for x in others if x.end > start]
+            if other_idx == idx:
+                continue
+            for other in others:
+                if other_idx < idx:
+                    yield other_idx, other, idx, interval
+                else:
+                    yield idx, interval, other_idx, other
+
+        active[idx].append(interval)
@@ -11,9 +11,10 @@ Code
 import os
 import subprocess
 import tempfile
-import string
 import re
 import random
+import multiprocessing
+import numpy
 
 from CGAT import Experiment as E
 from CGAT import Genomics as Genomics
@@ -51,23 +52,50 @@ class Masker:
 
         return alphabet
 
-    def __call__(self, sequence):
-        """mask a sequence."""
+    def prepareSequence(self, sequence):
+        """prepare a sequence for masking.
+
+        returns a tuple (sequence, alphabet, query) with the
+        sequence with whitespace removed, its alphabet and the
+        sequence that needs to be submitted to the masker. The
+        query is None if the sequence is not to be masked.
+        """
 
         sequence = re.sub("\s", "", sequence)
 
         a = self.getAlphabet(sequence)
 
-        seq = list(sequence)
-
-        if len(seq) < 5:
+        if len(sequence) < 5:
             # do not mask empty/short sequences
-            pass
-
+            query = None
         elif a == "aa" and self.mHasPeptideMasking:
+            query = sequence
+        elif a == "codons" and self.mHasPeptideMasking:
+            query = Genomics.TranslateDNA2Protein(sequence)
+        elif a in ("na", "codons") and self.mHasNucleicAcidMasking:
+            query = sequence
+        else:
+            raise ValueError(
+                "masking of sequence type %s not implemented." % a)
+
+        return sequence, a, query
+
+    def applyMask(self, sequence, alphabet, query, masked_sequence):
+        """apply the output of the masker to *sequence*.
+
+        *sequence*, *alphabet* and *query* are the values
+        returned by :meth:`prepareSequence`.
+        """
+        if query is None:
+            return sequence
+
+        seq = list(sequence)
+        a = alphabet
+
+        if a == "aa" and self.mHasPeptideMasking:
 
             c = 0
-            m = self.maskSequence(sequence)
+            m = masked_sequence
             if self.soft_mask:
                 m = re.sub("[a-z]", "x", m)
             for p, m in zip(sequence, m):
@@ -80,13 +108,11 @@ class Masker:
 
         elif a == "codons" and self.mHasPeptideMasking:
 
-            peptide_sequence = Genomics.TranslateDNA2Protein(sequence)
-            masked_sequence = self.maskSequence(peptide_sequence)
             if self.soft_mask:
                 masked_sequence = re.sub("[a-z]", "x", masked_sequence)
 
             c = 0
-            for p, m in zip(peptide_sequence, masked_sequence):
+            for p, m in zip(query, masked_sequence):
                 if m in "Xx":
                     if p.isupper():
                         seq[c:c + 3] = ["N"] * 3
@@ -95,58 +121,84 @@ class Masker:
                 c += 3
 
         elif a in ("na", "codons") and self.mHasNucleicAcidMasking:
-            masked_sequence = self.maskSequence(sequence)
             if self.soft_mask:
                 masked_sequence = re.sub("[a-z]", "N", masked_sequence)
             return masked_sequence
-        else:
-            raise ValueError(
-                "masking of sequence type %s not implemented." % a)
 
         return "".join(seq)
 
-    def maskSequence(self, peptide_sequence):
-        """mask peptide sequence
-        """
+    def __call__(self, sequence):
+        """mask a sequence."""
 
-        Masker.__init__(self)
+        sequence, alphabet, query = self.prepareSequence(sequence)
+        if query is None:
+            return sequence
 
-        outfile, filename_peptide = tempfile.mkstemp()
-        os.write(outfile, ">test\n%s\n" % (peptide_sequence))
-        os.close(outfile)
+        return self.applyMask(sequence, alphabet, query,
+                              self.maskSequence(query))
 
-        infile = filename_peptide
-        statement = self.mCommand % locals()
+    def maskBatch(self, sequences, chunk_size=1000, threads=1):
+        """mask a collection of sequences.
 
-        E.debug("statement: %s" % statement)
+        Sequences are submitted to the masker in chunks of
+        *chunk_size* sequences, running a single masker process
+        per chunk instead of one per sequence. If *threads* is
+        larger than 1, chunks are masked in parallel by a pool of
+        worker processes.
 
-        s = subprocess.Popen(statement,
-                             shell=True,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE,
-                             close_fds=True)
+        returns a list of masked sequences in the same order
+        as *sequences*.
+        """
 
-        (out, err) = s.communicate()
-        if s.returncode != 0:
-            raise RuntimeError(
-                "Error in running %s \n%s\nTemporary directory" %
-                (statement, err))
+        prepared = [self.prepareSequence(x) for x in sequences]
+        queries = [x[2] for x in prepared if x[2] is not None]
+
+        chunks = [queries[x:x + chunk_size]
+                  for x in range(0, len(queries), chunk_size)]
+
+        if threads > 1 and len(chunks) > 1:
+            E.info("masking %i sequences in %i chunks with %i processes" %
+                   (len(queries), len(chunks), threads))
+            pool = multiprocessing.Pool(threads,
+                                        initializer=initializeWorker,
+                                        initargs=(self,))
+            masked = pool.map(maskChunk, chunks)
+            pool.close()
+            pool.join()
+        else:
+            masked = [self.maskSequences(x) for x in chunks]
+
+        masked = iter([y for x in masked for y in x])
 
-        os.remove(filename_peptide)
+        result = []
+        for sequence, alphabet, query in prepared:
+            if query is None:
+                result.append(sequence)
+            else:
+                result.append(self.applyMask(
+                    sequence, alphabet, query, next(masked)))
+        return result
 
-        masked_sequence = re.sub(
-            "\s", "", string.join(out.split("\n")[1:], ""))
-        return masked_sequence
+    def maskSequence(self, peptide_sequence):
+        """mask peptide sequence
+        """
+        return self.maskSequences((peptide_sequence,))[0]
 
     def maskSequences(self, sequences):
-        '''mask a collection of sequences.'''
+        '''mask a collection of sequences.
 
-        outfile, infile = tempfile.mkstemp()
+        All sequences are masked by a single invocation
+        of the masker.
+        '''
 
-        for x, s in enumerate(sequences):
-            os.write(outfile, ">%i\n%s\n" % (x, s))
+        if len(sequences) == 0:
+            return []
 
-        os.close(outfile)
+        outfile, infile = tempfile.mkstemp()
+
+        with os.fdopen(outfile, "w") as outf:
+            for x, s in enumerate(sequences):
+                outf.write(">%i\n%s\n" % (x, s))
 
         statement = self.mCommand % locals()
 
@@ -156,19 +208,26 @@ class Masker:
                              shell=True,
                              stdout=subprocess.PIPE,
                              stderr=subprocess.PIPE,
-                             close_fds=True)
+                             close_fds=True,
+                             universal_newlines=True)
 
         (out, err) = s.communicate()
 
+        os.remove(infile)
+
         if s.returncode != 0:
             raise RuntimeError(
                 "Error in running %s \n%s\nTemporary directory" %
                 (statement, err))
 
         result = [
-            x.sequence for x in FastaIterator.iterate(StringIO(out))]
+            re.sub("\s", "", x.sequence)
+            for x in FastaIterator.iterate(StringIO(out))]
 
-        os.remove(infile)
+        if len(result) != len(sequences):
+            raise ValueError(
+                "masker returned %i sequences, expected %i" %
+                (len(result), len(sequences)))
 
         return result
 
@@ -196,6 +255,181 @@ class MaskerDustMasker(Masker):
     mHasNucleicAcidMasking = True
 
 
+class MaskerDust(Masker):
+
+    '''mask low complexity regions in nucleotide sequences
+    with an in-process implementation of the DUST algorithm.
+
+    Masked characters are returned as lower case characters.
+    See :func:`dustSequence` for the meaning of *window*
+    and *level*.
+    '''
+
+    mHasNucleicAcidMasking = True
+
+    def __init__(self, window=64, level=20):
+        Masker.__init__(self)
+        self.window = window
+        self.level = level
+
+    def maskSequences(self, sequences):
+        '''mask a collection of sequences.'''
+        return [softmaskSequence(x,
+                                 dustSequence(x,
+                                              window=self.window,
+                                              level=self.level))
+                for x in sequences]
+
+
+# map nucleotides to 0-3, other characters to 4
+_DUST_CODES = numpy.empty(256, dtype=numpy.int64)
+_DUST_CODES.fill(4)
+for _x, _c in enumerate("ACGT"):
+    _DUST_CODES[ord(_c)] = _x
+    _DUST_CODES[ord(_c.lower())] = _x
+
+# triplet code for triplets containing other characters
+_DUST_INVALID = 64
+
+
+# sort keys combine triplet code and position
+_DUST_STRIDE = 2 ** 32
+
+
+def _dustBlock(triplets, nwindows, ntriplets, level):
+    '''return low complexity intervals in a block of triplets.
+
+    Windows of *ntriplets* triplets starting at positions
+    0 to *nwindows* - 1 are scored.
+
+    returns arrays of interval starts and ends in triplet
+    coordinates.
+    '''
+
+    valid = triplets != _DUST_INVALID
+    positions = numpy.arange(len(triplets), dtype=numpy.int64)
+    keys = triplets * _DUST_STRIDE + positions
+    sorted_keys = numpy.sort(keys)
+
+    # number of identical triplets preceding each triplet within
+    # the window ending at it and following it within the window
+    # starting at it.
+    before = numpy.searchsorted(sorted_keys, keys) - numpy.searchsorted(
+        sorted_keys,
+        triplets * _DUST_STRIDE + numpy.maximum(positions - ntriplets + 1, 0))
+    after = numpy.searchsorted(
+        sorted_keys,
+        triplets * _DUST_STRIDE + positions + ntriplets) - \
+        numpy.searchsorted(sorted_keys, keys) - 1
+    before[~valid] = 0
+    after[~valid] = 0
+
+    # number of pairs of identical triplets in each window
+    pairs = numpy.empty(nwindows, dtype=numpy.int64)
+    pairs[0] = before[:ntriplets].sum()
+    pairs[1:] = pairs[0] + numpy.cumsum(
+        before[ntriplets:ntriplets + nwindows - 1] -
+        after[:nwindows - 1])
+
+    # mask windows with score (pairs / (ntriplets - 1)) above level / 10
+    high = numpy.nonzero(pairs * 10 > level * (ntriplets - 1))[0]
+    if len(high) == 0:
+        return high, high
+
+    # within each window, find the highest scoring prefix and
+    # suffix to delineate the low complexity region.
+    offsets = numpy.arange(ntriplets, dtype=numpy.int64)
+    idx = high[:, None] + offsets[None, :]
+    t = triplets[idx]
+    k = keys[idx]
+    v = valid[idx]
+
+    previous = numpy.searchsorted(sorted_keys, k) - numpy.searchsorted(
+        sorted_keys, t * _DUST_STRIDE + high[:, None])
+    following = numpy.searchsorted(
+        sorted_keys, t * _DUST_STRIDE + high[:, None] + ntriplets) - \
+        numpy.searchsorted(sorted_keys, k) - 1
+    previous[~v] = 0
+    following[~v] = 0
+
+    prefix = numpy.cumsum(previous, axis=1)[:, 1:] / offsets[None, 1:]
+    suffix = (numpy.cumsum(following[:, ::-1], axis=1)[:, 1:] /
+              offsets[None, 1:])[:, ::-1]
+
+    ends = high + 1 + numpy.argmax(prefix, axis=1)
+    starts = high + numpy.argmax(suffix, axis=1)
+    keep = starts <= ends
+    return starts[keep], ends[keep] + 1
+
+
+def dustSequence(sequence, window=64, level=20, block_size=1000000):
+    '''find low complexity regions in a nucleotide sequence.
+
+    The algorithm follows DUST: a window of *window* nucleotides
+    is moved along the sequence and the triplets in it are
+    counted. The score of a window is the number of pairs of
+    identical triplets divided by the number of triplets minus
+    one. In windows scoring above *level* / 10, the highest scoring
+    prefix and suffix delineate the low complexity region.
+    Triplets containing characters other than ``ACGT`` are ignored.
+
+    The sequence is processed in blocks of *block_size* windows.
+
+    returns a boolean numpy array with masked positions set
+    to True.
+    '''
+    nsequence = len(sequence)
+    mask = numpy.zeros(nsequence, dtype=numpy.bool_)
+    if nsequence < 4:
+        return mask
+
+    codes = _DUST_CODES[numpy.frombuffer(sequence.encode("latin-1"),
+                                         dtype=numpy.uint8)]
+    triplets = codes[:-2] * 16 + codes[1:-1] * 4 + codes[2:]
+    triplets[(codes[:-2] == 4) | (codes[1:-1] == 4) | (codes[2:] == 4)] = \
+        _DUST_INVALID
+
+    ntriplets = min(window - 2, len(triplets))
+    nwindows = len(triplets) - ntriplets + 1
+
+    changes = numpy.zeros(nsequence + 1, dtype=numpy.int64)
+    for start in range(0, nwindows, block_size):
+        n = min(block_size, nwindows - start)
+        starts, ends = _dustBlock(triplets[start:start + n + ntriplets - 1],
+                                  n, ntriplets, level)
+        # triplets cover three nucleotides
+        numpy.add.at(changes, starts + start, 1)
+        numpy.add.at(changes, ends + start + 2, -1)
+
+    mask[:] = numpy.cumsum(changes[:-1]) > 0
+    return mask
+
+
+def softmaskSequence(sequence, mask):
+    '''return *sequence* with positions in the boolean array
+    *mask* converted to lower case.'''
+    if not mask.any():
+        return sequence
+    s = numpy.frombuffer(sequence.encode("latin-1"),
+                         dtype=numpy.uint8).copy()
+    upper = mask & (s >= ord("A")) & (s <= ord("Z"))
+    s[upper] += ord("a") - ord("A")
+    return s.tobytes().decode("latin-1")
+
+
+WORKER_STATE = {}
+
+
+def initializeWorker(masker):
+    '''initialize a worker process for :meth:`Masker.maskBatch`.'''
+    WORKER_STATE["masker"] = masker
+
+
+def maskChunk(sequences):
+    '''mask a chunk of sequences in a worker process.'''
+    return WORKER_STATE["masker"].maskSequences(sequences)
+
+
 class MaskerRandom (Masker):
     """randomly mask a proportion of positions in a sequence
     in multiple alignment."""
@@ -244,18 +478,21 @@ def maskSequences(sequences, masker=None):
 
     *masker* can be one of
         dust/dustmasker * run dustmasker on sequences
+        pydust          * run in-process DUST on sequences
         softmask        * use softmask to hardmask sequences
     '''
 
     if masker in ("dust", "dustmasker"):
         masker_object = MaskerDustMasker()
+    elif masker == "pydust":
+        masker_object = MaskerDust()
     else:
         masker_object = None
 
     if masker == "softmask":
         # the genome sequence is repeat soft-masked
         masked_seq = sequences
-    elif masker in ("dust", "dustmasker"):
+    elif masker in ("dust", "dustmasker", "pydust"):
         # run dust
         masked_seq = masker_object.maskSequences(
             [x.upper() for x in sequences])
@@ -69,6 +69,27 @@ class NCLSimple(object):
         self._commit()
         return self.mDatabase.find_overlap(start, end)
 
+    def find_overlaps(self, starts, ends):
+        """find intervals in database overlapping with a set of
+        query intervals given by *starts* and *ends*.
+
+        returns a tuple of numpy arrays (query_index, hit_index)
+        with the position of the query and the index of the
+        overlapping segment.
+        """
+        self._commit()
+        return self.mDatabase.find_overlaps(starts, ends)
+
+    def count_overlaps(self, starts, ends):
+        """count intervals in database overlapping with a set of
+        query intervals given by *starts* and *ends*.
+
+        returns a numpy array with the number of overlapping segments
+        for each query.
+        """
+        self._commit()
+        return self.mDatabase.count_overlaps(starts, ends)
+
     def _commit(self):
         """commit database if changed."""
         if self.mIsDirty:
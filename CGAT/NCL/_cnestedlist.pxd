@@ -1,3 +1,5 @@
+from libc.stdint cimport int64_t
+
 cdef extern from "string.h":
   ctypedef int size_t
   void *memcpy(void *dst,void *src,size_t len)
@@ -96,6 +98,10 @@ cdef class IntervalDB:
   cdef IntervalMap *im
   cdef SublistHeader *subheader
 
+  cdef int64_t _find_overlaps(self, starts, ends,
+                              int64_t **p_query, int64_t **p_hit,
+                              int64_t *counts) except -1
+
 cdef class IntervalDBIterator:
   cdef IntervalIterator *it,*it_alloc
   cdef IntervalMap im_buf[1024]
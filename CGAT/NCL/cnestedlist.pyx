@@ -1,5 +1,8 @@
 #cython: embedsignature=True
 cimport cython
+from libc.stdint cimport int64_t
+
+import numpy
 
 ###############################
 # Could not make .pxd file to be found in gpipe/setup.py, so including it here:
@@ -277,6 +280,131 @@ cdef class IntervalDB:
     free_interval_iterator(it_alloc)
     return l
         
+  cdef int64_t _find_overlaps(self, starts, ends,
+                              int64_t **p_query, int64_t **p_hit,
+                              int64_t *counts) except -1:
+    """find overlaps for query intervals in *starts* and *ends*.
+
+    If *p_query* is NULL, only the number of overlaps is computed
+    and added to *counts* (if given) for each query.  Otherwise,
+    the query and hit indices are returned in newly allocated
+    arrays in *p_query* and *p_hit* that need to be freed by the
+    caller.
+
+    returns the total number of overlaps.
+    """
+    cdef int64_t [:] c_starts = numpy.ascontiguousarray(starts, dtype=numpy.int64)
+    cdef int64_t [:] c_ends = numpy.ascontiguousarray(ends, dtype=numpy.int64)
+    cdef Py_ssize_t nqueries = c_starts.shape[0]
+    cdef Py_ssize_t q
+    cdef int i, nhit, start, end
+    cdef int64_t nresults = 0, capacity = 1024
+    cdef int64_t *query_idx = NULL
+    cdef int64_t *hit_idx = NULL
+    cdef void *tmp
+    cdef IntervalIterator *it,*it_alloc
+    cdef IntervalMap im_buf[1024]
+
+    if c_ends.shape[0] != nqueries:
+      raise ValueError("starts and ends of different length (%i != %i)" %
+                       (nqueries, c_ends.shape[0]))
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+
+    if p_query != NULL:
+      query_idx = <int64_t*>malloc(capacity * sizeof(int64_t))
+      hit_idx = <int64_t*>malloc(capacity * sizeof(int64_t))
+      if query_idx == NULL or hit_idx == NULL:
+        free(query_idx)
+        free(hit_idx)
+        raise MemoryError("unable to allocate result buffers")
+
+    it_alloc=interval_iterator_alloc()
+    try:
+      for q from 0 <= q < nqueries:
+        start, end = c_starts[q], c_ends[q]
+        if start >= end:
+          raise IndexError("invalid interval (%i,%i)" % (start, end))
+        it = reset_interval_iterator(it_alloc)
+        while it:
+          find_intervals(it,start,end,self.im,self.ntop,
+                         self.subheader,self.nlists,im_buf,1024,
+                         &(nhit),&(it)) # GET NEXT BUFFER CHUNK
+          if p_query == NULL:
+            nresults += nhit
+            if counts != NULL:
+              counts[q] += nhit
+            continue
+          if nresults + nhit > capacity:
+            capacity = 2 * (nresults + nhit)
+            tmp = realloc(query_idx, capacity * sizeof(int64_t))
+            if tmp == NULL:
+              raise MemoryError("unable to allocate result buffers")
+            query_idx = <int64_t*>tmp
+            tmp = realloc(hit_idx, capacity * sizeof(int64_t))
+            if tmp == NULL:
+              raise MemoryError("unable to allocate result buffers")
+            hit_idx = <int64_t*>tmp
+          for i from 0 <= i < nhit:
+            query_idx[nresults] = q
+            hit_idx[nresults] = im_buf[i].target_id
+            nresults += 1
+    except:
+      free(query_idx)
+      free(hit_idx)
+      raise
+    finally:
+      free_interval_iterator(it_alloc)
+
+    if p_query != NULL:
+      p_query[0] = query_idx
+      p_hit[0] = hit_idx
+    return nresults
+
+  def find_overlaps(self, starts, ends):
+    """find intervals in database overlapping with a set of queries.
+
+    The query intervals are given by the sequences *starts* and
+    *ends*. All queries are processed without returning to python.
+
+    returns a tuple of numpy arrays (query_index, hit_index). The
+    query index is the position of a query in *starts* and *ends*,
+    the hit index is the id of the interval in the database.
+    Results are sorted by query index.
+    """
+    cdef int64_t *query_idx = NULL
+    cdef int64_t *hit_idx = NULL
+    cdef int64_t x, nresults
+    cdef int64_t [:] c_queries
+    cdef int64_t [:] c_hits
+    nresults = self._find_overlaps(starts, ends, &query_idx, &hit_idx, NULL)
+    try:
+      queries = numpy.empty(nresults, dtype=numpy.int64)
+      hits = numpy.empty(nresults, dtype=numpy.int64)
+      c_queries = queries
+      c_hits = hits
+      for x from 0 <= x < nresults:
+        c_queries[x] = query_idx[x]
+        c_hits[x] = hit_idx[x]
+    finally:
+      free(query_idx)
+      free(hit_idx)
+    return queries, hits
+
+  def count_overlaps(self, starts, ends):
+    """count intervals in database overlapping with a set of queries.
+
+    The hits are only counted and not collected.
+
+    returns a numpy array with the number of overlapping intervals
+    for each query.
+    """
+    cdef int64_t [:] c_counts
+    counts = numpy.zeros(len(starts), dtype=numpy.int64)
+    if len(counts) > 0:
+      c_counts = counts
+      self._find_overlaps(starts, ends, NULL, NULL, &c_counts[0])
+    return counts
+
   def check_nonempty(self):
     """return True if the database is empty."""
     if self.im:
@@ -28,6 +28,16 @@ procedure::
 This design is useful to compute multiple properties while iterating
 only once over an input file and output a single, multi-column table.
 
+Residue, dinucleotide and codon counts are computed by a
+:class:`SequenceCounts` object. To avoid re-encoding and re-counting a
+sequence for each property, a single :class:`SequenceCounts` object
+can be passed to the counters instead of the sequence::
+
+   for sequence in sequences:
+      counts = SequenceCounts(sequence)
+      for c in counters:
+          c.loadSequence(counts)
+
 .. note::
     While useful and in working order, the design of the classes is
     cumbersome.
@@ -44,11 +54,151 @@ import hashlib
 import base64
 import itertools
 import six
+import numpy
 
 from CGAT import Genomics as Genomics
 
 import Bio.Alphabet.IUPAC
 
+try:
+    _encodebytes = base64.encodebytes
+except AttributeError:
+    # python 2
+    _encodebytes = base64.encodestring
+
+# lookup tables to encode sequence characters as integer codes.
+# _ENCODE_NA maps ACGT (either case) to 0-3 and everything else to 4.
+# _ENCODE_NA_UPPER only maps upper case ACGT.
+_NUCLEOTIDES = "ACGT"
+_ENCODE_NA = numpy.empty(256, dtype=numpy.uint8)
+_ENCODE_NA.fill(4)
+_ENCODE_NA_UPPER = _ENCODE_NA.copy()
+for _x, _c in enumerate(_NUCLEOTIDES):
+    _ENCODE_NA[ord(_c)] = _x
+    _ENCODE_NA[ord(_c.lower())] = _x
+    _ENCODE_NA_UPPER[ord(_c)] = _x
+
+# codons in the order of their codes
+_CODONS = ["".join(x) for x in itertools.product(_NUCLEOTIDES, repeat=3)]
+
+
+class SequenceCounts(object):
+    """Counts of residues, dinucleotides and codons in a sequence.
+
+    The sequence is encoded once as an array of bytes. Counts are
+    computed with :func:`numpy.bincount` when first requested and
+    then cached, so that several :class:`SequenceProperties` objects
+    can share them::
+
+       counts = SequenceCounts(sequence)
+       for c in counters:
+           c.loadSequence(counts)
+
+    Character counts are case-sensitive, dinucleotide counts only
+    consider upper-case nucleotides and codon counts are computed on
+    the upper-case sequence.
+    """
+
+    def __init__(self, sequence):
+        self.mSequence = sequence
+        self.mArray = numpy.frombuffer(sequence.encode("latin-1"),
+                                       dtype=numpy.uint8)
+        self.mCleanSequence = None
+        self.mCharacterCounts = None
+        self.mDinucleotideCounts = None
+        self.mCodonCounts = None
+
+    def __len__(self):
+        return len(self.mSequence)
+
+    def getSequence(self):
+        """return the sequence."""
+        return self.mSequence
+
+    def getCleanSequence(self):
+        """return upper-case sequence without gap characters."""
+        if self.mCleanSequence is None:
+            self.mCleanSequence = re.sub("[ -.]", "", self.mSequence).upper()
+        return self.mCleanSequence
+
+    def getCharacterCounts(self, uppercase=False):
+        """return counts of each byte value as an array of length 256.
+
+        If *uppercase* is set, lower-case letters are counted as
+        upper-case letters.
+        """
+        if self.mCharacterCounts is None:
+            self.mCharacterCounts = numpy.bincount(self.mArray,
+                                                   minlength=256)
+        counts = self.mCharacterCounts
+        if uppercase:
+            counts = counts.copy()
+            counts[ord("A"):ord("Z") + 1] += counts[ord("a"):ord("z") + 1]
+            counts[ord("a"):ord("z") + 1] = 0
+        return counts
+
+    def countCharacters(self, alphabet, uppercase=False):
+        """return a dictionary with counts of characters in *alphabet*
+        and the number of other characters.
+        """
+        counts = self.getCharacterCounts(uppercase)
+        result = dict([(x, int(counts[ord(x)])) for x in alphabet])
+        return result, len(self.mArray) - sum(result.values())
+
+    def getDinucleotideCounts(self):
+        """return a dictionary with counts of upper-case ACGT
+        dinucleotides and the number of other dinucleotides.
+        """
+        if self.mDinucleotideCounts is None:
+            codes = _ENCODE_NA_UPPER[self.mArray].astype(numpy.int32)
+            valid = (codes[:-1] < 4) & (codes[1:] < 4)
+            counts = numpy.bincount(
+                (codes[:-1] * 4 + codes[1:])[valid], minlength=16)
+            result = {}
+            for x, dinucleotide in enumerate(
+                    itertools.product(_NUCLEOTIDES, repeat=2)):
+                result["".join(dinucleotide)] = int(counts[x])
+            self.mDinucleotideCounts = (
+                result, max(0, len(self.mArray) - 1) - int(counts.sum()))
+        return self.mDinucleotideCounts
+
+    def getCodonCounts(self):
+        """return a dictionary with the counts of each codon in the
+        upper-case sequence.
+
+        Codons are taken in frame starting at the first position.
+        Only codons that occur in the sequence are reported. An
+        incomplete codon at the end of the sequence is ignored.
+        """
+        if self.mCodonCounts is None:
+            ncodons = len(self.mArray) // 3
+            codes = _ENCODE_NA[self.mArray[:ncodons * 3]].reshape(
+                ncodons, 3).astype(numpy.int32)
+            valid = (codes < 4).all(axis=1)
+            counts = numpy.bincount(
+                (codes[:, 0] * 16 + codes[:, 1] * 4 + codes[:, 2])[valid],
+                minlength=64)
+            result = dict([(codon, int(count))
+                           for codon, count in zip(_CODONS, counts)
+                           if count > 0])
+            # codons with other characters, e.g. N
+            sequence = self.mSequence
+            for x in numpy.nonzero(~valid)[0]:
+                codon = sequence[x * 3:x * 3 + 3].upper()
+                result[codon] = result.get(codon, 0) + 1
+            self.mCodonCounts = result
+        return self.mCodonCounts
+
+
+def getSequenceCounts(sequence):
+    """return a :class:`SequenceCounts` object for *sequence*.
+
+    *sequence* can be a string or a :class:`SequenceCounts` object.
+    """
+    if isinstance(sequence, SequenceCounts):
+        return sequence
+    return SequenceCounts(sequence)
+
 
 class SequenceProperties(object):
     """Base class.
@@ -71,11 +221,17 @@ class SequenceProperties(object):
         pass
 
     def loadSequence(self, sequence, seqtype="na"):
-        """load sequence properties from a sequence."""
+        """load sequence properties from a sequence.
+
+        *sequence* can be a string or a :class:`SequenceCounts`
+        object. Returns the :class:`SequenceCounts` object.
+        """
 
+        counts = getSequenceCounts(sequence)
         self.mSeqType = seqtype
-        self.mSequence = re.sub("[ -.]", "", sequence).upper()
+        self.mSequence = counts.getCleanSequence()
         self.mLength = len(self.mSequence)
+        return counts
 
     def __str__(self):
         return "\t".join(self.getFields())
@@ -109,8 +265,7 @@ class SequencePropertiesSequence(SequenceProperties):
 
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence."""
-        SequenceProperties.loadSequence(self, sequence, seqtype)
-        # self.mSequence = sequence
+        return SequenceProperties.loadSequence(self, sequence, seqtype)
 
     def getFields(self):
         fields = SequenceProperties.getFields(self)
@@ -137,14 +292,14 @@ class SequencePropertiesHid(SequenceProperties):
 
     def loadSequence(self, sequence, seqtype="na"):
         """load hid sequence properties from a sequence."""
-        SequenceProperties.loadSequence(self, sequence, seqtype)
+        counts = SequenceProperties.loadSequence(self, sequence, seqtype)
 
         # do the encryption
-        h = hashlib.md5(six.b(sequence)).digest()
+        h = hashlib.md5(six.b(counts.getSequence())).digest()
         # map to printable letters: hid has length 22, so the padded '=' are
         # truncated. You have to add them, if you ever want to decode,
         # but who would do such a thing :=)
-        r = base64.encodestring(h)[0:22].decode("ascii")
+        r = _encodebytes(h)[0:22].decode("ascii")
 
         # finally substitute some characters:
         # '/' for '_', so we have legal file names
@@ -152,6 +307,7 @@ class SequencePropertiesHid(SequenceProperties):
         hid = r.replace('/', '_').replace('+', '[').replace('=', ']')
 
         self.mHid = hid
+        return counts
 
     def getFields(self):
         fields = SequenceProperties.getFields(self)
@@ -188,12 +344,13 @@ class SequencePropertiesLength(SequenceProperties):
 
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence."""
-        SequenceProperties.loadSequence(self, sequence, seqtype)
-        self.mLength = len(sequence)
+        counts = SequenceProperties.loadSequence(self, sequence, seqtype)
+        self.mLength = len(counts)
         if self.mSeqType == "na":
-            self.mNCodons = len(sequence) / 3
+            self.mNCodons = len(counts) / 3
         else:
             self.mNCodons = 0
+        return counts
 
     def getFields(self):
         fields = SequenceProperties.getFields(self)
@@ -238,21 +395,14 @@ class SequencePropertiesNA(SequenceProperties):
 
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence."""
-        SequenceProperties.loadSequence(self, sequence, seqtype)
+        counts = SequenceProperties.loadSequence(self, sequence, seqtype)
         # counts of nucleotides
-        self.mCountsNA = {}
-        for x in self.mAlphabet:
-            self.mCountsNA[x] = 0
-
-        for na in sequence.upper():
-            if na in ('G', 'C'):
-                self.mCountsGC += 1
-            elif na in ('A', 'T'):
-                self.mCountsAT += 1
-            try:
-                self.mCountsNA[na] += 1
-            except KeyError:
-                self.mCountsOthers += 1
+        self.mCountsNA, nothers = counts.countCharacters(
+            self.mAlphabet, uppercase=True)
+        self.mCountsGC += self.mCountsNA["G"] + self.mCountsNA["C"]
+        self.mCountsAT += self.mCountsNA["A"] + self.mCountsNA["T"]
+        self.mCountsOthers += nothers
+        return counts
 
     def getFields(self):
         fields = SequenceProperties.getFields(self)
@@ -326,16 +476,13 @@ class SequencePropertiesDN(SequenceProperties):
 
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence."""
-        SequenceProperties.loadSequence(self, sequence, seqtype)
+        counts = SequenceProperties.loadSequence(self, sequence, seqtype)
 
-        # IMS: generator rather than list
-        # to save memory for might be a neater way of doing this.
-        for dinuc in (sequence[x - 2:x]
-                      for x in range(2, len(sequence) + 1, 1)):
-            try:
-                self.mCountsDinuc[dinuc] += 1
-            except KeyError:
-                self.mCountsOthers += 1
+        dinucleotides, nothers = counts.getDinucleotideCounts()
+        for dinuc, count in dinucleotides.items():
+            self.mCountsDinuc[dinuc] += count
+        self.mCountsOthers += nothers
+        return counts
 
     def getFields(self):
 
@@ -383,8 +530,9 @@ class SequencePropertiesCpg(SequencePropertiesNA, SequencePropertiesDN):
         self.mCpG_ObsExp += other.mCpG_ObsExp
 
     def loadSequence(self, sequence, seqtype="na"):
-        SequencePropertiesNA.loadSequence(self, sequence, seqtype)
-        SequencePropertiesDN.loadSequence(self, sequence, seqtype)
+        counts = getSequenceCounts(sequence)
+        SequencePropertiesNA.loadSequence(self, counts, seqtype)
+        SequencePropertiesDN.loadSequence(self, counts, seqtype)
 
         if self.mLength > 0:
             self.mCpG_density = (float(self.mCountsDinuc["CG"]) /
@@ -399,6 +547,7 @@ class SequencePropertiesCpg(SequencePropertiesNA, SequencePropertiesDN):
         else:
             self.mCpG_density = 0.0
             self.mCpG_ObsExp = 0.0
+        return counts
 
     def getFields(self):
         fields = ["%s" % self.mCountsDinuc["CG"]]
@@ -450,31 +599,19 @@ class SequencePropertiesGaps(SequenceProperties):
 
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence."""
-        SequenceProperties.loadSequence(self, sequence, seqtype)
-
-        gap_chars = self.gap_chars
-        ngaps = 0
-        was_gap = not (sequence[0] in gap_chars)
+        counts = SequenceProperties.loadSequence(self, sequence, seqtype)
 
-        ngap_regions = 0
-        nseq_regions = 0
+        is_gap = numpy.in1d(
+            counts.mArray,
+            numpy.frombuffer(self.gap_chars.encode("latin-1"),
+                             dtype=numpy.uint8))
+        # the region before the first residue is of the opposite type
+        was_gap = numpy.concatenate(([not is_gap[0]], is_gap[:-1]))
 
-        x = 0
-        for x, c in enumerate(sequence):
-
-            is_gap = c in gap_chars
-            if is_gap:
-                ngaps += 1
-                if not was_gap:
-                    ngap_regions += 1
-            else:
-                if was_gap:
-                    nseq_regions += 1
-            was_gap = is_gap
-
-        self.ngaps = ngaps
-        self.ngap_regions = ngap_regions
-        self.nseq_regions = nseq_regions
+        self.ngaps = int(is_gap.sum())
+        self.ngap_regions = int((is_gap & ~was_gap).sum())
+        self.nseq_regions = int((~is_gap & was_gap).sum())
+        return counts
 
     def addProperties(self, other):
         SequenceProperties.addProperties(self, other)
@@ -579,14 +716,12 @@ class SequencePropertiesDegeneracy (SequencePropertiesLength):
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence."""
 
-        SequencePropertiesLength.loadSequence(self, sequence, seqtype)
-        if len(sequence) % 3:
+        counts = SequencePropertiesLength.loadSequence(
+            self, sequence, seqtype)
+        if len(counts) % 3:
             raise ValueError(
                 '''sequence length is not a multiple of 3 (length=%i)''' %
-                (len(sequence)))
-
-        # uppercase all letters
-        sequence = sequence.upper()
+                (len(counts)))
 
         self.mNStopCodons = 0
 
@@ -609,25 +744,27 @@ class SequencePropertiesDegeneracy (SequencePropertiesLength):
                 xx.append(yy)
             self.mCountsDegeneracy.append(xx)
 
-        # use generator rather than list to save memory
-        for codon in (sequence[x:x + 3] for x in range(0, len(sequence), 3)):
+        # (upper case) codons are counted once
+        for codon, count in sorted(counts.getCodonCounts().items()):
 
             for x in (0, 1, 2):
-                self.mCounts[x][codon[x]] += 1
+                self.mCounts[x][codon[x]] += count
 
             if Genomics.IsStopCodon(codon):
-                self.mNStopCodons += 1
+                self.mNStopCodons += count
                 continue
 
             try:
                 aa, deg1, deg2, deg3 = Genomics.GetDegeneracy(codon)
                 degrees = (deg1, deg2, deg3)
                 for x in range(len(degrees)):
-                    self.mCountsDegeneracy[x][degrees[x]][codon[x]] += 1
+                    self.mCountsDegeneracy[x][degrees[x]][codon[x]] += count
 
             except KeyError:
                 pass
 
+        return counts
+
     def updateProperties(self):
         """update fields from counts."""
 
@@ -772,12 +909,12 @@ class SequencePropertiesAA(SequenceProperties):
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence."""
 
-        SequenceProperties.loadSequence(self, sequence, seqtype)
+        counts = SequenceProperties.loadSequence(self, sequence, seqtype)
 
-        if len(sequence) % 3:
+        if len(counts) % 3:
             raise ValueError(
                 '''sequence length is not a multiple of 3 (length=%i)''' %
-                (len(sequence)))
+                (len(counts)))
 
         # counts of amino acids
         self.mCountsAA = {}
@@ -785,9 +922,11 @@ class SequencePropertiesAA(SequenceProperties):
         for x in Bio.Alphabet.IUPAC.extended_protein.letters:
             self.mCountsAA[x] = 0
 
-        for codon in (sequence[x:x + 3] for x in range(0, len(sequence), 3)):
+        for codon, count in sorted(counts.getCodonCounts().items()):
             aa = Genomics.MapCodon2AA(codon)
-            self.mCountsAA[aa] += 1
+            self.mCountsAA[aa] += count
+
+        return counts
 
     def getFields(self):
 
@@ -838,20 +977,13 @@ class SequencePropertiesAminoAcids(SequenceProperties):
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence. """
 
-        SequenceProperties.loadSequence(self, sequence, seqtype)
+        counts = SequenceProperties.loadSequence(self, sequence, seqtype)
 
-        # set to zero
-        for x in Bio.Alphabet.IUPAC.extended_protein.letters:
-            self.mCountsAA[x] = 0
-        self.mOtherCounts = 0
-
-        for aa in sequence:
-            if aa == "-":
-                continue
-            try:
-                self.mCountsAA[aa] += 1
-            except KeyError:
-                self.mOtherCounts += 1
+        self.mCountsAA, nothers = counts.countCharacters(
+            Bio.Alphabet.IUPAC.extended_protein.letters)
+        # gaps are not counted
+        self.mOtherCounts = nothers - counts.countCharacters("-")[0]["-"]
+        return counts
 
     def getFields(self):
 
@@ -915,15 +1047,21 @@ class SequencePropertiesCodons(SequencePropertiesLength):
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence."""
 
-        if len(sequence) % 3:
+        counts = getSequenceCounts(sequence)
+        if len(counts) % 3:
             raise ValueError(
                 '''sequence length is not a multiple of 3
-                (length=%i)''' % (len(sequence)))
+                (length=%i)''' % (len(counts)))
 
-        SequencePropertiesLength.loadSequence(self, sequence, seqtype)
+        SequencePropertiesLength.loadSequence(self, counts, seqtype)
 
-        # uppercase all letters and count codons
-        self.mCodonCounts = Genomics.CountCodons(sequence.upper())
+        # count codons of the upper case sequence, stop codons and
+        # codons with unknown characters are skipped
+        codon_counts = counts.getCodonCounts()
+        self.mCodonCounts = dict(
+            [(codon, codon_counts.get(codon, 0))
+             for codon in Genomics.GeneticCodeAA.keys()])
+        return counts
 
     def getFields(self):
 
@@ -1035,9 +1173,11 @@ class SequencePropertiesCodonTranslator(SequencePropertiesCodonUsage):
 
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence."""
-        SequencePropertiesCodons.loadSequence(self, sequence, seqtype)
+        counts = SequencePropertiesCodons.loadSequence(
+            self, sequence, seqtype)
 
-        self.mSequence = sequence
+        self.mSequence = counts.getSequence()
+        return counts
 
     def getHeaders(self):
 
@@ -1049,17 +1189,24 @@ class SequencePropertiesCodonTranslator(SequencePropertiesCodonUsage):
 
         fields = SequenceProperties.getFields(self)
 
-        data = []
-        for x in range(0, len(self.mSequence), 3):
-            codon = self.mSequence[x:x + 3]
-            if codon in self.mCodonFrequencies:
-                v = self.mCodonFrequencies[codon]
-            else:
-                v = 0.0
-
-            data.append("%i" % (v * 100))
-
-        fields.append(",".join(data))
+        # look up frequencies of upper case codons by their code,
+        # other codons have a frequency of 0
+        frequencies = numpy.array(
+            [self.mCodonFrequencies.get(codon, 0.0) for codon in _CODONS] +
+            [0.0])
+        ncodons = (len(self.mSequence) + 2) // 3
+        codes = numpy.empty(ncodons * 3, dtype=numpy.int32)
+        codes.fill(4)
+        codes[:len(self.mSequence)] = _ENCODE_NA_UPPER[numpy.frombuffer(
+            self.mSequence.encode("latin-1"), dtype=numpy.uint8)]
+        codes = codes.reshape(ncodons, 3)
+        codon_codes = numpy.where(
+            (codes < 4).all(axis=1),
+            codes[:, 0] * 16 + codes[:, 1] * 4 + codes[:, 2],
+            64)
+
+        fields.append(",".join(
+            ["%i" % x for x in frequencies[codon_codes] * 100]))
 
         return fields
 
@@ -1213,19 +1360,12 @@ class SequencePropertiesCounts(SequenceProperties):
     def loadSequence(self, sequence, seqtype="na"):
         """load sequence properties from a sequence."""
 
-        SequenceProperties.loadSequence(self, sequence, seqtype)
+        counts = SequenceProperties.loadSequence(self, sequence, seqtype)
 
-        # counts of amino acids
-        self.mCounts = {}
-        for x in self.mAlphabet:
-            self.mCounts[x] = 0
-        self.mCountsOthers = 0
-
-        for na in sequence.upper():
-            try:
-                self.mCounts[na] += 1
-            except KeyError:
-                self.mCountsOthers += 1
+        # counts of residues
+        self.mCounts, self.mCountsOthers = counts.countCharacters(
+            self.mAlphabet, uppercase=True)
+        return counts
 
     def getFields(self):
         fields = SequenceProperties.getFields(self)
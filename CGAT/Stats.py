@@ -493,17 +493,97 @@ class Summary(Result):
                           ))
 
 
-def adjustPValuesR(pvalues, method):
+def adjustPValuesR(pvalues, method, use_r=True):
     '''adjust P-Values for multiple testing using
     the p.adjust() method in R.
 
     Possible values of method are:
 
     c("holm", "hochberg", "hommel", "bonferroni", "BH", "BY", "fdr", "none")
+
+    If *use_r* is False, the p-values are adjusted with the
+    numpy implementation in :func:`adjustPValues` instead, which
+    also permits the method "storey" for q-values.
     '''
+    if not use_r:
+        return adjustPValues(pvalues, method=method)
     return R.p_adjust(pvalues, method)
 
 
+def computePi0Lambda(pvalues, vlambda):
+    '''estimate the proportion of true null hypotheses pi0 for
+    each tuning parameter in *vlambda*.
+
+    pi0(lambda) = #{p >= lambda} / (m * (1 - lambda))
+
+    All values of lambda are evaluated with a single binary search
+    in the sorted p-values.
+    '''
+    pvalues = numpy.sort(numpy.asarray(pvalues, dtype=numpy.float64))
+    vlambda = numpy.asarray(vlambda, dtype=numpy.float64)
+    m = len(pvalues)
+    ngreater = m - numpy.searchsorted(pvalues, vlambda, side="left")
+    return ngreater / (m * (1.0 - vlambda))
+
+
+def bootstrapPi0(pvalues, vlambda, pi0, nboot=100):
+    '''choose pi0 among the estimates *pi0* for each value in
+    *vlambda* by minimizing the bootstrap mean squared error.
+
+    The estimate only depends on the number of p-values falling
+    between successive values of lambda. Instead of resampling all
+    p-values, the bin counts of all *nboot* samples are drawn at once
+    from a multinomial distribution.
+    '''
+    vlambda = numpy.asarray(vlambda, dtype=numpy.float64)
+    pi0 = numpy.asarray(pi0, dtype=numpy.float64)
+    order = numpy.argsort(vlambda)
+    vlambda, pi0 = vlambda[order], pi0[order]
+
+    pvalues = numpy.sort(numpy.asarray(pvalues, dtype=numpy.float64))
+    m = len(pvalues)
+    ngreater = m - numpy.searchsorted(pvalues, vlambda, side="right")
+    # number of p-values in (-inf, l_0], (l_0, l_1], ..., (l_n, inf)
+    counts = -numpy.diff(numpy.concatenate(([m], ngreater, [0])))
+
+    samples = numpy.random.multinomial(m, counts / float(m), size=nboot)
+    # number of p-values greater than each lambda in each sample
+    boot_greater = numpy.cumsum(samples[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    pi0_boot = boot_greater / (m * (1.0 - vlambda))
+    mse = ((pi0_boot - pi0.min()) ** 2).sum(axis=0)
+
+    return min(pi0[mse == mse.min()])
+
+
+def computeQValues(pvalues, pi0=1.0, robust=False):
+    '''compute q-values from *pvalues* given an estimate
+    of the proportion of true null hypotheses *pi0*.
+
+    With *pi0* = 1, the q-values are the Benjamini-Hochberg
+    adjusted p-values.
+    '''
+    pvalues = numpy.asarray(pvalues, dtype=numpy.float64)
+    m = len(pvalues)
+    if m == 0:
+        return pvalues.copy()
+
+    idx = numpy.argsort(pvalues)
+    sorted_pvalues = pvalues[idx]
+    # v[i] = number of observations less than or equal to pvalue[i]
+    v = numpy.searchsorted(sorted_pvalues, sorted_pvalues, side="right")
+
+    qvalues = pi0 * m * sorted_pvalues / v
+    if robust:
+        qvalues /= (1.0 - (1.0 - sorted_pvalues) ** m)
+
+    # make q-values monotonic starting from the largest p-value
+    qvalues = numpy.minimum.accumulate(qvalues[::-1])[::-1]
+
+    result = numpy.empty(m, dtype=numpy.float64)
+    result[idx] = numpy.minimum(qvalues, 1.0)
+    return result
+
+
 def smoothPValues(pvalues,
                   vlambda=numpy.arange(0, 0.95, 0.05),
                   smooth_df=3,
@@ -522,11 +602,7 @@ def smoothPValues(pvalues,
 
     m = len(pvalues)
 
-    pi0 = numpy.zeros(len(vlambda), numpy.float)
-
-    for i in range(len(vlambda)):
-        pi0[i] = numpy.mean([x >= vlambda[i]
-                             for x in pvalues]) / (1.0 - vlambda[i])
+    pi0 = computePi0Lambda(pvalues, vlambda)
 
     R.assign("pi0", pi0)
     R.assign("vlambda", vlambda)
@@ -573,17 +649,13 @@ def getPi0(pvalues,
         if vlambda < 0 or vlambda >= 1:
             raise ValueError("vlambda must be within [0, 1).")
 
-        pi0 = numpy.mean([x >= vlambda for x in pvalues]) / (1.0 - vlambda)
+        pi0 = computePi0Lambda(pvalues, (vlambda,))[0]
         pi0 = min(pi0, 1.0)
         R.assign("pi0", pi0)
 
     else:
 
-        pi0 = numpy.zeros(len(vlambda), numpy.float)
-
-        for i in range(len(vlambda)):
-            pi0[i] = numpy.mean([x >= vlambda[i]
-                                 for x in pvalues]) / (1.0 - vlambda[i])
+        pi0 = computePi0Lambda(pvalues, vlambda)
 
         R.assign("pi0", pi0)
         R.assign("vlambda", vlambda)
@@ -602,11 +674,6 @@ def getPi0(pvalues,
 
         elif pi0_method == "bootstrap":
 
-            minpi0 = min(pi0)
-
-            mse = numpy.zeros(len(vlambda), numpy.float)
-            pi0_boot = numpy.zeros(len(vlambda), numpy.float)
-
             R.assign("pvalues", pvalues)
             pi0 = R("""
             m <- length(pvalues)
@@ -670,7 +737,9 @@ def doFDR(pvalues,
           robust=False,
           smooth_df=3,
           smooth_log_pi0=False,
-          plot=False):
+          plot=False,
+          method="storey",
+          use_r=True):
     """modeled after code taken from
 http://genomics.princeton.edu/storeylab/qvalue/linux.html.
 
@@ -678,8 +747,27 @@ http://genomics.princeton.edu/storeylab/qvalue/linux.html.
 
     Compute FDR after method by Storey et al. (2002).
 
+    *method* selects the correction. For "storey", q-values are
+    computed in R unless *use_r* is False, in which case
+    :func:`doFDRPython` is used. The methods "BH", "BY",
+    "bonferroni", "holm" and "hochberg" compute adjusted p-values
+    with :func:`adjustPValues` and set pi0 to 1.
+
     """
 
+    if method != "storey":
+        return doFDRAdjust(pvalues, method=method, fdr_level=fdr_level)
+
+    if not use_r:
+        return doFDRPython(pvalues,
+                           vlambda=vlambda,
+                           pi0_method=pi0_method,
+                           fdr_level=fdr_level,
+                           robust=robust,
+                           smooth_df=smooth_df,
+                           smooth_log_pi0=smooth_log_pi0,
+                           plot=plot)
+
     # set to default of qvalue method
     if vlambda is None:
         vlambda = numpy.arange(0, 0.95, 0.05)
@@ -706,15 +794,11 @@ http://genomics.princeton.edu/storeylab/qvalue/linux.html.
         if vlambda < 0 or vlambda >= 1:
             raise ValueError("vlambda must be within [0, 1).")
 
-        pi0 = numpy.mean([x >= vlambda for x in pvalues]) / (1.0 - vlambda)
+        pi0 = computePi0Lambda(pvalues, (vlambda,))[0]
         pi0 = min(pi0, 1.0)
         R.assign("pi0", pi0)
     else:
-        pi0 = numpy.zeros(len(vlambda), numpy.float)
-
-        for i in range(len(vlambda)):
-            pi0[i] = numpy.mean([x >= vlambda[i]
-                                 for x in pvalues]) / (1.0 - vlambda[i])
+        pi0 = computePi0Lambda(pvalues, vlambda)
 
         R.assign("pi0", pi0)
         R.assign("vlambda", vlambda)
@@ -742,11 +826,6 @@ http://genomics.princeton.edu/storeylab/qvalue/linux.html.
 
         elif pi0_method == "bootstrap":
 
-            minpi0 = min(pi0)
-
-            mse = numpy.zeros(len(vlambda), numpy.float)
-            pi0_boot = numpy.zeros(len(vlambda), numpy.float)
-
             R.assign("pvalues", pvalues)
             pi0 = R("""
             m <- length(pvalues)
@@ -837,6 +916,33 @@ qvalues
     return result
 
 
+def doFDRAdjust(pvalues, method="BH", fdr_level=None):
+    """compute FDR by adjusting p-values with :func:`adjustPValues`.
+
+    The result is an :class:`FDRResult` with pi0 set to 1.
+    """
+    if fdr_level is not None and (fdr_level <= 0 or fdr_level > 1):
+        raise ValueError("'fdr_level' must be within (0, 1].")
+
+    pvalues = numpy.array(pvalues, dtype=numpy.float64)
+    qvalues = adjustPValues(pvalues, method=method)
+
+    result = FDRResult()
+    result.mQValues = qvalues
+
+    if fdr_level is not None:
+        result.mPassed = (qvalues <= fdr_level).tolist()
+    else:
+        result.mPassed = [False] * len(qvalues)
+
+    result.mPValues = pvalues
+    result.mPi0 = 1.0
+    result.mLambda = None
+    result.xvalues = qvalues
+
+    return result
+
+
 def doFDRPython(pvalues,
                 vlambda=None,
                 pi0_method="smoother",
@@ -855,16 +961,15 @@ def doFDRPython(pvalues,
 
     """
 
-    if min(pvalues) < 0 or max(pvalues) > 1:
+    pvalues = numpy.array(pvalues, dtype=numpy.float64)
+
+    if pvalues.min() < 0 or pvalues.max() > 1:
         raise ValueError("p-values out of range")
 
     # set to default of qvalue method
     if vlambda is None:
         vlambda = numpy.arange(0, 0.95, 0.05)
 
-    m = len(pvalues)
-    pvalues = numpy.array(pvalues, dtype=numpy.float)
-
     if pi0 is None:
         if type(vlambda) == float:
             vlambda = (vlambda,)
@@ -882,20 +987,16 @@ def doFDRPython(pvalues,
             if vlambda < 0 or vlambda >= 1:
                 raise ValueError("vlambda must be within [0, 1).")
 
-            pi0 = numpy.mean([x >= vlambda for x in pvalues]) / (1.0 - vlambda)
+            pi0 = computePi0Lambda(pvalues, (vlambda,))[0]
             pi0 = min(pi0, 1.0)
         else:
 
-            pi0 = numpy.zeros(len(vlambda), numpy.float)
-
-            for i in range(len(vlambda)):
-                pi0[i] = numpy.mean([x >= vlambda[i]
-                                     for x in pvalues]) / (1.0 - vlambda[i])
+            pi0 = computePi0Lambda(pvalues, vlambda)
 
             if pi0_method == "smoother":
 
                 if smooth_log_pi0:
-                    pi0 = math.log(pi0)
+                    pi0 = numpy.log(pi0)
 
                 tck = scipy.interpolate.splrep(vlambda,
                                                pi0,
@@ -916,23 +1017,7 @@ def doFDRPython(pvalues,
                     pi0 = math.exp(pi0)
 
             elif pi0_method == "bootstrap":
-
-                minpi0 = min(pi0)
-
-                mse = numpy.zeros(len(vlambda), numpy.float)
-                pi0_boot = numpy.zeros(len(vlambda), numpy.float)
-
-                for i in range(100):
-                    # sample pvalues
-                    idx_boot = numpy.random.random_integers(0, m - 1, m)
-                    pvalues_boot = pvalues[idx_boot]
-
-                    for x in range(len(vlambda)):
-                        # compute number of pvalues larger than lambda[x]
-                        pi0_boot[x] = numpy.mean(
-                            pvalues_boot > vlambda[x]) / (1.0 - vlambda[x])
-                    mse += (pi0_boot - minpi0) ** 2
-                pi0 = min(pi0[mse == min(mse)])
+                pi0 = bootstrapPi0(pvalues, vlambda, pi0)
             else:
                 raise ValueError(
                     "'pi0_method' must be one of 'smoother' or 'bootstrap'.")
@@ -947,39 +1032,15 @@ def doFDRPython(pvalues,
     if fdr_level is not None and (fdr_level <= 0 or fdr_level > 1):
         raise ValueError("'fdr_level' must be within (0, 1].")
 
-    # compute qvalues
-    idx = numpy.argsort(pvalues)
-    # monotonically decreasing bins, so that bins[i-1] > x >=  bins[i]
-    bins = numpy.unique(pvalues)[::-1]
-
-    # v[i] = number of observations less than or equal to pvalue[i]
-    # could this be done more elegantly?
-    val2bin = len(bins) - numpy.digitize(pvalues, bins)
-    v = numpy.zeros(m, dtype=numpy.int)
-    lastbin = None
-    for x in range(m - 1, -1, -1):
-        bin = val2bin[idx[x]]
-        if bin != lastbin:
-            c = x
-        v[idx[x]] = c + 1
-        lastbin = bin
-
-    qvalues = pvalues * pi0 * m / v
-    if robust:
-        qvalues /= (1.0 - (1.0 - pvalues) ** m)
-
-    # bound qvalues by 1 and make them monotonic
-    qvalues[idx[m - 1]] = min(qvalues[idx[m - 1]], 1.0)
-    for i in range(m - 2, -1, -1):
-        qvalues[idx[i]] = min(min(qvalues[idx[i]], qvalues[idx[i + 1]]), 1.0)
+    qvalues = computeQValues(pvalues, pi0, robust=robust)
 
     result = FDRResult()
     result.mQValues = qvalues
 
     if fdr_level is not None:
-        result.mPassed = [x <= fdr_level for x in result.mQValues]
+        result.mPassed = (qvalues <= fdr_level).tolist()
     else:
-        result.mPassed = [False for x in result.mQValues]
+        result.mPassed = [False] * len(qvalues)
 
     result.mPValues = pvalues
     result.mPi0 = pi0
@@ -1402,7 +1463,10 @@ def adjustPValues(pvalues, method='fdr', n=None):
     p: numeric vector of p-values (possibly with 'NA's).  Any other
     R is coerced by 'as.numeric'.
 
-    method: correction method. Valid values are:
+    method: correction method. Valid values are "bonferroni", "holm",
+    "hochberg", "BH" (or "fdr"), "BY", "none" and "storey". The
+    latter computes q-values after Storey et al. (2002), see
+    :func:`doFDRPython`.
 
     n: number of comparisons, must be at least 'length(p)'; only set
     this (to non-default) when you know what you are doing
@@ -1417,6 +1481,9 @@ def adjustPValues(pvalues, method='fdr', n=None):
     if method == "fdr":
         method = "BH"
 
+    if method == "storey":
+        return doFDRPython(pvalues).mQValues
+
     # optional, remove NA values
     p = numpy.array(pvalues, dtype=numpy.float)
     lp = len(p)
@@ -4,6 +4,11 @@ VCF.py - Tools for working with VCF files
 
 The parser for VCF files is very simplistic.
 
+Genotype fields are only split when they are accessed. Use
+:meth:`VCFFile.iterBlocks` to process a file in blocks of variants,
+for example to obtain genotype calls as a variants x samples matrix
+or to reorder sample columns.
+
 .. note::
    Another way to access the information in :term:`vcf` formatted
    files is through pysam_.
@@ -15,27 +20,248 @@ Reference
 ---------
 
 '''
+import re
 import sys
+import numpy
+
+
+def _decodeCall(genotype):
+    '''return the number of non-reference alleles in *genotype*.
+
+    Returns -1 if any allele is missing.
+    '''
+    alleles = re.split("[/|]", genotype)
+    if "." in alleles or "" in alleles:
+        return -1
+    return sum([x != "0" for x in alleles])
+
+
+def _getSubfield(field, idx):
+    '''return subfield *idx* of genotype *field* or ``.`` if
+    it is absent.'''
+    parts = field.split(":")
+    if idx < len(parts):
+        return parts[idx]
+    return "."
 
 
 class VCFEntry:
-    """A VCF Entry"""
+    """A VCF Entry
 
-    def __init__(self, data, samples):
+    The genotype fields are kept as the raw fields of the line. They
+    are only split and decoded into the :attr:`genotypes` dictionary
+    when accessed.
+    """
+
+    def __init__(self, data, samples, sample_index=None):
 
         assert len(data) == len(samples) + 9
         self.contig, self.pos, self.id, self.ref, self.alt, self.qual, \
             self.filter, self.info, self.format = \
             data[:9]
 
-        self.genotypes = dict(list(zip(samples, data[9:])))
+        self._fields = data[9:]
+        self._raw = None
+        self._genotypes = None
+        self._index = sample_index
+        self.samples = samples
         self.order = samples
 
+    @classmethod
+    def fromLine(cls, line, samples, sample_index=None):
+        '''build entry from a line without splitting the
+        genotype fields.'''
+        data = line.split("\t", 9)
+        if len(data) != 10:
+            raise ValueError("malformatted vcf line: %s" % line)
+        entry = cls.__new__(cls)
+        entry.contig, entry.pos, entry.id, entry.ref, entry.alt, \
+            entry.qual, entry.filter, entry.info, entry.format = \
+            data[:9]
+        entry._raw = data[9]
+        entry._fields = None
+        entry._genotypes = None
+        entry._index = sample_index
+        entry.samples = samples
+        entry.order = samples
+        return entry
+
+    def getFields(self):
+        '''return the raw genotype fields in the order of the file.'''
+        if self._fields is None:
+            self._fields = self._raw.split("\t")
+            if len(self._fields) != len(self.samples):
+                raise ValueError(
+                    "number of samples do not match: %i != %i" %
+                    (len(self._fields), len(self.samples)))
+        return self._fields
+
+    def getSampleIndex(self):
+        if self._index is None:
+            self._index = dict([(y, x) for x, y in enumerate(self.samples)])
+        return self._index
+
+    def getGenotype(self, sample):
+        '''return the raw genotype field for *sample*.'''
+        if self._genotypes is not None:
+            return self._genotypes[sample]
+        return self.getFields()[self.getSampleIndex()[sample]]
+
+    def getCalls(self):
+        '''return genotype calls as a numpy int8 array.
+
+        See :meth:`VCFBlock.getCalls` for the encoding.
+        '''
+        fields = self.getFields()
+        formats = self.format.split(":")
+        calls = numpy.empty(len(fields), dtype=numpy.int8)
+        if "GT" not in formats:
+            calls.fill(-1)
+            return calls
+        idx = formats.index("GT")
+        cache = {}
+        for x, field in enumerate(fields):
+            genotype = _getSubfield(field, idx)
+            try:
+                calls[x] = cache[genotype]
+            except KeyError:
+                calls[x] = cache[genotype] = _decodeCall(genotype)
+        return calls
+
+    def _getGenotypes(self):
+        if self._genotypes is None:
+            self._genotypes = dict(list(zip(self.samples, self.getFields())))
+        return self._genotypes
+
+    def _setGenotypes(self, genotypes):
+        self._genotypes = genotypes
+
+    genotypes = property(_getGenotypes, _setGenotypes)
+
     def __str__(self):
+        if self._genotypes is not None:
+            fields = "\t".join([self._genotypes[x] for x in self.order])
+        elif self.order is self.samples:
+            if self._raw is not None:
+                fields = self._raw
+            else:
+                fields = "\t".join(self._fields)
+        else:
+            index = self.getSampleIndex()
+            f = self.getFields()
+            fields = "\t".join([f[index[x]] for x in self.order])
+
         return "\t".join(map(str, (
             self.contig, self.pos, self.id, self.ref, self.alt, self.qual,
             self.filter, self.info, self.format,
-            "\t".join([self.genotypes[x] for x in self.order]))))
+            fields)))
+
+
+class VCFBlock:
+    """A block of consecutive entries in a VCF File.
+
+    The block keeps the nine fixed columns of each line and the
+    unsplit genotype fields. Genotype fields are split into a
+    variants x samples matrix of strings (:attr:`fields`) and
+    decoded into a matrix of calls (:meth:`getCalls`) only on
+    demand.
+    """
+
+    def __init__(self, lines, samples):
+
+        self.samples = samples
+        self.data = [x.split("\t", 9) for x in lines]
+        for data in self.data:
+            if len(data) != 10:
+                raise ValueError(
+                    "malformatted vcf line: %s" % "\t".join(data))
+        self._fields = None
+        self._calls = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def getFields(self):
+        '''return genotype fields as a numpy object matrix
+        (variants x samples).'''
+        if self._fields is None:
+            fields = numpy.empty((len(self.data), len(self.samples)),
+                                 dtype=object)
+            for x, data in enumerate(self.data):
+                row = data[9].split("\t")
+                if len(row) != len(self.samples):
+                    raise ValueError(
+                        "number of samples do not match: %i != %i" %
+                        (len(row), len(self.samples)))
+                fields[x] = row
+            self._fields = fields
+        return self._fields
+
+    fields = property(getFields)
+
+    def getCalls(self):
+        '''return genotype calls as an int8 numpy matrix
+        (variants x samples).
+
+        Each call is the number of non-reference alleles in the
+        ``GT`` field, for example 0 for ``0/0``, 1 for ``0|1`` and 2
+        for ``1/1`` or ``1/2``. Missing calls such as ``./.``, as
+        well as variants without a ``GT`` field, are encoded as -1.
+        '''
+        if self._calls is not None:
+            return self._calls
+
+        nvariants, nsamples = len(self.data), len(self.samples)
+        genotypes = numpy.empty((nvariants, nsamples), dtype=object)
+        genotypes.fill(".")
+        rx = re.compile("(?:^|\t)([^\t:]*)")
+        for x, data in enumerate(self.data):
+            formats = data[8].split(":")
+            if "GT" not in formats:
+                continue
+            if formats[0] == "GT" and self._fields is None:
+                row = rx.findall(data[9])
+            else:
+                idx = formats.index("GT")
+                row = [_getSubfield(y, idx) for y in self.getFields()[x]]
+            if len(row) != nsamples:
+                raise ValueError(
+                    "number of samples do not match: %i != %i" %
+                    (len(row), nsamples))
+            genotypes[x] = row
+
+        # decode each distinct genotype string only once
+        keys, inverse = numpy.unique(genotypes.ravel(), return_inverse=True)
+        codes = numpy.array([_decodeCall(x) for x in keys],
+                            dtype=numpy.int8)
+        self._calls = codes[inverse].reshape((nvariants, nsamples))
+        return self._calls
+
+    calls = property(getCalls)
+
+    def permute(self, permutation):
+        '''reorder the sample columns.
+
+        *permutation* is a list of column indices such as returned
+        by :meth:`VCFFile.getPermutation`.
+        '''
+        permutation = numpy.asarray(permutation, dtype=numpy.int64)
+        fields = self.getFields()[:, permutation]
+        for data, row in zip(self.data, fields):
+            data[9] = "\t".join(row)
+        self._fields = fields
+        if self._calls is not None:
+            self._calls = self._calls[:, permutation]
+        self.samples = [self.samples[x] for x in permutation]
+
+    def __iter__(self):
+        '''iterate over :class:`VCFEntry` objects in the block.'''
+        index = dict([(y, x) for x, y in enumerate(self.samples)])
+        for data in self.data:
+            yield VCFEntry.fromLine("\t".join(data), self.samples, index)
+
+    def __str__(self):
+        return "\n".join(["\t".join(x) for x in self.data])
 
 
 class VCFFile:
@@ -61,6 +287,8 @@ class VCFFile:
                 continue
             break
         self.line = line
+        self.sample_index = dict(
+            [(y, x) for x, y in enumerate(self.samples)])
 
     def writeHeader(self, outfile, order=None):
         outfile.write("##fileformat=%s\n" % self.fileformat)
@@ -94,13 +322,48 @@ class VCFFile:
         elif key == "fileformat":
             self.fileformat = value
 
-    def __next__(self):
+    def getPermutation(self, order):
+        '''return column indices that reorder the samples
+        in the file according to *order*.'''
+        if len(order) != len(self.samples):
+            raise ValueError(
+                "number of samples do not match: %i != %i" % (
+                    len(order), len(self.samples)))
+        return [self.sample_index[x] for x in order]
 
-        data = self.line[:-1].split("\t")
-        self.line = self.infile.readline()
+    def nextLine(self):
+        '''return the next data line without the trailing
+        new-line character. Comment lines, such as the footer
+        added by CGAT scripts, are skipped.'''
+        while self.line.startswith("#"):
+            self.line = self.infile.readline()
         if not self.line:
             raise StopIteration
-        return VCFEntry(data, self.samples)
+        line = self.line.rstrip("\n")
+        self.line = self.infile.readline()
+        return line
+
+    def iterBlocks(self, block_size=10000):
+        '''iterate over the file in blocks of at most
+        *block_size* entries.
+
+        Yields :class:`VCFBlock` objects.
+        '''
+        while 1:
+            lines = []
+            try:
+                while len(lines) < block_size:
+                    lines.append(self.nextLine())
+            except StopIteration:
+                if lines:
+                    yield VCFBlock(lines, self.samples)
+                return
+            yield VCFBlock(lines, self.samples)
+
+    def __next__(self):
+        return VCFEntry.fromLine(self.nextLine(),
+                                 self.samples,
+                                 self.sample_index)
 
     def next(self):
         return self.__next__()
@@ -34,8 +34,8 @@ def updateVariants(variants, lcontig, strand, phased=True):
     for variant in variants:
 
         pos = variant.pos
-        genotype = bytes(variant.genotype)
-        reference = bytes(variant.reference)
+        genotype = str(variant.genotype)
+        reference = str(variant.reference)
 
         # fix 1-ness of variants
         # pos -= 1
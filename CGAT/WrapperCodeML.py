@@ -9,6 +9,7 @@ Code
 
 '''
 import sys
+import os
 import string
 import re
 import tempfile
@@ -16,7 +17,11 @@ import subprocess
 import shutil
 import random
 import traceback
+import hashlib
+import pickle
+import multiprocessing
 from types import *
+from six import StringIO
 from CGAT import Experiment as Experiment
 from CGAT import TreeTools as TreeTools
 from CGAT import IOTools as IOTools
@@ -615,9 +620,20 @@ class CodeML:
             tree=None,
             dump=0,
             test=False,
-            options={}):
+            options={},
+            tempdir=None):
+        """run the analysis on *alignment*.
 
-        self.mTempdir = tempfile.mkdtemp()
+        If *tempdir* is given, the analysis is run in this directory
+        instead of a newly created temporary directory. The directory
+        is emptied before the run, but not removed afterwards.
+        """
+
+        if tempdir:
+            self.mTempdir = tempdir
+            clearDirectory(tempdir)
+        else:
+            self.mTempdir = tempfile.mkdtemp()
         self.mFilenameSequences = "input"
         self.mWarnings = []
 
@@ -629,7 +645,7 @@ class CodeML:
         if tree:
 
             # check what kind of tree is given.
-            if type(tree) == StringType:
+            if isinstance(tree, str):
                 t = tree.strip()
                 if t[0] == "(" and t[-1] in ");":
                     nexus = TreeTools.Newick2Nexus(tree)
@@ -668,7 +684,8 @@ class CodeML:
                              stdout=subprocess.PIPE,
                              stderr=subprocess.PIPE,
                              cwd=self.mTempdir,
-                             close_fds=True)
+                             close_fds=True,
+                             universal_newlines=True)
 
         (out, err) = s.communicate()
 
@@ -700,11 +717,133 @@ class CodeML:
             print("# stdout output of %s:\n%s\n######################################" % (
                 self.mExecutable, out))
 
-        if not test:
+        if not test and not tempdir:
             shutil.rmtree(self.mTempdir)
 
         return self.parseOutput(lines, out.split("\n"), rst_lines)
 
+    def getCacheKey(self, alignment, tree=None, options={}):
+        """return a key identifying an analysis.
+
+        The key is a hash of the alignment, the tree and the
+        control file.
+        """
+        h = hashlib.md5()
+        h.update(self.mExecutable.encode("utf-8"))
+
+        outfile = StringIO()
+        alignment.writeToFile(outfile, format="phylip")
+        h.update(outfile.getvalue().encode("utf-8"))
+
+        if tree:
+            if isinstance(tree, str):
+                t = tree.strip()
+                if not (t[0] == "(" and t[-1] in ");"):
+                    with open(tree, "r") as inf:
+                        t = inf.read().strip()
+            else:
+                t = TreeTools.Tree2Newick(tree)
+            h.update(t.encode("utf-8"))
+            filename_tree = "tree"
+        else:
+            filename_tree = None
+
+        outfile = StringIO()
+        self.writeControlFile(outfile,
+                              filename_tree=filename_tree,
+                              options=options)
+        h.update(outfile.getvalue().encode("utf-8"))
+
+        return h.hexdigest()
+
+    def RunBatch(self, jobs,
+                 threads=1,
+                 cache_dir=None,
+                 tempdir=None,
+                 ignore_errors=False):
+        """run a collection of analyses.
+
+        *jobs* is an iterator of tuples (alignment, tree, options)
+        with the arguments to :meth:`Run`. If *threads* is larger
+        than 1, analyses are run in parallel by a pool of worker
+        processes. Each worker runs its analyses in a single scratch
+        directory that is created within *tempdir*.
+
+        If *cache_dir* is given, results are saved in this directory
+        and analyses with a cached result are not run again.
+
+        If *ignore_errors* is set, failed analyses are reported as
+        warnings and return None instead of raising an error.
+
+        This method is a generator yielding tuples (index, result),
+        where index is the position of the job in *jobs*. Results
+        are returned in the order in which they complete.
+        """
+
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        scratch_dir = tempfile.mkdtemp(dir=tempdir)
+
+        def _iterJobs():
+            for index, job in enumerate(jobs):
+                alignment, tree, options = job
+                if cache_dir:
+                    key = self.getCacheKey(alignment, tree, options)
+                    filename = os.path.join(cache_dir, key + ".pickle")
+                    if os.path.exists(filename):
+                        Experiment.debug("job %i: using cached result %s" %
+                                         (index, filename))
+                        with open(filename, "rb") as inf:
+                            cached.append((index, pickle.load(inf)))
+                        continue
+                else:
+                    filename = None
+                yield index, filename, alignment, tree, options
+
+        def _collect(result):
+            index, filename, value, error = result
+            if error is not None:
+                if ignore_errors:
+                    Experiment.warn("job %i failed: %s" % (index, error))
+                else:
+                    raise UsageError("job %i failed: %s" % (index, error))
+            elif filename:
+                # write to temporary file first so that
+                # aborted runs do not leave incomplete files.
+                with open(filename + ".tmp", "wb") as outf:
+                    pickle.dump(value, outf)
+                os.rename(filename + ".tmp", filename)
+            return index, value
+
+        cached = []
+        try:
+            if threads > 1:
+                pool = multiprocessing.Pool(
+                    threads,
+                    initializer=initializeWorker,
+                    initargs=(self, scratch_dir))
+                try:
+                    for result in pool.imap_unordered(runJob, _iterJobs()):
+                        while cached:
+                            yield cached.pop(0)
+                        yield _collect(result)
+                    while cached:
+                        yield cached.pop(0)
+                finally:
+                    pool.terminate()
+                    pool.join()
+            else:
+                initializeWorker(self, scratch_dir)
+                for job in _iterJobs():
+                    while cached:
+                        yield cached.pop(0)
+                    yield _collect(runJob(job))
+                while cached:
+                    yield cached.pop(0)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
     def parseRst(self, inlines, result):
         """parse lines from rst file."""
 
@@ -1120,6 +1259,52 @@ class CodeML:
         return result
 
 
+def clearDirectory(dirname):
+    """remove all files and subdirectories in *dirname*."""
+    for filename in os.listdir(dirname):
+        path = os.path.join(dirname, filename)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+WORKER_STATE = {}
+
+
+def initializeWorker(wrapper, scratch_dir):
+    """initialize a worker process for :meth:`CodeML.RunBatch`.
+
+    Each worker runs its analyses in its own scratch directory
+    within *scratch_dir*.
+    """
+    WORKER_STATE["wrapper"] = wrapper
+    WORKER_STATE["tempdir"] = tempfile.mkdtemp(dir=scratch_dir)
+
+
+def runJob(job):
+    """run a single analysis in a worker process.
+
+    returns a tuple (index, filename, result, error), where error
+    is the error message if the analysis failed. Any exception is
+    caught so that a single failing job does not stop the batch.
+    """
+    index, filename, alignment, tree, options = job
+    wrapper = WORKER_STATE["wrapper"]
+    try:
+        result = wrapper.Run(alignment, tree,
+                             options=options,
+                             tempdir=WORKER_STATE["tempdir"])
+    except Exception as error:
+        return index, filename, None, "%s: %s" % (
+            error.__class__.__name__, str(error))
+
+    for warning in wrapper.mWarnings:
+        Experiment.debug("job %i: PAML warning: %s" % (index, warning))
+
+    return index, filename, result, None
+
+
 class CodeMLSites (CodeML):
 
     def __init__(self):
@@ -1965,7 +2150,7 @@ class Evolver:
 
         if tree:
             # check what kind of tree is given.
-            if type(tree) == StringType:
+            if isinstance(tree, str):
                 t = tree.strip()
                 if t[0] == "(" and t[-1] in ");":
                     self.mTree = t
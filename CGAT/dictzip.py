@@ -271,7 +271,7 @@ class GzipFile:
     def _read_gzip_extra(self):
         xlen = ord(self.fileobj.read(1))
         xlen = xlen + 256 * ord(self.fileobj.read(1))
-        xtra = self.fileobj.read(xlen)
+        xtra = bytearray(self.fileobj.read(xlen))
         xptr = 0
         # loop over subfields
         while xptr < xlen:
@@ -279,25 +279,25 @@ class GzipFile:
                 # ill-formed header: magic word + subfield length required
                 return
             # subfield length
-            sublen = ord(xtra[xptr + 2]) + 256 * ord(xtra[xptr + 3])
+            sublen = xtra[xptr + 2] + 256 * xtra[xptr + 3]
             ptr = xptr
             xptr += sublen + 4
-            if xtra[ptr] != 'R' or xtra[ptr + 1] != 'A':
+            if xtra[ptr:ptr + 2] != b'RA':
                 continue     # magic word for dictzip data is 'R'andom 'A'ccess
-            if xtra[ptr + 4] != '\001' or xtra[ptr + 5] != '\000':
+            if xtra[ptr + 4:ptr + 6] != b'\001\000':
                 raise IOError("Unrecognized DictZip version: " +
-                              str(ord(xtra[ptr + 4]) + 256 * ord(xtra[ptr + 5])))
+                              str(xtra[ptr + 4] + 256 * xtra[ptr + 5]))
             # chunk length
-            chlen = ord(xtra[ptr + 6]) + 256 * ord(xtra[ptr + 7])
+            chlen = xtra[ptr + 6] + 256 * xtra[ptr + 7]
             # chunk count
-            chcnt = ord(xtra[ptr + 8]) + 256 * ord(xtra[ptr + 9])
+            chcnt = xtra[ptr + 8] + 256 * xtra[ptr + 9]
             if chcnt * 2 != sublen - 6:
                 raise IOError("Invalid DictZip header: wrong number of chunks:" +
                               str(chcnt) + " expected " + str((sublen - 6) // 2))
             flushpoints = [0]
             for idx in range(chcnt):
                 flushpoints.append(
-                    flushpoints[-1] + ord(xtra[ptr + 10 + 2 * idx]) + 256 * ord(xtra[ptr + 11 + 2 * idx]))
+                    flushpoints[-1] + xtra[ptr + 10 + 2 * idx] + 256 * xtra[ptr + 11 + 2 * idx])
             # ignore other subfields
             return (chlen, flushpoints)
         if xptr != xlen:
@@ -306,7 +306,7 @@ class GzipFile:
 
     def _read_gzip_header(self):
         magic = self.fileobj.read(2)
-        if magic != '\037\213':
+        if magic != b'\037\213':
             raise IOError('Not a gzipped file')
         method = ord(self.fileobj.read(1))
         if method != 8:
@@ -325,13 +325,13 @@ class GzipFile:
             # Read and discard a null-terminated string containing the filename
             while True:
                 s = self.fileobj.read(1)
-                if not s or s == '\000':
+                if not s or s == b'\000':
                     break
         if flag & FCOMMENT:
             # Read and discard a null-terminated string containing a comment
             while True:
                 s = self.fileobj.read(1)
-                if not s or s == '\000':
+                if not s or s == b'\000':
                     break
         if flag & FHCRC:
             # Read & discard the 16-bit header CRC
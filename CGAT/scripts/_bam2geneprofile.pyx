@@ -680,6 +680,34 @@ class IntervalsCounter:
         for field, l in zip(self.fields, self.lengths):
             outfile.write("%s\t%s\n" % (field, str(Stats.Summary(l))))
 
+    def getState(self):
+        '''return the aggregated counts and book keeping of this counter.
+
+        The state is a tuple that can be pickled and added to an
+        equivalent counter with :meth:`addState`.
+        '''
+        return (self.aggregate_counts,
+                self.counts,
+                self.lengths,
+                self.nskipped)
+
+    def addState(self, state):
+        '''add counts from *state* to this counter.
+
+        *state* has been obtained by :meth:`getState` from a
+        counter with the same segments and normalization. Counts are
+        summed and lengths are appended, so adding states in the order
+        of the input preserves the output of a serial run.
+        '''
+        aggregate_counts, counts, lengths, nskipped = state
+
+        assert len(aggregate_counts) == len(self.aggregate_counts)
+        for x, c in enumerate(aggregate_counts):
+            self.aggregate_counts[x] += c.astype(self.aggregate_counts[x].dtype)
+            self.counts[x] += counts[x]
+            self.lengths[x].extend(lengths[x])
+        self.nskipped += nskipped
+
     def update(self, gtf):
         
         counted = self.count(gtf)
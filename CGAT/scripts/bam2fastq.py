@@ -28,6 +28,33 @@ below will create the same two output files::
 
    cat in.bam cgat bam2fastq --output-filename-pattern=out.%s.fastq.gz
 
+Reads are collated into pairs by read name. The method is chosen with
+the option ``--collate-method``:
+
+``sort``
+   Output is sorted by read name. Reads are collected in memory
+   until ``--buffer-size`` read names are held, at which point the
+   buffer is written to a temporary file sorted by read name. The
+   temporary files are merged at the end.
+
+``buffer``
+   A pair is output as soon as both mates have been seen, so that
+   only reads with pending mates are kept in memory. Mates that are
+   still pending when the buffer is full are written to sorted
+   temporary files and paired up at the end. This is the fastest
+   method for coordinate sorted input, but the output order follows
+   the input order.
+
+``name-sorted``
+   The input is name sorted or collated, i.e. mates are adjacent in
+   the file. Pairs are output directly without buffering.
+
+Missing mates are output as reads consisting of ``N`` with the lowest
+quality score. Secondary and supplementary alignments are not counted
+twice: only the first occurrence of each mate is output.
+
+Output files are compressed in a background thread.
+
 Type::
 
    python bam2fastq.py --help
@@ -41,14 +68,192 @@ Command line options
 
 import os
 import sys
+import heapq
+import itertools
 import tempfile
+import threading
 import shutil
+from six.moves import queue
 import CGAT.Experiment as E
 import CGAT.IOTools as IOTools
 
 import pysam
 
 
+class ThreadedWriter(object):
+    '''write to a file from a background thread.
+
+    Data are collected into chunks that are passed to a thread
+    writing (and compressing) them, so that compression overlaps
+    with parsing of the input.
+    '''
+
+    def __init__(self, filename, chunk_size=10000, max_chunks=8):
+        self.outfile = IOTools.openFile(filename, "w")
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.error = None
+        self.queue = queue.Queue(max_chunks)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            # keep draining the queue after an error so that
+            # the main thread does not block.
+            if self.error is not None:
+                continue
+            try:
+                self.outfile.write(chunk)
+            except Exception as e:
+                self.error = e
+
+    def write(self, data):
+        self.buffer.append(data)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.queue.put("".join(self.buffer))
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.outfile.close()
+        if self.error is not None:
+            raise self.error
+
+
+class FastqOutput(object):
+    '''output reads to fastq files. Files are opened on first use.'''
+
+    def __init__(self, filename1, filename2):
+        self.filenames = (filename1, filename2)
+        self.outfiles = [None, None]
+
+    def write(self, idx, name, seq, qual):
+        outfile = self.outfiles[idx]
+        if outfile is None:
+            outfile = self.outfiles[idx] = ThreadedWriter(self.filenames[idx])
+        outfile.write("@%s\n%s\n+\n%s\n" % (name, seq, qual))
+
+    def close(self):
+        for outfile in self.outfiles:
+            if outfile is not None:
+                outfile.close()
+
+
+class ReadCollator(object):
+    '''collate reads into pairs using a bounded buffer.
+
+    Reads are kept in a dictionary mapping the read name to a list
+    ``[seq1, qual1, seq2, qual2]``. Once the buffer contains
+    *buffer_size* read names, it is written to a temporary file
+    sorted by read name. :meth:`finish` merges the temporary files
+    and the remaining buffer and yields entries sorted by read name.
+
+    If *emit_complete* is set, :meth:`add` returns entries as soon
+    as both mates have been seen and removes them from the buffer.
+    '''
+
+    def __init__(self, tmpdir, buffer_size=1000000, emit_complete=False):
+        self.tmpdir = tmpdir
+        self.buffer_size = buffer_size
+        self.emit_complete = emit_complete
+        self.buffer = {}
+        self.runs = []
+        self.nduplicates = 0
+
+    def add(self, name, mate, seq, qual):
+        '''add a read. *mate* is 0 for the first and 1 for the second
+        read in a pair.'''
+        entry = self.buffer.get(name)
+        if entry is None:
+            entry = self.buffer[name] = [None, None, None, None]
+        elif entry[2 * mate] is not None:
+            self.nduplicates += 1
+            return None
+
+        entry[2 * mate] = seq
+        entry[2 * mate + 1] = qual
+
+        if self.emit_complete and entry[0] is not None and \
+           entry[2] is not None:
+            del self.buffer[name]
+            return entry
+
+        if len(self.buffer) >= self.buffer_size:
+            self.spill()
+
+        return None
+
+    def spill(self):
+        '''write buffer sorted by read name to a temporary file.'''
+        filename = os.path.join(self.tmpdir, "run%i.gz" % len(self.runs))
+        E.debug("writing %i reads to %s" % (len(self.buffer), filename))
+        with IOTools.openFile(filename, "w") as outf:
+            for name, entry in sorted(self.buffer.items()):
+                outf.write("\t".join(
+                    [name] + [x or "" for x in entry]) + "\n")
+        self.runs.append(filename)
+        self.buffer = {}
+
+    def _iterateRun(self, filename, idx):
+        with IOTools.openFile(filename) as inf:
+            for line in inf:
+                data = line[:-1].split("\t")
+                yield data[0], idx, [x or None for x in data[1:]]
+
+    def finish(self):
+        '''yield tuples (name, entry) sorted by read name.'''
+        iterators = [self._iterateRun(x, idx)
+                     for idx, x in enumerate(self.runs)]
+        iterators.append(
+            (name, len(self.runs), entry)
+            for name, entry in sorted(self.buffer.items()))
+        self.buffer = {}
+
+        for name, group in itertools.groupby(
+                heapq.merge(*iterators), key=lambda x: x[0]):
+            entry = next(group)[2]
+            # combine mates spread over several runs
+            for _, _, other in group:
+                for x in (0, 2):
+                    if other[x] is None:
+                        continue
+                    if entry[x] is None:
+                        entry[x], entry[x + 1] = other[x], other[x + 1]
+                    else:
+                        self.nduplicates += 1
+            yield name, entry
+
+    def close(self):
+        for filename in self.runs:
+            os.unlink(filename)
+        self.runs = []
+
+
+def iterateNameSorted(reads, counter):
+    '''yield tuples (name, entry) from reads that are collated by name.'''
+    for name, group in itertools.groupby(reads, key=lambda x: x.query_name):
+        entry = [None, None, None, None]
+        for read in group:
+            mate = int(read.is_paired and read.is_read2)
+            if entry[2 * mate] is not None:
+                counter.duplicates += 1
+                continue
+            entry[2 * mate] = read.query_sequence
+            entry[2 * mate + 1] = read.qual
+        yield name, entry
+
+
 def main(argv=None):
     """script main.
 
@@ -62,7 +267,20 @@ def main(argv=None):
     parser = E.OptionParser(version="%prog version: $Id$",
                             usage=globals()["__doc__"])
 
+    parser.add_option(
+        "--collate-method", dest="collate_method", type="choice",
+        choices=("sort", "buffer", "name-sorted"),
+        help="method to collate reads into pairs. See the "
+        "documentation for details [default=%default].")
+
+    parser.add_option(
+        "--buffer-size", dest="buffer_size", type="int",
+        help="number of read names to keep in memory before writing "
+        "to a temporary file [default=%default].")
+
     parser.set_defaults(
+        collate_method="sort",
+        buffer_size=1000000,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -89,83 +307,91 @@ def main(argv=None):
     else:
         samfile = pysam.AlignmentFile("-", "rb")
 
-    tmpdir = tempfile.mkdtemp()
+    c = E.Counter()
+    outputs = FastqOutput(fastqfile1, fastqfile2)
+    qlens = [0, 0]
+
+    def writeEntry(name, entry, paired):
+        for mate in (0, 1):
+            seq, qual = entry[2 * mate], entry[2 * mate + 1]
+            if seq is not None:
+                outputs.write(mate, name, seq, qual)
+            elif paired:
+                # missing mate, use length of first read seen
+                # or the length of the other mate
+                qlen = qlens[mate] or len(entry[2 * (1 - mate)])
+                outputs.write(mate, name, "N" * qlen, "B" * qlen)
+                if mate == 0:
+                    c.extra1 += 1
+                else:
+                    c.extra2 += 1
+
+    reads = samfile.fetch(until_eof=True)
+
+    if options.collate_method == "name-sorted":
+        def _count(reads):
+            for read in reads:
+                c.input += 1
+                if not read.is_paired:
+                    c.unpaired += 1
+                elif read.is_read1:
+                    c.output1 += 1
+                    qlens[0] = qlens[0] or read.qlen
+                elif read.is_read2:
+                    c.output2 += 1
+                    qlens[1] = qlens[1] or read.qlen
+                yield read
+
+        for name, entry in iterateNameSorted(_count(reads), c):
+            writeEntry(name, entry, c.output1 > 0 or c.output2 > 0)
+
+    else:
+        tmpdir = tempfile.mkdtemp()
+        E.info('writing temporary files to %s' % tmpdir)
+        collator = ReadCollator(
+            tmpdir,
+            buffer_size=options.buffer_size,
+            emit_complete=options.collate_method == "buffer")
+
+        for read in reads:
+            c.input += 1
+            if not read.is_paired:
+                mate = 0
+                c.unpaired += 1
+            elif read.is_read1:
+                mate = 0
+                c.output1 += 1
+            elif read.is_read2:
+                mate = 1
+                c.output2 += 1
+            else:
+                continue
 
-    outtemp1 = os.path.join(tmpdir, "pair1.gz")
-    outtemp2 = os.path.join(tmpdir, "pair2.gz")
+            if not qlens[mate]:
+                qlens[mate] = read.qlen
 
-    outstream1 = IOTools.openFile(outtemp1, "w")
-    outstream2 = IOTools.openFile(outtemp2, "w")
+            entry = collator.add(read.query_name, mate,
+                                 read.query_sequence, read.qual)
+            if entry is not None:
+                writeEntry(read.query_name, entry, True)
 
-    E.info('writing fastq files to temporary directory %s' % tmpdir)
+        paired = c.output1 > 0 or c.output2 > 0
+        E.info("merging %i temporary files" % len(collator.runs))
+        for name, entry in collator.finish():
+            writeEntry(name, entry, paired)
 
-    found1, found2 = set(), set()
-    read1_qlen, read2_qlen = 0, 0
+        c.duplicates = collator.nduplicates
+        c.runs = len(collator.runs)
+        collator.close()
+        shutil.rmtree(tmpdir)
 
-    c = E.Counter()
-    for read in samfile.fetch(until_eof=True):
-        c.input += 1
-        if not read.is_paired:
-            outstream1.write(
-                "\t".join((read.qname, read.seq, read.qual)) + "\n")
-            found1.add(read.qname)
-            if not read1_qlen:
-                read1_qlen = read.qlen
-            c.unpaired += 1
-        elif read.is_read1:
-            outstream1.write(
-                "\t".join((read.qname, read.seq, read.qual)) + "\n")
-            found1.add(read.qname)
-            if not read1_qlen:
-                read1_qlen = read.qlen
-            c.output1 += 1
-        elif read.is_read2:
-            if read.qname not in found2:
-                outstream2.write(
-                    "\t".join((read.qname, read.seq, read.qual)) + "\n")
-                found2.add(read.qname)
-                if not read2_qlen:
-                    read2_qlen = read.qlen
-                c.output2 += 1
+    outputs.close()
 
     if c.unpaired == 0 and c.output1 == 0 and c.output2 == 0:
         E.warn("no reads were found")
         return
 
-    sort_statement = '''zcat %s
-    | sort -k1,1
-    | awk '{printf("@%%s\\n%%s\\n+\\n%%s\\n", $1,$2,$3)}'
-    | gzip > %s'''
-
-    if c.output1 == 0 and c.output2 == 0:
-        # single end data:
-        outstream1.close()
-        outstream2.close()
-        E.info("sorting fastq files")
-        E.run(sort_statement % (outtemp1, fastqfile1))
-
-    else:
-        # paired end data
-        for qname in found2.difference(found1):
-            outstream1.write(
-                "\t".join((qname, "N" * read1_qlen, "B" * read1_qlen)) + "\n")
-            c.extra1 += 1
-
-        for qname in found1.difference(found2):
-            outstream2.write(
-                "\t".join((qname, "N" * read2_qlen, "B" * read2_qlen)) + "\n")
-            c.extra2 += 1
-
-        E.info("%s" % str(c))
-
-        outstream1.close()
-        outstream2.close()
-
-        E.info("sorting fastq files")
-        E.run(sort_statement % (outtemp1, fastqfile1))
-        E.run(sort_statement % (outtemp2, fastqfile2))
-
-    shutil.rmtree(tmpdir)
+    E.info("%s" % str(c))
 
     # write footer and output benchmark information.
     E.Stop()
@@ -277,6 +277,17 @@ Control
 If control files (chip-seq input tracks) are supplied, counts in the
 control file can be used to compute a fold-change.
 
+Parallel counting
++++++++++++++++++
+
+With ``--threads``, transcripts are partitioned into chunks of
+``--chunk-size`` transcripts that are counted in separate
+processes. Each process opens its own copy of the input files and
+aggregates counts into its own meta-gene profiles. These are summed in
+the order of the input, so that the output is the same as in a serial
+run (up to floating point rounding if transcript normalization is
+applied).
+
 Bed and wiggle files
 ++++++++++++++++++++
 
@@ -297,6 +308,9 @@ Command line options
 
 import os
 import sys
+import optparse
+import multiprocessing
+from six import StringIO
 import CGAT.Experiment as E
 import CGAT.IOTools as IOTools
 import pysam
@@ -313,6 +327,277 @@ except ImportError:
 import CGAT.scripts._bam2geneprofile as _bam2geneprofile
 
 
+def buildRangeCounter(options):
+    '''build a range counter for the files in *options.infiles*.
+
+    The type of counter is selected based on the file type and
+    the counting options.
+    '''
+
+    # Select rangecounter based on file type
+    if len(options.infiles) > 0:
+        if options.infiles[0].endswith(".bam"):
+            bamfiles = [pysam.AlignmentFile(x, "rb") for x in options.infiles]
+
+            if options.controlfiles:
+                controlfiles = [pysam.AlignmentFile(x, "rb")
+                                for x in options.controlfiles]
+            else:
+                controlfiles = None
+
+            format = "bam"
+            if options.merge_pairs:
+                range_counter = _bam2geneprofile.RangeCounterBAM(
+                    bamfiles,
+                    shifts=options.shifts,
+                    extends=options.extends,
+                    merge_pairs=options.merge_pairs,
+                    min_insert_size=options.min_insert_size,
+                    max_insert_size=options.max_insert_size,
+                    controfiles=controlfiles,
+                    control_factor=options.control_factor)
+
+            elif options.shifts or options.extends:
+                range_counter = _bam2geneprofile.RangeCounterBAM(
+                    bamfiles,
+                    shifts=options.shifts,
+                    extends=options.extends,
+                    controlfiles=controlfiles,
+                    control_factor=options.control_factor)
+
+            elif options.base_accuracy:
+                range_counter = _bam2geneprofile.RangeCounterBAMBaseAccuracy(
+                    bamfiles,
+                    controlfiles=controlfiles,
+                    control_factor=options.control_factor)
+            else:
+                range_counter = _bam2geneprofile.RangeCounterBAM(
+                    bamfiles,
+                    controlfiles=controlfiles,
+                    control_factor=options.control_factor)
+
+        elif options.infiles[0].endswith(".bed.gz"):
+            bedfiles = [pysam.Tabixfile(x) for x in options.infiles]
+
+            if options.controlfiles:
+                controlfiles = [pysam.Tabixfile(x)
+                                for x in options.controlfiles]
+            else:
+                controlfiles = None
+
+            range_counter = _bam2geneprofile.RangeCounterBed(
+                bedfiles,
+                controlfiles=controlfiles,
+                control_factor=options.control_factor)
+
+        elif options.infiles[0].endswith(".bw"):
+            wigfiles = [BigWigFile(file=open(x)) for x in options.infiles]
+            range_counter = _bam2geneprofile.RangeCounterBigWig(wigfiles)
+
+        else:
+            raise NotImplementedError(
+                "can't determine file type for %s" % str(options.infiles))
+
+    return range_counter
+
+
+def buildCounters(options, range_counter):
+    '''build a meta-gene counter for each method in *options.methods*
+    using *range_counter* to collect counts.
+    '''
+
+    counters = []
+    for method in options.methods:
+        if method == "utrprofile":
+            counters.append(_bam2geneprofile.UTRCounter(
+                range_counter,
+                options.resolution_upstream,
+                options.resolution_upstream_utr,
+                options.resolution_cds,
+                options.resolution_downstream_utr,
+                options.resolution_downstream,
+                options.extension_upstream,
+                options.extension_downstream,
+            ))
+
+        elif method == "geneprofile":
+            counters.append(_bam2geneprofile.GeneCounter(
+                range_counter,
+                options.resolution_upstream,
+                options.resolution_cds,
+                options.resolution_downstream,
+                options.extension_upstream,
+                options.extension_downstream,
+                options.scale_flanks))
+
+        elif method == "geneprofilewithintrons":
+            counters.append(_bam2geneprofile.GeneCounterWithIntrons(
+                range_counter,
+                options.resolution_upstream,
+                options.resolution_cds,
+                options.resolution_introns,
+                options.resolution_downstream,
+                options.extension_upstream,
+                options.extension_downstream,
+                options.scale_flanks))
+
+        elif method == "geneprofileabsolutedistancefromthreeprimeend":
+            # options.extension_exons_absolute_distance_tostartsite,
+            # options.extension_introns_absolute_distance_tostartsite,
+            # Tim 31th Aug 2013: a possible feature for future,  if five prime
+            # bias is of your interest.
+            # (you need to create another class). It is not very difficult to
+            # derive from this class, but is not implemented yet
+            # This future feature is slightly different the TSS profile
+            # already implemented, because in this future feature introns are
+            # skipped,
+            counters.append(
+                _bam2geneprofile.GeneCounterAbsoluteDistanceFromThreePrimeEnd(
+                    range_counter, options.resolution_upstream,
+                    options.resolution_downstream,
+                    options.resolution_exons_absolute_distance_topolya,
+                    options.resolution_introns_absolute_distance_topolya,
+                    options.extension_upstream,
+                    options.extension_downstream,
+                    options.extension_exons_absolute_distance_topolya,
+                    options.extension_introns_absolute_distance_topolya,
+                    options.scale_flanks))
+
+        elif method == "tssprofile":
+            counters.append(_bam2geneprofile.TSSCounter(
+                range_counter,
+                options.extension_outward,
+                options.extension_inward))
+
+        elif method == "intervalprofile":
+            counters.append(_bam2geneprofile.RegionCounter(
+                range_counter,
+                options.resolution_upstream,
+                options.resolution_cds,
+                options.resolution_downstream,
+                options.extension_upstream,
+                options.extension_downstream))
+
+        elif method == "midpointprofile":
+            counters.append(_bam2geneprofile.MidpointCounter(
+                range_counter,
+                options.resolution_upstream,
+                options.resolution_downstream,
+                options.extension_upstream,
+                options.extension_downstream))
+
+        # add new method to split 1st and last exons out
+        # requires a representative transcript for reach gene
+        # gtf should be sorted gene-position
+        elif method == "separateexonprofile":
+            counters.append(_bam2geneprofile.SeparateExonCounter(
+                range_counter,
+                options.resolution_upstream,
+                options.resolution_first,
+                options.resolution_last,
+                options.resolution_cds,
+                options.resolution_downstream,
+                options.extension_upstream,
+                options.extension_downstream))
+
+        elif method == "separateexonprofilewithintrons":
+            counters.append(_bam2geneprofile.SeparateExonWithIntronCounter(
+                range_counter,
+                options.resolution_upstream,
+                options.resolution_first,
+                options.resolution_last,
+                options.resolution_cds,
+                options.resolution_introns,
+                options.resolution_downstream,
+                options.extension_upstream,
+                options.extension_downstream))
+
+    return counters
+
+
+# per-process state in multi-process mode
+WORKER_STATE = {}
+
+
+def initializeWorker(options):
+    '''open the input files in a worker process.'''
+    WORKER_STATE["options"] = options
+    WORKER_STATE["range_counter"] = buildRangeCounter(options)
+
+
+def countChunk(chunk):
+    '''count transcripts in *chunk* with a fresh set of counters.
+
+    Returns a list with the state of each counter and its
+    per-transcript profiles (or None if not requested).
+    '''
+    options = WORKER_STATE["options"]
+    counters = buildCounters(options, WORKER_STATE["range_counter"])
+
+    for counter in counters:
+        counter.setNormalization(options.transcript_normalization)
+        if options.output_all_profiles:
+            counter.outfile_profiles = StringIO()
+
+    _bam2geneprofile.countFromGTF(counters, chunk)
+
+    result = []
+    for counter in counters:
+        if options.output_all_profiles:
+            profiles = counter.outfile_profiles.getvalue()
+        else:
+            profiles = None
+        result.append((counter.getState(), profiles))
+    return result
+
+
+def countFromGTFParallel(counters, gtf_iterator, options):
+    '''compute counts using counters for transcripts in gtf_iterator
+    with *options.threads* processes.
+
+    Transcripts are partitioned into chunks of *options.chunk_size*
+    transcripts. Each chunk is counted by a worker with its own
+    counters and the results are added to *counters* in input
+    order.
+    '''
+
+    def iterate_chunks():
+        chunk = []
+        for gtf in gtf_iterator:
+            # pysam proxy objects can not be pickled, pass plain
+            # GTF entries on to the workers
+            chunk.append([GTF.Entry().fromGTF(x) for x in gtf])
+            if len(chunk) == options.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    # open file handles can not be passed on to the workers
+    worker_options = optparse.Values(
+        dict([(key, value) for key, value in list(vars(options).items())
+              if not hasattr(value, "read") and
+              not hasattr(value, "write")]))
+
+    E.info("starting counting with %i processes" % options.threads)
+    pool = multiprocessing.Pool(options.threads,
+                                initializer=initializeWorker,
+                                initargs=(worker_options,))
+
+    for nchunk, result in enumerate(
+            pool.imap(countChunk, iterate_chunks())):
+        for counter, state_profiles in zip(counters, result):
+            state, profiles = state_profiles
+            counter.addState(state)
+            if profiles:
+                counter.outfile_profiles.write(profiles)
+        E.debug("chunk %i: counts=%s" %
+                (nchunk, ",".join(map(str, counters))))
+
+    pool.close()
+    pool.join()
+
+
 def main(argv=None):
     """script main.
 
@@ -536,6 +821,19 @@ def main(argv=None):
         "to be considered for background meta-gene normalization "
         "[%default]")
 
+    parser.add_option(
+        "--threads", dest="threads", type="int",
+        help="number of processes to use for counting. Transcripts "
+        "are partitioned into chunks that are counted in parallel "
+        "and the meta-gene profiles are summed "
+        "[%default]")
+
+    parser.add_option(
+        "--chunk-size", dest="chunk_size", type="int",
+        help="number of transcripts per chunk when counting "
+        "with multiple processes "
+        "[%default]")
+
     parser.set_defaults(
         remove_rna=False,
         ignore_pairs=False,
@@ -585,6 +883,8 @@ def main(argv=None):
         output_all_profiles=False,
         background_region_bins=10,
         input_filename_counts=None,
+        threads=1,
+        chunk_size=1000,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -623,175 +923,8 @@ def main(argv=None):
     elif options.reporter == "transcript":
         gtf_iterator = GTF.transcript_iterator(GTF.iterator(options.gtffile))
 
-    # Select rangecounter based on file type
-    if len(options.infiles) > 0:
-        if options.infiles[0].endswith(".bam"):
-            bamfiles = [pysam.AlignmentFile(x, "rb") for x in options.infiles]
-
-            if options.controlfiles:
-                controlfiles = [pysam.AlignmentFile(x, "rb")
-                                for x in options.controlfiles]
-            else:
-                controlfiles = None
-
-            format = "bam"
-            if options.merge_pairs:
-                range_counter = _bam2geneprofile.RangeCounterBAM(
-                    bamfiles,
-                    shifts=options.shifts,
-                    extends=options.extends,
-                    merge_pairs=options.merge_pairs,
-                    min_insert_size=options.min_insert_size,
-                    max_insert_size=options.max_insert_size,
-                    controfiles=controlfiles,
-                    control_factor=options.control_factor)
-
-            elif options.shifts or options.extends:
-                range_counter = _bam2geneprofile.RangeCounterBAM(
-                    bamfiles,
-                    shifts=options.shifts,
-                    extends=options.extends,
-                    controlfiles=controlfiles,
-                    control_factor=options.control_factor)
-
-            elif options.base_accuracy:
-                range_counter = _bam2geneprofile.RangeCounterBAMBaseAccuracy(
-                    bamfiles,
-                    controlfiles=controlfiles,
-                    control_factor=options.control_factor)
-            else:
-                range_counter = _bam2geneprofile.RangeCounterBAM(
-                    bamfiles,
-                    controlfiles=controlfiles,
-                    control_factor=options.control_factor)
-
-        elif options.infiles[0].endswith(".bed.gz"):
-            bedfiles = [pysam.Tabixfile(x) for x in options.infiles]
-
-            if options.controlfiles:
-                controlfiles = [pysam.Tabixfile(x)
-                                for x in options.controlfiles]
-            else:
-                controlfiles = None
-
-            range_counter = _bam2geneprofile.RangeCounterBed(
-                bedfiles,
-                controlfiles=controlfiles,
-                control_factor=options.control_factor)
-
-        elif options.infiles[0].endswith(".bw"):
-            wigfiles = [BigWigFile(file=open(x)) for x in options.infiles]
-            range_counter = _bam2geneprofile.RangeCounterBigWig(wigfiles)
-
-        else:
-            raise NotImplementedError(
-                "can't determine file type for %s" % str(options.infiles))
-
-    counters = []
-    for method in options.methods:
-        if method == "utrprofile":
-            counters.append(_bam2geneprofile.UTRCounter(
-                range_counter,
-                options.resolution_upstream,
-                options.resolution_upstream_utr,
-                options.resolution_cds,
-                options.resolution_downstream_utr,
-                options.resolution_downstream,
-                options.extension_upstream,
-                options.extension_downstream,
-            ))
-
-        elif method == "geneprofile":
-            counters.append(_bam2geneprofile.GeneCounter(
-                range_counter,
-                options.resolution_upstream,
-                options.resolution_cds,
-                options.resolution_downstream,
-                options.extension_upstream,
-                options.extension_downstream,
-                options.scale_flanks))
-
-        elif method == "geneprofilewithintrons":
-            counters.append(_bam2geneprofile.GeneCounterWithIntrons(
-                range_counter,
-                options.resolution_upstream,
-                options.resolution_cds,
-                options.resolution_introns,
-                options.resolution_downstream,
-                options.extension_upstream,
-                options.extension_downstream,
-                options.scale_flanks))
-
-        elif method == "geneprofileabsolutedistancefromthreeprimeend":
-            # options.extension_exons_absolute_distance_tostartsite,
-            # options.extension_introns_absolute_distance_tostartsite,
-            # Tim 31th Aug 2013: a possible feature for future,  if five prime
-            # bias is of your interest.
-            # (you need to create another class). It is not very difficult to
-            # derive from this class, but is not implemented yet
-            # This future feature is slightly different the TSS profile
-            # already implemented, because in this future feature introns are
-            # skipped,
-            counters.append(
-                _bam2geneprofile.GeneCounterAbsoluteDistanceFromThreePrimeEnd(
-                    range_counter, options.resolution_upstream,
-                    options.resolution_downstream,
-                    options.resolution_exons_absolute_distance_topolya,
-                    options.resolution_introns_absolute_distance_topolya,
-                    options.extension_upstream,
-                    options.extension_downstream,
-                    options.extension_exons_absolute_distance_topolya,
-                    options.extension_introns_absolute_distance_topolya,
-                    options.scale_flanks))
-
-        elif method == "tssprofile":
-            counters.append(_bam2geneprofile.TSSCounter(
-                range_counter,
-                options.extension_outward,
-                options.extension_inward))
-
-        elif method == "intervalprofile":
-            counters.append(_bam2geneprofile.RegionCounter(
-                range_counter,
-                options.resolution_upstream,
-                options.resolution_cds,
-                options.resolution_downstream,
-                options.extension_upstream,
-                options.extension_downstream))
-
-        elif method == "midpointprofile":
-            counters.append(_bam2geneprofile.MidpointCounter(
-                range_counter,
-                options.resolution_upstream,
-                options.resolution_downstream,
-                options.extension_upstream,
-                options.extension_downstream))
-
-        # add new method to split 1st and last exons out
-        # requires a representative transcript for reach gene
-        # gtf should be sorted gene-position
-        elif method == "separateexonprofile":
-            counters.append(_bam2geneprofile.SeparateExonCounter(
-                range_counter,
-                options.resolution_upstream,
-                options.resolution_first,
-                options.resolution_last,
-                options.resolution_cds,
-                options.resolution_downstream,
-                options.extension_upstream,
-                options.extension_downstream))
-
-        elif method == "separateexonprofilewithintrons":
-            counters.append(_bam2geneprofile.SeparateExonWithIntronCounter(
-                range_counter,
-                options.resolution_upstream,
-                options.resolution_first,
-                options.resolution_last,
-                options.resolution_cds,
-                options.resolution_introns,
-                options.resolution_downstream,
-                options.extension_upstream,
-                options.extension_downstream))
+    range_counter = buildRangeCounter(options)
+    counters = buildCounters(options, range_counter)
 
     # set normalization
     for c in counters:
@@ -817,8 +950,12 @@ def main(argv=None):
 
     else:
         E.info("starting counting with %i counters" % len(counters))
-        feature_names = _bam2geneprofile.countFromGTF(counters,
-                                                      gtf_iterator)
+        if options.threads > 1:
+            # compute the control factor once for all workers
+            options.control_factor = range_counter.control_factor
+            countFromGTFParallel(counters, gtf_iterator, options)
+        else:
+            _bam2geneprofile.countFromGTF(counters, gtf_iterator)
 
     # output matrices
     if not options.profile_normalizations:
@@ -64,7 +64,7 @@ def main(argv=None):
                       "sequences from.")
 
     parser.add_option("-m", "--masker", dest="masker", type="choice",
-                      choices=("dust", "dustmasker", "softmask", "none"),
+                      choices=("dust", "dustmasker", "pydust", "softmask", "none"),
                       help="apply masker to mask output sequences "
                       "[%default].")
 
@@ -10,6 +10,10 @@ Purpose
 This script ouputs a list of the names of all overlapping intervals 
 between two bed files.
 
+If both files are sorted by contig and start (``sort -k1,1 -k2,2n``),
+they are compared in a single pass without building an index in
+memory.
+
 Usage
 -----
 
@@ -28,6 +32,15 @@ import sys
 import CGAT.Experiment as E
 import CGAT.IOTools as IOTools
 import CGAT.Bed as Bed
+import CGAT.Intervals as Intervals
+
+
+def isSorted(filename):
+    '''return True if bed file *filename* is sorted by contig and start.'''
+    infile = IOTools.openFile(filename, "r")
+    is_sorted = Intervals.isSorted(Bed.iterator(infile))
+    infile.close()
+    return is_sorted
 
 
 def main(argv=None):
@@ -64,8 +77,6 @@ def main(argv=None):
 
     infile2 = IOTools.openFile(args[1], "r")
 
-    idx = Bed.readAndIndex(infile2, with_values=True)
-
     output = options.output
     outfile = options.stdout
 
@@ -75,15 +86,24 @@ def main(argv=None):
     else:
         outf = str
 
-    for bed in Bed.iterator(infile1):
-        try:
-            overlaps = idx[bed.contig].find(bed.start, bed.end)
-        except (KeyError, IndexError):
-            # ignore missing contig and zero length intervals
-            continue
+    if args[0] != "-" and isSorted(args[0]) and isSorted(args[1]):
+        E.info("input is sorted, comparing in a single pass")
+        for bed, overlaps in Intervals.iterator_overlapping(
+                Bed.iterator(infile1), Bed.iterator(infile2)):
+            for o in overlaps:
+                outfile.write("\t".join((outf(bed), outf(o))) + "\n")
+    else:
+        idx = Bed.readAndIndex(infile2, with_values=True)
+
+        for bed in Bed.iterator(infile1):
+            try:
+                overlaps = idx[bed.contig].find(bed.start, bed.end)
+            except (KeyError, IndexError):
+                # ignore missing contig and zero length intervals
+                continue
 
-        for o in overlaps:
-            outfile.write("\t".join((outf(bed), outf(o[2]))) + "\n")
+            for o in overlaps:
+                outfile.write("\t".join((outf(bed), outf(o[2]))) + "\n")
 
     E.Stop()
 
@@ -23,6 +23,9 @@ the ``--aggregate-by`` command line option:
 Note that a count of bases usually makes only sense if the intervals
 submitted are non-overlapping.
 
+Unless counts are aggregated by track, the intervals are loaded into
+numpy arrays (see :func:`Bed.readArrays`) and counted in bulk.
+
 If the option --add-percent is given, an additional column will output
 the percent of the genome covered by intervals. This requires a
 --genome-file to be given as well.
@@ -68,6 +71,7 @@ Command line options
 '''
 import sys
 import collections
+import numpy
 import CGAT.Bed as Bed
 import CGAT.Experiment as E
 import CGAT.IndexedFasta as IndexedFasta
@@ -90,6 +94,10 @@ class Counter:
         self.intervals_per_contig[bed.contig] += 1
         self.bases_per_contig[bed.contig] += bed.end - bed.start
 
+    def addCounts(self, contig, nintervals, nbases):
+        self.intervals_per_contig[contig] += nintervals
+        self.bases_per_contig[contig] += nbases
+
     def __str__(self):
         bases = sum(self.bases_per_contig.values())
         if self.size is None:
@@ -153,18 +161,40 @@ def main(argv=None):
     output_totals = True
 
     if options.aggregate == "track":
-        keyf = lambda x: x.track
-    elif options.aggregate == "name":
-        keyf = lambda x: x.name
-    elif options.aggregate == "contig":
-        keyf = lambda x: x.contig
+        for bed in Bed.iterator(options.stdin):
+            counts[bed.track].add(bed)
+            total.add(bed)
     else:
-        keyf = lambda x: "all"
-        output_totals = False
-
-    for bed in Bed.iterator(options.stdin):
-        counts[keyf(bed)].add(bed)
-        total.add(bed)
+        arrays = Bed.readArrays(options.stdin)
+        contig_codes = arrays.contig_codes
+        lengths = arrays.getLengths()
+
+        if options.aggregate == "name":
+            _, first, key_codes = numpy.unique(
+                arrays.names.astype(str),
+                return_index=True, return_inverse=True)
+            keys = arrays.names[first].tolist()
+        elif options.aggregate == "contig":
+            keys, key_codes = arrays.contigs, contig_codes
+        else:
+            keys, key_codes = ["all"], numpy.zeros(len(arrays), dtype=int)
+            output_totals = False
+
+        # count intervals and bases for each (key, contig) combination
+        ncontigs = len(arrays.contigs)
+        pairs, pair_codes = numpy.unique(
+            key_codes.astype(numpy.int64) * ncontigs + contig_codes,
+            return_inverse=True)
+        nintervals = numpy.bincount(pair_codes)
+        nbases = numpy.bincount(pair_codes, weights=lengths)
+
+        for pair, nint, nbase in zip(pairs.tolist(),
+                                     nintervals.tolist(),
+                                     nbases.tolist()):
+            key, contig = divmod(pair, ncontigs)
+            contig = arrays.contigs[contig]
+            counts[keys[key]].addCounts(contig, nint, int(nbase))
+            total.addCounts(contig, nint, int(nbase))
 
     outf = options.stdout
 
@@ -12,7 +12,6 @@ single one.
 .. todo::
 
    * Rename to tables2table.py
-   * Use pandas dataframes for fast IO and merging/joining
 
 Usage
 -----
@@ -21,6 +20,16 @@ The option ``--header-names`` sets the column titles explicitely. Add
 ``--skip-titles`` if you want to avoid echoing the original title in
 the input files.
 
+When joining, only the key columns and the columns to take are kept
+in memory. Keys are numbered in the order they are first seen and the
+values of each table are stored as numpy arrays. The joined table is
+assembled and written in blocks of rows.
+
+If all input tables are sorted by the join key, the option
+``--sorted-input`` joins the tables with a merge of the sorted tables.
+Only the current row of each table is kept in memory. The output is
+sorted by key.
+
 
 Example::
 
@@ -40,44 +49,201 @@ import sys
 import re
 import os
 import glob
+import heapq
+import itertools
 import collections
+import numpy
 
 import CGAT.IOTools as IOTools
 import CGAT.Experiment as E
 
 
-def readTable(filename, options):
-    '''read table and filter.
+def iterateTable(filename, options):
+    '''iterate over lines in a table.
+
+    Comments and empty lines are skipped. If the options
+    ``regex_start`` or ``regex_end`` are given, only the lines
+    between the matching lines are returned.
     '''
 
-    if os.path.exists(filename):
-        lines = IOTools.openFile(filename, "r").readlines()
-    else:
-        lines = []
+    if not os.path.exists(filename):
+        return
 
-    # extract table by regular expression
     if options.regex_start:
-        rx = re.compile(options.regex_start)
-        for n, line in enumerate(lines):
-            if rx.search(line):
-                E.info("reading table from line %i/%i" % (n, len(lines)))
-                lines = lines[n:]
-                break
-        else:
-            E.info("start regex not found - no table")
-            lines = []
+        rx_start = re.compile(options.regex_start)
+    else:
+        rx_start = None
 
     if options.regex_end:
-        rx = re.compile(options.regex_end)
-        for n, line in enumerate(lines):
-            if rx.search(line):
+        rx_end = re.compile(options.regex_end)
+    else:
+        rx_end = None
+
+    with IOTools.openFile(filename, "r") as inf:
+        if rx_start:
+            for n, line in enumerate(inf):
+                if rx_start.search(line):
+                    E.info("reading table from line %i" % n)
+                    inf = itertools.chain([line], inf)
+                    break
+            else:
+                E.info("start regex not found - no table")
+                return
+
+        for line in inf:
+            if rx_end and rx_end.search(line):
                 break
-        lines = lines[:n]
+            # remove comments and empty lines
+            if line.startswith("#") or not line.strip():
+                continue
+            yield line
+
+
+def readTable(filename, options):
+    '''read table and filter.
+    '''
+    return list(iterateTable(filename, options))
+
+
+def iterateRows(lines, filename, take, options):
+    '''iterate over rows in *lines* yielding tuples of
+    (key, values).
+
+    Only the key columns and the columns in *take* are extracted.
+    If *take* is None, all columns apart from the key columns are
+    returned.
+    '''
+    columns = options.columns
+    if not take:
+        skip = set(columns)
+    for n, line in enumerate(lines):
+        data = line[:-1].split("\t")
+        try:
+            row_keys = [data[x] for x in columns]
+        except IndexError as msg:
+            raise IndexError(
+                "error while parsing %s: %s" % (filename, msg))
+        if options.sort_keys:
+            if options.sort_keys == "numeric":
+                row_keys.sort(key=float)
+            else:
+                row_keys.sort()
+        if options.merge:
+            key = n
+        else:
+            key = "-".join(row_keys)
 
-    # remove comments and empty lines
-    lines = [x for x in lines if not x.startswith("#") and x.strip()]
+        if take:
+            yield key, [data[x] for x in take]
+        else:
+            yield key, [data[x] for x in range(len(data)) if x not in skip]
 
-    return lines
+
+def readIndexedTable(rows, key_index, sorted_keys, max_size,
+                     missing_value):
+    '''read all rows of a table into numpy arrays.
+
+    Keys are converted to integers through the dictionary
+    *key_index*. New keys are added to *key_index* and appended to
+    *sorted_keys*. If a key appears multiple times, the last row is
+    kept.
+
+    Returns a tuple (max_size, (indices, columns)). *indices* is a
+    sorted array of key indices and *columns* a list of arrays with
+    the values for these keys. Short rows are padded with
+    *missing_value*.
+    '''
+    indices, values = [], []
+    for key, fields in rows:
+        try:
+            idx = key_index[key]
+        except KeyError:
+            idx = key_index[key] = len(sorted_keys)
+            sorted_keys.append(key)
+        indices.append(idx)
+        values.append(fields)
+        max_size = max(max_size, len(fields))
+
+    if not indices:
+        return max_size, (numpy.zeros(0, dtype=numpy.int64), [])
+
+    indices = numpy.array(indices, dtype=numpy.int64)
+    # stable sort by key index, keep last row for duplicate keys
+    order = numpy.argsort(indices, kind="mergesort")
+    indices = indices[order]
+    is_last = numpy.ones(len(indices), dtype=bool)
+    is_last[:-1] = indices[1:] != indices[:-1]
+    order = order[is_last]
+    indices = indices[is_last]
+
+    columns = []
+    for column in range(max_size):
+        columns.append(numpy.array(
+            [values[x][column] if column < len(values[x])
+             else missing_value
+             for x in order.tolist()], dtype=object))
+    return max_size, (indices, columns)
+
+
+def iterateIndexedRows(tables, sorted_keys, missing_value,
+                       block_size=10000):
+    '''iterate over joined rows of tables read with
+    :func:`readIndexedTable`.
+
+    Rows are assembled in blocks of *block_size* keys, filling a
+    preallocated matrix column by column.
+    '''
+    ncolumns = sum([x[0] for x in tables])
+    nkeys = len(sorted_keys)
+    matrix = numpy.empty((min(block_size, nkeys), ncolumns), dtype=object)
+
+    for start in range(0, nkeys, block_size):
+        end = min(start + block_size, nkeys)
+        block = matrix[:end - start]
+        block.fill(missing_value)
+        offset = 0
+        for max_size, (indices, columns) in tables:
+            first, last = numpy.searchsorted(indices, (start, end))
+            rows = indices[first:last] - start
+            for x, column in enumerate(columns):
+                block[rows, offset + x] = column[first:last]
+            offset += max_size
+        for key, values in zip(sorted_keys[start:end], block.tolist()):
+            yield key, values
+
+
+def iterateMergedRows(tables, filenames, missing_value):
+    '''iterate over joined rows of tables sorted by key.
+
+    *tables* is a list of tuples (max_size, rows) with *rows*
+    an iterator over tuples of (key, values) and *filenames*
+    the corresponding list of filenames. The tables are
+    merged with only the current row of each table in memory.
+    '''
+
+    def _tag(idx, rows):
+        last_key = None
+        for key, values in rows:
+            if last_key is not None and key < last_key:
+                raise ValueError(
+                    "table %s is not sorted by key: %s after %s" %
+                    (filenames[idx], key, last_key))
+            last_key = key
+            yield key, idx, values
+
+    merged = heapq.merge(*[_tag(idx, rows) for idx, (max_size, rows)
+                           in enumerate(tables)])
+    for key, group in itertools.groupby(merged, key=lambda x: x[0]):
+        row = [None] * len(tables)
+        for _, idx, values in group:
+            row[idx] = values
+        data = []
+        for (max_size, rows), values in zip(tables, row):
+            if values is None:
+                values = []
+            data.extend(values)
+            data.extend([missing_value] * (max_size - len(values)))
+        yield key, data
 
 
 def concatenateTables(outfile, options, args):
@@ -176,9 +342,9 @@ def joinTables(outfile, options, args):
                          (len(options.headers), len(options.filenames)))
 
     tables = []
-    keys = {}
+    table_filenames = []
+    key_index = {}
     sorted_keys = []
-    sizes = {}
 
     if options.merge:
         titles = ["count"]
@@ -207,21 +373,20 @@ def joinTables(outfile, options, args):
 
         prefix = os.path.basename(filename)
 
-        lines = readTable(filename, options)
+        lines = iterateTable(filename, options)
+        first_line = next(lines, None)
 
         # skip (or not skip) empty tables
-        if len(lines) == 0 and options.ignore_empty:
+        if first_line is None and options.ignore_empty:
             E.warn("%s is empty - skipped" % filename)
             headers_to_delete.append(nindex)
             continue
 
-        table = {}
-        sizes = {}
         max_size = 0
         ncolumns = 0
 
-        if options.input_has_titles:
-            data = lines[0][:-1].split("\t")
+        if options.input_has_titles and first_line is not None:
+            data = first_line[:-1].split("\t")
             # no titles have been defined so far
             if not titles:
                 key = "-".join([data[x] for x in options.columns])
@@ -266,8 +431,9 @@ def joinTables(outfile, options, args):
                 else:
                     titles.append(data[x])
 
-            del lines[0]
         else:
+            if first_line is not None:
+                lines = itertools.chain([first_line], lines)
 
             # set take based on numeric columns if no titles are present
             if options.take:
@@ -301,44 +467,31 @@ def joinTables(outfile, options, args):
                 titles.append("%s" % p)
             ncolumns = 1
 
-        n = 0
-        for line in lines:
-            data = line[:-1].split("\t")
-            try:
-                row_keys = [data[x] for x in options.columns]
-            except IndexError as msg:
-                raise IndexError(
-                    "error while parsing %s: %s" % (filename, msg))
-            if options.sort_keys:
-                if options.sort_keys == "numeric":
-                    row_keys.sort(lambda x, y: cmp(float(x), float(y)))
-                else:
-                    row_keys.sort()
-            if options.merge:
-                key = n
-            else:
-                key = "-".join(row_keys)
-
-            if key not in keys:
-                sorted_keys.append(key)
-                keys[key] = 1
-                sizes[key] = 0
-
+        rows = iterateRows(lines, filename, take, options)
+        if options.sorted_input:
+            # the row width of tables without titles is not known
+            # in advance, take it from the first row.
             if take:
                 max_size = len(take)
-                table[key] = [data[x] for x in take]
+            elif not options.input_has_titles:
+                first_row = next(rows, None)
+                if first_row is not None:
+                    max_size = len(first_row[1])
+                    rows = itertools.chain([first_row], rows)
             else:
-                max_size = max(len(data) - len(options.columns), max_size)
-                table[key] = [data[x]
-                              for x in range(0, len(data))
-                              if x not in options.columns]
-            n += 1
+                max_size = ncolumns
+            table = rows
+        else:
+            max_size, table = readIndexedTable(
+                rows, key_index, sorted_keys, max_size,
+                options.missing_value)
 
         # enter columns of "na" for empty tables.
         if max_size == 0:
             max_size = ncolumns
 
         tables.append((max_size, table))
+        table_filenames.append(filename)
 
     # delete in reverse order
     if options.headers:
@@ -407,31 +560,12 @@ def joinTables(outfile, options, args):
                 "\t".join([titles[order[x]] for x in range(len(titles))]))
             outfile.write("\n")
 
-        if options.sort_keys:
-            if options.sort_keys:
-                if options.sort_keys == "numeric":
-                    sorted_keys.sort(lambda x, y: cmp(float(x), float(y)))
-                else:
-                    sorted_keys.sort()
-
-        for key in sorted_keys:
-
-            outfile.write("%s" % key)
+        tables = [tables[x - 1] for x in order[1:]]
+        table_filenames = [table_filenames[x - 1] for x in order[1:]]
+        for max_size, table in tables:
+            assert(max_size == 1)
 
-            for x in order[1:]:
-
-                max_size, table = tables[x - 1]
-                c = 0
-                if key in table:
-                    outfile.write("\t")
-                    outfile.write("\t".join(table[key]))
-                    c = len(table[key])
-
-                assert(max_size == 1)
-
-                outfile.write("\t%s" % options.missing_value * (max_size - c))
-
-            outfile.write("\n")
+        sort_keys = options.sort_keys
 
     else:
 
@@ -441,23 +575,37 @@ def joinTables(outfile, options, args):
                 "\t".join([titles[x] for x in range(len(titles))]))
             outfile.write("\n")
 
-        for key in sorted_keys:
-
-            outfile.write("%s" % key)
-
-            for x in range(len(tables)):
+        # keys of multi-column tables are output in input order
+        sort_keys = False
 
-                max_size, table = tables[x]
-                c = 0
-                if key in table:
-                    outfile.write("\t")
-                    outfile.write("\t".join(table[key]))
-                    c = len(table[key])
+    if options.sorted_input:
+        rows = iterateMergedRows(tables, table_filenames,
+                                 options.missing_value)
+    else:
+        if sort_keys:
+            if sort_keys == "numeric":
+                sorted_keys.sort(key=float)
+            else:
+                sorted_keys.sort()
 
-                outfile.write("\t%s" % options.missing_value * (max_size - c))
+            # re-number keys in sorted order
+            map_old2new = numpy.zeros(len(sorted_keys), dtype=numpy.int64)
+            map_old2new[[key_index[x] for x in sorted_keys]] = numpy.arange(
+                len(sorted_keys))
+            sorted_tables = []
+            for max_size, (indices, columns) in tables:
+                indices = map_old2new[indices]
+                order = numpy.argsort(indices)
+                sorted_tables.append(
+                    (max_size, (indices[order],
+                                [x[order] for x in columns])))
+            tables = sorted_tables
 
-            outfile.write("\n")
+        rows = iterateIndexedRows(tables, sorted_keys,
+                                  options.missing_value)
 
+    for key, values in rows:
+        outfile.write("\t".join(["%s" % key] + values) + "\n")
 
 
 def main(argv=sys.argv):
@@ -520,6 +668,12 @@ def main(argv=sys.argv):
                       "additional column called X with the filename "
                       " [default=%default].")
 
+    parser.add_option("--sorted-input", dest="sorted_input",
+                      action="store_true",
+                      help="input tables are sorted by the join key. "
+                      "Tables are merged without reading them into "
+                      "memory [default=%default].")
+
     parser.add_option("--sort-keys", dest="sort_keys", type="choice",
                       choices=("numeric", "alphabetic"),
                       help="sort key columns by value.")
@@ -586,6 +740,7 @@ def main(argv=sys.argv):
         glob=None,
         columns="1",
         sort_keys=False,
+        sorted_input=False,
         merge=False,
         ignore_empty=True,
         regex_start=None,
@@ -613,6 +768,10 @@ def main(argv=sys.argv):
         else:
             options.sort = re.split("\s+", options.sort)
 
+    if options.merge and options.sorted_input:
+        raise ValueError(
+            "--merge-overlapping and --sorted-input are incompatible")
+
     if options.merge:
         options.columns = []
     else:
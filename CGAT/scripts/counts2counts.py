@@ -529,7 +529,8 @@ def main(argv=None):
                 options.min_cbin, options.max_cbin, options.width_cbin,
                 options.min_ibin, options.max_ibin, options.width_ibin,
                 g_to_spike_tracks, design.groups, options.difference,
-                options.max_spike, options.iterations)
+                options.max_spike, options.iterations,
+                seed=options.random_seed)
 
         filled_bins = Counts.thresholdBins(output_indices, bin_counts,
                                            options.min_spike)
@@ -35,6 +35,12 @@ dexseq
 ttest
    Application of Welch's ttest to FPKM values
 
+sam
+   Application of a SAM permutation test to log2 transformed
+   normalised counts. Use --sam-permutations to set the number
+   of permutations and --threads to distribute them over several
+   processes.
+
 mock
    A mock analysis. No differential analysis is performed,
    but fold changes are computed and output.
@@ -176,8 +182,8 @@ def main(argv=None):
                       "[default=%default].")
 
     parser.add_option("-m", "--method", dest="method", type="choice",
-                      choices=("ttest", "sleuth", "edger", "deseq2", "mock",
-                               "dexseq"),
+                      choices=("ttest", "sam", "sleuth", "edger", "deseq2",
+                               "mock", "dexseq"),
                       help="differential expression method to apply "
                       "[default=%default].")
 
@@ -199,6 +205,15 @@ def main(argv=None):
     parser.add_option("-f", "--fdr", dest="fdr", type="float",
                       help="fdr to apply [default=%default].")
 
+    parser.add_option("--sam-permutations", dest="sam_permutations",
+                      type="int",
+                      help="number of permutations for sam "
+                      "[default=%default].")
+
+    parser.add_option("--threads", dest="threads", type="int",
+                      help="number of processes to use for permutations "
+                      "[default=%default].")
+
     # currently not implemented
     #parser.add_option("-R", "--output-R-code", dest="save_r_environment",
     #                  type="string",
@@ -306,6 +321,8 @@ def main(argv=None):
         output_filename=sys.stdout,
         method="deseq2",
         fdr=0.1,
+        sam_permutations=1000,
+        threads=1,
         deseq2_dispersion_method="pooled",
         deseq2_fit_type="parametric",
         edger_dispersion=0.4,
@@ -454,6 +471,13 @@ def main(argv=None):
             experiment = Expression.DEExperiment_TTest()
             results = experiment.run(counts, design)
 
+        elif options.method == "sam":
+            experiment = Expression.DEExperiment_SAM()
+            results = experiment.run(counts,
+                                     design,
+                                     npermutations=options.sam_permutations,
+                                     threads=options.threads)
+
         elif options.method == "edger":
             experiment = Expression.DEExperiment_edgeR()
             results = experiment.run(counts,
@@ -14,10 +14,9 @@ auto-detected.
 Read a table from stdin and create an sqlite3 database. By default,
 the database will reside in a file called csvdb and in a table csv.
 
-.. todo::
-
-   Use file import where appropriate to speed up loading. Currently, this is
-   not always the case.
+Rows are inserted in batches (``--batch-size``) and indices are built
+after loading. For large tables, use ``--bulk-load`` to relax sqlite
+durability settings while the table is being loaded.
 
 Usage
 -----
@@ -13,6 +13,10 @@ of gtf files.
 If results from a previous run are present, existing
 pairs are not re-computed but simply echoed.
 
+If both files in a pair are sorted by contig and start (for example
+with ``gtf2gtf.py --method=sort --sort-order=position``), they are
+compared in a single pass without building an index in memory.
+
 The output is a tab-separated table with counts for each pair
 of files being compared. The fields are:
 
@@ -127,11 +131,11 @@ Command line options
 
 import sys
 import re
-import numpy
 
 import CGAT.Experiment as E
 import CGAT.GTF as GTF
 import CGAT.IOTools as IOTools
+import CGAT.Intervals as Intervals
 import CGAT.NCL as NCL
 
 
@@ -168,39 +172,65 @@ class Counter:
         infile.close()
         return idx
 
-    def _count(self, filename, idx):
+    @E.cachedmethod
+    def isSorted(self, filename):
+        """return True if filename is sorted by contig and start."""
+        infile = IOTools.openFile(filename, "r")
+        is_sorted = Intervals.isSorted(GTF.iterator(infile))
+        infile.close()
+        return is_sorted
+
+    def iterateOverlaps(self, filename1, filename2):
+        """iterate over entries in filename1 and return
+        overlapping intervals in filename2.
+
+        If both files are sorted by position, they are compared
+        in a single pass. Otherwise, filename2 is indexed.
+        """
+        infile = IOTools.openFile(filename1, "r")
+
+        if self.isSorted(filename1) and self.isSorted(filename2):
+            E.debug("comparing sorted files %s and %s" %
+                    (filename1, filename2))
+            infile2 = IOTools.openFile(filename2, "r")
+            for this, others in Intervals.iterator_overlapping(
+                    GTF.iterator(infile), GTF.iterator(infile2)):
+                yield this, [(x.start, x.end) for x in others]
+            infile2.close()
+        else:
+            idx = self.buildIndex(filename2)
+            for this in GTF.iterator(infile):
+                try:
+                    intervals = [(x[0], x[1]) for x in
+                                 idx[this.contig].find(this.start, this.end)]
+                except KeyError:
+                    intervals = []
+                yield this, intervals
+
+        infile.close()
+
+    def _count(self, filename1, filename2):
 
         overlapping_genes = set()
         genes = set()
-        # iterate over exons
-        infile = IOTools.openFile(filename, "r")
-        it = GTF.iterator(infile)
 
         nexons, nexons_overlapping = 0, 0
         nbases, nbases_overlapping = 0, 0
-        for this in it:
+        # iterate over exons
+        for this, intervals in self.iterateOverlaps(filename1, filename2):
             nexons += 1
             nbases += this.end - this.start
             genes.add(this.gene_id)
 
-            try:
-                intervals = list(idx[this.contig].find(this.start, this.end))
-            except KeyError:
-                continue
-
             if len(intervals) == 0:
                 continue
 
             overlapping_genes.add(this.gene_id)
             nexons_overlapping += 1
             start, end = this.start, this.end
-            counts = numpy.zeros(end - start, numpy.int)
-            for other_start, other_end, other_value in intervals:
-                for x in range(max(start, other_start) - start, min(end, other_end) - start):
-                    counts[x] += 1
-            nbases_overlapping += sum([1 for x in counts if x > 0])
-
-        infile.close()
+            nbases_overlapping += Intervals.getLength(Intervals.combine(
+                [(max(start, other_start), min(end, other_end))
+                 for other_start, other_end in intervals]))
 
         return len(genes), len(overlapping_genes), nexons, nexons_overlapping, nbases, nbases_overlapping
 
@@ -209,23 +239,19 @@ class Counter:
 
         E.info("counting started for %s versus %s" % (filename1, filename2))
 
-        idx2 = self.buildIndex(filename2)
-
         (self.mGenes1, self.mGenesOverlapping1,
          self.mExons1, self.mExonsOverlapping1,
          self.mBases1, self.mBasesOverlapping1 ) = \
-            self._count(filename1, idx2)
+            self._count(filename1, filename2)
 
         self.mGenesUnique1 = self.mGenes1 - self.mGenesOverlapping1
         self.mExonsUnique1 = self.mExons1 - self.mExonsOverlapping1
         self.mBasesUnique1 = self.mBases1 - self.mBasesOverlapping1
 
-        idx1 = self.buildIndex(filename1)
-
         (self.mGenes2, self.mGenesOverlapping2,
          self.mExons2, self.mExonsOverlapping2,
          self.mBases2, self.mBasesOverlapping2 ) = \
-            self._count(filename2, idx1)
+            self._count(filename2, filename1)
 
         self.mGenesUnique2 = self.mGenes2 - self.mGenesOverlapping2
         self.mExonsUnique2 = self.mExons2 - self.mExonsOverlapping2
@@ -272,28 +298,18 @@ class CounterGenes(Counter):
              "nuniq2", "ovl1", "ovl2", "uniq1", "uniq2"]
         return "\t".join(h)
 
-    def _count(self, filename, idx):
+    def _count(self, filename1, filename2):
 
         overlapping_genes = set()
         genes = set()
         # iterate over exons
-        infile = IOTools.openFile(filename, "r")
-        it = GTF.iterator(infile)
-
-        for this in it:
+        for this, intervals in self.iterateOverlaps(filename1, filename2):
             genes.add(this.gene_id)
 
-            try:
-                intervals = idx[this.contig].find(this.start, this.end)
-            except KeyError:
-                continue
-
             if len(intervals) == 0:
                 continue
-	
-            overlapping_genes.add(this.gene_id)
 
-        infile.close()
+            overlapping_genes.add(this.gene_id)
 
         return genes, overlapping_genes
 
@@ -302,12 +318,10 @@ class CounterGenes(Counter):
 
         E.info("counting started for %s versus %s" % (filename1, filename2))
 
-        idx2 = self.buildIndex(filename2)
-
-        (self.mGenes1, self.mGenesOverlapping1) = self._count(filename1, idx2)
-
-        idx1 = self.buildIndex(filename1)
-        (self.mGenes2, self.mGenesOverlapping2) = self._count(filename2, idx1)
+        (self.mGenes1, self.mGenesOverlapping1) = self._count(
+            filename1, filename2)
+        (self.mGenes2, self.mGenesOverlapping2) = self._count(
+            filename2, filename1)
 
     def __str__(self):
 
@@ -349,8 +349,6 @@ def main(argv=None):
 
             if method == "translate":
                 # translate such that gaps are preserved
-                seq = []
-
                 ls = len(re.sub('[%s]' % options.gap_chars, sequence, ""))
 
                 if ls % 3 != 0:
@@ -363,11 +361,9 @@ def main(argv=None):
                     else:
                         raise ValueError(msg)
 
-                for codon in [sequence[x:x + 3] for x in range(0, l, 3)]:
-                    aa = Genomics.MapCodon2AA(codon)
-                    seq.append(aa)
-
-                sequence = "".join(seq)
+                sequence = Genomics.translate(sequence[:l].upper(),
+                                              prefer_lowercase=False,
+                                              ignore_n=True)
 
             elif method == "back-translate":
                 # translate from an amino acid alignment to codon alignment
@@ -66,6 +66,12 @@ either by splitting each line at the first space and taking only the
 first part (--split-fasta-identifier), or by any user-supplied python
 regular expression (--regex-identifier).
 
+Each sequence is encoded and counted only once and all sections are
+derived from these counts. With ``--threads``, sequences are
+partitioned into chunks of ``--chunk-size`` sequences that are
+processed in separate processes. The output is in the same order as
+the input.
+
 Usage
 -----
 
@@ -111,6 +117,8 @@ Command line options
 import sys
 import re
 import math
+import optparse
+import multiprocessing
 
 import CGAT.Experiment as E
 import CGAT.Genomics as Genomics
@@ -119,6 +127,121 @@ import CGAT.SequenceProperties as SequenceProperties
 import CGAT.FastaIterator as FastaIterator
 
 
+def buildCounter(section, options, reference_codons):
+    '''return a SequenceProperties object for *section*.'''
+
+    if options.seqtype == "na":
+        if section == "length":
+            s = SequenceProperties.SequencePropertiesLength()
+        elif section == "sequence":
+            s = SequenceProperties.SequencePropertiesSequence()
+        elif section == "hid":
+            s = SequenceProperties.SequencePropertiesHid()
+        elif section == "na":
+            s = SequenceProperties.SequencePropertiesNA()
+        elif section == "gaps":
+            s = SequenceProperties.SequencePropertiesGaps(
+                options.gap_chars)
+        elif section == "cpg":
+            s = SequenceProperties.SequencePropertiesCpg()
+        elif section == "dn":
+            s = SequenceProperties.SequencePropertiesDN()
+        # these sections requires sequence length to be a multiple of 3
+        elif section == "aa":
+            s = SequenceProperties.SequencePropertiesAA()
+        elif section == "degeneracy":
+            s = SequenceProperties.SequencePropertiesDegeneracy()
+        elif section == "codon-bias":
+            s = SequenceProperties.SequencePropertiesBias(reference_codons)
+        elif section == "codons":
+            s = SequenceProperties.SequencePropertiesCodons()
+        elif section == "codon-usage":
+            s = SequenceProperties.SequencePropertiesCodonUsage()
+        elif section == "codon-translator":
+            s = SequenceProperties.SequencePropertiesCodonTranslator()
+        else:
+            raise ValueError("unknown section %s" % section)
+    elif options.seqtype == "aa":
+        if section == "length":
+            s = SequenceProperties.SequencePropertiesLength()
+        elif section == "sequence":
+            s = SequenceProperties.SequencePropertiesSequence()
+        elif section == "hid":
+            s = SequenceProperties.SequencePropertiesHid()
+        elif section == "aa":
+            s = SequenceProperties.SequencePropertiesAminoAcids()
+        else:
+            raise ValueError("unknown section %s" % section)
+    return s
+
+
+# per-process state in multi-process mode
+WORKER_STATE = {}
+
+
+def initializeWorker(options, reference_codons):
+    '''store options in a worker process.'''
+    WORKER_STATE["options"] = options
+    WORKER_STATE["reference_codons"] = reference_codons
+
+
+def processChunk(chunk):
+    '''compute sequence properties for (title, sequence) tuples
+    in *chunk*.
+
+    Returns the output for the chunk and, if totals are requested,
+    a counter per section with the totals of the chunk.
+    '''
+    options = WORKER_STATE["options"]
+    reference_codons = WORKER_STATE["reference_codons"]
+    rx = re.compile(options.regex_identifier)
+
+    if options.add_total:
+        totals = [buildCounter(section, options, reference_codons)
+                  for section in options.sections]
+    else:
+        totals = None
+
+    lines = []
+    for title, sequence in chunk:
+
+        sequence = re.sub(" ", "", sequence).upper()
+
+        if len(sequence) == 0:
+            raise ValueError("empty sequence %s" % title)
+
+        id = rx.search(title).groups()[0]
+
+        if options.split_id is True:
+            id = id.split()[0]
+
+        # encode and count the sequence once for all sections
+        counts = SequenceProperties.SequenceCounts(sequence)
+        line = [id]
+        for x, section in enumerate(options.sections):
+            s = buildCounter(section, options, reference_codons)
+            s.loadSequence(counts, options.seqtype)
+            if totals:
+                totals[x].addProperties(s)
+
+            line.append("\t" + "\t".join(s.getFields()))
+
+        lines.append("".join(line) + "\n")
+
+    return "".join(lines), totals
+
+
+def iterateChunks(iterator, chunk_size):
+    '''group fasta records into chunks of (title, sequence) tuples.'''
+    chunk = []
+    for record in iterator:
+        chunk.append((record.title, record.sequence))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
 
 def main(argv=None):
 
@@ -159,6 +282,15 @@ def main(argv=None):
         help="add a row with column totals at the end of the table"
         "[%default]")
 
+    parser.add_option(
+        "--threads", dest="threads", type="int",
+        help="number of processes to use. Sequences are partitioned "
+        "into chunks that are processed in parallel [%default]")
+
+    parser.add_option(
+        "--chunk-size", dest="chunk_size", type="int",
+        help="number of sequences per chunk [%default]")
+
     parser.set_defaults(
         filename_weights=None,
         pseudocounts=1,
@@ -168,6 +300,8 @@ def main(argv=None):
         gap_chars='xXnN',
         split_id=False,
         add_total=False,
+        threads=1,
+        chunk_size=1000,
     )
 
     (options, args) = E.Start(parser, argv=argv)
@@ -209,56 +343,10 @@ def main(argv=None):
 
     iterator = FastaIterator.FastaIterator(options.stdin)
 
-    def getCounter(section):
-
-        if options.seqtype == "na":
-            if section == "length":
-                s = SequenceProperties.SequencePropertiesLength()
-            elif section == "sequence":
-                s = SequenceProperties.SequencePropertiesSequence()
-            elif section == "hid":
-                s = SequenceProperties.SequencePropertiesHid()
-            elif section == "na":
-                s = SequenceProperties.SequencePropertiesNA()
-            elif section == "gaps":
-                s = SequenceProperties.SequencePropertiesGaps(
-                    options.gap_chars)
-            elif section == "cpg":
-                s = SequenceProperties.SequencePropertiesCpg()
-            elif section == "dn":
-                s = SequenceProperties.SequencePropertiesDN()
-            # these sections requires sequence length to be a multiple of 3
-            elif section == "aa":
-                s = SequenceProperties.SequencePropertiesAA()
-            elif section == "degeneracy":
-                s = SequenceProperties.SequencePropertiesDegeneracy()
-            elif section == "codon-bias":
-                s = SequenceProperties.SequencePropertiesBias(reference_codons)
-            elif section == "codons":
-                s = SequenceProperties.SequencePropertiesCodons()
-            elif section == "codon-usage":
-                s = SequenceProperties.SequencePropertiesCodonUsage()
-            elif section == "codon-translator":
-                s = SequenceProperties.SequencePropertiesCodonTranslator()
-            else:
-                raise ValueError("unknown section %s" % section)
-        elif options.seqtype == "aa":
-            if section == "length":
-                s = SequenceProperties.SequencePropertiesLength()
-            elif section == "sequence":
-                s = SequenceProperties.SequencePropertiesSequence()
-            elif section == "hid":
-                s = SequenceProperties.SequencePropertiesHid()
-            elif section == "aa":
-                s = SequenceProperties.SequencePropertiesAminoAcids()
-            else:
-                raise ValueError("unknown section %s" % section)
-        return s
-
     # setup totals
     totals = {}
     for section in options.sections:
-        totals[section] = getCounter(section)
+        totals[section] = buildCounter(section, options, reference_codons)
 
     options.stdout.write("id")
     for section in options.sections:
@@ -267,32 +355,35 @@ def main(argv=None):
     options.stdout.write("\n")
     options.stdout.flush()
 
-    s = getCounter("hid")
-    s.loadSequence("AAAAAAAAA", "na")
-
-    for cur_record in iterator:
-
-        sequence = re.sub(" ", "", cur_record.sequence).upper()
-
-        if len(sequence) == 0:
-            raise ValueError("empty sequence %s" % cur_record.title)
-
-        id = rx.search(cur_record.title).groups()[0]
-
-        if options.split_id is True:
-            options.stdout.write("%s" % id.split()[0])
-        else:
-            options.stdout.write("%s" % id)
-        options.stdout.flush()
-
-        for section in options.sections:
-            s = getCounter(section)
-            s.loadSequence(sequence, options.seqtype)
-            totals[section].addProperties(s)
-
-            options.stdout.write("\t" + "\t".join(s.getFields()))
-
-        options.stdout.write("\n")
+    if options.threads > 1:
+        # open file handles can not be passed on to the workers
+        worker_options = optparse.Values(
+            dict([(key, value) for key, value in list(vars(options).items())
+                  if not hasattr(value, "read") and
+                  not hasattr(value, "write")]))
+
+        E.info("processing sequences with %i processes" % options.threads)
+        pool = multiprocessing.Pool(options.threads,
+                                    initializer=initializeWorker,
+                                    initargs=(worker_options,
+                                              reference_codons))
+        results = pool.imap(processChunk,
+                            iterateChunks(iterator, options.chunk_size))
+    else:
+        pool = None
+        initializeWorker(options, reference_codons)
+        results = (processChunk(chunk) for chunk in
+                   iterateChunks(iterator, options.chunk_size))
+
+    for output, chunk_totals in results:
+        options.stdout.write(output)
+        if chunk_totals:
+            for section, total in zip(options.sections, chunk_totals):
+                totals[section].addProperties(total)
+
+    if pool:
+        pool.close()
+        pool.join()
 
     if options.add_total:
         options.stdout.write("total")
@@ -60,7 +60,8 @@ option and a given :term:`gff` formatted file::
  --maskregions-bed-file=intervals.gff < features.gff > features.fasta
 
 where ``--masker`` can take the following values: ``dust``, ``dustmasker``,
-and ``softmask``.
+``pydust`` and ``softmask``. ``pydust`` runs an in-process
+implementation of DUST and does not require ``dustmasker``.
 
 Options
 -------
@@ -105,7 +106,7 @@ Options
 
 
 ``--masker``
-  Masker type to use: dust, dustmasker, soft or none
+  Masker type to use: dust, dustmasker, pydust, soft or none
 
 ``--fold-at``
   Fold the fasta sequence every n bases
@@ -202,7 +203,7 @@ def main(argv=None):
 
     parser.add_option(
         "--masker", dest="masker", type="choice",
-        choices=("dust", "dustmasker", "softmask", "none"),
+        choices=("dust", "dustmasker", "pydust", "softmask", "none"),
         help="apply masker [%default].")
 
     parser.add_option(
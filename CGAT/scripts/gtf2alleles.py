@@ -35,7 +35,11 @@ Command line options
 """
 
 import sys
+import bisect
 import collections
+import itertools
+import optparse
+import multiprocessing
 import sqlite3
 
 import CGAT.Experiment as E
@@ -75,13 +79,21 @@ Allele = collections.namedtuple('Allele',
 class VariantGetter(object):
 
     '''base class for objects returning variants.'''
-    pass
+
+    # True if variants at the end coordinate are returned
+    mIncludeEnd = False
+
+    # True if variants overlapping the region are returned. Otherwise
+    # only variants positioned within the region are returned.
+    mOverlaps = False
 
 
 class VariantGetterSqlite(VariantGetter):
 
     '''retrieve variants from an sqlite table in pileup format.'''
 
+    mIncludeEnd = True
+
     def __init__(self, dbname, tablename):
         self.dbname = dbname
         self.tablename = tablename
@@ -132,6 +144,8 @@ class VariantGetterVCF(VariantGetter):
 
     '''retrieve variants from tabix indexed vcf file.'''
 
+    mOverlaps = True
+
     def __init__(self, filename, sample):
         self.sample = sample
         self.vcf = pysam.VCF()
@@ -161,6 +175,79 @@ class VariantGetterVCF(VariantGetter):
         return variants
 
 
+def getVariantEnd(variant):
+    '''return the end of the reference region affected by *variant*.
+
+    The extent follows :func:`Variants.updateVariants`: deletions
+    cover the deleted bases after the variant position and insertions
+    the two flanking bases.
+    '''
+    pos, reference, genotype = variant
+    end = pos + max(1, len(reference))
+    if len(genotype) > 1 and ("+" in genotype or "-" in genotype):
+        lvariant = max([len(x) - 1 for x in genotype.split("/")])
+        if "-" in genotype:
+            end = max(end, pos + lvariant + 1)
+        else:
+            end = max(end, pos + 2)
+    return end
+
+
+class VariantCache(VariantGetter):
+
+    '''cache variants returned by another :class:`VariantGetter`.
+
+    Variants are fetched for a window of at least *window_size*
+    bases and kept until a region outside the window is requested.
+    Neighbouring and overlapping genes thus re-use the variants
+    that have been fetched and parsed once. Variants are selected
+    in the same way as by *getter*: by overlap with the requested
+    region (see :func:`getVariantEnd`) if the getter returns
+    overlapping variants and by position otherwise.
+    '''
+
+    def __init__(self, getter, window_size=100000):
+        self.getter = getter
+        self.window_size = window_size
+        self.mIncludeEnd = getter.mIncludeEnd
+        self.mOverlaps = getter.mOverlaps
+        self.contig = None
+        self.start, self.end = 0, 0
+        self.variants = []
+        self.positions = []
+        self.ends = []
+        self.max_length = 0
+        self.nfetched = 0
+
+    def __call__(self, contig, start, end):
+
+        if contig != self.contig or start < self.start or end > self.end:
+            fetch_end = max(end, start + self.window_size)
+            self.variants = sorted(self.getter(contig, start, fetch_end),
+                                   key=lambda x: x.pos)
+            self.positions = [x.pos for x in self.variants]
+            self.ends = [getVariantEnd(x) for x in self.variants]
+            self.max_length = max(
+                [e - p for p, e in zip(self.positions, self.ends)] or [0])
+            self.contig, self.start, self.end = contig, start, fetch_end
+            self.nfetched += 1
+
+        if self.mIncludeEnd:
+            last = bisect.bisect_right(self.positions, end)
+        else:
+            last = bisect.bisect_left(self.positions, end)
+
+        if not self.mOverlaps:
+            first = bisect.bisect_left(self.positions, start)
+            return self.variants[first:last]
+
+        # variants starting more than max_length before start can
+        # not overlap the region
+        first = bisect.bisect_left(self.positions, start - self.max_length)
+        return [self.variants[x] for x in range(first, last)
+                if self.ends[x] > start]
+
+
 def collectExonIntronSequences(transcripts, fasta):
     '''collect all the wild type sequences for exons and introns
 
@@ -790,6 +877,273 @@ def buildAlleles(transcript,
     return result
 
 
+def processGene(transcripts, fasta, variant_getter, seleno, sections, options):
+    '''build alleles for the transcripts of a gene.
+
+    *sections* is a collection of output sections to build.
+
+    returns a tuple (noutput, output) with the number of alleles
+    and a dictionary of output lines per section.
+    '''
+
+    output = collections.defaultdict(list)
+    noutput = 0
+    separator = options.separator
+
+    gene_id = transcripts[0][0].gene_id
+
+    overall_start = min([min([x.start for x in y]) for y in transcripts])
+    overall_end = max([max([x.end for x in y]) for y in transcripts])
+    contig = transcripts[0][0].contig
+    strand = transcripts[0][0].strand
+    is_positive_strand = Genomics.IsPositiveStrand(strand)
+    lcontig = fasta.getLength(contig)
+    E.info("%s: started processing on %s:%i..%i (%s)" %
+           (gene_id, contig, overall_start, overall_end, strand))
+
+    extended_start = max(0, overall_start - options.border)
+    extended_end = min(lcontig, overall_end + options.border)
+
+    # if contig.startswith("chr"): contig = contig[3:]
+
+    variants = variant_getter(contig, extended_start, extended_end)
+
+    E.debug("%s: found %i variants in %s:%i..%i" %
+            (gene_id, len(variants), contig, extended_start, extended_end))
+
+    if E.global_options.loglevel >= 10:
+        print("# collected variants:", variants)
+
+    # collect intron/exon sequences
+    # coordinates are forward/reverse
+    # also updates the coordinates in transcripts
+    all_exons, all_introns = collectExonIntronSequences(transcripts, fasta)
+
+    # update variants such that they use the same coordinates
+    # as the transcript
+    variants = Variants.updateVariants(variants, lcontig, strand)
+
+    # deal with overlapping but consistent variants
+    variants = Variants.mergeVariants(variants)
+
+    E.debug("%s: found %i variants after merging in %s:%i..%i" %
+            (gene_id, len(variants), contig, extended_start, extended_end))
+
+    if E.global_options.loglevel >= 10:
+        print("# merged variants:", variants)
+
+    # collect coordinate offsets and remove conflicting variants
+    variants, removed_variants, offsets = Variants.buildOffsets(
+        variants, contig=contig)
+
+    if len(removed_variants) > 0:
+        E.warn("removed %i conflicting variants" % len(removed_variants))
+        for v in removed_variants:
+            E.info("removed variant: %s" % str(v))
+
+    E.info("%i variants after filtering" % len(variants))
+
+    if len(variants) > 0:
+        # build variants
+        indexed_variants = Variants.indexVariants(variants)
+
+        # update exon sequences according to variants
+        variant_exons = buildVariantSequences(indexed_variants, all_exons)
+
+        # update intron sequences according to variants
+        variant_introns = buildVariantSequences(
+            indexed_variants, all_introns)
+
+        if E.global_options.loglevel >= 10:
+            for key in variant_exons:
+                print("exon", key)
+                Genomics.printPrettyAlignment(
+                    all_exons[key],
+                    variant_exons[key][0],
+                    variant_exons[key][1],
+                )
+            for key in variant_introns:
+                print("intron", key)
+                Genomics.printPrettyAlignment(
+                    all_introns[key][:30] + all_introns[key][-30:],
+                    variant_introns[key][0][:30] +
+                    variant_introns[key][0][-30:],
+                    variant_introns[key][1][:30] + variant_introns[key][1][-30:])
+
+    else:
+        variant_exons, variant_introns = None, None
+
+    for transcript in transcripts:
+
+        transcript.sort(key=lambda x: x.start)
+
+        transcript_id = transcript[0].transcript_id
+        alleles = buildAlleles(transcript,
+                               variant_exons,
+                               variant_introns,
+                               all_exons,
+                               all_introns,
+                               offsets,
+                               is_seleno=transcript_id in seleno,
+                               reference_coordinates=False,
+                               )
+
+        ##############################################################
+        ##############################################################
+        ##############################################################
+        # output
+        reference_cds_sequence = buildCDSSequence(transcript, all_exons)
+
+        for aid, al in enumerate(alleles):
+
+            allele, map_cds2reference = al
+
+            is_wildtype = reference_cds_sequence == allele.cds
+
+            allele_id = str(aid)
+            assert len(allele.exon_starts) == allele.nexons
+            assert len(allele.cds_starts) == allele.nexons
+            assert len(allele.frames) == allele.nexons
+
+            # the output id
+            outid = separator.join((gene_id, transcript_id, allele_id))
+
+            # output map between cds and reference
+            if "map" in sections and map_cds2reference:
+                match = Blat.Match()
+                match.mQueryId = allele_id
+                match.mQueryLength = allele.cds_len
+                match.mSbjctId = contig
+                match.mSbjctLength = lcontig
+                match.strand = strand
+                match.fromMap(map_cds2reference, use_strand=True)
+                output["map"].append("%s\n" % str(match))
+
+            # only output sequences for genes that have not been knocked
+            # out, unless required
+            if not allele.is_nmd_knockout or options.with_knockouts:
+
+                if "gtf" in sections:
+                    gtf = GTF.Entry()
+                    gtf.gene_id = gene_id
+                    gtf.transcript_id = transcript_id
+                    gtf.addAttribute("allele_id", allele_id)
+                    gtf.contig = contig
+                    gtf.strand = strand
+                    gtf.feature = "CDS"
+                    gtf.source = "gtfxnsps"
+                    l = 0
+                    last_cds_start = allele.cds_starts[0]
+                    gtf.start = allele.exon_starts[0]
+                    gtf.frame = allele.frames[0]
+
+                    for exon_start, cds_start, frame in zip(allele.exon_starts[1:],
+                                                            allele.cds_starts[
+                                                                1:],
+                                                            allele.frames[1:]):
+                        cds_length = cds_start - last_cds_start
+                        gtf.end = gtf.start + cds_length
+                        if not is_positive_strand:
+                            gtf.start, gtf.end = lcontig - \
+                                gtf.end, lcontig - gtf.start
+                        output["gtf"].append(str(gtf) + "\n")
+
+                        gtf.start = exon_start
+                        gtf.frame = frame
+
+                        l += cds_length
+                        last_cds_start = cds_start
+
+                    cds_length = len(allele.cds) - last_cds_start
+                    gtf.end = gtf.start + cds_length
+                    if not is_positive_strand:
+                        gtf.start, gtf.end = lcontig - \
+                            gtf.end, lcontig - gtf.start
+                    output["gtf"].append(str(gtf) + "\n")
+
+                if "cds" in sections:
+                    output["cds"].append(">%s\n%s\n" % (outid, allele.cds))
+                if "peptide" in sections:
+                    output["peptide"].append(
+                        ">%s\n%s\n" % (outid, allele.peptide))
+
+            # reformat for tabular output
+            allele = allele._replace(
+                cds_starts=",".join(map(str, allele.cds_starts)),
+                exon_starts=",".join(map(str, allele.exon_starts)),
+                frames=",".join(map(str, allele.frames)))
+
+            # convert reference coordinates to positive strand coordinates
+            if allele.reference_first_stop_start >= 0 and not is_positive_strand:
+                allele = allele._replace(
+                    reference_first_stop_start=lcontig -
+                    allele.reference_first_stop_end,
+                    reference_first_stop_end=lcontig - allele.reference_first_stop_start, )
+
+            if "table" in sections:
+                output["table"].append("%s\t%s\n" % (
+                    "\t".join((gene_id,
+                               transcript_id,
+                               allele_id,
+                               contig,
+                               strand,
+                               "%i" % is_wildtype)),
+                    "\t".join(map(str, allele))))
+
+            noutput += 1
+            # only output first allele (debugging)
+            # break
+
+    return noutput, output
+
+
+WORKER_STATE = {}
+
+
+def buildVariantGetter(options):
+    '''return a variant getter according to *options*.'''
+
+    # acquire variants from SQLlite database
+    if options.tablename:
+        if not options.database:
+            raise ValueError("please supply both database and tablename")
+        variant_getter = VariantGetterSqlite(
+            options.database, options.tablename)
+    elif options.filename_pileup:
+        variant_getter = VariantGetterPileup(options.filename_pileup)
+    elif options.filename_vcf:
+        variant_getter = VariantGetterVCF(
+            options.filename_vcf, options.vcf_sample)
+    else:
+        raise ValueError("please specify a source of variants.")
+
+    if options.variant_cache_size > 0:
+        variant_getter = VariantCache(variant_getter,
+                                      options.variant_cache_size)
+
+    return variant_getter
+
+
+def initializeWorker(options, seleno, sections):
+    '''open genome and variants in a worker process.'''
+    WORKER_STATE["options"] = options
+    WORKER_STATE["fasta"] = IndexedFasta.IndexedFasta(options.genome_file)
+    WORKER_STATE["variant_getter"] = buildVariantGetter(options)
+    WORKER_STATE["seleno"] = seleno
+    WORKER_STATE["sections"] = sections
+
+
+def processGenes(genes):
+    '''build alleles for a list of genes in a worker process.'''
+    return [processGene(transcripts,
+                        WORKER_STATE["fasta"],
+                        WORKER_STATE["variant_getter"],
+                        WORKER_STATE["seleno"],
+                        WORKER_STATE["sections"],
+                        WORKER_STATE["options"])
+            for transcripts in genes]
+
+
 def main(argv=None):
     """script main.
 
@@ -830,6 +1184,15 @@ def main(argv=None):
                       help="sections to output [default=%default].")
     parser.add_option("-k", "--with-knockouts", dest="with_knockouts", action="store_true",
                       help="add alleles that are knocked out to fasta and gtf files [default=%default].")
+    parser.add_option("--variant-cache-size", dest="variant_cache_size", type="int",
+                      help="size of the genomic window in bases for which "
+                      "variants are fetched at once and kept in memory. Set to "
+                      "0 to fetch variants for each gene separately "
+                      "[default=%default].")
+    parser.add_option("--threads", dest="threads", type="int",
+                      help="number of processes to use. Genes on the same "
+                      "contig are processed by the same process "
+                      "[default=%default].")
 
     parser.set_defaults(
         genome_file=None,
@@ -845,6 +1208,8 @@ def main(argv=None):
         with_knockouts=False,
         filename_vcf=None,
         vcf_sample=None,
+        variant_cache_size=100000,
+        threads=1,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -852,11 +1217,6 @@ def main(argv=None):
 
     ninput, nskipped, noutput = 0, 0, 0
 
-    if options.genome_file:
-        fasta = IndexedFasta.IndexedFasta(options.genome_file)
-    else:
-        fasta = None
-
     if options.filename_seleno:
         seleno = set(IOTools.readList(open(options.filename_seleno, "r")))
     else:
@@ -864,265 +1224,79 @@ def main(argv=None):
 
     infile_gtf = GTF.gene_iterator(GTF.iterator(options.stdin))
 
-    # acquire variants from SQLlite database
-    if options.tablename:
-        if not options.database:
-            raise ValueError("please supply both database and tablename")
-        variant_getter = VariantGetterSqlite(
-            options.database, options.tablename)
-    elif options.filename_pileup:
-        variant_getter = VariantGetterPileup(options.filename_pileup)
-    elif options.filename_vcf:
-        variant_getter = VariantGetterVCF(
-            options.filename_vcf, options.vcf_sample)
-    else:
-        raise ValueError("please specify a source of variants.")
-
     if len(options.output) == 0 or "all" in options.output:
         output_all = True
     else:
         output_all = False
 
-    if "cds" in options.output or output_all:
-        outfile_cds = E.openOutputFile("cds.fasta")
-    else:
-        outfile_cds = None
+    sections = [x for x in ("cds", "map", "peptide", "table", "gtf")
+                if x in options.output or output_all]
 
-    if "map" in options.output or output_all:
-        outfile_map = E.openOutputFile("map.psl")
-    else:
-        outfile_map = None
+    outfiles = {}
+    if "cds" in sections:
+        outfiles["cds"] = E.openOutputFile("cds.fasta")
 
-    if "peptide" in options.output or output_all:
-        outfile_peptides = E.openOutputFile("peptides.fasta")
-    else:
-        outfile_peptides = None
+    if "map" in sections:
+        outfiles["map"] = E.openOutputFile("map.psl")
+
+    if "peptide" in sections:
+        outfiles["peptide"] = E.openOutputFile("peptides.fasta")
 
-    if "table" in options.output or output_all:
-        outfile_alleles = E.openOutputFile("table")
-        outfile_alleles.write("\t".join(
+    if "table" in sections:
+        outfiles["table"] = E.openOutputFile("table")
+        outfiles["table"].write("\t".join(
             ("gene_id",
              "transcript_id", "allele_id", "contig", "strand",
              "is_wildtype",
              ("\t".join(Allele._fields)))) + "\n")
-    else:
-        outfile_alleles = None
 
-    if "gtf" in options.output or output_all:
-        outfile_gtf = E.openOutputFile("gtf")
+    if "gtf" in sections:
+        outfiles["gtf"] = E.openOutputFile("gtf")
+
+    if options.threads > 1:
+        # process genes on different contigs in parallel, each
+        # worker with its own genome and variant handles.
+        worker_options = optparse.Values(
+            dict([(key, value) for key, value in list(vars(options).items())
+                  if not hasattr(value, "read") and
+                  not hasattr(value, "write")]))
+
+        pool = multiprocessing.Pool(options.threads,
+                                    initializer=initializeWorker,
+                                    initargs=(worker_options,
+                                              seleno,
+                                              sections))
+
+        def _iterContigs():
+            # gtf entries are copied as they need to be pickled
+            for contig, genes in itertools.groupby(
+                    infile_gtf, lambda x: x[0][0].contig):
+                yield [[[GTF.Entry().copy(x) for x in transcript]
+                        for transcript in gene]
+                       for gene in genes]
+
+        results = pool.imap(processGenes, _iterContigs())
+        results = itertools.chain.from_iterable(results)
     else:
-        outfile_gtf = None
-
-    # id separatar
-    separator = options.separator
-
-    for transcripts in infile_gtf:
-
-        gene_id = transcripts[0][0].gene_id
-
-        overall_start = min([min([x.start for x in y]) for y in transcripts])
-        overall_end = max([max([x.end for x in y]) for y in transcripts])
-        contig = transcripts[0][0].contig
-        strand = transcripts[0][0].strand
-        is_positive_strand = Genomics.IsPositiveStrand(strand)
-        lcontig = fasta.getLength(contig)
-        E.info("%s: started processing on %s:%i..%i (%s)" %
-               (gene_id, contig, overall_start, overall_end, strand))
+        pool = None
+        fasta = IndexedFasta.IndexedFasta(options.genome_file)
+        variant_getter = buildVariantGetter(options)
+        results = (processGene(transcripts, fasta, variant_getter,
+                               seleno, sections, options)
+                   for transcripts in infile_gtf)
 
+    for nalleles, output in results:
         ninput += 1
-        extended_start = max(0, overall_start - options.border)
-        extended_end = min(lcontig, overall_end + options.border)
-
-        # if contig.startswith("chr"): contig = contig[3:]
-
-        variants = variant_getter(contig, extended_start, extended_end)
-
-        E.debug("%s: found %i variants in %s:%i..%i" %
-                (gene_id, len(variants), contig, extended_start, extended_end))
+        noutput += nalleles
+        for section, lines in list(output.items()):
+            outfiles[section].write("".join(lines))
 
-        if E.global_options.loglevel >= 10:
-            print("# collected variants:", variants)
-
-        # collect intron/exon sequences
-        # coordinates are forward/reverse
-        # also updates the coordinates in transcripts
-        all_exons, all_introns = collectExonIntronSequences(transcripts, fasta)
-
-        # update variants such that they use the same coordinates
-        # as the transcript
-        variants = Variants.updateVariants(variants, lcontig, strand)
-
-        # deal with overlapping but consistent variants
-        variants = Variants.mergeVariants(variants)
-
-        E.debug("%s: found %i variants after merging in %s:%i..%i" %
-                (gene_id, len(variants), contig, extended_start, extended_end))
-
-        if E.global_options.loglevel >= 10:
-            print("# merged variants:", variants)
-
-        # collect coordinate offsets and remove conflicting variants
-        variants, removed_variants, offsets = Variants.buildOffsets(
-            variants, contig=contig)
-
-        if len(removed_variants) > 0:
-            E.warn("removed %i conflicting variants" % len(removed_variants))
-            for v in removed_variants:
-                E.info("removed variant: %s" % str(v))
-
-        E.info("%i variants after filtering" % len(variants))
-
-        if len(variants) > 0:
-            # build variants
-            indexed_variants = Variants.indexVariants(variants)
-
-            # update exon sequences according to variants
-            variant_exons = buildVariantSequences(indexed_variants, all_exons)
-
-            # update intron sequences according to variants
-            variant_introns = buildVariantSequences(
-                indexed_variants, all_introns)
-
-            if E.global_options.loglevel >= 10:
-                for key in variant_exons:
-                    print("exon", key)
-                    Genomics.printPrettyAlignment(
-                        all_exons[key],
-                        variant_exons[key][0],
-                        variant_exons[key][1],
-                    )
-                for key in variant_introns:
-                    print("intron", key)
-                    Genomics.printPrettyAlignment(
-                        all_introns[key][:30] + all_introns[key][-30:],
-                        variant_introns[key][0][:30] +
-                        variant_introns[key][0][-30:],
-                        variant_introns[key][1][:30] + variant_introns[key][1][-30:])
-
-        else:
-            variant_exons, variant_introns = None, None
-
-        for transcript in transcripts:
-
-            transcript.sort(key=lambda x: x.start)
-
-            transcript_id = transcript[0].transcript_id
-            alleles = buildAlleles(transcript,
-                                   variant_exons,
-                                   variant_introns,
-                                   all_exons,
-                                   all_introns,
-                                   offsets,
-                                   is_seleno=transcript_id in seleno,
-                                   reference_coordinates=False,
-                                   )
-
-            ##############################################################
-            ##############################################################
-            ##############################################################
-            # output
-            for aid, al in enumerate(alleles):
-
-                allele, map_cds2reference = al
-
-                reference_cds_sequence = buildCDSSequence(
-                    transcript, all_exons)
-                is_wildtype = reference_cds_sequence == allele.cds
-
-                allele_id = str(aid)
-                assert len(allele.exon_starts) == allele.nexons
-                assert len(allele.cds_starts) == allele.nexons
-                assert len(allele.frames) == allele.nexons
-
-                # the output id
-                outid = separator.join((gene_id, transcript_id, allele_id))
-
-                # output map between cds and reference
-                if outfile_map and map_cds2reference:
-                    match = Blat.Match()
-                    match.mQueryId = allele_id
-                    match.mQueryLength = allele.cds_len
-                    match.mSbjctId = contig
-                    match.mSbjctLength = lcontig
-                    match.strand = strand
-                    match.fromMap(map_cds2reference, use_strand=True)
-                    outfile_map.write("%s\n" % str(match))
-
-                # only output sequences for genes that have not been knocked
-                # out, unless required
-                if not allele.is_nmd_knockout or options.with_knockouts:
-
-                    if outfile_gtf:
-                        gtf = GTF.Entry()
-                        gtf.gene_id = gene_id
-                        gtf.transcript_id = transcript_id
-                        gtf.addAttribute("allele_id", allele_id)
-                        gtf.contig = contig
-                        gtf.strand = strand
-                        gtf.feature = "CDS"
-                        gtf.source = "gtfxnsps"
-                        l = 0
-                        last_cds_start = allele.cds_starts[0]
-                        gtf.start = allele.exon_starts[0]
-                        gtf.frame = allele.frames[0]
-
-                        for exon_start, cds_start, frame in zip(allele.exon_starts[1:],
-                                                                allele.cds_starts[
-                                                                    1:],
-                                                                allele.frames[1:]):
-                            cds_length = cds_start - last_cds_start
-                            gtf.end = gtf.start + cds_length
-                            if not is_positive_strand:
-                                gtf.start, gtf.end = lcontig - \
-                                    gtf.end, lcontig - gtf.start
-                            outfile_gtf.write(str(gtf) + "\n")
-
-                            gtf.start = exon_start
-                            gtf.frame = frame
-
-                            l += cds_length
-                            last_cds_start = cds_start
-
-                        cds_length = len(allele.cds) - last_cds_start
-                        gtf.end = gtf.start + cds_length
-                        if not is_positive_strand:
-                            gtf.start, gtf.end = lcontig - \
-                                gtf.end, lcontig - gtf.start
-                        outfile_gtf.write(str(gtf) + "\n")
-
-                    if outfile_cds:
-                        outfile_cds.write(">%s\n%s\n" % (outid, allele.cds))
-                    if outfile_peptides:
-                        outfile_peptides.write(
-                            ">%s\n%s\n" % (outid, allele.peptide))
-
-                # reformat for tabular output
-                allele = allele._replace(
-                    cds_starts=",".join(map(str, allele.cds_starts)),
-                    exon_starts=",".join(map(str, allele.exon_starts)),
-                    frames=",".join(map(str, allele.frames)))
-
-                # convert reference coordinates to positive strand coordinates
-                if allele.reference_first_stop_start >= 0 and not is_positive_strand:
-                    allele = allele._replace(
-                        reference_first_stop_start=lcontig -
-                        allele.reference_first_stop_end,
-                        reference_first_stop_end=lcontig - allele.reference_first_stop_start, )
-
-                if outfile_alleles:
-                    outfile_alleles.write("%s\t%s\n" % (
-                        "\t".join((gene_id,
-                                   transcript_id,
-                                   allele_id,
-                                   contig,
-                                   strand,
-                                   "%i" % is_wildtype)),
-                        "\t".join(map(str, allele))))
-
-                noutput += 1
-                # only output first allele (debugging)
-                # break
+    if pool:
+        pool.close()
+        pool.join()
 
+    for outfile in list(outfiles.values()):
+        outfile.close()
     E.info("ninput=%i, noutput=%i, nskipped=%i" % (ninput, noutput, nskipped))
 
     # write footer and output benchmark information.
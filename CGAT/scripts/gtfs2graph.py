@@ -10,6 +10,9 @@ Purpose
 This script compares two :term:`gtf` output files and outputs a bi-partite
 graph connecting overlapping genes.
 
+If both files are sorted by contig and start, they are compared in a
+single pass without building an index in memory.
+
 Usage
 -----
 
@@ -31,8 +34,8 @@ import sys
 import CGAT.Experiment as E
 import CGAT.GTF as GTF
 import CGAT.IOTools as IOTools
+import CGAT.Intervals as Intervals
 import bx.intervals.intersection
-import numpy
 
 
 class Counter:
@@ -72,39 +75,65 @@ class Counter:
         infile.close()
         return idx
 
-    def _count(self, filename, idx):
+    @E.cachedmethod
+    def isSorted(self, filename):
+        """return True if filename is sorted by contig and start."""
+        infile = IOTools.openFile(filename, "r")
+        is_sorted = Intervals.isSorted(GTF.iterator(infile))
+        infile.close()
+        return is_sorted
+
+    def iterateOverlaps(self, filename1, filename2):
+        """iterate over entries in filename1 and return
+        overlapping entries in filename2.
+
+        If both files are sorted by position, they are compared
+        in a single pass. Otherwise, filename2 is indexed.
+        """
+        infile = IOTools.openFile(filename1, "r")
+
+        if self.isSorted(filename1) and self.isSorted(filename2):
+            E.debug("comparing sorted files %s and %s" %
+                    (filename1, filename2))
+            infile2 = IOTools.openFile(filename2, "r")
+            for this, others in Intervals.iterator_overlapping(
+                    GTF.iterator(infile), GTF.iterator(infile2)):
+                yield this, others
+            infile2.close()
+        else:
+            idx = self.buildIndex(filename2)
+            for this in GTF.iterator(infile):
+                try:
+                    others = [x.value for x in
+                              idx[this.contig].find(this.start, this.end)]
+                except KeyError:
+                    others = []
+                yield this, others
+
+        infile.close()
+
+    def _count(self, filename1, filename2):
 
         overlapping_genes = set()
         genes = set()
-        # iterate over exons
-        infile = IOTools.openFile(filename, "r")
-        it = GTF.iterator(infile)
 
         nexons, nexons_overlapping = 0, 0
         nbases, nbases_overlapping = 0, 0
-        for this in it:
+        # iterate over exons
+        for this, intervals in self.iterateOverlaps(filename1, filename2):
             nexons += 1
             nbases += this.end - this.start
             genes.add(this.gene_id)
 
-            try:
-                intervals = idx[this.contig].find(this.start, this.end)
-            except KeyError:
-                continue
-
             if len(intervals) == 0:
                 continue
 
             overlapping_genes.add(this.gene_id)
             nexons_overlapping += 1
             start, end = this.start, this.end
-            counts = numpy.zeros(end - start, numpy.int)
-            for other in intervals:
-                for x in range(max(start, other.start) - start, min(end, other.end) - start):
-                    counts[x] += 1
-            nbases_overlapping += sum([1 for x in counts if x > 0])
-
-        infile.close()
+            nbases_overlapping += Intervals.getLength(Intervals.combine(
+                [(max(start, other.start), min(end, other.end))
+                 for other in intervals]))
 
         return len(genes), len(overlapping_genes), nexons, nexons_overlapping, nbases, nbases_overlapping
 
@@ -113,23 +142,19 @@ class Counter:
 
         E.info("counting started for %s versus %s" % (filename1, filename2))
 
-        idx2 = self.buildIndex(filename2)
-
         (self.mGenes1, self.mGenesOverlapping1,
          self.mExons1, self.mExonsOverlapping1,
          self.mBases1, self.mBasesOverlapping1 ) = \
-            self._count(filename1, idx2)
+            self._count(filename1, filename2)
 
         self.mGenesUnique1 = self.mGenes1 - self.mGenesOverlapping1
         self.mExonsUnique1 = self.mExons1 - self.mExonsOverlapping1
         self.mBasesUnique1 = self.mBases1 - self.mBasesOverlapping1
 
-        idx1 = self.buildIndex(filename1)
-
         (self.mGenes2, self.mGenesOverlapping2,
          self.mExons2, self.mExonsOverlapping2,
          self.mBases2, self.mBasesOverlapping2 ) = \
-            self._count(filename2, idx1)
+            self._count(filename2, filename1)
 
         self.mGenesUnique2 = self.mGenes2 - self.mGenesOverlapping2
         self.mExonsUnique2 = self.mExons2 - self.mExonsOverlapping2
@@ -175,39 +200,25 @@ class CounterGenes(Counter):
         h = ["genes", "gene2"]
         return "\t".join(h)
 
-    def _run(self, filename, idx):
-
-        # iterate over exons
-        infile = IOTools.openFile(filename, "r")
-        it = GTF.iterator(infile)
+    def _run(self, filename1, filename2):
 
         keys = set()
 
-        for this in it:
-
-            try:
-                intervals = idx[this.contig].find(this.start, this.end)
-            except KeyError:
-                continue
-
-            if len(intervals) == 0:
-                continue
+        # iterate over exons
+        for this, intervals in self.iterateOverlaps(filename1, filename2):
 
-            for i in intervals:
-                key = "%s-%s" % (this.gene_id, i.value.gene_id)
+            for other in intervals:
+                key = "%s-%s" % (this.gene_id, other.gene_id)
                 if key not in keys:
-                    self.write(this.gene_id, i.value.gene_id)
+                    self.write(this.gene_id, other.gene_id)
                     keys.add(key)
 
-        infile.close()
-
     def run(self, filename1, filename2):
         """count overlap between two gtf files."""
 
         E.info("counting started for %s versus %s" % (filename1, filename2))
 
-        idx2 = self.buildIndex(filename2)
-        self._run(filename1, idx2)
+        self._run(filename1, filename2)
 
 
 def main(argv=None):
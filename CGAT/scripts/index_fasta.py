@@ -133,6 +133,17 @@ def main(argv=None):
                      dest="benchmark_fragment_size",
                      type="int",
                      help="benchmark: fragment size [default=%default].")
+    group.add_option("--benchmark-access",
+                     dest="benchmark_access",
+                     type="choice",
+                     choices=("random", "sequential"),
+                     help="benchmark: access pattern. Sequential access "
+                     "reads consecutive fragments [default=%default].")
+    group.add_option("--cache-size",
+                     dest="cache_size",
+                     type="int",
+                     help="number of decompressed blocks to cache for "
+                     "compressed databases [default=%default].")
     parser.add_option_group(group)
 
     group = E.OptionGroup(parser, "Validation options")
@@ -211,6 +222,8 @@ def main(argv=None):
         benchmark_fragment_size=1000,
         benchmark_num_iterations=1000000,
         benchmark=False,
+        benchmark_access="random",
+        cache_size=IndexedFasta.DEFAULT_CACHE_SIZE,
         compression=None,
         random_access_points=0,
         synonyms=None,
@@ -266,11 +279,18 @@ def main(argv=None):
 
     elif options.benchmark:
         import timeit
-        timer = timeit.Timer(
-            stmt="IndexedFasta.benchmarkRandomFragment(fasta=fasta, size=%i)" %
-            (options.benchmark_fragment_size),
-            setup="from CGAT import IndexedFasta\n"
-            "fasta=IndexedFasta.IndexedFasta('%s')" % (args[0]))
+        setup = ("from CGAT import IndexedFasta\n"
+                 "fasta=IndexedFasta.IndexedFasta('%s', cache_size=%i)" %
+                 (args[0], options.cache_size))
+        if options.benchmark_access == "random":
+            stmt = ("IndexedFasta.benchmarkRandomFragment("
+                    "fasta=fasta, size=%i)" %
+                    options.benchmark_fragment_size)
+        else:
+            setup += ("\nfragments=IndexedFasta.iterateSequentialFragments("
+                      "fasta, %i)" % options.benchmark_fragment_size)
+            stmt = "next(fragments)"
+        timer = timeit.Timer(stmt=stmt, setup=setup)
 
         t = timer.timeit(number=options.benchmark_num_iterations)
         options.stdout.write("iter\tsize\ttime\n")
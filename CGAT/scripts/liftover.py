@@ -9,12 +9,46 @@ Purpose
 
 liftover coordinates using a liftover formatted file from the ucsc.
 
+The chain file is converted into a compact list of ungapped chain
+blocks sorted by their position on the source genome. Coordinates
+are mapped by looking up the block containing a position with a
+binary search. If blocks of different chains overlap, a position is
+mapped by the chain that appears last in the chain file.
+
+The block list can be saved with ``--cache-file``. If the cache
+exists and is more recent than the chain file, it is memory-mapped
+instead of parsing the chain file again.
+
+Input is processed in chunks of ``--chunk-size`` records. The
+following input formats are recognized (``--input-format``):
+
+positions
+   :term:`bed` formatted intervals. Output the mapped position of
+   every base in each interval.
+
+bed
+   :term:`bed` formatted intervals.
+
+gtf
+   :term:`gtf` formatted intervals.
+
+psl
+   :term:`psl` formatted alignments. The target coordinates are
+   converted. Each alignment block needs to map within a single
+   chain block.
+
+An interval is mapped if its first and last base map to the same
+chain. The mapped interval spans from the mapped first to the mapped
+last base. If the chain is on the negative strand, the strand of the
+interval is inverted. Intervals that can not be mapped are removed.
+
 Usage
 -----
 
 Example::
 
-   python liftover.py --help
+   python liftover.py --map=hg18ToHg19.over.chain.gz
+                      --input-format=bed < in.bed > out.bed
 
 Type::
 
@@ -27,71 +61,241 @@ Command line options
 
 '''
 
+import os
 import sys
+import heapq
+import itertools
 import numpy
 import CGAT.Experiment as E
 import CGAT.IOTools as IOTools
+import CGAT.Blat as Blat
+
+if sys.version_info.major >= 3:
+    import pickle as pickle
+else:
+    import cPickle as pickle
+
+
+class LiftOverMap(object):
+
+    '''map coordinates between two assemblies using chain blocks.
+
+    Blocks are stored in a (6, nblocks) integer array with the
+    following rows:
+
+    0. start of the block on the source contig
+    1. end of the block on the source contig
+    2. position of the first base of the block on the target
+       contig (forward strand coordinates)
+    3. index of the target contig
+    4. strand of the target (1 or -1)
+    5. index of the chain in the chain file
+
+    Blocks are sorted by source contig and start and do not
+    overlap.
+    '''
+
+    def __init__(self, blocks, contigs, targets):
+        self.mBlocks = blocks
+        self.mStarts, self.mEnds, self.mTargets, self.mTargetIds, \
+            self.mStrands, self.mChainIds = blocks
+        # source contig -> (offset, number of blocks)
+        self.mContigs = contigs
+        # list of (target contig, size)
+        self.mTargetContigs = targets
+
+    def __len__(self):
+        return self.mBlocks.shape[1]
+
+    def save(self, filename):
+        '''save map to *filename*.
+
+        The blocks are saved in :file:`filename.npy` and the contigs
+        in :file:`filename.contigs`.
+        '''
+        numpy.save(filename + ".npy", numpy.asarray(self.mBlocks))
+        with open(filename + ".contigs", "wb") as outf:
+            pickle.dump((self.mContigs, self.mTargetContigs), outf)
+
+    @classmethod
+    def load(cls, filename, mmap_mode="r"):
+        '''load map from *filename*.
+
+        The blocks are memory-mapped with *mmap_mode*
+        (see :func:`numpy.load`).
+        '''
+        blocks = numpy.load(filename + ".npy", mmap_mode=mmap_mode)
+        with open(filename + ".contigs", "rb") as inf:
+            contigs, targets = pickle.load(inf)
+        return cls(blocks, contigs, targets)
+
+    def getTarget(self, block):
+        '''return target contig and strand of *block*.'''
+        contig, size = self.mTargetContigs[self.mTargetIds[block]]
+        if self.mStrands[block] > 0:
+            return contig, "+"
+        else:
+            return contig, "-"
+
+    def getTargetSize(self, block):
+        '''return size of target contig of *block*.'''
+        return self.mTargetContigs[self.mTargetIds[block]][1]
+
+    def mapPositions(self, contig, positions):
+        '''map *positions* on *contig*.
+
+        Returns a tuple of two arrays with the block that a
+        position falls into and the position on the target
+        contig. Positions that can not be mapped are assigned to
+        block -1.
+        '''
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        blocks = numpy.empty(len(positions), dtype=numpy.int64)
+        blocks.fill(-1)
+        mapped = numpy.zeros(len(positions), dtype=numpy.int64)
+
+        if contig not in self.mContigs or len(positions) == 0:
+            return blocks, mapped
+
+        offset, nblocks = self.mContigs[contig]
+        starts = self.mStarts[offset:offset + nblocks]
+        idx = numpy.searchsorted(starts, positions, side="right") - 1
+        found = idx >= 0
+        idx = numpy.maximum(idx, 0) + offset
+        found &= positions < self.mEnds[idx]
+
+        delta = positions - self.mStarts[idx]
+        mapped = numpy.where(self.mStrands[idx] > 0,
+                             self.mTargets[idx] + delta,
+                             self.mTargets[idx] - delta)
+        blocks[found] = idx[found]
+        mapped[~found] = 0
+        return blocks, mapped
+
+    def mapIntervals(self, contigs, starts, ends):
+        '''map intervals given by arrays of *contigs*, *starts* and
+        *ends*.
+
+        Returns a tuple of arrays with the first and last block, the
+        start and the end of the mapped interval. The first block is
+        -1 if the interval could not be mapped.
+        '''
+        contigs = numpy.asarray(contigs)
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        ends = numpy.asarray(ends, dtype=numpy.int64)
+
+        first_blocks = numpy.empty(len(starts), dtype=numpy.int64)
+        last_blocks = numpy.empty(len(starts), dtype=numpy.int64)
+        first_mapped = numpy.zeros(len(starts), dtype=numpy.int64)
+        last_mapped = numpy.zeros(len(starts), dtype=numpy.int64)
+
+        for contig in numpy.unique(contigs):
+            take = numpy.nonzero(contigs == contig)[0]
+            first_blocks[take], first_mapped[take] = self.mapPositions(
+                str(contig), starts[take])
+            last_blocks[take], last_mapped[take] = self.mapPositions(
+                str(contig), ends[take] - 1)
+
+        found = (first_blocks >= 0) & (last_blocks >= 0) & \
+            (ends > starts)
+        found[found] &= self.mChainIds[first_blocks[found]] == \
+            self.mChainIds[last_blocks[found]]
+
+        first_blocks[~found] = -1
+        new_starts = numpy.minimum(first_mapped, last_mapped)
+        new_ends = numpy.maximum(first_mapped, last_mapped) + 1
+        return first_blocks, last_blocks, new_starts, new_ends
+
+
+def removeOverlappingBlocks(starts, ends, order):
+    '''resolve overlaps between blocks.
+
+    Returns a list of (start, end, block) tuples of non-overlapping
+    segments. Each segment is assigned to the block with the highest
+    *order* covering it.
+    '''
+    boundaries = numpy.unique(numpy.concatenate((starts, ends)))
+    sorted_blocks = numpy.argsort(starts, kind="mergesort")
+
+    segments = []
+    heap = []
+    x = 0
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        while x < len(sorted_blocks) and \
+                starts[sorted_blocks[x]] <= start:
+            block = sorted_blocks[x]
+            heapq.heappush(heap, (-order[block], block))
+            x += 1
+        while heap and ends[heap[0][1]] <= start:
+            heapq.heappop(heap)
+        if not heap:
+            continue
+        block = heap[0][1]
+        if segments and segments[-1][2] == block and \
+                segments[-1][1] == start:
+            segments[-1] = (segments[-1][0], end, block)
+        else:
+            segments.append((start, end, block))
+    return segments
 
 
-def readLiftOver(infile, chromosome,
-                 chromosome_size=250000000,
+def readLiftOver(infile, chromosome=None,
                  report_step=1000000):
-    """read a matrix. There probably is a routine for this in Numpy, which
-    I haven't found yet.
-    """
-
-    if options.loglevel >= 2:
-        print("## started reading mapping information")
-        sys.stdout.flush()
+    """read chain blocks from a liftover formatted file.
 
-    map_position = numpy.zeros((chromosome_size,), numpy.int)
+    If *chromosome* is given, only chains for this source
+    chromosome are read.
 
-    # signed character for chromosme, negative values for negative strands
-    map_chromosome = numpy.zeros((chromosome_size,), numpy.int8)
+    Returns a :class:`LiftOverMap`.
+    """
 
-    map_id2chromosome = ["", ]
-    map_chromosome2id = {}
-    n = 0
+    # lists of block starts, sizes, target starts, target ids,
+    # strand and chain index per source contig
+    blocks = {}
+    target2id, targets = {}, []
+    nchains, n = 0, 0
+    keep = False
 
     for line in infile:
 
         n += 1
-
         if not (n % report_step):
-            if options.loglevel >= 2:
-                print("# iteration %i" % n)
-                sys.stdout.flush()
+            E.debug("iteration %i" % n)
 
-        if line[:5] == "chain":
+        if line.startswith("chain"):
             (chr_x, size_x, strand_x, first_x, last_x,
-             chr_y, size_y, strand_y, first_y, last_y,
-             dontknow) = line[:-1].split(" ")[2:]
+             chr_y, size_y, strand_y, first_y, last_y) = \
+                line[:-1].split()[2:12]
 
             if strand_x == "-":
                 raise ValueError("what shall I do with negative strands?")
 
+            keep = chromosome is None or chr_x == chromosome
+            if not keep:
+                continue
+
+            if chr_y not in target2id:
+                target2id[chr_y] = len(targets)
+                targets.append((chr_y, int(size_y)))
+
             x = int(first_x)
 
-            # revert coordinates for negative strands (it seems that
-            # the mapping file uses reverse coordinates, while liftover
-            # output doesn't)
-            # add 1 to coordinates, because 0 is flag for unmappable.
+            # chain files use reverse coordinates on the negative
+            # strand. y is the forward strand coordinate of the
+            # next base to be aligned.
             if strand_y == "-":
-                invert = True
-                # no +1, because already one past current residue (due to open
-                # bracket)
-                y = int(size_y) - int(first_y)
-            else:
-                invert = False
-                y = int(first_y) + 1
-
-            if chr_x != chromosome:
-                keep = False
+                strand = -1
+                y = int(size_y) - int(first_y) - 1
             else:
-                keep = True
-                if options.loglevel >= 3:
-                    print("# adding alignment", line[:-1])
-
+                strand = 1
+                y = int(first_y)
+
+            if chr_x not in blocks:
+                blocks[chr_x] = ([], [], [], [], [], [])
+            contig_blocks = blocks[chr_x]
+            target_id = target2id[chr_y]
+            chain_id = nchains
+            nchains += 1
             continue
 
         elif line.strip() == "":
@@ -100,37 +304,24 @@ def readLiftOver(infile, chromosome,
 
         elif keep:
 
-            data = list(map(int, line[:-1].split("\t")))
+            data = list(map(int, line[:-1].split()))
 
             if len(data) == 3:
                 size, increment_x, increment_y = data
             else:
                 size, increment_x, increment_y = data[0], 0, 0
 
-            # add position
-            if invert:
-                map_position[x:x + size] = numpy.arrayrange(y, y - size, -1)
-            else:
-                map_position[x:x + size] = numpy.arrayrange(y, y + size, 1)
-
-            if chr_y not in map_id2chromosome:
-                map_chromosome2id[chr_y] = len(map_id2chromosome)
-                map_id2chromosome.append(chr_y)
-
-            id = map_chromosome2id[chr_y]
-            if strand_y == "-":
-                id = -id
-
-            # add chromsome
-            map_chromosome[x:x + size] = id
+            contig_blocks[0].append(x)
+            contig_blocks[1].append(size)
+            contig_blocks[2].append(y)
+            contig_blocks[3].append(target_id)
+            contig_blocks[4].append(strand)
+            contig_blocks[5].append(chain_id)
 
             x += increment_x + size
-            if invert:
-                y -= increment_y + size
-            else:
-                y += increment_y + size
+            y += strand * (increment_y + size)
 
-            if y < 0:
+            if y < -1:
                 raise ValueError(
                     "illegal mapping: %i -> %i for %s %s:%s-%s(%s) "
                     "to %s %s: %s-%s(%s)" % (
@@ -138,7 +329,189 @@ def readLiftOver(infile, chromosome,
                         chr_x, strand_x, first_x, last_x, size_x,
                         chr_y, strand_y, first_y, last_y, size_y))
 
-    return map_position, map_chromosome, map_chromosome2id, map_id2chromosome
+    arrays, contigs, offset = [], {}, 0
+    for contig, data in sorted(blocks.items()):
+        starts, sizes, ys, target_ids, strands, chain_ids = [
+            numpy.array(x, dtype=numpy.int64) for x in data]
+        ends = starts + sizes
+
+        order = numpy.argsort(starts, kind="mergesort")
+        if numpy.any(starts[order][1:] < ends[order][:-1]):
+            segments = removeOverlappingBlocks(starts, ends, chain_ids)
+            E.debug("resolved overlapping blocks on %s: %i blocks -> "
+                    "%i segments" % (contig, len(starts), len(segments)))
+            new_starts, new_ends, order = [
+                numpy.array(x, dtype=numpy.int64) for x in zip(*segments)]
+            ys = ys[order] + strands[order] * (new_starts - starts[order])
+            starts, ends = new_starts, new_ends
+        else:
+            starts, ends, ys = starts[order], ends[order], ys[order]
+
+        arrays.append(numpy.vstack((starts, ends, ys,
+                                    target_ids[order],
+                                    strands[order],
+                                    chain_ids[order])))
+        contigs[contig] = (offset, len(starts))
+        offset += len(starts)
+
+    if arrays:
+        data = numpy.hstack(arrays)
+    else:
+        data = numpy.zeros((6, 0), dtype=numpy.int64)
+
+    E.info("read %i chains with %i blocks on %i contigs" %
+           (nchains, data.shape[1], len(contigs)))
+
+    return LiftOverMap(data, contigs, targets)
+
+
+def buildLiftOverMap(filename_map, cache_file=None, chromosome=None):
+    '''return a :class:`LiftOverMap` for *filename_map*.
+
+    If *cache_file* is given, the map is loaded from the cache
+    if it is more recent than *filename_map*. Otherwise the map is
+    built and saved in the cache.
+    '''
+    if cache_file:
+        if os.path.exists(cache_file + ".npy") and \
+           os.path.exists(cache_file + ".contigs") and \
+           os.path.getmtime(cache_file + ".npy") >= \
+           os.path.getmtime(filename_map):
+            E.info("loading chain blocks from %s" % cache_file)
+            return LiftOverMap.load(cache_file)
+        # the cache keeps all contigs
+        chromosome = None
+
+    liftover = readLiftOver(IOTools.openFile(filename_map, "r"),
+                            chromosome)
+    if cache_file:
+        E.info("saving chain blocks to %s" % cache_file)
+        liftover.save(cache_file)
+    return liftover
+
+
+def invertStrand(strand):
+    return {"+": "-", "-": "+"}.get(strand, strand)
+
+
+def iterChunks(infile, chunk_size):
+    '''iterate over lines in *infile* in chunks of *chunk_size*
+    lines, skipping comments and empty lines.'''
+    lines = (x for x in infile if x.strip() and not x.startswith("#"))
+    while 1:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def convertPositions(liftover, lines, options):
+    '''output mapped position of every base in bed intervals.'''
+    noutput = 0
+    for line in lines:
+        data = line[:-1].split("\t")
+        contig = data[0]
+        if options.chromosome and contig != options.chromosome:
+            continue
+        if options.loglevel >= 1:
+            options.stdout.write("# %s\n" % line[:-1])
+        positions = numpy.arange(int(data[1]), int(data[2]))
+        blocks, mapped = liftover.mapPositions(contig, positions)
+        for position, block, pos in zip(positions, blocks, mapped):
+            if block < 0:
+                continue
+            target, strand = liftover.getTarget(block)
+            options.stdout.write("%s\t%i\t%s\t%s\t%i\n" % (
+                contig, position, target, strand, pos))
+            noutput += 1
+    return noutput
+
+
+def convertIntervals(liftover, lines, options):
+    '''map bed or gtf formatted intervals.'''
+
+    if options.input_format == "bed":
+        start_col, end_col, strand_col, offset = 1, 2, 5, 0
+    else:
+        start_col, end_col, strand_col, offset = 3, 4, 6, 1
+
+    records = [x[:-1].split("\t") for x in lines]
+    blocks, last_blocks, starts, ends = liftover.mapIntervals(
+        [x[0] for x in records],
+        [int(x[start_col]) - offset for x in records],
+        [int(x[end_col]) for x in records])
+
+    noutput = 0
+    for data, block, start, end in zip(records, blocks, starts, ends):
+        if block < 0:
+            continue
+        data[0], strand = liftover.getTarget(block)
+        data[start_col] = str(start + offset)
+        data[end_col] = str(end)
+        if strand == "-" and len(data) > strand_col:
+            data[strand_col] = invertStrand(data[strand_col])
+        options.stdout.write("\t".join(data) + "\n")
+        noutput += 1
+    return noutput
+
+
+def convertAlignments(liftover, lines, options):
+    '''map target coordinates of psl formatted alignments.'''
+
+    matches = []
+    for line in lines:
+        if line.startswith("match") or line.startswith("psLayout") or \
+           not line[0].isdigit():
+            continue
+        match = Blat.Match()
+        match.fromTable(line[:-1].split("\t"))
+        matches.append(match)
+
+    # map all blocks of all alignments at once
+    nblocks = [len(x.mBlockSizes) for x in matches]
+    contigs = [x.mSbjctId for x, n in zip(matches, nblocks)
+               for y in range(n)]
+    starts = [y for x in matches for y in x.mSbjctBlockStarts]
+    ends = [y + z for x in matches
+            for y, z in zip(x.mSbjctBlockStarts, x.mBlockSizes)]
+    first_blocks, last_blocks, new_starts, new_ends = \
+        liftover.mapIntervals(contigs, starts, ends)
+
+    noutput, offset = 0, 0
+    for match, n in zip(matches, nblocks):
+        b = first_blocks[offset:offset + n]
+        s = new_starts[offset:offset + n]
+        offset += n
+
+        # each block needs to map within a single chain block
+        # and all blocks to the same chain
+        if numpy.any(b < 0) or \
+           numpy.any(b != last_blocks[offset - n:offset]) or \
+           len(numpy.unique(liftover.mChainIds[b])) != 1:
+            continue
+
+        target, strand = liftover.getTarget(b[0])
+        match.mSbjctId = target
+        match.mSbjctLength = liftover.getTargetSize(b[0])
+        match.mSbjctBlockStarts = [int(x) for x in s]
+        if strand == "-":
+            # blocks are now in reverse order on the target
+            match.mSbjctBlockStarts.reverse()
+            match.mBlockSizes.reverse()
+            match.mQueryBlockStarts = [
+                match.mQueryLength - x - y
+                for x, y in zip(match.mQueryBlockStarts,
+                                reversed(match.mBlockSizes))]
+            match.mQueryBlockStarts.reverse()
+            match._switchQueryStrandFlag()
+
+        match.mSbjctFrom = match.mSbjctBlockStarts[0]
+        match.mSbjctTo = match.mSbjctBlockStarts[-1] + \
+            match.mBlockSizes[-1]
+        options.stdout.write(str(match) + "\n")
+        noutput += 1
+
+    return noutput
 
 
 def main(argv=None):
@@ -151,7 +524,8 @@ def main(argv=None):
         argv = sys.argv
 
     parser = E.OptionParser(
-        version="%prog version: $Id$")
+        version="%prog version: $Id$",
+        usage=globals()["__doc__"])
 
     parser.add_option("-c", "--chromosome", dest="chromosome", type="string",
                       help="chromosome to take.")
@@ -160,9 +534,25 @@ def main(argv=None):
                       help="filename with mapping info.",
                       metavar="FILE")
 
+    parser.add_option("-i", "--input-format", dest="input_format",
+                      type="choice",
+                      choices=("positions", "bed", "gtf", "psl"),
+                      help="input format [default=%default].")
+
+    parser.add_option("--cache-file", dest="cache_file", type="string",
+                      help="filename prefix of a cache for the chain "
+                      "blocks [default=%default].")
+
+    parser.add_option("--chunk-size", dest="chunk_size", type="int",
+                      help="number of records to convert in one batch "
+                      "[default=%default].")
+
     parser.set_defaults(
         filename_map="",
         chromosome=None,
+        input_format="positions",
+        cache_file=None,
+        chunk_size=100000,
     )
 
     (options, args) = E.Start(parser)
@@ -171,46 +561,23 @@ def main(argv=None):
         raise ValueError("please specify the file with the "
                          "liftover mapping information")
 
-    if not options.chromosome:
-        raise ValueError("please give a chromosome")
-
-    map_position, map_chromosome, map_chromosome2id, \
-        map_id2chromosome = readLiftOver(
-            IOTools.openFile(options.filename_map, "r"),
-            options.chromosome)
+    liftover = buildLiftOverMap(options.filename_map,
+                                options.cache_file,
+                                options.chromosome)
 
-    l = 0
+    if options.input_format == "positions":
+        converter = convertPositions
+    elif options.input_format in ("bed", "gtf"):
+        converter = convertIntervals
+    elif options.input_format == "psl":
+        converter = convertAlignments
 
-    for line in options.stdin:
-
-        if line[0] == "#":
-            continue
-
-        data = line[:-1].split("\t")
+    ninput, noutput = 0, 0
+    for lines in iterChunks(options.stdin, options.chunk_size):
+        ninput += len(lines)
+        noutput += converter(liftover, lines, options)
 
-        chromosome = data[0]
-        range_from, range_to = int(data[1]), int(data[2])
-        l += 1
-
-        if chromosome == options.chromosome:
-
-            if options.loglevel >= 1:
-                print("#", l, ":", line[:-1])
-
-            for x in range(range_from, range_to):
-                if map_position[x]:
-                    id = map_chromosome[x]
-                    if id > 0:
-                        c = "+"
-                    else:
-                        c = "-"
-                        id = -id
-
-                    print("%s\t%i\t%s\t%s\t%i" % (
-                        chromosome, x, map_id2chromosome[id], c, map_position[x] - 1))
-                else:
-                    pass
-                    # print "%s\t%i\tna" % (chromosome, x )
+    E.info("ninput=%i, noutput=%i" % (ninput, noutput))
 
     E.Stop()
 
@@ -7,9 +7,20 @@ mask_fasta.py - mask fasta formatted sequences
 Purpose
 -------
 
-If the file contains multiple sequence entries, it is split
-at entry boundaries. Currently, individual entries are not
-split.
+Mask sequences in a fasta formatted file. Regions can be masked
+from a list of regions (``--mask-regions``) and low complexity
+regions can be masked with a masker (``--masker``):
+
+pydust
+   in-process implementation of the DUST algorithm. No
+   external program is required.
+
+dustmasker
+   run the external ``dustmasker`` program.
+
+Low complexity regions are returned soft-masked, i.e. in lower case.
+Sequences are masked in batches of ``--batch-size`` sequences, which
+are processed in parallel with ``--threads``.
 
 Usage
 -----
@@ -29,18 +40,18 @@ Command line options
 
 '''
 import sys
-import string
 import re
-import array
 
 import CGAT.Experiment as E
+import CGAT.IOTools as IOTools
+import CGAT.FastaIterator as FastaIterator
+import CGAT.Masker as Masker
 
 
 def maskSequence(sequence, regions, mask_char="N"):
     """mask sequence with regions."""
     nmasked = 0
-    v = array.array('c')
-    v.fromstring(sequence)
+    v = list(sequence)
     errors = []
     for start, end in regions:
 
@@ -53,7 +64,7 @@ def maskSequence(sequence, regions, mask_char="N"):
                 v[x] = mask_char
                 nmasked += 1
 
-    return v.tostring(), nmasked, errors
+    return "".join(v), nmasked, errors
 
 
 def main(argv=None):
@@ -87,12 +98,28 @@ def main(argv=None):
     parser.add_option("-m", "--mask-regions", dest="filename_mask_regions", type="string",
                       help="mask regions - parameter is a filename of regions with forward strand coordinates in the format 'contig <tab> start <tab> end'.")
 
+    parser.add_option("--masker", dest="masker", type="choice",
+                      choices=("pydust", "dustmasker"),
+                      help="mask low complexity regions with masker "
+                      "[%default].")
+
+    parser.add_option("--batch-size", dest="batch_size", type="int",
+                      help="number of sequences to submit to the masker "
+                      "in a single batch [%default].")
+
+    parser.add_option("--threads", dest="threads", type="int",
+                      help="number of processes to use for masking "
+                      "[%default].")
+
     parser.set_defaults(
         extend=0,
         format="fasta",
         filename_sequence=None,
         filename_mask_regions=None,
-        mask_char="N")
+        mask_char="N",
+        masker=None,
+        batch_size=1000,
+        threads=1)
 
     (options, args) = E.Start(parser, add_pipe_options=True)
 
@@ -122,90 +149,67 @@ def main(argv=None):
     else:
         mask_regions = None
 
+    if options.masker == "pydust":
+        masker = Masker.MaskerDust()
+    elif options.masker == "dustmasker":
+        masker = Masker.MaskerDustMasker()
+    else:
+        masker = None
+
     if options.filename_sequence:
         infile = IOTools.openFile(options.filename_sequence, "r")
     else:
-        infile = sys.stdin
+        infile = options.stdin
 
     # For large genomic sequences, reading the whole data is
-    # a stretch for memory resources. Thus proceed sequence by
-    # sequence
-
-    # read complete genomic sequences
-    fragments = []
-    sequences = []
-    key = None
-    description_rest = None
+    # a stretch for memory resources. Thus proceed in batches
+    # of sequences.
     total_keys, total_written, total_masked, nerrors = 0, 0, 0, 0
     outfile = options.stdout
 
-    for line in infile:
-        if line[0] == "#":
-            continue
-        if line[0] == ">":
-            if fragments:
-
-                if options.loglevel >= 1:
-                    options.stdlog.write("# processing sequence %s\n" % key)
-                    options.stdlog.flush()
-
-                if key in mask_regions:
-                    sequence, nmasked, errors = maskSequence(
-                        string.join(fragments, ""), mask_regions[key], options.mask_char)
-                    if errors:
-                        nerrors += len(errors)
-                        options.stdlog.write(
-                            "# %i errors while masking\n" % len(errors))
-                        for e in errors:
-                            options.stdlog.write("# %s\n" % e)
-                else:
-                    sequence = string.join(fragments, "")
-
-                if description_rest:
-                    outfile.write(">%s %s\n%s\n" %
-                                  (key, description_rest, sequence))
-                else:
-                    outfile.write(">%s\n%s\n" % (key, sequence))
+    def _iterBatches():
+        batch = []
+        for record in FastaIterator.iterate(infile):
+            batch.append(record)
+            if len(batch) >= options.batch_size * options.threads:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    for batch in _iterBatches():
+
+        sequences = []
+        for record in batch:
+            key = re.split("\s", record.title)[0]
+            E.debug("processing sequence %s" % key)
+            sequence = record.sequence
+            if mask_regions and key in mask_regions:
+                sequence, nmasked, errors = maskSequence(
+                    sequence, mask_regions[key], options.mask_char)
                 total_masked += nmasked
-                total_keys += 1
-                total_written += len(sequence)
-
-            fragments = []
-
-            x = re.split("\s", line[1:-1])
-            key = x[0]
-            description_rest = string.join(x[1:], " ")
-            continue
-        fragments.append(line[:-1])
-
-    if fragments:
-        if key in mask_regions:
-            sequence, nmasked, errors = maskSequence(
-                string.join(fragments, ""), mask_regions[key], options.mask_char)
-            if errors:
-                nerrors += len(errors)
-                options.stdlog.write(
-                    "# %i errors while masking\n" % len(errors))
-                for e in errors:
-                    options.stdlog.write("# %s\n" % e)
-        else:
-            sequence = string.join(fragments, "")
-
-    total_masked += nmasked
-    total_keys += 1
-    total_written += len(sequence)
-
-    if description_rest:
-        outfile.write(">%s %s\n%s\n" % (key, description_rest, sequence))
-    else:
-        outfile.write(">%s\n%s\n" % (key, sequence))
+                if errors:
+                    nerrors += len(errors)
+                    E.warn("%i errors while masking %s" % (len(errors), key))
+                    for e in errors:
+                        E.warn(e)
+            sequences.append(sequence)
+
+        if masker:
+            sequences = masker.maskBatch(sequences,
+                                         chunk_size=options.batch_size,
+                                         threads=options.threads)
+
+        for record, sequence in zip(batch, sequences):
+            outfile.write(">%s\n%s\n" % (record.title, sequence))
+            total_keys += 1
+            total_written += len(sequence)
 
     if options.filename_sequence:
         infile.close()
 
-    if options.loglevel >= 1:
-        options.stdlog.write("# nkeys=%i, nwritten=%i, nmasked=%i, nerrors=%i\n" % (
-            total_keys, total_written, total_masked, nerrors))
+    E.info("nkeys=%i, nwritten=%i, nmasked=%i, nerrors=%i" % (
+        total_keys, total_written, total_masked, nerrors))
 
     E.Stop()
 
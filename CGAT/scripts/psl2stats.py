@@ -31,6 +31,7 @@ Command line options
 import sys
 import CGAT.Experiment as E
 import CGAT.Blat as Blat
+import numpy
 import bx.bitset
 
 
@@ -53,26 +54,25 @@ def main(argv=None):
 
     query_bitsets, target_bitsets = {}, {}
 
-    def addRange(bitset, id, size, iterator):
+    def addRanges(bitsets, matches, by_query):
 
-        if id not in bitset:
-            bitset[id] = bx.bitset.BinnedBitSet(size)
-        b = bitset[id]
+        if by_query:
+            ids, sizes = matches.mQueryId, matches.mQueryLength
+        else:
+            ids, sizes = matches.mSbjctId, matches.mSbjctLength
 
-        for start, end in iterator:
-            b.set_range(start, end - start)
+        nblocks = matches.mBlockOffsets[1:] - matches.mBlockOffsets[:-1]
+        contigs, starts, ends = matches.getBlockCoordinates(by_query)
+        sizes = numpy.repeat(sizes, nblocks)
 
-    for psl in Blat.iterator(options.stdin):
+        for id, size, start, end in zip(contigs, sizes, starts, ends):
+            if id not in bitsets:
+                bitsets[id] = bx.bitset.BinnedBitSet(int(size))
+            bitsets[id].set_range(int(start), int(end - start))
 
-        addRange(query_bitsets,
-                 psl.mQueryId,
-                 psl.mQueryLength,
-                 psl.iterator_query_exons())
-
-        addRange(target_bitsets,
-                 psl.mSbjctId,
-                 psl.mSbjctLength,
-                 psl.iterator_sbjct_exons())
+    for matches in Blat.iterator_arrays(options.stdin):
+        addRanges(query_bitsets, matches, True)
+        addRanges(target_bitsets, matches, False)
 
     def printBitset(outfile, bitsets):
 
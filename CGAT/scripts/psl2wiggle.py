@@ -33,7 +33,6 @@ Command line options
 
 import sys
 import os
-import itertools
 import tempfile
 import subprocess
 import shutil
@@ -45,6 +44,25 @@ import CGAT.IOTools as IOTools
 import numpy
 
 
+def iterateRuns(coverage):
+    '''iterate over runs of positive coverage.
+
+    Yields tuples of (contig, start, end, value).
+    '''
+    for contig, vals in coverage.items():
+        E.debug("output for %s" % contig)
+        if len(vals) == 0:
+            continue
+        starts = numpy.concatenate(
+            ([0], numpy.nonzero(vals[1:] != vals[:-1])[0] + 1))
+        ends = numpy.concatenate((starts[1:], [len(vals)]))
+        values = vals[starts]
+        for start, end, val in zip(starts[values > 0],
+                                   ends[values > 0],
+                                   values[values > 0]):
+            yield contig, start, end, val
+
+
 def main(argv=sys.argv):
 
     parser = E.OptionParser(
@@ -60,8 +78,13 @@ def main(argv=sys.argv):
                       choices=("bedgraph", "wiggle", "bigbed", "bigwig"),
                       help="output format [default=%default]")
 
+    parser.add_option("--chunk-size", dest="chunk_size", type="int",
+                      help="number of alignments to read in one chunk "
+                      "[default=%default]")
+
     parser.set_defaults(genome_file=None,
                         typecode=numpy.int16,
+                        chunk_size=100000,
                         output_filename=None,
                         output_format="wiggle",
                         test=None)
@@ -78,13 +101,15 @@ def main(argv=sys.argv):
                (len(contig_sizes), sum(contig_sizes.values()) * typecode().itemsize))
         for contig, size in list(contig_sizes.items()):
             E.debug("allocating %s: %i bases" % (contig, size))
-            counts[contig] = numpy.zeros(size, typecode)
+            # per-base differences in coverage
+            counts[contig] = numpy.zeros(size + 1, numpy.int32)
 
         E.info("allocated memory for %i contigs" % len(fasta))
 
     else:
         fasta = None
         contig_sizes = {}
+        counts = {}
 
     if options.output_format in ("bigwig", "bigbed"):
 
@@ -126,62 +151,44 @@ def main(argv=sys.argv):
     else:
         outfile = options.stdout
 
-    iterator = Blat.BlatIterator(sys.stdin)
-
     ninput, ncontigs, nskipped = 0, 0, 0
 
     E.info("started counting")
 
-    while 1:
-
-        if options.test and ninput >= options.test:
-            break
+    for matches in Blat.iterator_arrays(options.stdin,
+                                        block_size=options.chunk_size):
 
-        match = next(iterator)
+        if options.test and ninput + len(matches) > options.test:
+            matches = matches.select(
+                numpy.arange(max(0, options.test - ninput)))
+            if len(matches) == 0:
+                break
 
-        if match is None:
-            break
-
-        ninput += 1
-
-        contig = match.mSbjctId
-
-        for start, length in zip(match.mSbjctBlockStarts, match.mBlockSizes):
-            counts[contig][start:start + length] += 1
+        ninput += len(matches)
+        matches.addCoverage(counts)
 
     E.info("finished counting")
 
-    if options.output_format in ("wig", "bigwig"):
-        E.info("starting wig output")
+    coverage = Blat.getCoverage(counts, typecode)
 
-        for contig, vals in list(counts.items()):
+    if options.output_format in ("wiggle", "bigwig"):
+        E.info("starting wig output")
 
-            E.debug("output for %s" % contig)
-            for val, iter in itertools.groupby(enumerate(vals), lambda x: x[1]):
-                l = list(iter)
-                start, end = l[0][0], l[-1][0]
-                val = vals[start]
-                if val > 0:
-                    outfile.write("variableStep chrom=%s span=%i\n" %
-                                  (contig, end - start + 1))
-                    outfile.write("%i\t%i\n" % (start, val))
+        for contig, start, end, val in iterateRuns(coverage):
+            outfile.write("variableStep chrom=%s span=%i\n" %
+                          (contig, end - start))
+            outfile.write("%i\t%i\n" % (start, val))
 
-            ncontigs += 1
+        ncontigs = len(coverage)
     elif options.output_format in ("bedgraph", "bigbed"):
 
         E.info("starting bedgraph output")
 
-        for contig, vals in list(counts.items()):
-            E.debug("output for %s" % contig)
-            for val, iter in itertools.groupby(enumerate(vals), lambda x: x[1]):
-                l = list(iter)
-                start, end = l[0][0], l[-1][0]
-                val = vals[start]
-                if val > 0:
-                    outfile.write("%s\t%i\t%i\t%i\n" %
-                                  (contig, start, end + 1, val))
-
-            ncontigs += 1
+        for contig, start, end, val in iterateRuns(coverage):
+            outfile.write("%s\t%i\t%i\t%i\n" %
+                          (contig, start, end, val))
+
+        ncontigs = len(coverage)
 
     E.info("finished output")
 
@@ -20,6 +20,13 @@ The windows are given in gtf format.
    In case of a gene set, make sure to first flatten the gene set by combining
    all transcript/exons per gene.
 
+The ``transcript-effects`` module can be run in several worker
+processes with the ``--threads`` option. Transcripts are grouped by
+gene into shards of ``--shard-size`` genes, and each worker
+computes the effects of the variants overlapping the transcripts
+in a shard. The output is merged in input order and is the same as
+when running in a single process.
+
 Usage
 -----
 
@@ -46,8 +53,11 @@ Command line options
 """
 
 import sys
+import time
 import collections
+import multiprocessing
 import numpy
+from six import StringIO
 import CGAT.Experiment as E
 import CGAT.IOTools as IOTools
 import pysam
@@ -755,38 +765,67 @@ class CounterTranscripts(Counter):
     mMinIntronSize = 5
 
     def __init__(self, filename_exons, seleno, *args, **kwargs):
+
+        # transcripts can be given directly as a list of exon lists
+        # instead of being read from *filename_exons*
+        gtf_transcripts = kwargs.pop("transcripts", None)
+        self.mGenomeFile = kwargs.pop("genome_file", None)
+        self.mThreads = kwargs.pop("threads", 1)
+        shard_size = kwargs.pop("shard_size", 100)
+
         Counter.__init__(self, *args, **kwargs)
 
         transcripts = IndexedGenome.IndexedGenome()
         self.mExons = {}
         nexons = 0
         ntranscripts = 0
-        inf = IOTools.openFile(filename_exons, "r")
-        for gtfs in GTF.transcript_iterator(GTF.iterator(inf)):
+        if gtf_transcripts is None:
+            inf = IOTools.openFile(filename_exons, "r")
+            gtf_transcripts = GTF.transcript_iterator(GTF.iterator(inf))
+        else:
+            inf = None
+
+        for gtfs in gtf_transcripts:
             start, end = min([x.start for x in gtfs]), max(
                 [x.end for x in gtfs])
             transcripts.add(gtfs[0].contig, start, end, gtfs)
             nexons += len(gtfs)
             ntranscripts += 1
             self.mExons[gtfs[0].transcript_id] = gtfs
-        inf.close()
 
         self.mTranscripts = transcripts
         self.mSeleno = seleno
 
-        E.info("indexed %i transcripts and %i exons on %i contigs" %
-               (ntranscripts, nexons, len(transcripts)))
-        E.info("received %i selenoprotein transcripts" % (len(self.mSeleno)))
+        if inf is not None:
+            inf.close()
+            E.info("indexed %i transcripts and %i exons on %i contigs" %
+                   (ntranscripts, nexons, len(transcripts)))
+            E.info("received %i selenoprotein transcripts" %
+                   (len(self.mSeleno)))
+
+        # in multi-process mode, variants are collected per shard
+        # and processed in writeTable()
+        if self.mThreads > 1:
+            self.mShards = self.buildShards(shard_size)
+            self.mShardOfTranscript = {}
+            for shard_index, shard in enumerate(self.mShards):
+                for transcript_id in shard:
+                    self.mShardOfTranscript[transcript_id] = shard_index
+            self.mShardVariants = [[] for x in self.mShards]
+            self.mNVariants = 0
+            E.info("grouped %i transcripts into %i shards" %
+                   (ntranscripts, len(self.mShards)))
+        else:
+            self.mShards = None
 
         # create counter
         self.mCounts = collections.defaultdict(int)
 
-        self.mOutfileIntron = IOTools.openFile(
-            self.mFilenamePattern % "intron", "w")
+        self.mOutfileIntron = self.openOutfile("intron")
         self.mOutfileIntron.write(
             "transcript_id\tcontig\tsnp_position\tvariant_type\tvariant_code\tvariant_seq\texon_id\tnexon\tcode\torig_name\torig_seq5\torig_seq3\tvariant_name\tvariant_seq5\tvariant_seq3\tintron_start\tintron_end\tstrand\tnc_start\tnc_end\n")
 
-        self.mOutfileCds = IOTools.openFile(self.mFilenamePattern % "cds", "w")
+        self.mOutfileCds = self.openOutfile("cds")
         self.mOutfileCds.write("\t".join((
             "transcript_id",
             "contig",
@@ -809,18 +848,61 @@ class CounterTranscripts(Counter):
             "cds_end",
             "cds_len")) + "\n")
 
-        self.mOutfileTranscripts = IOTools.openFile(
-            self.mFilenamePattern % "translation", "w")
+        self.mOutfileTranscripts = self.openOutfile("translation")
         self.mOutfileTranscripts.write(
             "transcript_id\tvariant_id\tlast_exon_start\t%s\tseq_na\tseq_aa\n" % "\t".join(TranslationEffect._fields))
 
-        self.mOutfileSplicing = IOTools.openFile(
-            self.mFilenamePattern % "splicing", "w")
+        self.mOutfileSplicing = self.openOutfile("splicing")
         self.mOutfileSplicing.write(
             "transcript_id\tvariant_id\t%s\n" % "\t".join(SplicingEffect._fields))
 
         self.mTranscriptVariants = {}
 
+    def openOutfile(self, section):
+        '''open output file for *section*.'''
+        return IOTools.openFile(self.mFilenamePattern % section, "w")
+
+    def buildShards(self, shard_size):
+        '''group transcripts into shards of *shard_size* genes.
+
+        Shards keep the order of transcripts in the input, so that
+        concatenating per-shard output gives the same order as
+        processing all transcripts at once.
+        '''
+        shards, shard = [], []
+        last_gene_id, ngenes = None, 0
+        for transcript_id, exons in self.mExons.items():
+            gene_id = exons[0].gene_id
+            if gene_id != last_gene_id:
+                if ngenes == shard_size:
+                    shards.append(shard)
+                    shard, ngenes = [], 0
+                ngenes += 1
+                last_gene_id = gene_id
+            shard.append(transcript_id)
+        if shard:
+            shards.append(shard)
+        return shards
+
+    def addToShards(self, snp, transcripts):
+        '''record *snp* for all shards containing one of
+        *transcripts*.
+
+        The rank of a transcript within *transcripts* is kept
+        so that output can be merged in the same order as if
+        the variant had been processed by :meth:`update`.
+        '''
+        variant_index = self.mNVariants
+        self.mNVariants += 1
+        ranks = collections.defaultdict(list)
+        for rank, transcript in enumerate(transcripts):
+            transcript_id = transcript[2][0].transcript_id
+            ranks[self.mShardOfTranscript[transcript_id]].append(
+                (rank, transcript_id))
+        for shard_index, shard_ranks in ranks.items():
+            self.mShardVariants[shard_index].append(
+                (variant_index, snp, shard_ranks))
+
     def getVariantRange(self, snp):
         '''return effective range of a variant.
 
@@ -1113,8 +1195,13 @@ class CounterTranscripts(Counter):
 
         return coding_effects
 
-    def update(self, snp):
-        '''update with snp.'''
+    def update(self, snp, transcripts=None):
+        '''update with snp.
+
+        If *transcripts* is given, only these transcripts are
+        tested. Otherwise all transcripts overlapping the
+        snp are used.
+        '''
 
         # get effective range of snp
         snp_start, snp_end = self.getVariantRange(snp)
@@ -1125,12 +1212,17 @@ class CounterTranscripts(Counter):
 
         contig = snp.chromosome
 
-        transcripts = list(
-            self.mTranscripts.get(snp.chromosome, snp_start, snp_end))
+        if transcripts is None:
+            transcripts = list(
+                self.mTranscripts.get(snp.chromosome, snp_start, snp_end))
 
         if not transcripts:
             return
 
+        if self.mShards is not None:
+            self.addToShards(snp, transcripts)
+            return
+
         reference_base = snp.reference_base
 
         # collect all variants at this position
@@ -1791,6 +1883,90 @@ class CounterTranscripts(Counter):
         3. mOutfile: counts
         '''
 
+        if self.mShards is not None:
+            cds_counts, splice_counts, all_counts = self.writeShards(outfile)
+        else:
+            cds_counts, splice_counts, all_counts = \
+                self.writeTranscripts(outfile)
+
+        E.info("cds counts: %s" % (str(cds_counts)))
+        E.info("splice counts: %s" % (str(splice_counts)))
+        E.info("combined counts: %s" % (str(all_counts)))
+
+    def writeShards(self, outfile):
+        '''compute effects for each shard in a pool of worker
+        processes and merge the output in input order.
+
+        Returns counters for cds, splice and combined effects.
+        '''
+
+        counts = (E.Counter(), E.Counter(), E.Counter())
+        nshards = len(self.mShards)
+
+        def _iterShards():
+            for shard_index, shard in enumerate(self.mShards):
+                transcripts = [[GTF.Entry().copy(x)
+                                for x in self.mExons[transcript_id]]
+                               for transcript_id in shard]
+                variants = self.mShardVariants[shard_index]
+                # release memory as soon as the shard has been sent
+                self.mShardVariants[shard_index] = None
+                yield shard_index, transcripts, variants
+
+        pool = multiprocessing.Pool(self.mThreads,
+                                    initializer=initializeWorker,
+                                    initargs=(self.mGenomeFile,
+                                              self.mSeleno))
+
+        E.info("processing %i variants in %i shards with %i threads" %
+               (self.mNVariants, nshards, self.mThreads))
+
+        # per-variant output is sorted by variant and rank of the
+        # transcript to give the same order as in single-process mode
+        effects = []
+        ndone, ntranscripts, nvariants = 0, 0, 0
+        report_step = max(1, nshards // 20)
+        t0 = time.time()
+        for result in pool.imap(countShard, _iterShards()):
+            (shard_index, shard_effects, translation, splicing,
+             table, shard_counts, shard_ntranscripts,
+             shard_nvariants) = result
+            effects.extend(shard_effects)
+            self.mOutfileTranscripts.write(translation)
+            self.mOutfileSplicing.write(splicing)
+            outfile.write(table)
+            for counter, shard_counter in zip(counts, shard_counts):
+                counter += shard_counter
+
+            ndone += 1
+            ntranscripts += shard_ntranscripts
+            nvariants += shard_nvariants
+            if ndone % report_step == 0 or ndone == nshards:
+                elapsed = max(time.time() - t0, 1e-6)
+                E.info("processed %i/%i shards (%5.1f%%): "
+                       "%i transcripts, %i variants, "
+                       "%.1f transcripts/s, %.1f variants/s" %
+                       (ndone, nshards, 100.0 * ndone / nshards,
+                        ntranscripts, nvariants,
+                        ntranscripts / elapsed,
+                        nvariants / elapsed))
+
+        pool.close()
+        pool.join()
+
+        effects.sort(key=lambda x: x[:2])
+        for variant_index, rank, intron, cds in effects:
+            self.mOutfileIntron.write(intron)
+            self.mOutfileCds.write(cds)
+
+        return counts
+
+    def writeTranscripts(self, outfile):
+        '''output summary for each transcript.
+
+        Returns counters for cds, splice and combined effects.
+        '''
+
         cds_counts = E.Counter()
         splice_counts = E.Counter()
         all_counts = E.Counter()
@@ -2093,9 +2269,84 @@ class CounterTranscripts(Counter):
             E.debug("processing %s with %i cds effects and %i splice effects finished" %
                     (transcript_id, cds_nvariant_positions, splice_nvariant_positions))
 
-        E.info("cds counts: %s" % (str(cds_counts)))
-        E.info("splice counts: %s" % (str(splice_counts)))
-        E.info("combined counts: %s" % (str(all_counts)))
+        return cds_counts, splice_counts, all_counts
+
+
+class CounterTranscriptsShard(CounterTranscripts):
+
+    '''count SNPs for a shard of transcripts in a worker process.
+
+    Output is collected in memory and returned by :meth:`popOutput`.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.mBuffers = {}
+        CounterTranscripts.__init__(self, *args, **kwargs)
+        # discard headers
+        for section in self.mBuffers:
+            self.popOutput(section)
+
+    def openOutfile(self, section):
+        self.mBuffers[section] = StringIO()
+        return self.mBuffers[section]
+
+    def popOutput(self, section):
+        '''return and clear output collected for *section*.'''
+        buf = self.mBuffers[section]
+        value = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return value
+
+
+# global variables in worker processes
+WORKER_STATE = {}
+
+
+def initializeWorker(genome_file, seleno):
+    '''open genome in a worker process.'''
+    if genome_file:
+        WORKER_STATE["fasta"] = IndexedFasta.IndexedFasta(genome_file)
+    else:
+        WORKER_STATE["fasta"] = None
+    WORKER_STATE["seleno"] = seleno
+
+
+def countShard(args):
+    '''compute effects of variants on a shard of transcripts.
+
+    Returns the per-variant output tagged with the variant index
+    and rank of the transcript, the per-transcript output and
+    counters.
+    '''
+    shard_index, transcripts, variants = args
+
+    counter = CounterTranscriptsShard(None,
+                                      WORKER_STATE["seleno"],
+                                      fasta=WORKER_STATE["fasta"],
+                                      transcripts=transcripts)
+
+    effects = []
+    for variant_index, snp, ranks in variants:
+        for rank, transcript_id in ranks:
+            exons = counter.mExons[transcript_id]
+            counter.update(snp, transcripts=[(None, None, exons)])
+            intron = counter.popOutput("intron")
+            cds = counter.popOutput("cds")
+            if intron or cds:
+                effects.append((variant_index, rank, intron, cds))
+
+    outfile = StringIO()
+    counts = counter.writeTranscripts(outfile)
+
+    return (shard_index,
+            effects,
+            counter.popOutput("translation"),
+            counter.popOutput("splicing"),
+            outfile.getvalue(),
+            [dict(list(x.items())) for x in counts],
+            len(transcripts),
+            len(variants))
 
 
 class CounterContigs(Counter):
@@ -2168,6 +2419,12 @@ def main(argv=None):
                       help="input format [default=%default].")
     parser.add_option("--vcf-sample", dest="vcf_sample", type="string",
                       help="sample id in vcf file to analyse [default=%default].")
+    parser.add_option("--threads", dest="threads", type="int",
+                      help="number of worker processes for computing "
+                      "transcript effects [default=%default].")
+    parser.add_option("--shard-size", dest="shard_size", type="int",
+                      help="number of genes per shard when using multiple "
+                      "threads [default=%default].")
 
     parser.set_defaults(
         genome_file=None,
@@ -2177,6 +2434,8 @@ def main(argv=None):
         modules=[],
         input_format="pileup",
         vcf_sample=None,
+        threads=1,
+        shard_size=100,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -2225,7 +2484,10 @@ def main(argv=None):
                     "please supply exon information (--filename-exons)")
             modules.append(CounterTranscripts(options.filename_exons, fasta=fasta,
                                               pattern=options.output_filename_pattern,
-                                              seleno=seleno))
+                                              seleno=seleno,
+                                              genome_file=options.genome_file,
+                                              threads=options.threads,
+                                              shard_size=options.shard_size))
 
         elif module == "contig-counts":
             modules.append(CounterContigs(fasta=fasta))
@@ -99,6 +99,11 @@ base_qualities
 
 See the samtools documentation for the meaning of these.
 
+Variants are processed in blocks of ``--chunk-size`` consecutive
+variants on the same contig. Overlaps with exons and splice sites are
+resolved for a whole block at a time against sorted arrays of
+intervals and sequence is retrieved from a single fetch per contig.
+
 Command line options
 --------------------
 
@@ -106,10 +111,15 @@ Command line options
 
 import sys
 import collections
+import itertools
+import numpy
 import pysam
 import CGAT.Experiment as E
+import CGAT.IOTools as IOTools
+import CGAT.GTF as GTF
 import CGAT.IndexedFasta as IndexedFasta
 import CGAT.IndexedGenome as IndexedGenome
+import CGAT.NCL as ncl
 import CGAT.Genomics as Genomics
 
 
@@ -144,13 +154,80 @@ def readJunctions(filename_junctions):
     return junctions
 
 
+class ContigSequence(object):
+
+    '''provide sequence from an :class:`IndexedFasta.IndexedFasta`
+    object.
+
+    The sequence of the current contig is fetched once and kept
+    in memory. Requests for other contigs are passed on to the
+    indexed fasta file. A single instance is shared by all
+    annotators so that only one contig is held in memory.
+
+    Coordinates are pythonic forward/reverse coordinates as in
+    :meth:`IndexedFasta.IndexedFasta.getSequence` without a
+    converter. If the indexed fasta file has a converter or a
+    translator set, all requests are passed on to it.
+    '''
+
+    def __init__(self, fasta):
+        self.mFasta = fasta
+        self.mContig = None
+        self.mSequence = None
+
+    def setContig(self, contig):
+        '''load sequence for *contig*.'''
+        if contig == self.mContig:
+            return
+        if self.mFasta.mConverter or self.mFasta.mTranslator:
+            return
+        self.mSequence = self.mFasta.getSequence(
+            contig, "+", 0, self.mFasta.getLength(contig))
+        self.mContig = contig
+
+    def getLength(self, contig):
+        if contig == self.mContig:
+            return len(self.mSequence)
+        return self.mFasta.getLength(contig)
+
+    def getSequence(self, contig, strand="+", start=0, end=0):
+        '''return sequence, see
+        :meth:`IndexedFasta.IndexedFasta.getSequence`.'''
+        if contig != self.mContig:
+            return self.mFasta.getSequence(contig, strand, start, end)
+
+        lcontig = len(self.mSequence)
+        if end == 0:
+            end = lcontig
+        if end > lcontig:
+            raise ValueError(
+                "3' coordinate on %s out of bounds: %i > %i" %
+                (contig, end, lcontig))
+        if start < 0:
+            raise ValueError(
+                "5' coordinate on %s out of bounds: %i < 0" % (contig, start))
+
+        if Genomics.IsNegativeStrand(strand):
+            return Genomics.complement(
+                self.mSequence[lcontig - end:lcontig - start])
+        else:
+            return self.mSequence[start:end]
+
+
 class BaseAnnotator(object):
 
-    '''annotator for single bases in the genome.'''
+    '''annotator for single bases in the genome.
+
+    *fasta* is a :class:`ContigSequence` that can be shared between
+    annotators. An :class:`IndexedFasta.IndexedFasta` object is
+    wrapped in a :class:`ContigSequence` of its own.
+    '''
 
     mHeader = ()
 
     def __init__(self, fasta=None, *args, **kwargs):
+        if fasta is not None and not isinstance(fasta, ContigSequence):
+            fasta = ContigSequence(fasta)
         self.mFasta = fasta
 
     def __str__(self):
@@ -160,6 +237,23 @@ class BaseAnnotator(object):
         '''return header'''
         return "\t".join(self.mHeader)
 
+    def setContig(self, contig):
+        '''prepare annotation of variants on *contig*.'''
+        if self.mFasta:
+            self.mFasta.setContig(contig)
+
+    def annotateBlock(self, contig, snps):
+        '''annotate a block of *snps* on *contig*.
+
+        returns a list with the output for each snp.
+        '''
+        self.setContig(contig)
+        result = []
+        for snp in snps:
+            self.update(snp)
+            result.append(str(self))
+        return result
+
 
 class BaseAnnotatorSNP(BaseAnnotator):
 
@@ -187,7 +281,7 @@ class BaseAnnotatorSNP(BaseAnnotator):
 
     def __str__(self):
         # truncate the last two columns to make the snp output even length
-        return "\t".join(map(str, self.mSNP)[:len(self.mHeader)])
+        return "\t".join(list(map(str, self.mSNP))[:len(self.mHeader)])
 
     def update(self, snp):
         '''update with snp.'''
@@ -203,35 +297,49 @@ class BaseAnnotatorExons(BaseAnnotator):
     def __init__(self, filename_exons, *args, **kwargs):
         BaseAnnotator.__init__(self, *args, **kwargs)
 
-        exons = IndexedGenome.IndexedGenome()
+        # exon index and output per contig. The index of an exon in
+        # the nested containment list is its position in the output.
+        exons = collections.defaultdict(ncl.NCLSimple)
+        output = collections.defaultdict(list)
         nexons = 0
-        for g in GTF.iterator(open(filename_exons, "r")):
-            exons.add(g.contig, g.start, g.end, g)
+        for g in GTF.iterator(IOTools.openFile(filename_exons, "r")):
+            exons[g.contig].add(g.start, g.end)
+            output[g.contig].append("%i\t%i\t%s" % (
+                g["ntranscripts"], g["nused"], g["pos"]))
             nexons += 1
 
-        self.mExons = exons
+        self.mExons = dict(exons)
+        self.mOutput = dict([(x, numpy.array(y, dtype=object))
+                             for x, y in list(output.items())])
 
-        E.info("indexed %i exons on %i contigs" % (nexons, len(exons)))
+        E.info("indexed %i exons on %i contigs" % (nexons,
+                                                   len(self.mOutput)))
 
-    def update(self, snp):
-        '''update with snp.'''
+    def annotateBlock(self, contig, snps):
+        '''annotate a block of *snps* on *contig*.'''
 
-        exons = list(self.mExons.get(snp.chromosome,
-                                     snp.pos,
-                                     snp.pos + 1))
+        result = numpy.empty(len(snps), dtype=object)
+        result.fill("na\tna\tna")
 
-        if exons:
-            for start, end, gff in exons:
-                self.mOTranscripts = "%i" % gff["ntranscripts"]
-                self.mOUsed = "%i" % gff["nused"]
-                self.mOPos = "%s" % gff["pos"]
-        else:
-            self.mOTranscripts = "na"
-            self.mOUsed = "na"
-            self.mOPos = "na"
+        if contig in self.mExons:
+            positions = numpy.array([x.pos for x in snps], dtype=numpy.int64)
+            query_ids, exon_ids = self.mExons[contig].find_overlaps(
+                positions, positions + 1)
+            query_ids = numpy.asarray(query_ids)
+            exon_ids = numpy.asarray(exon_ids)
+            # the last exon found for a snp is reported
+            snp_ids, last = numpy.unique(query_ids[::-1], return_index=True)
+            last = len(query_ids) - 1 - last
+            result[snp_ids] = self.mOutput[contig][exon_ids[last]]
+
+        return list(result)
+
+    def update(self, snp):
+        '''update with snp.'''
+        self.mResult = self.annotateBlock(snp.chromosome, (snp,))[0]
 
     def __str__(self):
-        return "\t".join((self.mOTranscripts, self.mOUsed, self.mOPos))
+        return self.mResult
 
 
 class BaseAnnotatorSpliceSites(BaseAnnotator):
@@ -286,7 +394,7 @@ class BaseAnnotatorSpliceSites(BaseAnnotator):
     def __init__(self, filename_junctions, *args, **kwargs):
         BaseAnnotator.__init__(self, *args, **kwargs)
 
-        junctions = IndexedGenome.IndexedGenome()
+        junctions = IndexedGenome.Static()
 
         infile = IOTools.openFile(filename_junctions, "r")
         njunctions = 0
@@ -425,12 +533,42 @@ class BaseAnnotatorSpliceSites(BaseAnnotator):
 
         return is_homozygous, new_sequences
 
-    def update(self, snp):
-        '''update with snp.'''
+    def annotateBlock(self, contig, snps):
+        '''annotate a block of *snps* on *contig*.'''
+
+        self.setContig(contig)
+
+        if contig not in self.mJunctions.mIndex:
+            self.mResults = []
+            return [str(self)] * len(snps)
 
-        junctions = list(self.mJunctions.get(snp.chromosome,
-                                             snp.pos,
-                                             snp.pos + 1))
+        positions = numpy.array([x.pos for x in snps], dtype=numpy.int64)
+        offsets, ids = self.mJunctions.getBatch(
+            contig, positions, positions + 1)
+        index = self.mJunctions.mIndex[contig]
+
+        result = []
+        for x, snp in enumerate(snps):
+            self.update(snp,
+                        [(0, 0, index.getValue(y))
+                         for y in ids[offsets[x]:offsets[x + 1]]])
+            result.append(str(self))
+        return result
+
+    def update(self, snp, junctions=None):
+        '''update with snp.
+
+        If *junctions* is not given, the junctions overlapping
+        *snp* are looked up.
+        '''
+
+        if junctions is None:
+            if snp.chromosome in self.mJunctions.mIndex:
+                junctions = list(self.mJunctions.get(snp.chromosome,
+                                                     snp.pos,
+                                                     snp.pos + 1))
+            else:
+                junctions = []
 
         self.mResults = []
 
@@ -558,9 +696,17 @@ class BaseAnnotatorCodon(BaseAnnotator):
 
         BaseAnnotator.__init__(self, *args, **kwargs)
 
-        self.mAnnotations = IndexedFasta.IndexedFasta(annotations_file)
+        # base annotations are a separate file with a contig cache
+        # of its own
+        self.mAnnotations = ContigSequence(
+            IndexedFasta.IndexedFasta(annotations_file))
         self.mJunctions = junctions
 
+    def setContig(self, contig):
+        '''prepare annotation of variants on *contig*.'''
+        BaseAnnotator.setContig(self, contig)
+        self.mAnnotations.setContig(contig)
+
     def updateSNPs(self, snp, is_negative_strand, pos):
         '''update SNPs.'''
 
@@ -780,6 +926,9 @@ def main(argv=None):
                       help="input format [default=%default].")
     parser.add_option("--vcf-sample", dest="vcf_sample", type="string",
                       help="sample id in vcf file to analyse [default=%default].")
+    parser.add_option("--chunk-size", dest="chunk_size", type="int",
+                      help="number of variants on the same contig to "
+                      "annotate in a single block [default=%default].")
 
     parser.set_defaults(
         genome_file=None,
@@ -789,17 +938,21 @@ def main(argv=None):
         input_format="pileup",
         vcf_sample=None,
         filename_vcf=None,
+        chunk_size=10000,
     )
 
     # add common options (-h/--help, ...) and parse command line
     (options, args) = E.Start(parser, argv=argv)
 
-    ninput, nskipped, noutput = 0, 0, 0
+    counter = E.Counter()
 
     if options.genome_file:
         fasta = IndexedFasta.IndexedFasta(options.genome_file)
+        # sequence of the current contig shared by all annotators
+        sequence = ContigSequence(fasta)
     else:
         fasta = None
+        sequence = None
 
     if options.filename_junctions:
         junctions = readJunctions(options.filename_junctions)
@@ -824,36 +977,55 @@ def main(argv=None):
     modules.append(BaseAnnotatorSNP())
 
     if options.filename_exons:
-        modules.append(BaseAnnotatorExons(options.filename_exons, fasta=fasta))
+        modules.append(BaseAnnotatorExons(options.filename_exons,
+                                          fasta=sequence))
     if options.filename_annotations:
         modules.append(BaseAnnotatorCodon(
-            options.filename_annotations, fasta=fasta, junctions=junctions))
+            options.filename_annotations, fasta=sequence,
+            junctions=junctions))
     if options.filename_junctions:
         modules.append(
-            BaseAnnotatorSpliceSites(options.filename_junctions, fasta=fasta))
+            BaseAnnotatorSpliceSites(options.filename_junctions,
+                                     fasta=sequence))
 
     options.stdout.write("\t".join([x.getHeader() for x in modules]) + "\n")
 
-    for snp in iterator:
-        ninput += 1
+    def _iterSNPs():
+        for snp in iterator:
+            counter.input += 1
+            # translate chromosome according to fasta
+            if fasta:
+                try:
+                    snp = snp._replace(
+                        chromosome=fasta.getToken(snp.chromosome))
+                except KeyError:
+                    E.warn("unknown contig `%s` for snp `%s`" %
+                           (snp.chromosome, str(snp)))
+                    counter.skipped += 1
+                    continue
+            yield snp
 
-        # translate chromosome according to fasta
-        if fasta:
-            try:
-                snp = snp._replace(chromosome=fasta.getToken(snp.chromosome))
-            except KeyError:
-                E.warn("unknown contig `%s` for snp `%s`" %
-                       (snp.chromosome, str(snp)))
-                continue
+    def _iterBlocks():
+        # group consecutive variants by contig and cut into blocks
+        for contig, snps in itertools.groupby(_iterSNPs(),
+                                              lambda x: x.chromosome):
+            while True:
+                block = list(itertools.islice(snps, options.chunk_size))
+                if not block:
+                    break
+                yield contig, block
+
+    for contig, block in _iterBlocks():
 
-        for module in modules:
-            module.update(snp)
+        columns = [module.annotateBlock(contig, block) for module in modules]
 
-        options.stdout.write("\t".join(map(str, modules)) + "\n")
+        options.stdout.write("".join(
+            ["\t".join(x) + "\n" for x in zip(*columns)]))
 
-        noutput += 1
+        counter.output += len(block)
 
-    E.info("ninput=%i, noutput=%i, nskipped=%i" % (ninput, noutput, nskipped))
+    E.info("ninput=%i, noutput=%i, nskipped=%i" %
+           (counter.input, counter.output, counter.skipped))
 
     # write footer and output benchmark information.
     E.Stop()
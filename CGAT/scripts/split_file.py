@@ -30,7 +30,6 @@ Command line options
 '''
 import sys
 import re
-import string
 import os
 import getopt
 import CGAT.Experiment as E
@@ -180,7 +179,7 @@ def main(argv=None):
     if param_split_column is not None:
 
         header = None
-        files = {}
+        outfiles = None
         for line in sys.stdin:
 
             if line[0] == "#":
@@ -214,33 +213,33 @@ def main(argv=None):
             found.add(key)
 
             filename = re.sub("%s", key, param_pattern_output)
-            filenames.add(filename)
-
-            if filename not in files:
-
-                # reset if too many files are open
-                if len(files) > 1000:
-                    if param_loglevel >= 1:
-                        print("# resetting all files.")
-                        sys.stdout.flush()
+            if param_dry_run:
+                if filename not in filenames:
+                    print("# opening file %s" % filename)
+                filenames.add(filename)
+                noutput += 1
+                continue
 
-                    for f in list(files.values()):
-                        f.close()
-                    files = {}
+            filenames.add(filename)
 
-                files[filename] = CreateOpen(
-                    filename, "a", param_dry_run, header)
+            if outfiles is None:
+                # output is buffered per file and written in large
+                # blocks, keeping a limited number of files open.
+                outfiles = IOTools.FilePool(
+                    param_pattern_output,
+                    header=header + "\n" if header else None,
+                    force=False)
 
             if param_remove_key:
                 del data[param_split_column]
-                files[filename].write(string.join(data, "\t") + "\n")
+                outfiles.write(key, "\t".join(data) + "\n")
             else:
-                files[filename].write(line)
+                outfiles.write(key, line)
 
             noutput += 1
 
-        for f in list(files.values()):
-            f.close()
+        if outfiles is not None:
+            outfiles.close()
 
     else:
         file_id = 0
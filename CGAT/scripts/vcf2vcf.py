@@ -86,9 +86,15 @@ def main(argv=sys.argv):
         "comma-separated list or specify ``alphabetical`` "
         "[default=%default]")
 
+    parser.add_option(
+        "--block-size", dest="block_size", type="int",
+        help="number of variants to process in one block "
+        "[default=%default]")
+
     parser.set_defaults(
         methods=[],
         sort_order="alphabetical",
+        block_size=10000,
     )
 
     (options, args) = E.Start(parser, add_pipe_options=True)
@@ -107,10 +113,15 @@ def main(argv=sys.argv):
 
     infile.writeHeader(options.stdout, order=sort_order)
 
-    for vcf in infile:
-        if sort_order:
-            vcf.order = sort_order
-        options.stdout.write(str(vcf) + "\n")
+    if sort_order:
+        permutation = infile.getPermutation(sort_order)
+    else:
+        permutation = None
+
+    for block in infile.iterBlocks(options.block_size):
+        if permutation:
+            block.permute(permutation)
+        options.stdout.write(str(block) + "\n")
 
     E.Stop()
 
@@ -0,0 +1,53 @@
+"""unit testing module for Bed.py"""
+
+import unittest
+from six import StringIO
+import CGAT.Bed as Bed
+
+
+class TestBedArrays(unittest.TestCase):
+
+    data = ("track name=test\n"
+            "chr2\t100\t200\tb\t2.0\t-\n"
+            "# comment\n"
+            "chr1\t10\t20\ta\t1.0\t+\n"
+            "chr1\t15\t30\n"
+            "chr1\t30\t40\tc\t.\t+\n")
+
+    def testReadArrays(self):
+        arrays = Bed.readArrays(StringIO(self.data))
+        self.assertEqual(len(arrays), 4)
+        self.assertEqual(arrays.contigs, ["chr1", "chr2"])
+        self.assertEqual(list(arrays.contig_codes), [1, 0, 0, 0])
+        self.assertEqual(list(arrays.getLengths()), [100, 10, 15, 10])
+        self.assertEqual(list(arrays.names), ["b", "a", None, "c"])
+        self.assertEqual(list(arrays.strands), ["-", "+", ".", "+"])
+        self.assertEqual(list(arrays.getSortOrder()), [1, 2, 3, 0])
+
+    def testMerge(self):
+        merged = Bed.merge(Bed.iterator(StringIO(self.data)))
+        self.assertEqual([(x.contig, x.start, x.end) for x in merged],
+                         [("chr1", 10, 30),
+                          ("chr1", 30, 40),
+                          ("chr2", 100, 200)])
+
+    def testSlots(self):
+        bed = next(Bed.iterator(StringIO(self.data)))
+        self.assertEqual(bed.name, "b")
+        self.assertEqual(bed.blockCount, None)
+        self.assertRaises(AttributeError, setattr, bed, "unknown", 1)
+        copy = bed.copy()
+        copy.name = "x"
+        self.assertEqual(bed.name, "b")
+
+    def testCopy(self):
+        bed = next(Bed.iterator(StringIO(self.data)))
+        copy = bed.copy()
+        for attribute in Bed.Bed.__slots__:
+            self.assertEqual(getattr(copy, attribute),
+                             getattr(bed, attribute))
+        self.assertFalse(copy.fields is bed.fields)
+
+
+if __name__ == "__main__":
+    unittest.main()
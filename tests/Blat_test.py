@@ -0,0 +1,129 @@
+"""unit testing module for Blat.py"""
+
+import unittest
+import random
+import numpy
+from six import StringIO
+import CGAT.Blat as Blat
+import CGAT.IndexedGenome as IndexedGenome
+
+
+def buildPSL(nmatches=200):
+    '''return a random psl formatted file.'''
+    random.seed(1)
+    lines = []
+    for x in range(nmatches):
+        contig = random.choice(("chr1", "chr2"))
+        nblocks = random.randint(1, 4)
+        qpos, tpos = random.randint(0, 20), random.randint(0, 1000)
+        sizes, qstarts, tstarts = [], [], []
+        for y in range(nblocks):
+            size = random.randint(1, 50)
+            sizes.append(size)
+            qstarts.append(qpos)
+            tstarts.append(tpos)
+            qpos += size + random.randint(0, 5)
+            tpos += size + random.randint(0, 50)
+        aligned = sum(sizes)
+        nmismatches = random.randint(0, aligned)
+        lines.append("\t".join(map(str, (
+            aligned - nmismatches, nmismatches, 0, 0, 0, 0, 0, 0,
+            random.choice("+-"), "query%i" % x, 250,
+            qstarts[0], qstarts[-1] + sizes[-1],
+            contig, 2000, tstarts[0], tstarts[-1] + sizes[-1],
+            nblocks,
+            ",".join(map(str, sizes)) + ",",
+            ",".join(map(str, qstarts)) + ",",
+            ",".join(map(str, tstarts)) + ","))))
+    return "psLayout version 3\n\n\n\n\n" + "\n".join(lines) + "\n"
+
+
+class TestMatchArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.data = buildPSL()
+        self.matches = list(Blat.iterator(StringIO(self.data)))
+
+    def testRoundTrip(self):
+        for block_size in (1, 7, 1000):
+            result = []
+            for block in Blat.iterator_arrays(StringIO(self.data),
+                                              block_size=block_size):
+                self.assertTrue(len(block) <= block_size)
+                result.extend(list(block))
+            self.assertEqual([str(x) for x in result],
+                             [str(x) for x in self.matches])
+            self.assertEqual([x.mPid for x in result],
+                             [x.mPid for x in self.matches])
+
+    def testIrregularSpacing(self):
+        data = self.data.replace("\t", " ")
+        result = []
+        for block in Blat.iterator_arrays(StringIO(data)):
+            result.extend(list(block))
+        self.assertEqual([str(x) for x in result],
+                         [str(x) for x in self.matches])
+
+    def testFilter(self):
+        block = next(Blat.iterator_arrays(StringIO(self.data)))
+        selected = block.filter(min_query_coverage=10, min_pid=50)
+        expected = [x for x in self.matches
+                    if x.mQueryCoverage >= 10 and x.mPid >= 50]
+        self.assertTrue(0 < len(expected) < len(self.matches))
+        self.assertEqual(str(selected),
+                         "\n".join([str(x) for x in expected]))
+        self.assertEqual(len(block.select([])), 0)
+
+    def testOverlaps(self):
+        block = next(Blat.iterator_arrays(StringIO(self.data)))
+        index = IndexedGenome.Static.fromArrays(["chr1", "chr3"],
+                                                [100, 0],
+                                                [200, 100])
+        expected = [x.mSbjctId == "chr1"
+                    and x.mSbjctFrom < 200 and x.mSbjctTo > 100
+                    for x in self.matches]
+        self.assertEqual(list(block.overlaps(index)), expected)
+
+    def testCoverage(self):
+        counts = {}
+        for block in Blat.iterator_arrays(StringIO(self.data),
+                                          block_size=33):
+            block.addCoverage(counts)
+        coverage = Blat.getCoverage(counts)
+
+        expected = {"chr1": numpy.zeros(2000, numpy.int64),
+                    "chr2": numpy.zeros(2000, numpy.int64)}
+        for match in self.matches:
+            for start, end in match.iterator_sbjct_exons():
+                expected[match.mSbjctId][start:end] += 1
+
+        self.assertEqual(sorted(coverage.keys()), ["chr1", "chr2"])
+        for contig, values in expected.items():
+            self.assertEqual(list(coverage[contig]), list(values))
+
+    def testCoverageTruncated(self):
+        # contigs shorter than the alignments, as with a genome file
+        # that does not match the alignments
+        counts = {"chr1": numpy.zeros(501, numpy.int64),
+                  "chr2": numpy.zeros(1001, numpy.int64)}
+        block = next(Blat.iterator_arrays(StringIO(self.data)))
+        block.addCoverage(counts)
+        coverage = Blat.getCoverage(counts)
+
+        expected = {"chr1": numpy.zeros(500, numpy.int64),
+                    "chr2": numpy.zeros(1000, numpy.int64)}
+        for match in self.matches:
+            for start, end in match.iterator_sbjct_exons():
+                expected[match.mSbjctId][start:end] += 1
+
+        for contig, values in expected.items():
+            self.assertEqual(list(coverage[contig]), list(values))
+
+    def testParsingError(self):
+        self.assertRaises(Blat.ParsingError,
+                          Blat.MatchArrays.fromLines,
+                          ["1\t2\t3\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import numpy
 import pandas
 import CGAT.Counts as Counts
 
@@ -23,3 +24,37 @@ class TestCountsClass(unittest.TestCase):
         self.assertRaises(
             self.counts.removeSamples,
             min_counts_per_sample='3')
+
+
+class TestShuffleRows(unittest.TestCase):
+
+    def setUp(self):
+        numpy.random.seed(1)
+        self.counts = Counts.Counts(pandas.DataFrame(
+            numpy.random.randint(0, 100, (1000, 4)),
+            columns=["a1", "a2", "b1", "b2"]))
+        self.tracks_map = {"a": ["a1", "a2"], "b": ["b1", "b2"]}
+
+    def shuffle(self, seed):
+        return self.counts.shuffleRows(
+            -50, 50, 10, 0, 100, 20,
+            self.tracks_map, ["a", "b"], "relative",
+            s_max=5, i=3, seed=seed)
+
+    def test_shuffleRows_is_reproducible(self):
+        indices1, counts1 = self.shuffle(seed=2)
+        indices2, counts2 = self.shuffle(seed=2)
+        self.assertEqual(indices1, indices2)
+        self.assertTrue((counts1 == counts2).all())
+
+    def test_shuffleRows_fills_bins(self):
+        indices, counts = self.shuffle(seed=2)
+        table = self.counts.table
+        self.assertTrue(counts.max() <= 5)
+        for key, rows in indices.items():
+            self.assertEqual(len(rows), counts[key])
+            for row1, row2 in rows:
+                change = (table.loc[row2, ["b1", "b2"]].mean() -
+                          table.loc[row1, ["a1", "a2"]].mean())
+                self.assertTrue(-50 + (key[1] - 1) * 10 < change)
+                self.assertTrue(change <= -50 + key[1] * 10)
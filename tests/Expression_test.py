@@ -0,0 +1,148 @@
+"""unit testing module for Expression.py"""
+
+import unittest
+import numpy
+import pandas
+import scipy.stats
+import CGAT.Counts as Counts
+import CGAT.Expression as Expression
+
+
+def buildExpression(ngenes=200, nplanted=10, nsamples=4, shift=4.0):
+    '''return log2 expression values for treatment and control
+    samples with *nplanted* differentially expressed genes.'''
+    numpy.random.seed(1)
+    treatments = numpy.random.normal(8.0, 0.5, (nsamples, ngenes))
+    controls = numpy.random.normal(8.0, 0.5, (nsamples, ngenes))
+    treatments[:, :nplanted] += shift
+    probesets = ["gene%i" % x for x in range(ngenes)]
+    return probesets, list(treatments), list(controls)
+
+
+class TestComputeSAMStatistics(unittest.TestCase):
+
+    def testAgainstLoop(self):
+        numpy.random.seed(2)
+        matrix = numpy.random.normal(5.0, 2.0, (50, 7))
+        labels = numpy.array([[1, 1, 1, 0, 0, 0, 0],
+                              [0, 1, 0, 1, 0, 1, 0],
+                              [1, 0, 0, 0, 0, 0, 1]], dtype=numpy.bool_)
+        s0 = 0.1
+        d, r, s = Expression.computeSAMStatistics(matrix, labels, s0)
+        self.assertEqual(d.shape, (50, 3))
+
+        for y, label in enumerate(labels):
+            for x, values in enumerate(matrix):
+                group1, group2 = values[label], values[~label]
+                n1, n2 = len(group1), len(group2)
+                diff = group1.mean() - group2.mean()
+                ss = ((group1 - group1.mean()) ** 2).sum() + \
+                    ((group2 - group2.mean()) ** 2).sum()
+                se = numpy.sqrt((1.0 / n1 + 1.0 / n2) / (n1 + n2 - 2) * ss)
+                self.assertAlmostEqual(r[x, y], diff)
+                self.assertAlmostEqual(s[x, y], se)
+                self.assertAlmostEqual(d[x, y], diff / (se + s0))
+
+
+class TestWelchsTTest(unittest.TestCase):
+
+    def testAgainstScipy(self):
+        probesets, treatments, controls = buildExpression(ngenes=50)
+        # a probeset without variance is skipped
+        treatments[0][1] = treatments[1][1] = treatments[2][1] = \
+            treatments[3][1] = 1.0
+        controls[0][1] = controls[1][1] = controls[2][1] = \
+            controls[3][1] = 2.0
+
+        results, nskipped = Expression.WelchsTTest()(probesets,
+                                                     treatments,
+                                                     controls)
+        self.assertEqual(nskipped, 1)
+        self.assertEqual([x.mProbeset for x in results],
+                         probesets[:1] + probesets[2:])
+
+        t, pvalues = scipy.stats.ttest_ind(numpy.array(treatments),
+                                           numpy.array(controls),
+                                           equal_var=False)
+        pvalues = numpy.concatenate((pvalues[:1], pvalues[2:]))
+        for result, pvalue in zip(results, pvalues):
+            self.assertAlmostEqual(result.mPValue, pvalue)
+
+
+class TestSAMPermutation(unittest.TestCase):
+
+    nplanted = 10
+
+    def setUp(self):
+        self.probesets, self.treatments, self.controls = buildExpression(
+            nplanted=self.nplanted)
+
+    def runSAM(self, **kwargs):
+        return Expression.SAMPermutation()(
+            self.probesets,
+            self.treatments,
+            self.controls,
+            npermutations=200,
+            batch_size=30,
+            seed=1,
+            **kwargs)
+
+    def testPlanted(self):
+        genes, cutoff, fdr_values = self.runSAM(fdr=0.05)
+        self.assertTrue(cutoff is not None)
+        significant = [x.test_id for x in genes if x.significant]
+        self.assertEqual(significant,
+                         ["gene%i" % x for x in range(self.nplanted)])
+        pvalues = numpy.array([x.pvalue for x in genes])
+        self.assertTrue(
+            pvalues[:self.nplanted].max() < pvalues[self.nplanted:].min())
+        for gene in genes[:self.nplanted]:
+            self.assertTrue(gene.l2fold > 3.0)
+
+    def testThreads(self):
+        serial = self.runSAM(fdr=0.05, threads=1)
+        parallel = self.runSAM(fdr=0.05, threads=2)
+        self.assertEqual(serial[0], parallel[0])
+        self.assertEqual(serial[1], parallel[1])
+        self.assertEqual(serial[2], parallel[2])
+
+    def testSeed(self):
+        first = self.runSAM(fdr=0.05)
+        second = self.runSAM(fdr=0.05)
+        self.assertEqual(first[0], second[0])
+
+
+class TestDEExperimentSAM(unittest.TestCase):
+
+    def testRun(self):
+        numpy.random.seed(3)
+        ngenes, nplanted = 100, 5
+        counts = numpy.random.poisson(100, (ngenes, 8))
+        counts[:nplanted, 4:] *= 8
+        samples = ["c1", "c2", "c3", "c4", "t1", "t2", "t3", "t4"]
+        counts = Counts.Counts(pandas.DataFrame(
+            counts,
+            index=["gene%i" % x for x in range(ngenes)],
+            columns=samples))
+        # the first group is the control
+        design = Expression.ExperimentalDesign(pandas.DataFrame(
+            {"include": [1] * 8,
+             "group": ["control"] * 4 + ["treatment"] * 4,
+             "pair": [0] * 8},
+            index=samples))
+
+        result = Expression.DEExperiment_SAM().run(
+            counts, design, npermutations=200, seed=1)
+        result.getResults(fdr=0.05)
+        table = result.table
+        self.assertEqual(len(table), ngenes)
+        self.assertEqual(set(table["contrast"]),
+                         set(["control_vs_treatment"]))
+        significant = table.index[table["significant"] == 1].tolist()
+        self.assertEqual(significant,
+                         ["gene%i" % x for x in range(nplanted)])
+        self.assertTrue((table["l2fold"][:nplanted] > 2.0).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""unit testing module for Genomics.py"""
+
+import unittest
+import random
+import CGAT.Genomics as Genomics
+
+
+def translateCodonwise(sequence, is_seleno=False,
+                       prefer_lowercase=True, ignore_n=False):
+    '''reference translation codon by codon.'''
+    result = []
+    for x in range(0, len(sequence), 3):
+        codon = sequence[x:x + 3]
+        if prefer_lowercase:
+            is_lower = any(c in "acgtnx" for c in codon)
+        else:
+            is_lower = all(c in "acgtnx" for c in codon)
+        aa = Genomics.MapCodon2AA(codon.upper(),
+                                  is_seleno=is_seleno,
+                                  ignore_n=ignore_n)
+        if is_lower:
+            result.append(aa.lower())
+        else:
+            result.append(aa.upper())
+    return "".join(result)
+
+
+class TestTranslate(unittest.TestCase):
+
+    alphabet = "ACGTNacgtnXx.-R"
+
+    def setUp(self):
+        random.seed(1)
+        self.sequences = [
+            "".join([random.choice(self.alphabet)
+                     for y in range(random.randint(0, 300))])
+            for x in range(200)]
+
+    def testStandardCode(self):
+        self.assertEqual(Genomics.translate("ATGTGGTAA"), "MWX")
+        self.assertEqual(Genomics.translate("ATGtgaTAA"), "MxX")
+        self.assertEqual(Genomics.translate("ATGTGA", is_seleno=True), "MU")
+        self.assertEqual(Genomics.translate("ATGNNN", ignore_n=True), "M?")
+        self.assertEqual(Genomics.translate("ATG---GC"), "M-A")
+
+    def testAgainstCodonwise(self):
+        for sequence in self.sequences:
+            for is_seleno in (False, True):
+                for prefer_lowercase in (False, True):
+                    for ignore_n in (False, True):
+                        self.assertEqual(
+                            Genomics.translate(sequence,
+                                               is_seleno=is_seleno,
+                                               prefer_lowercase=prefer_lowercase,
+                                               ignore_n=ignore_n),
+                            translateCodonwise(sequence,
+                                               is_seleno=is_seleno,
+                                               prefer_lowercase=prefer_lowercase,
+                                               ignore_n=ignore_n))
+
+    def testBatch(self):
+        self.assertEqual(
+            Genomics.translateBatch(self.sequences, ignore_n=True),
+            [translateCodonwise(x, ignore_n=True) for x in self.sequences])
+        self.assertEqual(Genomics.translateBatch([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
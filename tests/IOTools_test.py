@@ -0,0 +1,166 @@
+"""unit testing module for IOTools.py"""
+
+import unittest
+import os
+import shutil
+import tempfile
+import gzip
+import numpy
+from six import StringIO
+import CGAT.IOTools as IOTools
+
+
+class TestReadColumns(unittest.TestCase):
+
+    data = ("# comment\n"
+            "bin\tname\tvalue\n"
+            "1\ta\t1.5\n"
+            "2\tb\tna\n"
+            "\n"
+            "3\tc\t2.5\n")
+
+    def testTypes(self):
+        columns, headers = IOTools.readColumns(
+            StringIO(self.data),
+            column_types={0: numpy.int32, 1: str},
+            chunk_size=2)
+        self.assertEqual(headers, ["bin", "name", "value"])
+        self.assertEqual(columns[0].dtype, numpy.int32)
+        self.assertEqual(list(columns[1]), ["a", "b", "c"])
+        self.assertEqual(list(columns[2].mask), [False, True, False])
+        self.assertEqual(columns[2].sum(), 4.0)
+
+    def testMissingValues(self):
+        columns, headers = IOTools.readColumns(
+            StringIO(self.data), take=[2], missing_values=("na",))
+        self.assertEqual(list(columns[0].mask), [False, True, False])
+        self.assertRaises(ValueError,
+                          IOTools.readColumns,
+                          StringIO(self.data),
+                          missing_values=("na",))
+
+    def testReadTable(self):
+        matrix, headers = IOTools.readTable(StringIO(self.data),
+                                            take=[0, 2])
+        self.assertEqual(matrix.shape, (3, 2))
+        self.assertEqual(headers, ["bin", "value"])
+        matrix, headers = IOTools.readTable(StringIO(self.data),
+                                            take=[0, 2],
+                                            truncate=(2, 3))
+        self.assertEqual(matrix.tolist(), [[2.0, 1.5], [3.0, 2.5]])
+
+    def testReadMatrixCache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "matrix.tsv")
+            with open(filename, "w") as outf:
+                outf.write("\tc1\tc2\nr1\t1\t2\nr2\t3\t4\n")
+            cache = filename + ".npz"
+            for x in range(2):
+                with open(filename) as inf:
+                    matrix, rows, cols = IOTools.readMatrix(inf, cache=cache)
+                self.assertTrue(os.path.exists(cache))
+                self.assertEqual(matrix.tolist(), [[1, 2], [3, 4]])
+                self.assertEqual(rows, ["r1", "r2"])
+                self.assertEqual(cols, ["c1", "c2"])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testCacheKey(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "table.tsv")
+            with open(filename, "w") as outf:
+                outf.write(self.data)
+            cache = filename + ".npz"
+            with open(filename) as inf:
+                columns, headers = IOTools.readColumns(
+                    inf, take=[0], cache=cache)
+            self.assertEqual(headers, ["bin"])
+            self.assertEqual(list(columns[0]), [1, 2, 3])
+            # different parsing options must not use the cache
+            with open(filename) as inf:
+                columns, headers = IOTools.readColumns(
+                    inf, take=[0], headers=False, comment="%",
+                    cache=cache)
+            self.assertEqual(headers, None)
+            self.assertEqual(list(columns[0].mask),
+                             [True, True, False, False, False])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testCacheStream(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache = os.path.join(tmpdir, "table.npz")
+            for data in (self.data, self.data.replace("2.5", "3.5")):
+                columns, headers = IOTools.readColumns(
+                    StringIO(data), take=[2], cache=cache)
+                self.assertEqual(columns[0][2], float(data[-4:-1]))
+            self.assertFalse(os.path.exists(cache))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestReadMap(unittest.TestCase):
+
+    data = "key\tvalue\na\t1\nb\t2\na\t3\nc\n"
+
+    def testReadMap(self):
+        m = IOTools.readMap(StringIO(self.data),
+                            map_functions=(str, int),
+                            has_header=True)
+        self.assertEqual(m, {"a": 3, "b": 2})
+
+    def testReadMultiMap(self):
+        m = IOTools.readMultiMap(StringIO(self.data[:-2]),
+                                 map_functions=(str, int),
+                                 has_header=True)
+        self.assertEqual(m, {"a": [1, 3], "b": [2]})
+
+
+class TestFilePool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def checkPool(self, pattern, line="%i\n", **kwargs):
+        pool = IOTools.FilePool(os.path.join(self.tmpdir, pattern),
+                                header="header\n",
+                                buffer_size=10,
+                                max_buffer_size=100,
+                                **kwargs)
+        pool.maxopen = 3
+        expected = {}
+        for x in range(1000):
+            key = "file%i" % (x % 7)
+            pool.write(key, line % x)
+            expected.setdefault(key, ["header\n"]).append(line % x)
+            self.assertTrue(len(pool.mFiles) <= 3)
+        pool.close()
+
+        self.assertEqual(len(pool), 7)
+        for key, lines in expected.items():
+            filename = pool.getFilename(key)
+            if filename.endswith(".gz"):
+                infile = gzip.open(filename, "rt", encoding="utf-8")
+            else:
+                infile = open(filename)
+            self.assertEqual(infile.read(), "".join(lines))
+            infile.close()
+
+    def testUncompressed(self):
+        self.checkPool("%s.tsv")
+
+    def testCompressed(self):
+        self.checkPool("%s.tsv.gz", threads=2)
+
+    def testCompressedNonAscii(self):
+        self.checkPool("%s.tsv.gz", line="\u00e9%i\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
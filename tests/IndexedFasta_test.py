@@ -0,0 +1,189 @@
+"""unit testing module for IndexedFasta.py"""
+
+import unittest
+import os
+import random
+import shutil
+import struct
+import tempfile
+import zlib
+import CGAT.IndexedFasta as IndexedFasta
+
+DATADIR = os.path.join(os.path.dirname(__file__), "index_fasta.py")
+
+
+def writeDictzip(filename, data, chunk_length, member_length):
+    '''write *data* to a dictzip file.
+
+    The data is split into gzip members of *member_length* bytes, each
+    compressed in chunks of *chunk_length* bytes.
+    '''
+    with open(filename, "wb") as outf:
+        for member_start in range(0, len(data), member_length):
+            member = data[member_start:member_start + member_length]
+            compressor = zlib.compressobj(
+                9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            chunks = []
+            for start in range(0, len(member), chunk_length):
+                chunks.append(
+                    compressor.compress(member[start:start + chunk_length]) +
+                    compressor.flush(zlib.Z_FULL_FLUSH))
+            sizes = b"".join([struct.pack("<H", len(x)) for x in chunks])
+            extra = b"RA" + struct.pack("<H", 6 + len(sizes)) + \
+                struct.pack("<HHH", 1, chunk_length, len(chunks)) + sizes
+            # magic, deflate, FEXTRA, mtime, extra flags and os
+            outf.write(b"\037\213\010\004" + struct.pack("<L", 0) +
+                       b"\002\377")
+            outf.write(struct.pack("<H", len(extra)) + extra)
+            outf.write(b"".join(chunks))
+            outf.write(compressor.flush())
+            outf.write(struct.pack("<LL",
+                                   zlib.crc32(member) & 0xffffffff,
+                                   len(member)))
+
+
+class TestDictzipUncompressor(unittest.TestCase):
+
+    chunk_length = 100
+    member_length = 2950
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "test.dz")
+        random.seed(1)
+        self.data = "".join(
+            [random.choice("ACGT") for x in range(10000)]).encode("ascii")
+        writeDictzip(self.filename, self.data,
+                     self.chunk_length, self.member_length)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testRead(self):
+        reader = IndexedFasta.DictzipUncompressor(self.filename)
+        for x in range(200):
+            start = random.randint(0, len(self.data) - 1)
+            size = random.randint(1, 1000)
+            reader.seek(start)
+            self.assertEqual(reader.read(size),
+                             self.data[start:start + size])
+
+    def testReadAcrossMembers(self):
+        reader = IndexedFasta.DictzipUncompressor(self.filename)
+        self.assertEqual(len(reader.mMemberOffsets), 4)
+        start = self.member_length - 10
+        reader.seek(start)
+        self.assertEqual(reader.read(2 * self.member_length),
+                         self.data[start:start + 2 * self.member_length])
+
+    def testReadPastEnd(self):
+        reader = IndexedFasta.DictzipUncompressor(self.filename)
+        reader.seek(len(self.data) - 10)
+        self.assertEqual(reader.read(100), self.data[-10:])
+        self.assertEqual(reader.read(100), b"")
+
+    def testReadIsSequential(self):
+        reader = IndexedFasta.DictzipUncompressor(self.filename)
+        reader.seek(0)
+        self.assertEqual(reader.read(150) + reader.read(150),
+                         self.data[:300])
+
+    def testCache(self):
+        reader = IndexedFasta.DictzipUncompressor(
+            self.filename, cache_size=4, read_ahead=0)
+        reader.seek(250)
+        reader.read(100)
+        self.assertEqual((reader.mCache.mHits, reader.mCache.mMisses),
+                         (0, 2))
+        reader.seek(250)
+        reader.read(100)
+        self.assertEqual((reader.mCache.mHits, reader.mCache.mMisses),
+                         (2, 2))
+
+    def testCacheIsBounded(self):
+        reader = IndexedFasta.DictzipUncompressor(
+            self.filename, cache_size=4, read_ahead=0)
+        reader.seek(0)
+        reader.read(len(self.data))
+        self.assertEqual(len(reader.mCache), 4)
+        reader.seek(0)
+        self.assertEqual(reader.read(len(self.data)), self.data)
+
+
+class TestCompressedDatabases(unittest.TestCase):
+    '''compare sequences from compressed databases against the
+    uncompressed database.'''
+
+    fragment_size = 300
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.uncompressed = IndexedFasta.IndexedFasta(
+            os.path.join(DATADIR, "test1"))
+        self.gzip = IndexedFasta.IndexedFasta(
+            os.path.join(DATADIR, "test3"))
+
+        # dictzip database sharing the index of the uncompressed one
+        dbname = os.path.join(self.tmpdir, "test1")
+        with open(os.path.join(DATADIR, "test1.fasta"), "rb") as inf:
+            writeDictzip(dbname + ".dz", inf.read(), 1000, 60000)
+        shutil.copyfile(os.path.join(DATADIR, "test1.idx"),
+                        dbname + ".idx")
+        self.dbname = dbname
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def openDictzip(self, **kwargs):
+        fasta = IndexedFasta.IndexedFasta(self.dbname, **kwargs)
+        self.assertEqual(fasta.mMethod, "dictzip")
+        return fasta
+
+    def checkSequential(self, fasta, num_fragments):
+        expected = IndexedFasta.iterateSequentialFragments(
+            self.uncompressed, self.fragment_size)
+        observed = IndexedFasta.iterateSequentialFragments(
+            fasta, self.fragment_size)
+        for x in range(num_fragments):
+            self.assertEqual(next(observed), next(expected))
+
+    def checkRandom(self, fasta, num_fragments):
+        random.seed(1)
+        for x in range(num_fragments):
+            contig, strand, start, end = \
+                self.uncompressed.getRandomCoordinates(self.fragment_size)
+            self.assertEqual(
+                fasta.getSequence(contig, strand, start, end),
+                self.uncompressed.getSequence(contig, strand, start, end))
+
+    def testGzipSequential(self):
+        # more fragments than in chrI to cross contig boundaries
+        self.checkSequential(self.gzip, 1000)
+
+    def testGzipRandom(self):
+        self.checkRandom(self.gzip, 200)
+
+    def testDictzipSequential(self):
+        self.checkSequential(self.openDictzip(), 1000)
+
+    def testDictzipRandom(self):
+        self.checkRandom(self.openDictzip(cache_size=2), 200)
+
+    def testSequentialReadAhead(self):
+        # 300 fragments of 300 bp span 91 chunks of 1000 bytes. Each
+        # chunk is decompressed once, on the first lookup.
+        fasta = self.openDictzip(read_ahead=0)
+        self.checkSequential(fasta, 300)
+        cache = fasta.mDatabaseFile.mCache
+        self.assertEqual((cache.mMisses, cache.mHits), (91, 299))
+
+        # decompressing two chunks ahead cuts the number of
+        # decompressing reads to a third.
+        fasta = self.openDictzip(read_ahead=2)
+        self.checkSequential(fasta, 300)
+        cache = fasta.mDatabaseFile.mCache
+        self.assertEqual((cache.mMisses, cache.mHits), (32, 358))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""unit testing module for IndexedGenome.py"""
+
+import unittest
+import random
+import tempfile
+import shutil
+import os
+import pickle
+import numpy
+import CGAT.IndexedGenome as IndexedGenome
+
+
+class TestIntervalArray(unittest.TestCase):
+
+    def setUp(self):
+        self.l = [(10, 20, 0),
+                  (15, 25, 1),
+                  (30, 50, 2),
+                  ]
+
+        self.tests = (((10, 15), (0,)),
+                      ((10, 30), (0, 1)),
+                      ((0, 10), (), ),
+                      ((10, 50), (0, 1, 2), ),
+                      ((25, 30), ()),
+                      )
+
+    def buildIndex(self, l):
+        index = IndexedGenome.IntervalArray()
+        for start, end, value in l:
+            index.add(start, end, value)
+        return index
+
+    def checkIntervals(self, index):
+        for a, b in self.tests:
+            result = tuple(sorted([x[2] for x in index.find(a[0], a[1])]))
+            self.assertEqual(result, b)
+
+    def testBuild(self):
+        index = self.buildIndex(self.l)
+        self.assertRaises(ValueError, index.add, 0, 0)
+        self.assertRaises(ValueError, index.add, -10, 0)
+
+    def testRandomizedList(self):
+        l = self.l[:]
+        random.shuffle(l)
+        self.checkIntervals(self.buildIndex(l))
+
+    def testFromArrays(self):
+        starts, ends, values = list(zip(*self.l))
+        index = IndexedGenome.IntervalArray.fromArrays(starts, ends, values)
+        self.checkIntervals(index)
+        self.assertRaises(ValueError, index.add, 0, 10)
+
+    def testBatch(self):
+        index = self.buildIndex(self.l)
+        offsets, ids = index.findBatch([x[0][0] for x in self.tests],
+                                       [x[0][1] for x in self.tests])
+        self.assertEqual(len(offsets), len(self.tests) + 1)
+        for x, test in enumerate(self.tests):
+            self.assertEqual(
+                tuple(sorted(ids[offsets[x]:offsets[x + 1]])),
+                test[1])
+
+    def testBatchRandom(self):
+        '''compare batch queries against brute force.'''
+        numpy.random.seed(1)
+        starts = numpy.random.randint(0, 10000, 1000)
+        ends = starts + numpy.random.randint(1, 500, 1000)
+        index = IndexedGenome.IntervalArray.fromArrays(starts, ends)
+
+        query_starts = numpy.random.randint(0, 10000, 200)
+        query_ends = query_starts + numpy.random.randint(1, 200, 200)
+        offsets, ids = index.findBatch(query_starts, query_ends)
+
+        for x, start, end in zip(range(len(query_starts)),
+                                 query_starts,
+                                 query_ends):
+            expected = numpy.nonzero((starts < end) & (ends > start))[0]
+            self.assertEqual(sorted(ids[offsets[x]:offsets[x + 1]]),
+                             sorted(expected))
+
+
+class TestStatic(unittest.TestCase):
+
+    def setUp(self):
+        self.contigs = ["chr1", "chr2", "chr1", "chr1"]
+        self.starts = [10, 10, 15, 30]
+        self.ends = [20, 20, 25, 50]
+        self.values = ["a", "b", "c", "d"]
+        self.index = IndexedGenome.Static.fromArrays(
+            self.contigs, self.starts, self.ends, self.values)
+
+    def checkIndex(self, index):
+        self.assertEqual(sorted([x[2] for x in index.get("chr1", 0, 100)]),
+                         ["a", "c", "d"])
+        self.assertEqual([x[2] for x in index.get("chr2", 0, 100)],
+                         ["b"])
+        self.assertEqual(index.contains("chr1", 25, 30), False)
+        self.assertRaises(KeyError, index.get, "chr3", 0, 100)
+        offsets, ids = index.getBatch("chr1", [0, 25], [100, 30])
+        self.assertEqual(sorted(index.getValues(
+            "chr1", ids[offsets[0]:offsets[1]])), ["a", "c", "d"])
+        self.assertEqual(offsets[2] - offsets[1], 0)
+
+    def testFromArrays(self):
+        self.checkIndex(self.index)
+
+    def testAdd(self):
+        index = IndexedGenome.Static()
+        for contig, start, end, value in zip(
+                self.contigs, self.starts, self.ends, self.values):
+            index.add(contig, start, end, value)
+        self.checkIndex(index)
+
+    def testPickle(self):
+        self.checkIndex(pickle.loads(pickle.dumps(self.index)))
+
+    def testSaveLoad(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "index")
+            self.index.save(filename)
+            self.checkIndex(IndexedGenome.Static.load(filename))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
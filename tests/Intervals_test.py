@@ -23,6 +23,11 @@
 
 import CGAT.Intervals as Intervals
 import unittest
+import random
+import collections
+
+GenomicInterval = collections.namedtuple(
+    "GenomicInterval", "contig start end name")
 
 
 class TruncateCheck(unittest.TestCase):
@@ -130,5 +135,63 @@ class FromArrayCheck(unittest.TestCase):
             Intervals.fromArray([not x for x in a]), [(3, 6), (9, 12)])
 
 
+class SortedOverlapCheck(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+        self.streams = [self.buildIntervals(x, 200) for x in "abc"]
+
+    def buildIntervals(self, prefix, n):
+        intervals = []
+        for x in range(n):
+            start = random.randint(0, 10000)
+            intervals.append(GenomicInterval(
+                random.choice(("chr1", "chr2", "chr10")),
+                start,
+                start + random.randint(0, 500),
+                "%s%i" % (prefix, x)))
+        intervals.sort(key=lambda x: (x.contig, x.start))
+        return intervals
+
+    def overlaps(self, a, b):
+        return a.contig == b.contig and \
+            a.start < b.end and b.start < a.end and \
+            a.start < a.end and b.start < b.end
+
+    def testIsSorted(self):
+        self.assertTrue(Intervals.isSorted(iter(self.streams[0])))
+        self.assertFalse(Intervals.isSorted(iter(self.streams[0][::-1])))
+
+    def testUnsorted(self):
+        self.assertRaises(ValueError, list,
+                          Intervals.iterator_overlapping(
+                              iter(self.streams[0][::-1]),
+                              iter(self.streams[1])))
+
+    def testOverlapping(self):
+        queries, targets = self.streams[:2]
+        result = list(Intervals.iterator_overlapping(iter(queries),
+                                                     iter(targets)))
+        self.assertEqual(len(result), len(queries))
+        for query, overlaps in result:
+            self.assertEqual(
+                sorted([x.name for x in overlaps]),
+                sorted([x.name for x in targets
+                        if self.overlaps(query, x)]))
+
+    def testOverlapPairs(self):
+        result = sorted(
+            [(idx1, x.name, idx2, y.name) for idx1, x, idx2, y in
+             Intervals.iterator_overlap_pairs(*self.streams)])
+        expected = []
+        for idx1 in range(len(self.streams)):
+            for idx2 in range(idx1 + 1, len(self.streams)):
+                for x in self.streams[idx1]:
+                    for y in self.streams[idx2]:
+                        if self.overlaps(x, y):
+                            expected.append((idx1, x.name, idx2, y.name))
+        self.assertEqual(result, sorted(expected))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -23,6 +23,7 @@
 
 import CGAT.Masker as Masker
 import unittest
+import random
 
 
 class SegCheck(unittest.TestCase):
@@ -57,5 +58,42 @@ class SegCheck(unittest.TestCase):
 class DustMaskerCheck(unittest.TestCase):
     mMasker = Masker.MaskerDustMasker()
 
+
+class DustCheck(unittest.TestCase):
+
+    mMasker = Masker.MaskerDust()
+
+    def setUp(self):
+        random.seed(1)
+        self.sequences = [
+            "".join([random.choice("ACGT") for x in range(100)]) +
+            "CA" * 20 +
+            "".join([random.choice("ACGT") for x in range(100)])
+            for y in range(10)]
+
+    def testEmpty(self):
+        """test empty input."""
+        self.assertEqual(self.mMasker(""), "")
+
+    def testRepeat(self):
+        """test masking of a dinucleotide repeat."""
+        for sequence in self.sequences:
+            mask = Masker.dustSequence(sequence)
+            self.assertTrue(mask[100:140].all())
+            self.assertTrue(mask.sum() < 60)
+
+    def testBlocks(self):
+        """test that blocks are joined seamlessly."""
+        for sequence in self.sequences:
+            self.assertEqual(
+                list(Masker.dustSequence(sequence, block_size=7)),
+                list(Masker.dustSequence(sequence)))
+
+    def testBatch(self):
+        """test masking in batches."""
+        self.assertEqual(
+            self.mMasker.maskBatch(self.sequences, chunk_size=3),
+            [self.mMasker(x) for x in self.sequences])
+
 if __name__ == "__main__":
     unittest.main()
@@ -440,5 +440,28 @@ class TestPValueAdust(unittest.TestCase):
     def testNone(self):
         self.check("none")
 
+
+class TestFDRMethods(TestPValueAdust):
+
+    '''test selectable FDR methods against R.'''
+
+    def check(self, method):
+        a = R['p.adjust'](self.pvalues, method=method)
+        b = Stats.doFDR(self.pvalues, method=method, fdr_level=0.05)
+        c = Stats.adjustPValuesR(self.pvalues, method, use_r=False)
+        self.assertEqual(len(a), len(b.mQValues))
+        for x, y, z in zip(a, b.mQValues, c):
+            self.assertAlmostEqual(x, y)
+            self.assertAlmostEqual(x, z)
+        self.assertEqual(b.mPassed, [x <= 0.05 for x in a])
+
+    def testHochberg(self):
+        self.check("hochberg")
+
+    def testStorey(self):
+        old = Stats.doFDR(self.pvalues)
+        new = Stats.doFDR(self.pvalues, use_r=False)
+        self.assertTrue(getRelativeError(old.mPi0, new.mPi0) < 0.1)
+
 if __name__ == "__main__":
     unittest.main()
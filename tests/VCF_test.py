@@ -0,0 +1,73 @@
+"""unit testing module for VCF.py"""
+
+import unittest
+from six import StringIO
+import CGAT.VCF as VCF
+
+
+class TestVCFFile(unittest.TestCase):
+
+    data = ("##fileformat=VCFv4.1\n"
+            "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t"
+            "s1\ts2\ts3\n"
+            "1\t100\t.\tA\tC\t10\t.\t.\tGT:DP\t0/0:1\t0|1:2\t1/1:3\n"
+            "1\t200\t.\tA\tC,G\t10\t.\t.\tDP:GT\t1:./.\t2:1/2\t3:0\n"
+            "1\t300\t.\tA\tC\t10\t.\t.\tDP\t1\t2\t3\n"
+            "1\t400\t.\tA\tC\t10\t.\t.\tGT\t1\t0/.\t0/1\n")
+
+    def testEntries(self):
+        entries = list(VCF.VCFFile(StringIO(self.data)))
+        self.assertEqual(len(entries), 4)
+        entry = entries[0]
+        self.assertEqual(entry.getGenotype("s2"), "0|1:2")
+        self.assertEqual(entry.genotypes,
+                         {"s1": "0/0:1", "s2": "0|1:2", "s3": "1/1:3"})
+        self.assertEqual(list(entries[1].getCalls()), [-1, 2, 0])
+        self.assertEqual(str(entries[2]), self.data.split("\n")[4])
+        entry.order = ["s3", "s1", "s2"]
+        self.assertEqual(str(entry).split("\t")[9:],
+                         ["1/1:3", "0/0:1", "0|1:2"])
+
+    def testLastLineWithoutNewline(self):
+        entries = list(VCF.VCFFile(StringIO(self.data[:-1])))
+        self.assertEqual(len(entries), 4)
+        self.assertEqual(str(entries[-1]), self.data.split("\n")[-2])
+
+    def testFooter(self):
+        entries = list(VCF.VCFFile(StringIO(
+            self.data + "# job finished in 0 seconds\n")))
+        self.assertEqual(len(entries), 4)
+
+    def testCalls(self):
+        for block_size in (1, 3, 10):
+            blocks = list(VCF.VCFFile(
+                StringIO(self.data)).iterBlocks(block_size))
+            self.assertEqual(sum([len(x) for x in blocks]), 4)
+            calls = []
+            for block in blocks:
+                self.assertEqual(str(block.getCalls().dtype), "int8")
+                calls.extend(block.getCalls().tolist())
+            self.assertEqual(calls, [[0, 1, 2],
+                                     [-1, 2, 0],
+                                     [-1, -1, -1],
+                                     [1, -1, 1]])
+
+    def testPermute(self):
+        infile = VCF.VCFFile(StringIO(self.data))
+        permutation = infile.getPermutation(["s3", "s1", "s2"])
+        self.assertRaises(ValueError, infile.getPermutation, ["s1"])
+        block = next(infile.iterBlocks())
+        calls = block.getCalls()
+        block.permute(permutation)
+        self.assertEqual(block.getCalls().tolist(),
+                         calls[:, permutation].tolist())
+        self.assertEqual(block.samples, ["s3", "s1", "s2"])
+        lines = str(block).split("\n")
+        self.assertEqual(lines[0].split("\t")[9:],
+                         ["1/1:3", "0/0:1", "0|1:2"])
+        entries = list(block)
+        self.assertEqual(entries[1].genotypes["s1"], "1:./.")
+
+
+if __name__ == "__main__":
+    unittest.main()
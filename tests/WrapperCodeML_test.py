@@ -0,0 +1,125 @@
+"""unit testing module for WrapperCodeML.py"""
+
+import unittest
+import os
+import shutil
+import tempfile
+import CGAT.Mali as Mali
+import CGAT.WrapperCodeML as WrapperCodeML
+
+
+class CodeMLStub(WrapperCodeML.CodeML):
+
+    '''replace running codeml with a function of the input.'''
+
+    def __init__(self):
+        WrapperCodeML.CodeML.__init__(self)
+        self.ncalls = 0
+
+    def Run(self, alignment, tree=None, options={}, tempdir=None,
+            test=False, dump=False):
+        self.ncalls += 1
+        if not os.path.isdir(tempdir):
+            raise IOError("no scratch directory")
+        if options.get("fail") == "io":
+            raise IOError("could not read output")
+        if options.get("fail") == "value":
+            raise ValueError("could not parse output")
+        return (alignment.getIdentifiers()[0], tree, options.get("omega"))
+
+
+def buildJobs(njobs, fail=None):
+    jobs = []
+    for x in range(njobs):
+        mali = Mali.Mali()
+        mali.addSequence("seq%i" % x, 0, 6, "ATGAAA")
+        mali.addSequence("other", 0, 6, "ATGAAG")
+        options = {"omega": str(x)}
+        if fail and x in fail:
+            options["fail"] = fail[x]
+        jobs.append((mali, "(seq%i,other);" % x, options))
+    return jobs
+
+
+def expectedResult(index):
+    return ("seq%i" % index, "(seq%i,other);" % index, str(index))
+
+
+class TestRunBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testSerialOrder(self):
+        results = list(CodeMLStub().RunBatch(buildJobs(5),
+                                             tempdir=self.tmpdir))
+        self.assertEqual(results,
+                         [(x, expectedResult(x)) for x in range(5)])
+
+    def testThreads(self):
+        results = list(CodeMLStub().RunBatch(buildJobs(20),
+                                             threads=2,
+                                             tempdir=self.tmpdir))
+        self.assertEqual(sorted(results),
+                         [(x, expectedResult(x)) for x in range(20)])
+        # scratch directories are removed
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def testErrors(self):
+        fail = {1: "io", 3: "value"}
+        for threads in (1, 2):
+            results = dict(CodeMLStub().RunBatch(
+                buildJobs(5, fail=fail),
+                threads=threads,
+                tempdir=self.tmpdir,
+                ignore_errors=True))
+            self.assertEqual(results,
+                             dict([(x, None) if x in fail
+                                   else (x, expectedResult(x))
+                                   for x in range(5)]))
+
+            self.assertRaises(WrapperCodeML.UsageError,
+                              list,
+                              CodeMLStub().RunBatch(
+                                  buildJobs(5, fail=fail),
+                                  threads=threads,
+                                  tempdir=self.tmpdir))
+
+    def testCache(self):
+        cache_dir = os.path.join(self.tmpdir, "cache")
+        wrapper = CodeMLStub()
+        first = list(wrapper.RunBatch(buildJobs(4),
+                                      cache_dir=cache_dir,
+                                      tempdir=self.tmpdir))
+        self.assertEqual(wrapper.ncalls, 4)
+        self.assertEqual(len(os.listdir(cache_dir)), 4)
+
+        # cached results are returned without running the analysis,
+        # results for new jobs are added to the cache.
+        wrapper = CodeMLStub()
+        second = list(wrapper.RunBatch(buildJobs(6),
+                                       cache_dir=cache_dir,
+                                       tempdir=self.tmpdir))
+        self.assertEqual(wrapper.ncalls, 2)
+        self.assertEqual(sorted(second),
+                         first + [(4, expectedResult(4)),
+                                  (5, expectedResult(5))])
+        self.assertEqual(len(os.listdir(cache_dir)), 6)
+
+    def testCacheKey(self):
+        wrapper = CodeMLStub()
+        mali, tree, options = buildJobs(1)[0]
+        filename = os.path.join(self.tmpdir, "tree.nh")
+        with open(filename, "w") as outf:
+            outf.write(tree + "\n")
+        self.assertEqual(wrapper.getCacheKey(mali, tree, options),
+                         wrapper.getCacheKey(mali, filename, options))
+        self.assertNotEqual(wrapper.getCacheKey(mali, tree, options),
+                            wrapper.getCacheKey(mali, "(a,b);", options))
+
+
+if __name__ == "__main__":
+    unittest.main()
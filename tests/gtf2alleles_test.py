@@ -0,0 +1,114 @@
+"""unit testing module for gtf2alleles.py"""
+
+import unittest
+import CGAT.Variants as Variants
+import CGAT.scripts.gtf2alleles as gtf2alleles
+
+
+class VariantGetterStub(gtf2alleles.VariantGetter):
+
+    '''return variants from a list.
+
+    Variants are selected by position like the sqlite and pileup
+    getters or, if *overlaps* is set, by overlap like the vcf getter.
+    '''
+
+    def __init__(self, variants, include_end=False, overlaps=False):
+        self.variants = [Variants.Variant._make(x) for x in variants]
+        self.mIncludeEnd = include_end
+        self.mOverlaps = overlaps
+        self.ncalls = 0
+
+    def __call__(self, contig, start, end):
+        self.ncalls += 1
+        if contig != "chr1":
+            return []
+        result = []
+        for x in self.variants:
+            if self.mOverlaps:
+                if gtf2alleles.getVariantEnd(x) <= start:
+                    continue
+            elif x.pos < start:
+                continue
+            if x.pos < end or (self.mIncludeEnd and x.pos == end):
+                result.append(x)
+        return result
+
+
+class TestVariantCache(unittest.TestCase):
+
+    variants = ((10, "A", "G"),
+                (20, "*", "*/-ACGT"),
+                (30, "C", "T"),
+                (40, "*", "+AA/*"),
+                (1000, "G", "A"))
+
+    def checkRegions(self, getter, cache, regions):
+        for contig, start, end in regions:
+            self.assertEqual(cache(contig, start, end),
+                             getter(contig, start, end),
+                             "mismatch for %s:%i-%i" % (contig, start, end))
+
+    def testVariantEnd(self):
+        self.assertEqual(gtf2alleles.getVariantEnd(
+            Variants.Variant._make((10, "A", "G"))), 11)
+        self.assertEqual(gtf2alleles.getVariantEnd(
+            Variants.Variant._make((20, "*", "*/-ACGT"))), 25)
+        self.assertEqual(gtf2alleles.getVariantEnd(
+            Variants.Variant._make((40, "*", "+AA/*"))), 42)
+
+    def testWindowReuse(self):
+        for overlaps in (False, True):
+            getter = VariantGetterStub(self.variants, overlaps=overlaps)
+            cache = gtf2alleles.VariantCache(getter, window_size=500)
+            self.assertEqual(len(cache("chr1", 0, 100)), 4)
+            self.assertEqual(len(cache("chr1", 22, 35)), 1 + overlaps)
+            self.assertEqual(len(cache("chr1", 30, 450)), 2)
+            self.assertEqual(cache.nfetched, 1)
+
+    def testRefetch(self):
+        getter = VariantGetterStub(self.variants)
+        cache = gtf2alleles.VariantCache(getter, window_size=500)
+        cache("chr1", 100, 200)
+        self.assertEqual(cache("chr1", 900, 1100)[0].pos, 1000)
+        self.assertEqual(len(cache("chr1", 0, 50)), 4)
+        self.assertEqual(cache("chr2", 0, 50), [])
+        self.assertEqual(cache.nfetched, 4)
+
+    def testOverlappingDeletion(self):
+        getter = VariantGetterStub(self.variants, overlaps=True)
+        cache = gtf2alleles.VariantCache(getter, window_size=500)
+        cache("chr1", 0, 10)
+        self.assertEqual([x.pos for x in cache("chr1", 22, 30)], [20])
+        self.assertEqual(cache("chr1", 25, 30), [])
+
+    def testDeletionByPosition(self):
+        # getters selecting by position do not return a deletion
+        # starting before the region, neither does the cache
+        getter = VariantGetterStub(self.variants)
+        cache = gtf2alleles.VariantCache(getter, window_size=500)
+        self.assertFalse(cache.mOverlaps)
+        cache("chr1", 0, 10)
+        self.assertEqual(getter("chr1", 22, 30), [])
+        self.assertEqual(cache("chr1", 22, 30), [])
+
+    def testIncludeEnd(self):
+        for include_end in (False, True):
+            for overlaps in (False, True):
+                getter = VariantGetterStub(self.variants,
+                                           include_end=include_end,
+                                           overlaps=overlaps)
+                cache = gtf2alleles.VariantCache(getter, window_size=50)
+                self.assertEqual(cache.mIncludeEnd, include_end)
+                self.assertEqual(cache.mOverlaps, overlaps)
+                self.assertEqual(len(cache("chr1", 5, 30)),
+                                 2 + include_end)
+                self.checkRegions(
+                    getter, cache,
+                    [("chr1", x, x + y)
+                     for x in range(0, 60, 3)
+                     for y in (0, 1, 5, 10, 30)])
+
+
+if __name__ == "__main__":
+    unittest.main()
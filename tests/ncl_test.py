@@ -112,6 +112,53 @@ class TestNCL(TestNCLSimple):
         self.assertRaises(ValueError, index.add, 0, 0, 4)
 
 
+class TestNCLSimpleBatch(unittest.TestCase):
+
+    """test batch queries."""
+
+    def setUp(self):
+        self.l = [(10, 20, 0),
+                  (15, 25, 1),
+                  (30, 50, 2),
+                  ]
+
+        self.tests = (((10, 15), (0,)),
+                      ((10, 30), (0, 1)),
+                      ((0, 10), (), ),
+                      ((10, 50), (0, 1, 2), ),
+                      ((25, 30), ()),
+                      )
+
+        self.index = NCLSimple()
+        for start, end, value in self.l:
+            self.index.add(start, end)
+
+        self.starts = [x[0][0] for x in self.tests]
+        self.ends = [x[0][1] for x in self.tests]
+
+    def testFindOverlaps(self):
+        queries, hits = self.index.find_overlaps(self.starts, self.ends)
+        for x, test in enumerate(self.tests):
+            self.assertEqual(tuple(sorted(hits[queries == x])), test[1])
+
+    def testCountOverlaps(self):
+        counts = self.index.count_overlaps(self.starts, self.ends)
+        self.assertEqual(list(counts), [len(x[1]) for x in self.tests])
+
+    def testManyHits(self):
+        """test result buffers beyond initial size."""
+        index = NCLSimple()
+        for x in range(5000):
+            index.add(x, x + 10)
+        queries, hits = index.find_overlaps([0, 100], [10000, 110])
+        self.assertEqual(len(hits), 5000 + 19)
+        self.assertEqual(list(index.count_overlaps([0, 100], [10000, 110])),
+                         [5000, 19])
+
+    def testEmptyIntervals(self):
+        self.assertRaises(IndexError, self.index.find_overlaps, [10], [10])
+
+
 class TestNCLDisk(TestNCLSimple):
 
     """basic tests on database."""